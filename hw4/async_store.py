@@ -0,0 +1,176 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import asyncio
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from constants import *
+from metrics import storage_waits
+from profiling import current_profile
+
+
+class StorageExecutor():
+    """ Runs blocking pymongo calls off the event loop. A bounded thread pool does the work and a semaphore caps how many calls
+        can be waiting on Mongo at once, so one slow query only ties up one worker instead of the whole uvicorn worker.
+    """
+    def __init__(self, max_workers: int = STORAGE_MAX_WORKERS, max_concurrency: int = STORAGE_MAX_CONCURRENCY) -> None:
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-storage')
+        self.__max_concurrency = max_concurrency
+        self.__semaphore = asyncio.Semaphore(max_concurrency)
+        self.__in_flight = 0
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.__max_concurrency
+
+    @property
+    def in_flight(self) -> int:
+        return self.__in_flight
+
+    async def run(self, function, *args, **kwargs):
+        """ Await function(*args, **kwargs) on the storage pool. Waits for a free slot first if we're at the concurrency limit
+            How long the call waited, for the slot and then for a worker thread, goes to the storage wait histogram
+            If the request is being profiled, the worker thread is sampled while it runs the call
+        """
+        queued = time.perf_counter()
+        profile = current_profile.get()
+        def call():
+            storage_waits.observe(time.perf_counter() - queued)
+            if profile is None:
+                return function(*args, **kwargs)
+            with profile.thread('storage'):
+                return function(*args, **kwargs)
+        async with self.__semaphore:
+            self.__in_flight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.__executor, call)
+            finally:
+                self.__in_flight -= 1
+
+    def shutdown(self) -> None:
+        self.__executor.shutdown(wait=True)
+
+
+# Shared by every wrapper unless one is handed its own, so the limit holds for the whole process
+storage_executor = StorageExecutor()
+
+
+class AsyncChatRoom():
+    """ Awaitable front for room.ChatRoom. Anything that touches Mongo runs on the storage executor.
+        get_messages returns a list, not a cursor, since iterating a pymongo cursor is blocking too
+    """
+    def __init__(self, room, executor: StorageExecutor = None) -> None:
+        self.__room = room
+        self.__executor = executor if executor is not None else storage_executor
+
+    @property
+    def room(self):
+        return self.__room
+
+    async def send_message(self, message: str, from_alias: str, mess_props) -> bool:
+        return await self.__executor.run(self.__room.send_message, message, from_alias, mess_props)
+
+    async def get_messages(self, *args, **kwargs) -> list:
+        return await self.__executor.run(self.__fetch_messages, *args, **kwargs)
+
+    async def get_page(self, *args, **kwargs) -> dict:
+        return await self.__executor.run(self.__room.get_page, *args, **kwargs)
+
+    async def get_messages_json(self, *args, **kwargs) -> bytes:
+        return await self.__executor.run(self.__room.get_messages_json, *args, **kwargs)
+
+    async def get_page_json(self, *args, **kwargs) -> bytes:
+        return await self.__executor.run(self.__room.get_page_json, *args, **kwargs)
+
+    async def find_message(self, message_text: str):
+        return await self.__executor.run(self.__room.find_message, message_text)
+
+    async def search_messages(self, *args, **kwargs) -> dict:
+        return await self.__executor.run(self.__room.search_messages, *args, **kwargs)
+
+    async def stream_messages(self, *args, batch_size: int = STREAM_BATCH_SIZE, **kwargs):
+        """ Async generator over the get_messages cursor, batch_size messages at a time. Only one batch is ever in memory, and each
+            batch is pulled on the executor. If the consumer stops early (client went away) the cursor is closed
+        """
+        messages = await self.__executor.run(self.__open_cursor, batch_size, *args, **kwargs)
+        try:
+            while len(batch := await self.__executor.run(self.__next_batch, messages, batch_size)) > 0:
+                yield batch
+        finally:
+            if hasattr(messages, 'close'):
+                await self.__executor.run(messages.close)
+
+    def __fetch_messages(self, *args, **kwargs) -> list:
+        messages = self.__room.get_messages(*args, **kwargs)
+        return list(messages) if messages is not None else []
+
+    def __open_cursor(self, batch_size: int, *args, **kwargs):
+        messages = self.__room.get_messages(*args, **kwargs)
+        if messages is None:
+            return iter([])
+        if hasattr(messages, 'batch_size'):
+            messages = messages.batch_size(batch_size)
+        return iter(messages)
+
+    @staticmethod
+    def __next_batch(messages, batch_size: int) -> list:
+        return list(itertools.islice(messages, batch_size))
+
+
+class AsyncRoomList():
+    """ Awaitable front for room.RoomList. Creating a room builds a ChatRoom, which can go to Mongo, so it runs on the executor
+    """
+    def __init__(self, room_list, executor: StorageExecutor = None) -> None:
+        self.__room_list = room_list
+        self.__executor = executor if executor is not None else storage_executor
+
+    @property
+    def room_list(self):
+        return self.__room_list
+
+    async def create(self, *args, **kwargs):
+        return await self.__executor.run(self.__room_list.create, *args, **kwargs)
+
+    async def get(self, room_name: str):
+        return await self.__executor.run(self.__room_list.get, room_name)
+
+    async def set_retention(self, room_name: str, policy) -> bool:
+        return await self.__executor.run(self.__room_list.set_retention, room_name, policy)
+
+    async def get_rooms(self) -> list:
+        return await self.__executor.run(self.__room_list.get_rooms)
+
+    async def contains(self, room_name: str) -> bool:
+        """ room_name in room_list, which can go to Mongo on a miss
+        """
+        return await self.__executor.run(self.__room_list.__contains__, room_name)
+
+    async def find_by_owner(self, owner_alias: str) -> list:
+        return await self.__executor.run(self.__room_list.find_by_owner, owner_alias)
+
+    async def find_by_member(self, member_alias: str) -> list:
+        return await self.__executor.run(self.__room_list.find_by_member, member_alias)
+
+
+class AsyncUserList():
+    """ Awaitable front for users.UserList
+    """
+    def __init__(self, user_list, executor: StorageExecutor = None) -> None:
+        self.__user_list = user_list
+        self.__executor = executor if executor is not None else storage_executor
+
+    @property
+    def user_list(self):
+        return self.__user_list
+
+    async def register(self, new_alias: str):
+        return await self.__executor.run(self.__user_list.register, new_alias)
+
+    async def register_many(self, new_aliases: list) -> list:
+        return await self.__executor.run(self.__user_list.register_many, new_aliases)
+
+    async def get(self, target_alias: str):
+        return await self.__executor.run(self.__user_list.get, target_alias)
+
+    async def get_all_users(self) -> list:
+        return await self.__executor.run(self.__user_list.get_all_users)
@@ -0,0 +1,79 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import asyncio
+import time
+import unittest
+from unittest import IsolatedAsyncioTestCase
+import logging
+from constants import *
+from async_store import AsyncChatRoom, StorageExecutor
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+SLOW_QUERY_SECONDS = 0.5
+
+class SlowRoom():
+    """ Stands in for a ChatRoom whose Mongo calls block, like pymongo does
+    """
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+
+    def get_messages(self, user_alias: str = None, num_messages: int = GET_ALL_MESSAGES):
+        time.sleep(self.delay)
+        return iter([{'message': f'for {user_alias}'}])
+
+    def send_message(self, message: str, from_alias: str, mess_props) -> bool:
+        time.sleep(self.delay)
+        return True
+
+
+class AsyncStoreTest(IsolatedAsyncioTestCase):
+    """ Testing that blocking storage calls no longer hold up the event loop
+    """
+    async def test_slow_query_does_not_block(self):
+        """ Start a slow query, then ten fast requests. The fast ones have to finish long before the slow one does
+        """
+        executor = StorageExecutor(max_workers=4, max_concurrency=4)
+        slow_room = AsyncChatRoom(SlowRoom(SLOW_QUERY_SECONDS), executor)
+        fast_room = AsyncChatRoom(SlowRoom(0), executor)
+        start = time.perf_counter()
+        slow_request = asyncio.create_task(slow_room.get_messages('slow'))
+        await asyncio.sleep(0)
+        for request in range(10):
+            assert await fast_room.get_messages('fast') == [{'message': 'for fast'}]
+        fast_done = time.perf_counter() - start
+        assert fast_done < SLOW_QUERY_SECONDS / 2
+        assert not slow_request.done()
+        assert await slow_request == [{'message': 'for slow'}]
+        executor.shutdown()
+
+    async def test_event_loop_stays_responsive(self):
+        """ Other coroutines keep getting scheduled while a send is stuck in Mongo
+        """
+        executor = StorageExecutor(max_workers=2, max_concurrency=2)
+        slow_room = AsyncChatRoom(SlowRoom(SLOW_QUERY_SECONDS), executor)
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+        ticker_task = asyncio.create_task(ticker())
+        assert await slow_room.send_message('hello', 'testing', None) is True
+        ticker_task.cancel()
+        assert ticks > 10
+        executor.shutdown()
+
+    async def test_concurrency_limit(self):
+        """ With a limit of 2, four 0.1s calls take two rounds
+        """
+        executor = StorageExecutor(max_workers=8, max_concurrency=2)
+        room = AsyncChatRoom(SlowRoom(0.1), executor)
+        start = time.perf_counter()
+        await asyncio.gather(*(room.get_messages('limit') for _ in range(4)))
+        assert time.perf_counter() - start >= 0.2
+        executor.shutdown()
+
+if __name__ == "__main__":
+    unittest.main()
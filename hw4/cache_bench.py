@@ -0,0 +1,90 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from room import ChatRoom, MessageProperties
+
+NUM_MESSAGES = 10000
+NUM_READS = 2000
+CACHE_SIZES = [10, 100, 500, 1000, 5000, 10000]
+# Readers mostly poll from a recent cursor, how far behind they are is exponential with this mean (in messages)
+MEAN_LAG = 300
+# Share of the reads that ask for the newest page instead of polling from a cursor
+LATEST_SHARE = 0.3
+PAGE_SIZE = 50
+
+
+def fill_room(num_messages: int) -> list:
+    """ Send the history through one room instance, returns the sequence numbers in order
+    """
+    room = ChatRoom('cache-bench', create_new=True, cache_size=1)
+    for index in range(num_messages):
+        room.send_message(f'bench message {index}', SENDER_NAME, MessageProperties('cache-bench', 'bench-to', SENDER_NAME, MESSAGE_TYPE_SENT))
+    return [message['mess_props']['sequence_num'] for message in room.get_messages()]
+
+
+def workload(sequence_nums: list, num_reads: int, seed: int) -> list:
+    """ (after_seq, latest) for each read
+    """
+    rng = random.Random(seed)
+    reads = []
+    for _ in range(num_reads):
+        if rng.random() < LATEST_SHARE:
+            reads.append((None, True))
+        else:
+            lag = min(int(rng.expovariate(1 / MEAN_LAG)) + 1, len(sequence_nums))
+            reads.append((sequence_nums[-lag], False))
+    return reads
+
+
+def bench_cache_size(cache_size: int, reads: list, cache_check: bool = False) -> dict:
+    """ Memory is what the room holds on to after the first read warmed the cache, measured with tracemalloc. The reads are timed
+            without tracing. Misses scan the in-memory collection, so their cost here only shows they are much slower than hits
+        cache_check is off by default, it's one indexed query per hit on a real Mongo but a scan of the in-memory collection
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    room = ChatRoom('cache-bench', cache_size=cache_size, cache_check=cache_check)
+    room.get_page('bench-to', limit=PAGE_SIZE, latest=True)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for after_seq, latest in reads:
+        room.get_page('bench-to', after_seq=after_seq, limit=PAGE_SIZE, latest=latest)
+    elapsed = time.perf_counter() - start
+    stats = room.cache_stats()
+    stats['hit_rate'] = stats['hits'] / max(stats['hits'] + stats['misses'], 1)
+    stats['memory'] = memory
+    stats['elapsed'] = elapsed
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Message cache size against hit rate, memory and read time, on an in-memory collection')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--reads', type=int, default=NUM_READS)
+    parser.add_argument('--sizes', default=','.join(str(size) for size in CACHE_SIZES))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--check', action='store_true', help='check the cache against Mongo before every hit, like a room several processes send to')
+    args = parser.parse_args()
+    mongo_pool.client_factory = memory_client_factory()
+
+    sequence_nums = fill_room(args.messages)
+    reads = workload(sequence_nums, args.reads, args.seed)
+    print(f'{args.messages} messages, {args.reads} reads ({LATEST_SHARE:.0%} latest page, the rest polling with mean lag {MEAN_LAG})')
+    for cache_size in [int(size) for size in args.sizes.split(',')]:
+        stats = bench_cache_size(cache_size, reads, args.check)
+        print(f'cache {cache_size:>6}: hit rate {stats["hit_rate"]:6.1%}  memory {stats["memory"] / 1024:9.1f} KB  '
+            f'reads {stats["elapsed"] / len(reads) * 1e6:8.1f} us/read')
+
+
+if __name__ == "__main__":
+    main()
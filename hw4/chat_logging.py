@@ -0,0 +1,136 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import atexit
+import copy
+import logging
+import logging.handlers
+import queue
+import threading
+from constants import *
+
+
+class SampledFilter(logging.Filter):
+    """ Per call site sampling for chatty records. Each call site (file and line) below WARNING gets its first burst records through,
+            after that only one in every. Warnings and errors always get through
+        Counting is a dict update on the calling thread, racing threads can only make it a record off either way
+    """
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, every: int = LOG_SAMPLE_EVERY) -> None:
+        super().__init__()
+        self.__burst = burst
+        self.__every = max(every, 1)
+        self.__seen = {}
+        self.__suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        call_site = (record.pathname, record.lineno)
+        seen = self.__seen[call_site] = self.__seen.get(call_site, 0) + 1
+        if seen <= self.__burst or (seen - self.__burst) % self.__every == 0:
+            return True
+        self.__suppressed += 1
+        return False
+
+    @property
+    def suppressed(self) -> int:
+        return self.__suppressed
+
+    def stats(self) -> dict:
+        """ Records seen per call site, busiest first
+        """
+        busiest = sorted(self.__seen.items(), key=lambda item: item[1], reverse=True)
+        return {'suppressed': self.__suppressed, 'call_sites': [(f'{path}:{line}', seen) for (path, line), seen in busiest]}
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """ The stock QueueHandler formats the message on the logging thread before queueing it. We queue the record as is, so the
+            '%s' formatting happens on the listener thread, off the event loop and storage threads. Arguments are formatted later,
+            so pass values (strings, numbers), not objects that change after the call
+        When the queue is full the record is dropped and counted, logging must never block a request
+    """
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info:
+            # tracebacks hold frames that keep changing, render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_lock = threading.Lock()
+_pipeline = None
+
+
+class LoggingPipeline():
+    """ What setup_logging installed: the queue handler on the root logger, the sampling filter and the listener thread that
+        writes records out
+    """
+    def __init__(self, filename: str, level: str, log_format: str, max_queue: int, sampling: SampledFilter, filemode: str) -> None:
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.handler = LazyQueueHandler(self.queue)
+        self.sampling = sampling
+        if sampling is not None:
+            self.handler.addFilter(sampling)
+        self.file_handler = logging.FileHandler(filename, mode=filemode)
+        self.file_handler.setFormatter(logging.Formatter(log_format))
+        self.listener = logging.handlers.QueueListener(self.queue, self.file_handler, respect_handler_level=True)
+        self.level = level
+
+    def start(self) -> None:
+        root = logging.getLogger()
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """ Take the handler off the root logger, write out what's queued and close the file
+        """
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        self.file_handler.close()
+
+    def stats(self) -> dict:
+        return {'queued': self.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'suppressed': self.sampling.suppressed if self.sampling is not None else 0,
+        }
+
+
+def setup_logging(filename: str = LOG_FILE, level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, max_queue: int = LOG_QUEUE_SIZE,
+                sample_burst: int = LOG_SAMPLE_BURST, sample_every: int = LOG_SAMPLE_EVERY, filemode: str = 'a') -> LoggingPipeline:
+    """ Send the root logger's records through a queue to a background thread that writes them to filename. Entry points
+            (the API, the p2p client) call this once, library modules only ever get their own logger and never configure logging.
+        sample_every=1 turns sampling off. Calling it again replaces the previous pipeline
+    """
+    global _pipeline
+    with _lock:
+        if _pipeline is not None:
+            _pipeline.stop()
+        sampling = SampledFilter(sample_burst, sample_every) if sample_every > 1 else None
+        _pipeline = LoggingPipeline(filename, level, log_format, max_queue, sampling, filemode)
+        _pipeline.start()
+        return _pipeline
+
+def stop_logging() -> None:
+    global _pipeline
+    with _lock:
+        if _pipeline is not None:
+            _pipeline.stop()
+            _pipeline = None
+
+def logging_stats() -> dict:
+    with _lock:
+        return _pipeline.stats() if _pipeline is not None else {}
+
+
+atexit.register(stop_logging)
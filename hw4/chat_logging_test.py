@@ -0,0 +1,66 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import logging
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from unittest import TestCase
+from constants import *
+from chat_logging import SampledFilter, LazyQueueHandler, setup_logging, stop_logging, logging_stats
+
+class FormattedOn():
+    """ Remembers which thread turned it into a string
+    """
+    def __init__(self) -> None:
+        self.thread_name = None
+
+    def __str__(self):
+        self.thread_name = threading.current_thread().name
+        return 'formatted'
+
+def record(level: int = logging.INFO, lineno: int = 1) -> logging.LogRecord:
+    return logging.LogRecord('chat', level, 'room.py', lineno, 'message %s', ('value',), None)
+
+class ChatLoggingTest(TestCase):
+    """ Testing the queued logging pipeline
+    """
+    def test_sampling_per_call_site(self):
+        """ Each call site gets its burst, then one in every. Warnings always pass
+        """
+        sampling = SampledFilter(burst=2, every=5)
+        passed = [sampling.filter(record(lineno=1)) for _ in range(12)]
+        assert passed == [True, True, False, False, False, False, True, False, False, False, False, True]
+        assert sampling.filter(record(lineno=2)) is True
+        assert all(sampling.filter(record(logging.WARNING, 1)) for _ in range(10))
+        assert sampling.suppressed == 8
+
+    def test_queue_full_drops(self):
+        handler = LazyQueueHandler(queue.Queue(maxsize=1))
+        handler.handle(record())
+        handler.handle(record())
+        assert handler.dropped == 1
+
+    def test_formats_on_listener_thread(self):
+        """ The message is only formatted when the background thread writes it, and it does get written
+        """
+        log_path = os.path.join(tempfile.mkdtemp(), 'pipeline.log')
+        root_level = logging.getLogger().level
+        setup_logging(log_path, level='INFO', sample_every=1)
+        try:
+            argument = FormattedOn()
+            logging.getLogger('chat_logging_test').info('argument was %s', argument)
+            logging.getLogger('chat_logging_test').debug('debug is off %s', argument)
+            assert logging_stats()['dropped'] == 0
+        finally:
+            stop_logging()
+            logging.getLogger().setLevel(root_level)
+        with open(log_path) as log_file:
+            lines = log_file.read().splitlines()
+        assert len(lines) == 1 and lines[0].endswith('argument was formatted')
+        assert argument.thread_name not in (None, threading.current_thread().name)
+
+if __name__ == "__main__":
+    unittest.main()
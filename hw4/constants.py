@@ -37,3 +37,77 @@ DEFAULT_PUBLIC_TEST_MESS = 'DE: Test Public Queue at '
 USER_ALIAS = 'testing'
 
 
+MONGODB_MAX_POOL_SIZE = 100
+MONGODB_MIN_POOL_SIZE = 0
+MONGODB_MAX_IDLE_TIME_MS = 60000
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = 5000
+SEQUENCE_BLOCK_SIZE = 1000
+SEQUENCE_COLLECTION = 'sequence'
+SEQUENCE_LEGACY_KEY = 'userid'
+STORAGE_MAX_WORKERS = 32
+STORAGE_MAX_CONCURRENCY = 32
+WRITE_BEHIND_BATCH_SIZE = 500
+WRITE_BEHIND_MAX_AGE = 0.05
+WRITE_BEHIND_MAX_PENDING = 10000
+WRITE_BEHIND_PUT_TIMEOUT = 1.0
+WRITE_BEHIND_ENABLED = False
+ENSURE_INDEXES = True
+# Seconds before ensure_indexes tries a collection again after it couldn't create all of its indexes
+ENSURE_INDEXES_RETRY = 60
+MESSAGES_PAGE_SIZE = 100
+MESSAGES_MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+PUSH_QUEUE_SIZE = 256
+PUSH_SLOW_CONSUMER_POLICY = 'drop_oldest'
+PUSH_HEARTBEAT_SECONDS = 15
+ROOM_CACHE_SIZE = 1000
+# Check the room cache against Mongo's newest message before answering from it, off only when one process does all the sends
+ROOM_CACHE_CHECK = True
+LOG_FILE = 'chat.log'
+LOG_LEVEL = 'INFO'
+LOG_FORMAT = '%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s'
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_BURST = 10
+LOG_SAMPLE_EVERY = 100
+RMQ_HOST = 'localhost'
+RMQ_PORT = 5672
+RMQ_USER = 'guest'
+RMQ_PASS = 'guest'
+RMQ_VHOST = '/'
+RMQ_PUBLISHER_CHANNELS = 4
+RMQ_MAX_UNCONFIRMED = 10000
+RMQ_PUBLISH_TIMEOUT = 5.0
+RMQ_RECONNECT_DELAY = 0.5
+RMQ_MAX_RECONNECT_DELAY = 30.0
+RMQ_CONFIRM_SAMPLES = 10000
+RMQ_PREFETCH_COUNT = 200
+RMQ_ACK_BATCH = 50
+RMQ_ACK_INTERVAL = 0.05
+RMQ_HANDLER_THREADS = 4
+# Seconds before a batch whose handler failed goes back on the queue, doubled for every failure in a row
+RMQ_HANDLER_RETRY_DELAY = 0.5
+ARCHIVE_DIR = 'archive'
+RETENTION_BATCH_SIZE = 10000
+RETENTION_SWEEP_INTERVAL = 3600
+RETENTION_TTL_GRACE = 86400
+LAYOUT_PARTITIONED = 'partitioned'
+LAYOUT_PER_ROOM = 'per_room'
+MESSAGE_LAYOUT = LAYOUT_PARTITIONED
+MESSAGES_COLLECTION = 'messages'
+QUEUES_COLLECTION = 'queues'
+# rmq.ChatRoom saves every message with a unique message_key, a duplicate key means it was already saved
+MESSAGE_KEY_INDEX = 'message_key_unique'
+MIGRATIONS_COLLECTION = 'migrations'
+MIGRATION_BATCH_SIZE = 1000
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_MAX_RESULTS = 1000
+SEARCH_LANGUAGE = 'english'
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_MONGO_COMMANDS = True
+METRICS_LOOP_LAG_INTERVAL = 0.5
+PROFILE_DIR = 'profiles'
+PROFILE_TOKEN = None
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_INTERVAL = 0.001
+PROFILE_MAX_CONCURRENT = 2
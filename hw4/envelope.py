@@ -0,0 +1,90 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import struct
+from datetime import datetime, timedelta, timezone
+import pika
+
+ENVELOPE_CONTENT_TYPE = 'application/vnd.chat.envelope'
+ENVELOPE_MAGIC = b'CE'
+ENVELOPE_VERSION = 1
+# Every version starts with the magic and the version byte, the rest of the layout belongs to the version
+PREFIX = struct.Struct('!2sB')
+# Version 1: mess_type, sent_time, rec_time (microseconds since 1970, NO_TIME for None), then the lengths of to_user, from_user
+#   and the message, followed by those three as UTF-8
+V1_FIXED = struct.Struct('!2sBbqqHHI')
+NO_TIME = -2 ** 63
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+# The header names peers on the old format send, from MessProperties.__dict__
+LEGACY_HEADERS = {'mess_type': '_MessProperties__mess_type',
+    'to_user': '_MessProperties__to_user',
+    'from_user': '_MessProperties__from_user',
+    'sent_time': '_MessProperties__sent_time',
+    'rec_time': '_MessProperties__rec_time',
+}
+
+
+class EnvelopeError(ValueError):
+    """ The body isn't an envelope we can read: wrong magic, a version we don't know or cut short
+    """
+
+
+def _to_micros(value: datetime) -> int:
+    if value is None:
+        return NO_TIME
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // ONE_MICROSECOND
+
+def _from_micros(value: int) -> datetime:
+    return None if value == NO_TIME else EPOCH + timedelta(microseconds=value)
+
+
+def encode(message: str, mess_props: dict) -> bytes:
+    """ Pack a message and its properties (the MessProperties.to_dict keys) into one body. Times go as naive datetimes, aware
+        ones are converted to UTC first
+    """
+    to_user = (mess_props.get('to_user') or '').encode('utf-8')
+    from_user = (mess_props.get('from_user') or '').encode('utf-8')
+    text = message.encode('utf-8') if isinstance(message, str) else bytes(message)
+    return V1_FIXED.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, mess_props.get('mess_type', 0), _to_micros(mess_props.get('sent_time')),
+                         _to_micros(mess_props.get('rec_time')), len(to_user), len(from_user), len(text)) + to_user + from_user + text
+
+def decode(body: bytes) -> tuple:
+    """ The other way, returns (message, mess_props dict)
+    """
+    if len(body) < PREFIX.size:
+        raise EnvelopeError('body too short for an envelope')
+    magic, version = PREFIX.unpack_from(body)
+    if magic != ENVELOPE_MAGIC:
+        raise EnvelopeError('not an envelope')
+    if version != 1:
+        raise EnvelopeError(f'unknown envelope version {version}')
+    if len(body) < V1_FIXED.size:
+        raise EnvelopeError('envelope cut short')
+    _, _, mess_type, sent_time, rec_time, to_len, from_len, text_len = V1_FIXED.unpack_from(body)
+    start = V1_FIXED.size
+    if len(body) != start + to_len + from_len + text_len:
+        raise EnvelopeError('envelope length does not match its contents')
+    view = memoryview(body)
+    to_user = str(view[start:start + to_len], 'utf-8')
+    from_user = str(view[start + to_len:start + to_len + from_len], 'utf-8')
+    message = str(view[start + to_len + from_len:], 'utf-8')
+    return message, {'mess_type': mess_type, 'to_user': to_user, 'from_user': from_user,
+                     'sent_time': _from_micros(sent_time), 'rec_time': _from_micros(rec_time)}
+
+def properties(**kwargs) -> pika.BasicProperties:
+    """ The AMQP properties that go with an envelope body, no header table
+    """
+    return pika.BasicProperties(content_type=ENVELOPE_CONTENT_TYPE, **kwargs)
+
+def decode_delivery(props: pika.BasicProperties, body: bytes) -> tuple:
+    """ (message, mess_props dict) for anything on a room queue: an envelope, or the old format with the properties in headers
+        under the mangled MessProperties names and the text as the body
+    """
+    if props.content_type == ENVELOPE_CONTENT_TYPE:
+        return decode(body)
+    headers = props.headers or {}
+    if LEGACY_HEADERS['to_user'] not in headers:
+        raise EnvelopeError('neither an envelope nor the old header format')
+    return body.decode('utf-8'), {name: headers.get(header) for name, header in LEGACY_HEADERS.items()}
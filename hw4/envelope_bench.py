@@ -0,0 +1,57 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import time
+import pika
+from pika.spec import BasicProperties
+from constants import *
+import envelope
+import rmq
+
+NUM_MESSAGES = 100000
+
+
+def legacy_round_trip(message: str, mess_props: rmq.MessProperties) -> int:
+    """ The old format: text as the body, our properties in an AMQP header table. Returns the bytes in the content header and
+        body frames, the rest of the framing is the same either way
+    """
+    properties = pika.BasicProperties(headers=mess_props.to_headers(), delivery_mode=2)
+    encoded = b''.join(properties.encode())
+    body = message.encode()
+    decoded = BasicProperties()
+    decoded.decode(encoded)
+    envelope.decode_delivery(decoded, body)
+    return len(encoded) + len(body)
+
+
+def envelope_round_trip(message: str, mess_props: rmq.MessProperties) -> int:
+    properties = envelope.properties(delivery_mode=2)
+    encoded = b''.join(properties.encode())
+    body = envelope.encode(message, mess_props.to_dict())
+    decoded = BasicProperties()
+    decoded.decode(encoded)
+    envelope.decode_delivery(decoded, body)
+    return len(encoded) + len(body)
+
+
+def bench(name: str, round_trip, num_messages: int, message: str) -> None:
+    mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'bench-to', 'bench-from')
+    start = time.perf_counter()
+    for _ in range(num_messages):
+        size = round_trip(message, mess_props)
+    elapsed = time.perf_counter() - start
+    print(f'{name}: {elapsed / num_messages * 1e6:.2f} us per encode + decode, {size} bytes per message')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Old header table format vs the binary envelope, encode + decode cost and bytes on the wire')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--length', type=int, default=40, help='message text length')
+    args = parser.parse_args()
+    message = 'x' * args.length
+    bench('headers ', legacy_round_trip, args.messages, message)
+    bench('envelope', envelope_round_trip, args.messages, message)
+
+
+if __name__ == "__main__":
+    main()
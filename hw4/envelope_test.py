@@ -0,0 +1,60 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+from datetime import datetime, timezone, timedelta
+import pika
+from constants import *
+import envelope
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class EnvelopeTest(TestCase):
+    """ Testing the binary message envelope and reading the old header format
+    """
+    def setUp(self) -> None:
+        self.sent_time = datetime(2023, 3, 14, 15, 9, 26, 535897)
+        self.mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'zoë', SENDER_NAME, self.sent_time, self.sent_time)
+
+    def test_round_trip(self):
+        body = envelope.encode('héllo wörld ✓', self.mess_props.to_dict())
+        message, mess_dict = envelope.decode(body)
+        assert message == 'héllo wörld ✓'
+        assert mess_dict == self.mess_props.to_dict()
+
+    def test_aware_times_and_none(self):
+        aware = datetime(2023, 3, 14, 10, 0, tzinfo=timezone(timedelta(hours=-5)))
+        _, mess_dict = envelope.decode(envelope.encode('', {'mess_type': MESSAGE_TYPE_SENT, 'to_user': 'a', 'from_user': 'b',
+                                                            'sent_time': aware, 'rec_time': None}))
+        assert mess_dict['sent_time'] == datetime(2023, 3, 14, 15, 0)
+        assert mess_dict['rec_time'] is None
+
+    def test_delivery_formats(self):
+        """ Envelopes by content type, and the old format with our properties in headers
+        """
+        body = envelope.encode('new format', self.mess_props.to_dict())
+        assert envelope.decode_delivery(envelope.properties(), body) == ('new format', self.mess_props.to_dict())
+        legacy = pika.BasicProperties(headers=self.mess_props.to_headers())
+        assert envelope.decode_delivery(legacy, 'old format'.encode()) == ('old format', self.mess_props.to_dict())
+
+    def test_bad_bodies(self):
+        body = envelope.encode('hello', self.mess_props.to_dict())
+        for bad in (b'', b'XX' + body[2:], body[:2] + bytes([9]) + body[3:], body[:-1], body + b'!'):
+            with self.assertRaises(envelope.EnvelopeError):
+                envelope.decode(bad)
+        with self.assertRaises(envelope.EnvelopeError):
+            envelope.decode_delivery(pika.BasicProperties(), b'who knows')
+
+    def test_smaller_than_headers(self):
+        """ Envelope plus its properties has to beat the text plus a header table on the wire
+        """
+        body = envelope.encode('hello', self.mess_props.to_dict())
+        new_size = len(body) + len(b''.join(envelope.properties(delivery_mode=2).encode()))
+        old_size = len(b'hello') + len(b''.join(pika.BasicProperties(headers=self.mess_props.to_headers(), delivery_mode=2).encode()))
+        assert new_size < old_size
+
+if __name__ == "__main__":
+    unittest.main()
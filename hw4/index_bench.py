@@ -0,0 +1,68 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime
+from pymongo import MongoClient, ASCENDING
+from constants import *
+from indexes import INDEX_SPECS, check_query_plans
+
+SIZES = [10000, 1000000, 10000000]
+NUM_ROOMS = 100
+NUM_USERS = 50
+INSERT_BATCH = 10000
+REPEATS = 20
+
+
+def populate(collection, num_messages: int) -> None:
+    """ Messages spread over NUM_ROOMS rooms and NUM_USERS recipients, shaped like ChatRoom.send_message writes them
+    """
+    collection.drop()
+    now = datetime.now()
+    for batch_start in range(0, num_messages, INSERT_BATCH):
+        collection.insert_many([{'message': f'bench message {index}',
+                                'mess_props': {'room_name': f'room-{index % NUM_ROOMS}', 'mess_type': MESSAGE_TYPE_SENT,
+                                            'to_user': f'user-{index % NUM_USERS}', 'from_user': 'bench',
+                                            'sent_time': now, 'rec_time': now, 'sequence_num': index}}
+                                for index in range(batch_start, min(batch_start + INSERT_BATCH, num_messages))], ordered=False)
+
+
+def time_queries(collection, num_messages: int) -> dict:
+    """ Median latency of each ChatRoom query shape, fetching the first page the way the API would
+    """
+    shapes = {'get_messages (recipient)': lambda: list(collection.find({'mess_props.room_name': 'room-7', 'mess_props.to_user': 'user-7'}).sort('mess_props.sequence_num', ASCENDING).limit(50)),
+            'get_messages (room)': lambda: list(collection.find({'mess_props.room_name': 'room-7'}).sort('mess_props.sequence_num', ASCENDING).limit(50)),
+            'find_message': lambda: collection.find_one({'message': f'bench message {num_messages - 1}'})}
+    timings = {}
+    for name, query in shapes.items():
+        samples = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            query()
+            samples.append(time.perf_counter() - start)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ChatRoom query latency with and without the INDEX_SPECS indexes (needs a mongod)')
+    parser.add_argument('--host', default='mongodb://localhost:27017/')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES))
+    args = parser.parse_args()
+    collection = MongoClient(args.host).detest.get_collection('index-bench')
+    for num_messages in [int(size) for size in args.sizes.split(',')]:
+        populate(collection, num_messages)
+        without_indexes = time_queries(collection, num_messages)
+        for name, keys, options in INDEX_SPECS['room']:
+            collection.create_index(keys, name=name, **options)
+        with_indexes = time_queries(collection, num_messages)
+        for name in without_indexes:
+            print(f'{num_messages:>10} messages  {name:<26} no index: {without_indexes[name] * 1000:9.2f} ms   indexed: {with_indexes[name] * 1000:7.2f} ms')
+        for description, stages, collscan in check_query_plans({'room': collection}):
+            print(f'{"":>10}  plan {description}: {" <- ".join(stages)}{"  (COLLSCAN)" if collscan else ""}')
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
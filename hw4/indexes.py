@@ -0,0 +1,258 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pymongo import ASCENDING, TEXT
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+# Every index each kind of collection should have, as (name, keys, options). ensure_indexes creates whatever is missing.
+#   room:      a ChatRoom collection. get_messages filters on room and recipient and sorts on sequence number, find_message on the text
+#              and search_messages goes through the text index (a collection can only have one)
+#   room_list: the RoomList collection, one metadata document per room, looked up by name, owner and member
+#   users:     the UserList collection, one document per user plus the list metadata document (found by name). Aliases are unique
+#   queue:     an rmq.ChatRoom collection, the metadata document is found by name, messages have a unique message_key
+#   messages:  the one collection every room.ChatRoom shares in the partitioned layout (see layout.py). Messages are keyed by
+#              (room, sequence number), which is also the shard key if the collection is ever sharded: a room's history stays
+#              together and ranged reads go to one shard. Text lookups are per room too
+#   queues:    the one collection every rmq.ChatRoom shares in the partitioned layout, metadata by name, messages by queue in _id order
+INDEX_SPECS = {
+    'room': [
+        ('room_recipient_seq', [('mess_props.room_name', ASCENDING), ('mess_props.to_user', ASCENDING), ('mess_props.sequence_num', ASCENDING)], {}),
+        ('room_seq', [('mess_props.room_name', ASCENDING), ('mess_props.sequence_num', ASCENDING)], {}),
+        ('message_text', [('message', ASCENDING)], {}),
+        ('message_search', [('message', TEXT)], {'default_language': SEARCH_LANGUAGE}),
+    ],
+    'messages': [
+        ('room_seq_unique', [('mess_props.room_name', ASCENDING), ('mess_props.sequence_num', ASCENDING)], {'unique': True, 'sparse': True}),
+        ('room_recipient_seq', [('mess_props.room_name', ASCENDING), ('mess_props.to_user', ASCENDING), ('mess_props.sequence_num', ASCENDING)], {}),
+        ('room_message_text', [('mess_props.room_name', ASCENDING), ('message', ASCENDING)], {}),
+        # No room prefix, a prefixed text index can't serve searches across rooms
+        ('message_search', [('message', TEXT)], {'default_language': SEARCH_LANGUAGE}),
+    ],
+    'room_list': [
+        ('room_name_unique', [('room_name', ASCENDING)], {'unique': True, 'sparse': True}),
+        ('room_owner', [('owner_alias', ASCENDING)], {'sparse': True}),
+        ('room_members', [('member_list', ASCENDING)], {'sparse': True}),
+    ],
+    'users': [
+        ('alias_unique', [('alias', ASCENDING)], {'unique': True, 'sparse': True}),
+        ('user_list_metadata', [('name', ASCENDING)], {'sparse': True}),
+    ],
+    'queue': [
+        ('queue_metadata', [('name', ASCENDING)], {'sparse': True}),
+        (MESSAGE_KEY_INDEX, [('message_key', ASCENDING)], {'unique': True, 'sparse': True}),
+    ],
+    'queues': [
+        ('queue_name_unique', [('name', ASCENDING)], {'unique': True, 'sparse': True}),
+        ('queue_messages', [('queue_name', ASCENDING), ('_id', ASCENDING)], {'sparse': True}),
+        (MESSAGE_KEY_INDEX, [('message_key', ASCENDING)], {'unique': True, 'sparse': True}),
+    ],
+}
+
+# Every query shape our classes send, as (kind, description, filter, sort). Values are placeholders, only the shape matters to
+#   the planner. check_query_plans runs explain on each of them
+QUERY_SHAPES = [
+    ('room', 'ChatRoom.get_messages for one recipient', {'mess_props.room_name': 'general', 'mess_props.to_user': 'testing'}, [('mess_props.sequence_num', ASCENDING)]),
+    ('room', 'ChatRoom.get_messages for the whole room', {'mess_props.room_name': 'general'}, [('mess_props.sequence_num', ASCENDING)]),
+    ('room', 'ChatRoom.find_message', {'message': 'hello'}, None),
+    ('messages', 'ChatRoom.get_messages for one recipient, partitioned', {'mess_props.room_name': 'general', 'mess_props.to_user': 'testing'}, [('mess_props.sequence_num', ASCENDING)]),
+    ('messages', 'ChatRoom.get_messages for the whole room, partitioned', {'mess_props.room_name': 'general'}, [('mess_props.sequence_num', ASCENDING)]),
+    ('messages', 'ChatRoom.find_message, partitioned', {'mess_props.room_name': 'general', 'message': 'hello'}, None),
+    ('messages', 'ChatRoom.search_messages, partitioned', {'$text': {'$search': 'hello'}, 'mess_props.room_name': 'general'}, None),
+    ('messages', 'search_rooms', {'$text': {'$search': 'hello'}}, None),
+    ('room_list', 'RoomList sequence counter', {'_id': 'userid'}, None),
+    ('room_list', 'RoomList room by name', {'room_name': 'general'}, None),
+    ('room_list', 'RoomList restore', {'room_name': {'$exists': True}}, None),
+    ('room_list', 'RoomList rooms by owner', {'owner_alias': 'testing'}, None),
+    ('room_list', 'RoomList rooms by member', {'member_list': 'testing'}, None),
+    ('queue', 'rmq.ChatRoom metadata', {'name': {'$exists': True}}, None),
+    ('queues', 'rmq.ChatRoom metadata, partitioned', {'name': 'general'}, None),
+    ('queues', 'rmq.ChatRoom restore, partitioned', {'queue_name': 'general', 'message': {'$exists': True}}, [('_id', -1)]),
+    ('users', 'UserList.get', {'alias': 'testing'}, None),
+    ('users', 'UserList.get_all_users', {'alias': {'$exists': True}}, None),
+    ('users', 'UserList metadata', {'name': {'$exists': True}}, None),
+]
+
+# Indexes an older INDEX_SPECS created that a newer one replaces, as kind -> names. They're dropped once the replacement is there
+SUPERSEDED_INDEXES = {
+    'users': ['alias'],
+}
+
+# (collection full name, which indexes) -> [lock, all there, monotonic time of the last attempt that failed]. A collection only
+#   counts as done once every index is there; after a failure we try again on the next call ENSURE_INDEXES_RETRY seconds later
+_ensured = {}
+_ensured_lock = threading.Lock()
+ALL_INDEXES = 'all'
+UNIQUE_INDEXES = 'unique'
+# Constructors run on the event loop, so they hand the index check to a background thread instead of waiting on Mongo. A daemon
+#   thread, not a ThreadPoolExecutor: the executor's workers are joined at exit, so with Mongo down every queued build held the
+#   process up for a server selection timeout
+_ensure_queue = queue.Queue()
+_ensure_thread = None
+
+def _ensure_worker() -> None:
+    while True:
+        future, collection, kind = _ensure_queue.get()
+        if future.set_running_or_notify_cancel() is False:
+            continue
+        try:
+            future.set_result(_ensure(collection, kind, ALL_INDEXES))
+        except BaseException as error:
+            future.set_exception(error)
+
+def _submit(collection, kind: str) -> Future:
+    global _ensure_thread
+    future = Future()
+    with _ensured_lock:
+        if _ensure_thread is None:
+            _ensure_thread = threading.Thread(target=_ensure_worker, name='ensure-indexes', daemon=True)
+            _ensure_thread.start()
+    _ensure_queue.put((future, collection, kind))
+    return future
+
+def _state(collection, which: str) -> list:
+    with _ensured_lock:
+        return _ensured.setdefault((collection.full_name, which), [threading.Lock(), False, None])
+
+def _due(state: list) -> bool:
+    """ Not done, and not failed too recently to try again
+    """
+    return state[1] is False and (state[2] is None or time.monotonic() - state[2] >= ENSURE_INDEXES_RETRY)
+
+def _ensure(collection, kind: str, which: str) -> list:
+    """ _create_missing once at a time per collection, remembering whether it got everything
+    """
+    state = _state(collection, which)
+    with state[0]:
+        if _due(state) is False:
+            return []
+        created, complete = _create_missing(collection, kind, unique_only=which == UNIQUE_INDEXES)
+        state[1] = complete
+        state[2] = None if complete is True else time.monotonic()
+    return created
+
+def ensure_indexes(collection, kind: str, wait: bool = True):
+    """ Create the indexes INDEX_SPECS lists for this kind of collection if they aren't there. Once they all are, the collection
+        isn't checked again in this process, so it's cheap to call from every constructor. Returns the names of the indexes we
+        created, or with wait=False a Future for them (None if there was nothing to do)
+    """
+    if ENSURE_INDEXES is not True or _due(_state(collection, ALL_INDEXES)) is False:
+        return [] if wait is True else None
+    if wait is False:
+        return _submit(collection, kind)
+    return _ensure(collection, kind, ALL_INDEXES)
+
+def ensure_unique_indexes(collection, kind: str) -> list:
+    """ The unique indexes of this kind of collection, built right away. Writers call it before writing: a unique index can't be
+        built once duplicates are in, so it has to be there before the first write, not whenever the background build gets to it
+        Cheap once they're there. Returns the names of the indexes we created
+    """
+    if ENSURE_INDEXES is not True:
+        return []
+    state = _state(collection, ALL_INDEXES)
+    if state[1] is True or all(options.get('unique') is not True for _, _, options in INDEX_SPECS[kind]):
+        return []
+    return _ensure(collection, kind, UNIQUE_INDEXES)
+
+def _create_missing(collection, kind: str, unique_only: bool = False) -> tuple:
+    """ Returns the indexes we created and whether all of them are there now. A unique index we couldn't create is an error:
+        until it's there nothing stops duplicates
+    """
+    specs = [spec for spec in INDEX_SPECS[kind] if unique_only is False or spec[2].get('unique') is True]
+    try:
+        existing = collection.index_information()
+    except Exception as error:
+        logger.warning('Could not read indexes for %s: %s', collection.full_name, error)
+        return [], False
+    created = []
+    for name, keys, options in specs:
+        if name in existing:
+            continue
+        try:
+            collection.create_index(keys, name=name, **options)
+            created.append(name)
+        except Exception as error:
+            log = logger.error if options.get('unique') is True else logger.warning
+            log('Could not create index %s on %s, trying again in %ss: %s', name, collection.full_name, ENSURE_INDEXES_RETRY, error)
+    if len(created) > 0:
+        logger.info('Created indexes %s on %s', created, collection.full_name)
+    complete = all(name in existing or name in created for name, _, _ in specs)
+    for name in SUPERSEDED_INDEXES.get(kind, []) if unique_only is False else []:
+        if name in existing and complete is True:
+            try:
+                collection.drop_index(name)
+                logger.info('Dropped superseded index %s on %s', name, collection.full_name)
+            except Exception as error:
+                logger.warning('Could not drop index %s on %s: %s', name, collection.full_name, error)
+    return created, complete
+
+def forget_ensured() -> None:
+    """ Make ensure_indexes check every collection again, for tests and after dropping collections
+    """
+    with _ensured_lock:
+        _ensured.clear()
+
+def winning_stages(plan: dict) -> list:
+    """ Flatten a winning plan into its stage names, outermost first
+    """
+    stages = [plan.get('stage')]
+    for child_key in ('inputStage', 'queryPlan'):
+        if child_key in plan:
+            stages.extend(winning_stages(plan[child_key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(winning_stages(child))
+    return [stage for stage in stages if stage is not None]
+
+def check_query_plans(collections: dict) -> list:
+    """ Run explain for every query shape against the collection of its kind (collections maps kind -> collection)
+        Returns (description, stages, collscan) for each, collscan is True when Mongo would scan the whole collection
+    """
+    results = []
+    for kind, description, query, sort in QUERY_SHAPES:
+        if (collection := collections.get(kind)) is None:
+            continue
+        cursor = collection.find(query)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        explanation = cursor.explain()
+        stages = winning_stages(explanation['queryPlanner']['winningPlan'])
+        results.append((description, stages, 'COLLSCAN' in stages))
+    return results
+
+
+def main():
+    """ Check (and optionally create) indexes, then explain every query shape and flag collection scans
+    """
+    from mongo_pool import get_mongo_client
+    parser = argparse.ArgumentParser(description='Explain every query shape ChatRoom/RoomList/UserList issue and flag COLLSCANs')
+    parser.add_argument('--room', default=DEFAULT_PUBLIC_ROOM, help='room collection to explain against')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_NAME, help='rmq queue collection to explain against')
+    parser.add_argument('--create', action='store_true', help='create missing indexes first')
+    args = parser.parse_args()
+    # Same clients and databases the classes themselves use
+    mongo_db = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH).detest
+    plain_client = get_mongo_client(host=MONGODB_URL)
+    collections = {'room': mongo_db.get_collection(args.room),
+                'room_list': mongo_db.get_collection(DEFAULT_ROOM_LIST_NAME),
+                'users': plain_client.detest.users,
+                'queue': plain_client.gueshner.get_collection(args.queue),
+                'messages': mongo_db.get_collection(MESSAGES_COLLECTION),
+                'queues': plain_client.gueshner.get_collection(QUEUES_COLLECTION)}
+    if args.create is True:
+        for kind, collection in collections.items():
+            print(f'{collection.full_name}: created {ensure_indexes(collection, kind)}')
+    collscans = 0
+    for description, stages, collscan in check_query_plans(collections):
+        collscans += collscan
+        print(f'{"COLLSCAN" if collscan else "ok      "} {description}: {" <- ".join(stages)}')
+    return 1 if collscans > 0 else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,64 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import time
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from layout import room_collection
+from message_stream import encode_raw_documents
+from room import ChatRoom, MessageProperties, MESSAGE_PROJECTION
+
+NUM_MESSAGES = 10000
+ROUNDS = 20
+
+
+def old_response(messages) -> bytes:
+    """ What the listing endpoints used to do with the messages: jsonable_encoder, then JSONResponse renders with json
+    """
+    return JSONResponse(content=jsonable_encoder(list(messages), custom_encoder={ObjectId: str})).body
+
+
+def timed(work, rounds: int) -> tuple:
+    body = work()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        work()
+    return (time.perf_counter() - start) / rounds, len(body)
+
+
+def report(name: str, elapsed: float, size: int, num_messages: int) -> None:
+    print(f'{name}: {elapsed * 1e3:8.2f} ms per response ({elapsed / num_messages * 1e6:.2f} us/message), {size} bytes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encoding a message listing, the old jsonable_encoder/JSONResponse path vs the JSON listings')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    args = parser.parse_args()
+    mongo_pool.client_factory = memory_client_factory()
+
+    room = ChatRoom('json-bench', create_new=True, cache_size=args.messages)
+    for index in range(args.messages):
+        room.send_message(f'bench message {index}', SENDER_NAME, MessageProperties('json-bench', 'bench-to', SENDER_NAME, MESSAGE_TYPE_SENT))
+
+    print(f'cache hit, {args.messages} messages')
+    report('  old  get_messages + jsonable_encoder', *timed(lambda: old_response(room.get_messages('bench-to', args.messages)), args.rounds), args.messages)
+    report('  new  get_messages_json              ', *timed(lambda: room.get_messages_json('bench-to', args.messages), args.rounds), args.messages)
+
+    # From Mongo: start from the BSON a batch of documents arrives as, so the in-memory stand-in doesn't decide the outcome
+    documents = list(room_collection(mongo_pool.get_client().detest, 'json-bench').find({'mess_props.room_name': 'json-bench', 'message': {'$exists': True}}))
+    full = [bson.encode(document) for document in documents]
+    projected = [bson.encode({field: document[field] for field in MESSAGE_PROJECTION if MESSAGE_PROJECTION[field] is True}) for document in documents]
+    print(f'from mongo, {len(documents)} messages')
+    report('  old  dict per document + jsonable_encoder', *timed(lambda: old_response(bson.decode(raw) for raw in full), args.rounds), len(documents))
+    report('  new  projected raw BSON batch            ', *timed(lambda: encode_raw_documents([RawBSONDocument(raw) for raw in projected]), args.rounds), len(documents))
+
+
+if __name__ == "__main__":
+    main()
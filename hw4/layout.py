@@ -0,0 +1,26 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+from constants import *
+
+# The kind of indexes (see indexes.INDEX_SPECS) each layout's collections need
+ROOM_INDEX_KINDS = {LAYOUT_PARTITIONED: 'messages', LAYOUT_PER_ROOM: 'room'}
+QUEUE_INDEX_KINDS = {LAYOUT_PARTITIONED: 'queues', LAYOUT_PER_ROOM: 'queue'}
+
+
+def _check(layout: str) -> None:
+    if layout not in ROOM_INDEX_KINDS:
+        raise ValueError(f'unknown message layout {layout}')
+
+def room_collection(mongo_db, room_name: str, layout: str = MESSAGE_LAYOUT):
+    """ Where a room.ChatRoom keeps its messages. Partitioned, every room shares MESSAGES_COLLECTION and its documents are told
+            apart by mess_props.room_name (they always carry it). Per room is the old layout, a collection named after the room
+    """
+    _check(layout)
+    return mongo_db.get_collection(MESSAGES_COLLECTION if layout == LAYOUT_PARTITIONED else room_name)
+
+def queue_collection(mongo_db, queue_name: str, layout: str = MESSAGE_LAYOUT):
+    """ Where an rmq.ChatRoom keeps its metadata and messages. Partitioned, every queue shares QUEUES_COLLECTION, the metadata
+            document is found by name and the messages carry a queue_name. Per room is the old collection named after the queue
+    """
+    _check(layout)
+    return mongo_db.get_collection(QUEUES_COLLECTION if layout == LAYOUT_PARTITIONED else queue_name)
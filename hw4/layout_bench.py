@@ -0,0 +1,67 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import time
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from indexes import ensure_indexes, forget_ensured
+from layout import room_collection, ROOM_INDEX_KINDS
+from room import ChatRoom, MessageProperties
+
+NUM_ROOMS = 10000
+NUM_MESSAGES = 5
+PAGE_SIZE = 20
+
+
+def timed(work) -> float:
+    start = time.perf_counter()
+    work()
+    return time.perf_counter() - start
+
+
+def bench_layout(layout: str, room_names: list, num_messages: int) -> dict:
+    """ Open every room the way a fresh process does (indexes checked, ChatRoom built), send to each, then read the newest page of
+        each through a second set of instances so the reads go to Mongo instead of the cache
+    """
+    forget_ensured()
+    mongo_db = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH).detest
+    collections_before = set(mongo_db.list_collection_names())
+    rooms = []
+    def open_rooms():
+        for name in room_names:
+            # What the constructor hands to the index thread, waited for here so it's part of the cost
+            ensure_indexes(room_collection(mongo_db, name, layout), ROOM_INDEX_KINDS[layout])
+            rooms.append(ChatRoom(name, create_new=True, cache_size=1, layout=layout))
+    def send():
+        for room in rooms:
+            for index in range(num_messages):
+                room.send_message(f'bench message {index}', SENDER_NAME, MessageProperties(room.room_name, 'bench-to', SENDER_NAME, MESSAGE_TYPE_SENT))
+    def read():
+        for name in room_names:
+            ChatRoom(name, cache_size=1, layout=layout).get_page('bench-to', limit=PAGE_SIZE, latest=True)
+    results = {'open': timed(open_rooms), 'send': timed(send), 'read': timed(read)}
+    new_collections = set(mongo_db.list_collection_names()) - collections_before
+    results['collections'] = len(new_collections)
+    results['indexes'] = sum(len(mongo_db.get_collection(name).index_information()) for name in new_collections)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collection per room vs the partitioned messages collection, opening, sending to and reading many rooms')
+    parser.add_argument('--rooms', type=int, default=NUM_ROOMS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES, help='messages sent to each room')
+    parser.add_argument('--mongo', action='store_true', help='run against the configured mongod (needs one you can drop bench rooms in) instead of in memory')
+    args = parser.parse_args()
+    for layout in (LAYOUT_PER_ROOM, LAYOUT_PARTITIONED):
+        if args.mongo is False:
+            mongo_pool.client_factory = memory_client_factory()
+        room_names = [f'layout-bench-{layout}-{index}' for index in range(args.rooms)]
+        results = bench_layout(layout, room_names, args.messages)
+        print(f'{layout:12}: open {results["open"]:7.2f}s, send {results["send"]:7.2f}s, read {results["read"]:7.2f}s '
+              f'({results["read"] / args.rooms * 1e6:.0f} us/room), {results["collections"]} collections, {results["indexes"]} indexes')
+        mongo_pool.close()
+
+
+if __name__ == "__main__":
+    main()
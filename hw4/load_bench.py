@@ -0,0 +1,287 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from constants import *
+
+NUM_CLIENTS = 50
+NUM_REQUESTS = 5000
+NUM_WARMUP = 200
+NUM_ROOMS = 5
+NUM_USERS = 20
+SEED_MESSAGES = 100
+PAGE_SIZE = 20
+# How much worse than the baseline (throughput down, p95/p99 up, as a fraction) counts as a regression
+TOLERANCE = 0.25
+# The defaults on in-memory Mongo, saved with --save. --baseline on its own compares against it. It's one machine's numbers,
+#   on other hardware save your own first and compare against that
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_bench_baseline.json')
+# requests a client picks, by weight. send is the HTML form post, page the room listing, messages the per user listing
+DEFAULT_MIX = {'send': 3, 'page': 3, 'messages': 3, 'alias': 1}
+ENDPOINTS = {'send': 'POST /page/send', 'page': 'GET /page/messages', 'messages': 'GET /messages/', 'alias': 'POST /alias'}
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(text: str) -> dict:
+    """ 'send=3,messages=5' -> {'send': 3, 'messages': 5}, the request kinds left out aren't sent
+    """
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f'unknown request kind {name}, pick from {", ".join(ENDPOINTS)}')
+        mix[name] = float(weight) if weight else 1.0
+        if mix[name] < 0:
+            raise ValueError(f'weight of {name} is negative')
+    if sum(mix.values()) <= 0:
+        raise ValueError('the mix needs at least one request kind with a weight')
+    return mix
+
+
+def url_client_factory(url: str):
+    """ A client factory for MongoPool that sends everybody to url (say a local mongod), whatever host and credentials they ask for
+    """
+    from pymongo import MongoClient
+    def factory(host = None, port = None, username = None, password = None, authSource = None, authMechanism = None, **options):
+        return MongoClient(url, **options)
+    return factory
+
+
+def local_app(mongo_url: str = None):
+    """ room_chat_api.app on the stand-ins: in-memory Mongo (or the mongod at mongo_url) and the in-process broker, so nothing
+        reaches for the hosts in constants. Has to run before anything else imports the api, its globals grab a client on import
+        Returns the app and a function that shuts the stand-ins down
+    """
+    from mongo_pool import mongo_pool
+    from memory_mongo import memory_client_factory
+    from rmq_stub import StubBroker
+    from rmq_publisher import RMQPublisher, set_publisher
+    from rmq_consumer import RMQConsumer, set_consumer
+    mongo_pool.client_factory = url_client_factory(mongo_url) if mongo_url is not None else memory_client_factory()
+    broker = StubBroker()
+    publisher = RMQPublisher(connection_factory=broker.connect)
+    consumer = RMQConsumer(connection_factory=broker.connect)
+    set_publisher(publisher)
+    set_consumer(consumer)
+    import room_chat_api
+    def close():
+        room_chat_api.retention_sweeper.stop()
+        publisher.close()
+        consumer.close()
+        mongo_pool.close()
+    return room_chat_api.app, close
+
+
+def percentile(times: list, pct: float) -> float:
+    """ Nearest rank percentile of already sorted times
+    """
+    return times[max(0, min(len(times) - 1, math.ceil(pct / 100 * len(times)) - 1))]
+
+
+def summarize(latencies: dict, errors: dict, elapsed: float) -> dict:
+    """ Throughput and latency (ms) per request kind and over everything. Failed requests count towards the latencies too,
+        a fast 500 is still a response the client waited for
+    """
+    def stats(times: list, failed: int) -> dict:
+        times = sorted(times)
+        result = {'requests': len(times), 'errors': failed, 'throughput': len(times) / elapsed if elapsed > 0 else 0.0}
+        if len(times) > 0:
+            result['mean'] = statistics.fmean(times) * 1e3
+            result.update({f'p{pct}': percentile(times, pct) * 1e3 for pct in PERCENTILES})
+        return result
+    endpoints = {name: stats(times, errors.get(name, 0)) for name, times in latencies.items()}
+    overall = stats([time for times in latencies.values() for time in times], sum(errors.values()))
+    return {'elapsed': elapsed, 'overall': overall, 'endpoints': endpoints}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """ What got worse than the baseline by more than tolerance: throughput, p95 and p99 overall and per request kind, plus any
+        request kind that now has errors when it had none. Request kinds missing from either side are skipped
+    """
+    regressions = []
+    def check(name: str, current: dict, before: dict) -> None:
+        if before.get('throughput', 0) > 0 and current['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput {current["throughput"]:.1f}/s, baseline {before["throughput"]:.1f}/s')
+        for pct in ('p95', 'p99'):
+            if pct in current and before.get(pct, 0) > 0 and current[pct] > before[pct] * (1 + tolerance):
+                regressions.append(f'{name}: {pct} {current[pct]:.2f} ms, baseline {before[pct]:.2f} ms')
+        if current['errors'] > 0 and before.get('errors', 0) == 0:
+            regressions.append(f'{name}: {current["errors"]} errors, baseline had none')
+    check('overall', results['overall'], baseline['overall'])
+    for name, current in results['endpoints'].items():
+        if name in baseline['endpoints']:
+            check(name, current, baseline['endpoints'][name])
+    return regressions
+
+
+class LoadRun():
+    """ Drives the api from num_clients concurrent clients, each one picking its next request from the weighted mix and sending it
+            as soon as the last one came back (closed loop, so throughput is what the server keeps up with)
+        The rooms and users are made up front through the api itself, tagged so runs against a persistent mongod don't collide
+    """
+    def __init__(self, client, mix: dict, num_clients: int = NUM_CLIENTS, num_rooms: int = NUM_ROOMS, num_users: int = NUM_USERS,
+                seed_messages: int = SEED_MESSAGES, tag: str = None, seed: int = 313) -> None:
+        self.__client = client
+        self.__kinds = list(mix)
+        self.__weights = [mix[kind] for kind in self.__kinds]
+        self.__num_clients = num_clients
+        self.__tag = tag if tag is not None else f'load-{int(time.time())}'
+        self.__rooms = [f'{self.__tag}-room-{index}' for index in range(num_rooms)]
+        self.__users = [f'{self.__tag}-user-{index}' for index in range(num_users)]
+        self.__seed_messages = seed_messages
+        self.__seed = seed
+        self.__sent = 0
+        self.__remaining = 0
+
+    async def setup(self) -> None:
+        for alias in self.__users:
+            await self.__expect(self.__client.post('/alias', params={'client_alias': alias}), 'registering', alias)
+        for room_name in self.__rooms:
+            await self.__expect(self.__client.post('/room', params={'room_name': room_name, 'owner_alias': self.__users[0], 'room_type': ROOM_TYPE_PUBLIC}),
+                                'creating', room_name)
+        rng = random.Random(self.__seed)
+        for index in range(self.__seed_messages):
+            sender, recipient = rng.sample(self.__users, 2) if len(self.__users) > 1 else self.__users * 2
+            await self.__expect(self.__client.post('/message/', params={'room_name': rng.choice(self.__rooms), 'message': f'seed message {index}',
+                                                                       'from_alias': sender, 'to_alias': recipient}), 'seeding', index)
+
+    @staticmethod
+    async def __expect(request, doing: str, what) -> None:
+        response = await request
+        if response.status_code >= 400:
+            raise RuntimeError(f'{doing} {what} failed with {response.status_code}: {response.text}')
+
+    def __request(self, kind: str, rng: random.Random):
+        room_name = rng.choice(self.__rooms)
+        alias = rng.choice(self.__users)
+        if kind == 'send':
+            self.__sent += 1
+            return self.__client.post('/page/send', data={'room_choice': room_name, 'message': f'load message {self.__sent}', 'alias': alias})
+        if kind == 'page':
+            return self.__client.get('/page/messages', params={'room_name': room_name, 'limit': PAGE_SIZE})
+        if kind == 'messages':
+            return self.__client.get('/messages/', params={'alias': alias, 'room_name': room_name, 'limit': PAGE_SIZE, 'latest': 'true'})
+        self.__sent += 1
+        return self.__client.post('/alias', params={'client_alias': f'{self.__tag}-new-{self.__sent}'})
+
+    async def __worker(self, number: int, latencies: dict, errors: dict) -> None:
+        rng = random.Random(self.__seed * 1000 + number)
+        while self.__remaining > 0:
+            self.__remaining -= 1
+            kind = rng.choices(self.__kinds, weights=self.__weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await self.__request(kind, rng)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            latencies[kind].append(time.perf_counter() - start)
+            if failed is True:
+                errors[kind] = errors.get(kind, 0) + 1
+
+    async def run(self, num_requests: int) -> dict:
+        """ Send num_requests between all the clients, returns summarize's report
+        """
+        latencies = {kind: [] for kind in self.__kinds}
+        errors = {}
+        self.__remaining = num_requests
+        start = time.perf_counter()
+        await asyncio.gather(*(self.__worker(number, latencies, errors) for number in range(self.__num_clients)))
+        return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def report(results: dict) -> None:
+    def line(name: str, stats: dict) -> str:
+        if stats['requests'] == 0:
+            return f'{name:20}: no requests'
+        return (f'{name:20}: {stats["throughput"]:8.1f} req/s, p50 {stats["p50"]:8.2f} ms, p95 {stats["p95"]:8.2f} ms, p99 {stats["p99"]:8.2f} ms, '
+                f'{stats["requests"]} requests, {stats["errors"]} errors')
+    for name, stats in results['endpoints'].items():
+        print(line(ENDPOINTS[name], stats))
+    print(line('overall', results['overall']))
+
+
+async def load(args, mix: dict) -> dict:
+    import httpx
+    # one log line per request would be most of what the run does
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    if args.url is not None:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        close = None
+    else:
+        app, close = local_app(args.mongo_url)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://load-bench', timeout=args.timeout)
+    try:
+        async with client:
+            load_run = LoadRun(client, mix, num_clients=args.clients, num_rooms=args.rooms, num_users=args.users,
+                               seed_messages=args.seed_messages, tag=args.tag, seed=args.seed)
+            await load_run.setup()
+            if args.warmup > 0:
+                await load_run.run(args.warmup)
+            return await load_run.run(args.requests)
+    finally:
+        if close is not None:
+            close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test room_chat_api: many concurrent clients on a weighted mix of requests, throughput and '
+                                                 'p50/p95/p99 per request kind, compared against a saved baseline')
+    parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+                        help=f'request kinds and weights, from {", ".join(f"{name} ({endpoint})" for name, endpoint in ENDPOINTS.items())}')
+    parser.add_argument('--clients', type=int, default=NUM_CLIENTS)
+    parser.add_argument('--requests', type=int, default=NUM_REQUESTS)
+    parser.add_argument('--warmup', type=int, default=NUM_WARMUP, help='requests sent first and left out of the numbers')
+    parser.add_argument('--rooms', type=int, default=NUM_ROOMS)
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--seed-messages', type=int, default=SEED_MESSAGES, help='messages in the rooms before the run')
+    parser.add_argument('--url', help='load test a running server (say uvicorn room_chat_api:app) instead of the app in this process')
+    parser.add_argument('--mongo-url', help='in process, use this mongod (say mongodb://localhost:27017) instead of in-memory Mongo')
+    parser.add_argument('--tag', help='prefix for the rooms and users the run makes, defaults to one from the time')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=313)
+    parser.add_argument('--save', help='write the results as JSON to this file, to use as a baseline later')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE,
+                        help='compare against the results saved in this file (load_bench_baseline.json if no file), exits 1 if anything regressed')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='how much worse than the baseline is a regression, as a fraction')
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+    results = asyncio.run(load(args, mix))
+    results['config'] = {'mix': mix, 'clients': args.clients, 'requests': args.requests, 'warmup': args.warmup, 'rooms': args.rooms, 'users': args.users,
+                         'seed_messages': args.seed_messages, 'seed': args.seed, 'target': args.url or args.mongo_url or 'memory'}
+    results['python'] = platform.python_version()
+    results['platform'] = platform.platform()
+    report(results)
+    if args.save is not None:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('config') != results['config']:
+            print(f'warning: baseline was run with {baseline.get("config")}, the numbers may not compare')
+        if baseline.get('platform') != results['platform']:
+            print(f'warning: baseline ran on {baseline.get("platform")}, this is {results["platform"]}')
+        if len(regressions := compare(results, baseline, args.tolerance)) > 0:
+            print('regressions against the baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print('no regressions against the baseline')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from load_bench import parse_mix, summarize, compare, percentile, BASELINE, DEFAULT_MIX, NUM_CLIENTS, NUM_REQUESTS, NUM_WARMUP, TOLERANCE
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class LoadBenchTest(TestCase):
+    """ Testing the load test harness: the report, the baseline comparison, and a short run of the api on the stand-ins
+    """
+    def test_parse_mix(self):
+        assert parse_mix('send=3,messages=1.5,alias') == {'send': 3.0, 'messages': 1.5, 'alias': 1.0}
+        for bad_mix in ('send=1,shout=2', 'send=-1', 'page=0'):
+            with self.assertRaises(ValueError):
+                parse_mix(bad_mix)
+
+    def test_summarize(self):
+        results = summarize({'send': [index / 1000 for index in range(1, 101)], 'page': []}, {'send': 2}, elapsed=2.0)
+        assert results['endpoints']['send']['p50'] == 50.0 and results['endpoints']['send']['p99'] == 99.0
+        assert results['endpoints']['send']['throughput'] == 50.0 and results['overall']['errors'] == 2
+        assert results['endpoints']['page'] == {'requests': 0, 'errors': 0, 'throughput': 0.0}
+        assert percentile([1.0], 99) == 1.0
+
+    def test_compare(self):
+        baseline = {'overall': {'throughput': 100.0, 'p95': 10.0, 'p99': 20.0, 'errors': 0},
+                    'endpoints': {'send': {'throughput': 50.0, 'p95': 10.0, 'p99': 20.0, 'errors': 0}}}
+        # Inside the tolerance is noise, not a regression
+        same = {'overall': {'throughput': 90.0, 'p95': 11.0, 'p99': 24.0, 'errors': 0},
+                'endpoints': {'send': {'throughput': 45.0, 'p95': 12.0, 'p99': 20.0, 'errors': 0}, 'alias': {'throughput': 1.0, 'errors': 0}}}
+        assert compare(same, baseline, 0.25) == []
+        worse = {'overall': {'throughput': 60.0, 'p95': 10.0, 'p99': 20.0, 'errors': 0},
+                 'endpoints': {'send': {'throughput': 50.0, 'p95': 15.0, 'p99': 20.0, 'errors': 3}}}
+        regressions = compare(worse, baseline, 0.25)
+        assert len(regressions) == 3
+        assert regressions[0].startswith('overall: throughput') and regressions[1].startswith('send: p95') and regressions[2].startswith('send: 3 errors')
+
+    def test_run(self):
+        """ A short run in a fresh process (the api grabs its clients on import), saved and then compared against itself
+        """
+        bench = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_bench.py')
+        with tempfile.TemporaryDirectory() as directory:
+            saved = os.path.join(directory, 'baseline.json')
+            run = subprocess.run([sys.executable, bench, '--requests', '200', '--warmup', '20', '--clients', '8', '--seed-messages', '20', '--save', saved],
+                                 cwd=directory, capture_output=True, text=True, timeout=120)
+            assert run.returncode == 0, run.stderr
+            with open(saved) as saved_file:
+                results = json.load(saved_file)
+            assert results['overall']['requests'] == 200 and results['overall']['errors'] == 0
+            assert sorted(results['endpoints']) == ['alias', 'messages', 'page', 'send']
+            # A baseline with p95s a thousand times lower, so the run right after can only come out as a regression
+            for stats in [results['overall']] + list(results['endpoints'].values()):
+                stats['p95'] /= 1000
+            with open(saved, 'w') as saved_file:
+                json.dump(results, saved_file)
+            run = subprocess.run([sys.executable, bench, '--requests', '200', '--warmup', '20', '--clients', '8', '--seed-messages', '20', '--baseline', saved],
+                                 cwd=directory, capture_output=True, text=True, timeout=120)
+            assert run.returncode == 1 and 'regressions against the baseline' in run.stdout
+
+    def test_committed_baseline(self):
+        """ The baseline --baseline compares against is a full run of the defaults on in-memory Mongo, so a run without options
+            compares like for like
+        """
+        with open(BASELINE) as baseline_file:
+            baseline = json.load(baseline_file)
+        config = baseline['config']
+        assert config['target'] == 'memory' and config['seed'] == 313 and config['mix'] == {name: float(weight) for name, weight in DEFAULT_MIX.items()}
+        assert (config['clients'], config['requests'], config['warmup']) == (NUM_CLIENTS, NUM_REQUESTS, NUM_WARMUP)
+        assert baseline['overall']['requests'] == NUM_REQUESTS and baseline['overall']['errors'] == 0
+        assert sorted(baseline['endpoints']) == sorted(DEFAULT_MIX)
+        assert compare(baseline, baseline, TOLERANCE) == []
+
+if __name__ == "__main__":
+    unittest.main()
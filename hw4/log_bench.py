@@ -0,0 +1,67 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from room import ChatRoom, MessageProperties
+from chat_logging import setup_logging, stop_logging
+
+NUM_SENDS = 20000
+
+
+def bench_sends(room: ChatRoom, num_sends: int) -> float:
+    """ Seconds per ChatRoom.send_message against the in-memory collection
+    """
+    start = time.perf_counter()
+    for index in range(num_sends):
+        room.send_message(f'bench message {index}', SENDER_NAME, MessageProperties('log-bench', 'bench-to', SENDER_NAME, MESSAGE_TYPE_SENT))
+    return (time.perf_counter() - start) / num_sends
+
+
+def reset_root() -> None:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    logging.disable(logging.NOTSET)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='What logging adds to every send, old synchronous setup against the queued pipeline')
+    parser.add_argument('--sends', type=int, default=NUM_SENDS)
+    args = parser.parse_args()
+    mongo_pool.client_factory = memory_client_factory()
+    room = ChatRoom('log-bench', create_new=True)
+    log_dir = tempfile.mkdtemp()
+    bench_sends(room, 1000)
+
+    logging.disable(logging.CRITICAL)
+    baseline = bench_sends(room, args.sends)
+    reset_root()
+
+    # What room.py and users.py used to set up at import: every trace line formatted and written to the file on the caller's thread
+    logging.basicConfig(filename=os.path.join(log_dir, 'sync.log'), level=logging.DEBUG, filemode='w')
+    synchronous = bench_sends(room, args.sends)
+    reset_root()
+
+    setup_logging(os.path.join(log_dir, 'queued.log'), filemode='w')
+    queued = bench_sends(room, args.sends)
+    stop_logging()
+
+    setup_logging(os.path.join(log_dir, 'queued_debug.log'), level='DEBUG', filemode='w')
+    queued_debug = bench_sends(room, args.sends)
+    stop_logging()
+
+    print(f'{args.sends} sends, logging disabled: {baseline * 1e6:.1f} us/send')
+    for description, per_send in [('old: sync file handler, DEBUG', synchronous), ('new: queued, INFO (default)', queued),
+                                  ('new: queued, DEBUG + sampling', queued_debug)]:
+        print(f'{description:<32} {per_send * 1e6:8.1f} us/send  logging overhead {(per_send - baseline) * 1e6:7.1f} us/send')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,626 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import copy
+import threading
+import bson
+from bson import ObjectId
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from search import tokenize, parse_search
+
+
+class InsertResult():
+    """ Looks enough like pymongo's InsertOneResult/InsertManyResult for our code
+    """
+    def __init__(self, inserted_ids: list) -> None:
+        self.inserted_ids = inserted_ids
+        self.inserted_id = inserted_ids[0] if len(inserted_ids) > 0 else None
+        self.acknowledged = True
+
+
+class DeleteResult():
+    def __init__(self, deleted_count: int) -> None:
+        self.deleted_count = deleted_count
+        self.acknowledged = True
+
+
+def get_path(document: dict, path: str):
+    """ Follow a dotted path like mess_props.room_name. Returns (found, value)
+    """
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+def set_path(document: dict, path: str, value) -> None:
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+def _compare(operator: str, value, target) -> bool:
+    try:
+        if operator == '$gt':
+            return value > target
+        if operator == '$gte':
+            return value >= target
+        if operator == '$lt':
+            return value < target
+        if operator == '$lte':
+            return value <= target
+    except TypeError:
+        return False
+    raise ValueError(f'memory_mongo does not support {operator}')
+
+def matches(document: dict, query: dict) -> bool:
+    """ The subset of the Mongo query language our modules use: equality on dotted paths (arrays match on any element), $exists,
+        $gt/$gte/$lt/$lte, $in, $nin, $ne, $and and $or
+    """
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(document, sub_query) for sub_query in condition):
+                return False
+            continue
+        if key == '$or':
+            if not any(matches(document, sub_query) for sub_query in condition):
+                return False
+            continue
+        found, value = get_path(document, key)
+        if isinstance(condition, dict) and len(condition) > 0 and all(name.startswith('$') for name in condition):
+            for operator, target in condition.items():
+                if operator == '$exists':
+                    if found is not bool(target):
+                        return False
+                elif operator == '$in':
+                    if not found or not (value in target or (isinstance(value, list) and any(item in target for item in value))):
+                        return False
+                elif operator == '$nin':
+                    if found and (value in target or (isinstance(value, list) and any(item in target for item in value))):
+                        return False
+                elif operator == '$ne':
+                    if found and value == target:
+                        return False
+                elif not found or not _compare(operator, value, target):
+                    return False
+        elif not found or not (value == condition or (isinstance(value, list) and condition in value)):
+            return False
+    return True
+
+def project(document: dict, projection) -> dict:
+    """ Inclusion or exclusion projections on top level and dotted fields
+    """
+    if projection is None:
+        return copy.deepcopy(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: True for field in projection}
+    include_id = projection.get('_id', True)
+    fields = {field: shown for field, shown in projection.items() if field != '_id'}
+    if any(fields.values()):
+        result = {}
+        for field, shown in fields.items():
+            found, value = get_path(document, field)
+            if shown and found:
+                set_path(result, field, copy.deepcopy(value))
+    else:
+        result = copy.deepcopy(document)
+        for field in fields:
+            parts = field.split('.')
+            target = result
+            for part in parts[:-1]:
+                target = target.get(part, {})
+            target.pop(parts[-1], None)
+    if include_id and '_id' in document:
+        result['_id'] = document['_id']
+    elif not include_id:
+        result.pop('_id', None)
+    return result
+
+def _sort_key(value):
+    """ Rough BSON ordering so mixed types don't blow up sorted(): missing < numbers < strings < everything else
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, str(value))
+
+
+class MemoryCursor():
+    """ Lazy cursor with the chainable sort/skip/limit/batch_size calls our queries use
+    """
+    def __init__(self, collection, query: dict, projection = None, document_class = dict) -> None:
+        self.__collection = collection
+        self.__query = query
+        self.__projection = projection
+        self.__document_class = document_class
+        self.__sort = []
+        self.__skip = 0
+        self.__limit = 0
+
+    def sort(self, key_or_list, direction: int = ASCENDING):
+        if isinstance(key_or_list, str):
+            self.__sort = [(key_or_list, direction)]
+        else:
+            self.__sort = list(key_or_list)
+        return self
+
+    def skip(self, count: int):
+        self.__skip = count
+        return self
+
+    def limit(self, count: int):
+        self.__limit = count
+        return self
+
+    def batch_size(self, count: int):
+        return self
+
+    def __iter__(self):
+        if self.__query is not None and '$text' in self.__query:
+            documents, scores = self.__collection._text_search(self.__query)
+        else:
+            documents, scores = self.__collection._matching(self.__query), {}
+        for field, direction in reversed(self.__sort):
+            if isinstance(direction, dict):
+                # {'$meta': 'textScore'}, best first
+                documents.sort(key=lambda document: scores[document['_id']], reverse=True)
+            else:
+                documents.sort(key=lambda document: _sort_key(get_path(document, field)[1]), reverse=direction < 0)
+        documents = documents[self.__skip:]
+        if self.__limit != 0:
+            # a negative limit in Mongo means "one batch of that many", for us that's the same thing
+            documents = documents[:abs(self.__limit)]
+        results = (self.__project(document, scores) for document in documents)
+        if self.__document_class is not dict:
+            # RawBSONDocument, what a real cursor hands out when the collection's codec options ask for raw batches
+            return (self.__document_class(bson.encode(result)) for result in results)
+        return results
+
+    def __project(self, document: dict, scores: dict) -> dict:
+        """ project, plus the {'$meta': 'textScore'} fields, which don't make a projection an inclusion one
+        """
+        if not isinstance(self.__projection, dict):
+            return project(document, self.__projection)
+        meta = [field for field, shown in self.__projection.items() if isinstance(shown, dict)]
+        if len(meta) == 0:
+            return project(document, self.__projection)
+        plain = {field: shown for field, shown in self.__projection.items() if field not in meta}
+        result = project(document, plain if len(plain) > 0 else None)
+        for field in meta:
+            result[field] = scores.get(document['_id'], 0.0)
+        return result
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryCollection():
+    """ One collection of documents in a dict keyed by _id, insertion ordered. Unique indexes are enforced, others are recorded only
+        Each unique index keeps a dict from key to _id, so inserts don't scan the collection and an equality find on a single
+            unique field is a dict lookup, like it would be an index lookup in Mongo
+        The leading field of every index also maps its values to the _ids that have them, so a find with an equality on it only
+            looks at those documents, the way an index scan only reads its range. Many rooms in one collection depend on that
+    """
+    def __init__(self, database, name: str) -> None:
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+        self.__documents = {}
+        self.__indexes = {'_id_': {'key': [('_id', ASCENDING)], 'unique': True}}
+        self.__unique_keys = {}
+        # leading index field -> value -> {_id: None}, insertion ordered like the documents
+        self.__prefixes = {}
+        self.__lock = threading.RLock()
+
+    def _matching(self, query: dict) -> list:
+        with self.__lock:
+            if query is not None and set(query) == {'_id'} and not isinstance(query['_id'], dict):
+                document = self.__documents.get(query['_id'])
+                return [document] if document is not None else []
+            if query is not None and len(query) == 1 and (keys := self.__unique_keys.get(self.__unique_index_on(*query))) is not None \
+                    and not isinstance(value := next(iter(query.values())), (dict, type(None))):
+                document_id = keys.get((value,))
+                return [self.__documents[document_id]] if document_id is not None else []
+            for field, buckets in self.__prefixes.items():
+                if query is not None and not isinstance(value := query.get(field), (dict, list, type(None))):
+                    return [document for document_id in buckets.get(value, ()) if matches(document := self.__documents[document_id], query)]
+            return [document for document in self.__documents.values() if matches(document, query)]
+
+    def _text_search(self, query: dict) -> tuple:
+        """ A $text query against the fields of the collection's text index: (matching documents, _id -> score). Words are matched
+            as they are, Mongo also stems them and drops stop words. The score is the share of the indexed words that are search words
+        """
+        with self.__lock:
+            fields = [field for index in self.__indexes.values() for field, kind in index['key'] if kind == 'text']
+        if len(fields) == 0:
+            raise OperationFailure('text index required for $text query')
+        terms, phrases, excluded = parse_search(query['$text']['$search'])
+        terms = set(terms)
+        documents, scores = [], {}
+        for document in self._matching({key: condition for key, condition in query.items() if key != '$text'}):
+            text = ' '.join(value for found, value in (get_path(document, field) for field in fields) if found and isinstance(value, str))
+            words = tokenize(text)
+            hits = sum(1 for word in words if word in terms)
+            if hits == 0 or any(word in excluded for word in words) or not all(phrase in text.lower() for phrase in phrases):
+                continue
+            documents.append(document)
+            scores[document['_id']] = hits / len(words)
+        return documents, scores
+
+    def __unique_index_on(self, field: str) -> str:
+        for name in self.__unique_keys:
+            if [index_field for index_field, _ in self.__indexes[name]['key']] == [field]:
+                return name
+        return None
+
+    def __index_key(self, name: str, document: dict) -> tuple:
+        """ The key a document has in a unique index, None if a sparse index leaves it out
+        """
+        index = self.__indexes[name]
+        found = [get_path(document, field) for field, _ in index['key']]
+        if index.get('sparse') is True and not any(exists for exists, _ in found):
+            return None
+        return tuple(value for _, value in found)
+
+    def __add_keys(self, document: dict) -> None:
+        """ Check the document against every unique index, then record its keys. Nothing is recorded if any of them clash
+        """
+        new_keys = []
+        for name, keys in self.__unique_keys.items():
+            key = self.__index_key(name, document)
+            if key is None:
+                continue
+            if keys.get(key, document['_id']) != document['_id']:
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: {name}')
+            new_keys.append((keys, key))
+        for keys, key in new_keys:
+            keys[key] = document['_id']
+
+    @staticmethod
+    def __prefix_items(document: dict, field: str) -> list:
+        """ The values a document is found under in a leading field lookup, every element for an array like a multikey index
+        """
+        found, value = get_path(document, field)
+        if not found:
+            return []
+        return value if isinstance(value, list) else [value]
+
+    def __add_prefixes(self, document: dict, fields = None) -> None:
+        unhashable = []
+        for field in (fields if fields is not None else list(self.__prefixes)):
+            try:
+                for item in self.__prefix_items(document, field):
+                    self.__prefixes[field].setdefault(item, {})[document['_id']] = None
+            except TypeError:
+                unhashable.append(field)
+        # Documents (as values) can't be dict keys, those fields go back to scanning
+        for field in unhashable:
+            del self.__prefixes[field]
+
+    def __remove_prefixes(self, document: dict, fields = None) -> None:
+        for field in (fields if fields is not None else list(self.__prefixes)):
+            buckets = self.__prefixes[field]
+            for item in self.__prefix_items(document, field):
+                if (bucket := buckets.get(item)) is not None:
+                    bucket.pop(document['_id'], None)
+                    if len(bucket) == 0:
+                        del buckets[item]
+
+    def __move_prefixes(self, before: dict, after: dict) -> None:
+        """ After an update, only for the fields it changed so the rest keep their place in insertion order
+        """
+        changed = [field for field in self.__prefixes if get_path(before, field) != get_path(after, field)]
+        self.__remove_prefixes(before, changed)
+        self.__add_prefixes(after, changed)
+
+    def __remove_keys(self, document: dict) -> None:
+        for name, keys in self.__unique_keys.items():
+            key = self.__index_key(name, document)
+            if key is not None and keys.get(key) == document['_id']:
+                del keys[key]
+
+    def insert_one(self, document: dict) -> InsertResult:
+        with self.__lock:
+            document.setdefault('_id', ObjectId())
+            if document['_id'] in self.__documents:
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: _id_')
+            stored = copy.deepcopy(document)
+            self.__add_keys(stored)
+            self.__add_prefixes(stored)
+            self.__documents[stored['_id']] = stored
+            return InsertResult([document['_id']])
+
+    def insert_many(self, documents: list, ordered: bool = True) -> InsertResult:
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self.insert_one(document).inserted_id)
+            except DuplicateKeyError as error:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(error)})
+                if ordered is True:
+                    break
+        if len(errors) > 0:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(inserted)})
+        return InsertResult(inserted)
+
+    def with_options(self, codec_options = None, **options):
+        """ The same collection, reads come back as codec_options.document_class
+        """
+        if codec_options is None or codec_options.document_class is dict:
+            return self
+        return MemoryCollectionView(self, codec_options.document_class)
+
+    def find(self, filter: dict = None, projection = None, sort = None, limit: int = 0, skip: int = 0, document_class = dict) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter, projection, document_class)
+        if sort is not None:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter: dict = None, projection = None, sort = None):
+        for document in self.find(filter, projection, sort=sort, limit=1):
+            return document
+        return None
+
+    def count_documents(self, filter: dict) -> int:
+        return len(self._matching(filter))
+
+    def estimated_document_count(self) -> int:
+        return len(self.__documents)
+
+    def __apply_update(self, document: dict, update: dict, inserting: bool) -> None:
+        for operator, fields in update.items():
+            for field, argument in fields.items():
+                found, value = get_path(document, field)
+                if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                    set_path(document, field, copy.deepcopy(argument))
+                elif operator == '$inc':
+                    set_path(document, field, (value if found else 0) + argument)
+                elif operator == '$max':
+                    if not found or argument > value:
+                        set_path(document, field, argument)
+                elif operator == '$min':
+                    if not found or argument < value:
+                        set_path(document, field, argument)
+                elif operator == '$unset':
+                    if found:
+                        parent = get_path(document, field.rpartition('.')[0])[1] if '.' in field else document
+                        parent.pop(field.rpartition('.')[2], None)
+                elif operator in ('$push', '$addToSet'):
+                    items = argument['$each'] if isinstance(argument, dict) and '$each' in argument else [argument]
+                    current = value if found else []
+                    for item in items:
+                        if operator == '$push' or item not in current:
+                            current.append(copy.deepcopy(item))
+                    set_path(document, field, current)
+                elif operator == '$pull':
+                    if found:
+                        set_path(document, field, [item for item in value if item != argument])
+                elif operator != '$setOnInsert':
+                    raise ValueError(f'memory_mongo does not support {operator}')
+
+    def __upsert_document(self, filter: dict) -> dict:
+        document = {}
+        for key, condition in filter.items():
+            if not key.startswith('$') and not isinstance(condition, dict):
+                set_path(document, key, copy.deepcopy(condition))
+        document.setdefault('_id', ObjectId())
+        return document
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False):
+        with self.__lock:
+            documents = self._matching(filter)
+            if len(documents) == 0:
+                if upsert is True:
+                    self.insert_one(dict(replacement))
+                return
+            document = documents[0]
+            before = copy.deepcopy(document)
+            self.__remove_keys(document)
+            document.clear()
+            document.update(copy.deepcopy(replacement), _id=before['_id'])
+            try:
+                self.__add_keys(document)
+            except DuplicateKeyError:
+                document.clear()
+                document.update(before)
+                self.__add_keys(document)
+                raise
+            self.__move_prefixes(before, document)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        self.find_one_and_update(filter, update, upsert=upsert)
+
+    def __update_document(self, document: dict, update: dict) -> None:
+        """ Apply an update in place, putting the document back the way it was if it would break a unique index
+        """
+        before = copy.deepcopy(document)
+        self.__remove_keys(document)
+        self.__apply_update(document, update, False)
+        try:
+            self.__add_keys(document)
+        except DuplicateKeyError:
+            document.clear()
+            document.update(before)
+            self.__add_keys(document)
+            raise
+        self.__move_prefixes(before, document)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False):
+        with self.__lock:
+            for document in self._matching(filter):
+                self.__update_document(document, update)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection = None, upsert: bool = False,
+                            return_document = ReturnDocument.BEFORE, sort = None):
+        with self.__lock:
+            documents = self._matching(filter)
+            if len(documents) == 0:
+                if upsert is not True:
+                    return None
+                document = self.__upsert_document(filter)
+                before = None
+                self.__apply_update(document, update, True)
+                self.__add_keys(document)
+                self.__add_prefixes(document)
+                self.__documents[document['_id']] = document
+            else:
+                document = documents[0]
+                before = project(document, projection)
+                self.__update_document(document, update)
+            if return_document == ReturnDocument.AFTER:
+                return project(document, projection)
+            return before
+
+    def delete_one(self, filter: dict) -> DeleteResult:
+        with self.__lock:
+            for document in self._matching(filter)[:1]:
+                self.__remove_keys(document)
+                self.__remove_prefixes(document)
+                del self.__documents[document['_id']]
+                return DeleteResult(1)
+            return DeleteResult(0)
+
+    def delete_many(self, filter: dict) -> DeleteResult:
+        with self.__lock:
+            documents = self._matching(filter)
+            for document in documents:
+                self.__remove_keys(document)
+                self.__remove_prefixes(document)
+                del self.__documents[document['_id']]
+            return DeleteResult(len(documents))
+
+    def create_index(self, keys, unique: bool = False, name: str = None, **options) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, ASCENDING)]
+        keys = list(keys)
+        name = name or '_'.join(f'{field}_{direction}' for field, direction in keys)
+        with self.__lock:
+            if name in self.__indexes:
+                return name
+            self.__indexes[name] = dict(options, key=keys, unique=unique)
+            if (field := keys[0][0]) != '_id' and field not in self.__prefixes:
+                self.__prefixes[field] = {}
+                for document in self.__documents.values():
+                    self.__add_prefixes(document, [field])
+                    if field not in self.__prefixes:
+                        break
+            if unique is True:
+                keys = self.__unique_keys[name] = {}
+                for document in self.__documents.values():
+                    if (key := self.__index_key(name, document)) is None:
+                        continue
+                    if key in keys:
+                        del self.__indexes[name], self.__unique_keys[name]
+                        raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: {name}')
+                    keys[key] = document['_id']
+        return name
+
+    def drop_index(self, name: str) -> None:
+        with self.__lock:
+            if name == '_id_' or name not in self.__indexes:
+                raise OperationFailure(f'index not found with name [{name}]')
+            del self.__indexes[name]
+            self.__unique_keys.pop(name, None)
+
+    def index_information(self) -> dict:
+        with self.__lock:
+            return copy.deepcopy(self.__indexes)
+
+    def drop(self) -> None:
+        self.database.drop_collection(self.name)
+
+
+class MemoryCollectionView():
+    """ A collection through with_options: find hands out another document class, everything else is the collection's
+    """
+    def __init__(self, collection: MemoryCollection, document_class) -> None:
+        self.__collection = collection
+        self.__document_class = document_class
+
+    def find(self, filter: dict = None, projection = None, sort = None, limit: int = 0, skip: int = 0) -> MemoryCursor:
+        return self.__collection.find(filter, projection, sort, limit, skip, document_class=self.__document_class)
+
+    def find_one(self, filter: dict = None, projection = None, sort = None):
+        for document in self.find(filter, projection, sort=sort, limit=1):
+            return document
+        return None
+
+    def __getattr__(self, name: str):
+        return getattr(self.__collection, name)
+
+
+class MemoryDatabase():
+    def __init__(self, client, name: str) -> None:
+        self.client = client
+        self.name = name
+        self.__collections = {}
+        self.__lock = threading.Lock()
+
+    def get_collection(self, name: str, **options) -> MemoryCollection:
+        with self.__lock:
+            if name not in self.__collections:
+                self.__collections[name] = MemoryCollection(self, name)
+            return self.__collections[name]
+
+    def create_collection(self, name: str, **options) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def drop_collection(self, name: str) -> None:
+        with self.__lock:
+            self.__collections.pop(name, None)
+
+    def list_collection_names(self) -> list:
+        with self.__lock:
+            return list(self.__collections)
+
+    def command(self, name, *args, **kwargs) -> dict:
+        return {'ok': 1.0}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+
+class MemoryClient():
+    """ In-process stand-in for MongoClient for benchmarks and load tests that should not need a mongod. Clients built from the same
+        databases dict see the same data, which is what memory_client_factory hands to MongoPool
+    """
+    def __init__(self, databases: dict = None, **options) -> None:
+        self.__databases = databases if databases is not None else {}
+        self.__lock = threading.Lock()
+        self.options = options
+
+    def get_database(self, name: str, **options) -> MemoryDatabase:
+        with self.__lock:
+            if name not in self.__databases:
+                self.__databases[name] = MemoryDatabase(self, name)
+            return self.__databases[name]
+
+    def list_database_names(self) -> list:
+        return list(self.__databases)
+
+    def close(self) -> None:
+        pass
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get_database(name)
+
+
+def memory_client_factory():
+    """ A client factory for MongoPool whose clients all share one set of databases
+    """
+    databases = {}
+    return lambda **options: MemoryClient(databases, **options)
@@ -0,0 +1,74 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import json
+from datetime import datetime
+import bson
+from bson import ObjectId
+try:
+    # orjson does datetimes itself and is several times faster than json, without it we fall back to json
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+JSON_MEDIA_TYPE = 'application/json'
+
+
+def json_default(value):
+    """ The two types Mongo hands us that json can't do on its own
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps(value) -> bytes:
+    """ Compact JSON as bytes, ready for the response body. Naive datetimes come out the same as isoformat() either way
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return json.dumps(value, default=json_default, separators=(',', ':')).encode()
+
+def encode_message(message: dict) -> str:
+    return dumps(message).decode()
+
+def encode_raw_documents(documents: list) -> bytes:
+    """ A JSON array of RawBSONDocuments. The raw bytes of the batch are decoded in one call and the list is encoded in one call,
+        instead of the driver building each document and the encoder walking it on its own. Plain dicts work too, mixed in or not
+            (archived messages come back as dicts)
+    """
+    raw = [document.raw for document in documents if hasattr(document, 'raw')]
+    if len(raw) == len(documents):
+        return dumps(bson.decode_all(b''.join(raw)))
+    if len(raw) > 0:
+        decoded = iter(bson.decode_all(b''.join(raw)))
+        documents = [next(decoded) if hasattr(document, 'raw') else document for document in documents]
+    return dumps(documents)
+
+async def ndjson_chunks(batches):
+    """ One chunk of newline delimited JSON per batch of messages
+    """
+    async for batch in batches:
+        yield b''.join(dumps(message) + b'\n' for message in batch)
+
+async def json_array_chunks(batches):
+    """ The same messages as one JSON array, written out a batch at a time so we never hold the whole array
+    """
+    first = True
+    yield b'['
+    async for batch in batches:
+        chunk = b','.join(dumps(message) for message in batch)
+        if len(chunk) > 0:
+            yield chunk if first else b',' + chunk
+            first = False
+    yield b']'
+
+def stream_chunks(batches, stream_format: str):
+    """ Pick the encoder for format ('ndjson' or 'json'), returns (chunks, media type)
+    """
+    if stream_format == 'ndjson':
+        return ndjson_chunks(batches), NDJSON_MEDIA_TYPE
+    if stream_format == 'json':
+        return json_array_chunks(batches), JSON_MEDIA_TYPE
+    raise ValueError(f'Unknown stream format {stream_format}')
@@ -0,0 +1,58 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import json
+import tracemalloc
+import unittest
+from unittest import IsolatedAsyncioTestCase
+import logging
+from bson import ObjectId
+from constants import *
+from async_store import AsyncChatRoom
+from message_stream import stream_chunks
+from stream_bench import HugeRoom
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+# The 1M message run is stream_bench.py, here enough messages that holding them all would blow well past the limit
+NUM_MESSAGES = 50000
+# Holding 50k of these messages as dicts takes tens of MB, streaming only ever holds a batch or two
+MAX_PEAK_MB = 4
+
+class MessageStreamTest(IsolatedAsyncioTestCase):
+    """ Testing that streaming a large room keeps memory flat
+    """
+    async def test_ndjson_peak_memory_bounded(self):
+        """ Stream a big room as NDJSON, throw the bytes away like a socket would, and check the peak of what we allocated while
+            streaming. tracemalloc measures just this test, the process' peak RSS is whatever the biggest test before it needed
+        """
+        tracemalloc.start()
+        try:
+            chunks, media_type = stream_chunks(AsyncChatRoom(HugeRoom(NUM_MESSAGES)).stream_messages('reader', GET_ALL_MESSAGES), 'ndjson')
+            lines = 0
+            last_line = b''
+            async for chunk in chunks:
+                lines += chunk.count(b'\n')
+                last_line = chunk.rsplit(b'\n', 2)[-2]
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert media_type == 'application/x-ndjson'
+        assert lines == NUM_MESSAGES
+        assert json.loads(last_line)['mess_props']['sequence_num'] == NUM_MESSAGES - 1
+        assert peak / (1024 * 1024) < MAX_PEAK_MB
+
+    async def test_json_array_is_valid(self):
+        """ The chunked array form has to parse as one JSON document
+        """
+        async def batches():
+            yield [{'message': 'one'}, {'message': 'two'}]
+            yield []
+            yield [{'message': 'three', '_id': ObjectId('6ad471cb2e1e771a503894f8')}]
+        chunks, media_type = stream_chunks(batches(), 'json')
+        body = b''.join([chunk async for chunk in chunks])
+        assert [message['message'] for message in json.loads(body)] == ['one', 'two', 'three']
+        assert json.loads(body)[2]['_id'] == '6ad471cb2e1e771a503894f8'
+
+if __name__ == "__main__":
+    unittest.main()
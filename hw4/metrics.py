@@ -0,0 +1,208 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from pymongo.monitoring import CommandListener
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+def format_labels(labels: dict) -> str:
+    """ {name="value",...} with the escaping the Prometheus text format wants, empty when there are no labels
+    """
+    if len(labels) == 0:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(value)
+
+
+class Histogram():
+    """ A Prometheus style histogram: per set of label values, how many observations fell in each bucket, plus their count and sum.
+        observe is a bisect and a short lock, cheap enough for every request and every Mongo command
+    """
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = METRICS_BUCKETS) -> None:
+        self.__name = name
+        self.__documentation = documentation
+        self.__labels = tuple(labels)
+        self.__buckets = tuple(sorted(buckets))
+        self.__lock = threading.Lock()
+        # label values -> [count per bucket, the last one is +Inf], sum
+        self.__series = {}
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.__buckets, value)
+        with self.__lock:
+            if (series := self.__series.get(label_values)) is None:
+                series = self.__series[label_values] = [[0] * (len(self.__buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self, *label_values) -> dict:
+        """ count, sum and cumulative bucket counts (upper bound -> count) for one set of label values, for tests and debugging
+        """
+        with self.__lock:
+            counts, total = self.__series.get(label_values, [[0] * (len(self.__buckets) + 1), 0.0])
+            counts = list(counts)
+        cumulative = [sum(counts[:index + 1]) for index in range(len(counts))]
+        return {'count': cumulative[-1], 'sum': total, 'buckets': dict(zip(self.__buckets + (float('inf'),), cumulative))}
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.__name} {self.__documentation}', f'# TYPE {self.__name} histogram']
+        with self.__lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self.__series.items()]
+        for label_values, counts, total in sorted(series, key=lambda item: item[0]):
+            labels = dict(zip(self.__labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.__buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.__name}_bucket{format_labels(dict(labels, le=format_value(bound)))} {cumulative}')
+            lines.append(f'{self.__name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{self.__name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry():
+    """ The histograms we keep ourselves plus collectors, functions called at scrape time that turn the stats() the rest of the
+            code already keeps (pool, cache, publisher...) into metrics. Collectors return (name, type, help, [(labels, value)])
+        Nothing is computed for the gauges and counters until somebody scrapes
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__histograms = {}
+        self.__collectors = []
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = METRICS_BUCKETS) -> Histogram:
+        """ The histogram called name, made the first time it's asked for
+        """
+        with self.__lock:
+            if (histogram := self.__histograms.get(name)) is None:
+                histogram = self.__histograms[name] = Histogram(name, documentation, labels, buckets)
+            return histogram
+
+    def add_collector(self, collector) -> None:
+        with self.__lock:
+            self.__collectors.append(collector)
+
+    def render(self) -> str:
+        """ Everything in the Prometheus text exposition format. A collector that raises is logged and left out, the rest still go
+        """
+        with self.__lock:
+            histograms = list(self.__histograms.values())
+            collectors = list(self.__collectors)
+        lines = []
+        for histogram in histograms:
+            lines.extend(histogram.render())
+        for collector in collectors:
+            try:
+                collected = collector()
+            except Exception:
+                logger.exception('Metrics collector %r failed', collector)
+                continue
+            for name, kind, documentation, samples in collected:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(f'{name}{format_labels(labels)} {format_value(value)}' for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+class CommandTimer(CommandListener):
+    """ pymongo command monitoring into a histogram per collection, command and outcome. The collection is only in the started
+            event, so we hold on to it until the command finishes. pymongo calls these on the thread running the command
+    """
+    def __init__(self, histogram: Histogram) -> None:
+        self.__histogram = histogram
+        self.__lock = threading.Lock()
+        self.__running = {}
+
+    @staticmethod
+    def collection(command_name: str, command: dict) -> str:
+        """ Most commands name their collection as the value of the command itself ({'insert': 'messages', ...}), getMore has it
+            under 'collection'. Commands on the database (ping, listCollections...) get ''
+        """
+        target = command.get('collection') if command_name == 'getMore' else command.get(command_name)
+        return target if isinstance(target, str) else ''
+
+    def started(self, event) -> None:
+        with self.__lock:
+            self.__running[(event.connection_id, event.request_id)] = self.collection(event.command_name, event.command)
+
+    def succeeded(self, event) -> None:
+        self.__finished(event, 'ok')
+
+    def failed(self, event) -> None:
+        self.__finished(event, 'error')
+
+    def __finished(self, event, outcome: str) -> None:
+        with self.__lock:
+            collection = self.__running.pop((event.connection_id, event.request_id), '')
+        self.__histogram.observe(event.duration_micros / 1e6, collection, event.command_name, outcome)
+
+
+async def watch_loop_lag(histogram: Histogram, interval: float = METRICS_LOOP_LAG_INTERVAL) -> None:
+    """ Sleep interval over and over and record how much later than asked we woke up. Anything that blocks the event loop (a
+        pymongo call that skipped the storage executor, a big JSON encode) shows up here
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        histogram.observe(max(time.perf_counter() - start - interval, 0.0))
+
+
+class MetricsMiddleware():
+    """ ASGI middleware timing every HTTP request, from the request coming in until the last of the response went out (streams
+            included), by method, route template (so /rooms/{room_name}/events is one series, not one per room) and status
+        A plain ASGI wrapper instead of @app.middleware('http'), which would run every response through another task and queue
+        The first request also starts the event loop lag watcher on the server's loop
+    """
+    def __init__(self, app, histogram: Histogram = None, loop_lag: Histogram = None) -> None:
+        self.app = app
+        self.__histogram = histogram if histogram is not None else http_requests
+        self.__loop_lag = loop_lag if loop_lag is not None else event_loop_lag
+        self.__watcher = None
+        self.__watcher_loop = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        if self.__watcher_loop is not (loop := asyncio.get_running_loop()):
+            self.__watcher_loop = loop
+            self.__watcher = loop.create_task(watch_loop_lag(self.__loop_lag))
+        start = time.perf_counter()
+        status = [500]
+        async def send_status(message) -> None:
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The router puts the route it matched in the scope on the way down
+            route = getattr(scope.get('route'), 'path', UNMATCHED_ROUTE)
+            self.__histogram.observe(time.perf_counter() - start, scope['method'], route, str(status[0]))
+
+
+# One per process, like the mongo pool: every client, room and queue records into the same histograms
+registry = MetricsRegistry()
+http_requests = registry.histogram('chat_http_request_seconds', 'HTTP request latency by method, route and status', ('method', 'route', 'status'))
+mongo_commands = registry.histogram('chat_mongo_command_seconds', 'Mongo command latency by collection, command and outcome', ('collection', 'command', 'outcome'))
+storage_waits = registry.histogram('chat_storage_wait_seconds', 'Time a storage call waited for a slot and a worker thread before it ran')
+rmq_publishes = registry.histogram('chat_rmq_publish_seconds', 'rmq.ChatRoom publish to broker confirm (or failure) by outcome', ('outcome',))
+rmq_consumes = registry.histogram('chat_rmq_consume_seconds', 'rmq.ChatRoom handling one batch of deliveries, decode to persisted')
+event_loop_lag = registry.histogram('chat_event_loop_lag_seconds', 'How late the event loop woke up from a sleep')
+command_timer = CommandTimer(mongo_commands)
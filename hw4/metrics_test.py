@@ -0,0 +1,128 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from rmq_stub import StubBroker
+from rmq_publisher import RMQPublisher, set_publisher
+from metrics import Histogram, MetricsRegistry, CommandTimer, MetricsMiddleware, command_timer, rmq_publishes, UNMATCHED_ROUTE
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class HistogramTest(TestCase):
+    """ Testing the histogram and the text format the registry renders
+    """
+    def test_render(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('test_seconds', 'Test latency', ('route',), buckets=(0.1, 1.0))
+        assert registry.histogram('test_seconds', 'Asked for again') is histogram
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, '/rooms/{room_name}')
+        histogram.observe(0.5, 'say "hi"\n')
+        registry.add_collector(lambda: [('test_rooms', 'gauge', 'Rooms', [({}, 3)])])
+        registry.add_collector(lambda: 1 / 0)
+        lines = registry.render().splitlines()
+        assert lines[:2] == ['# HELP test_seconds Test latency', '# TYPE test_seconds histogram']
+        assert 'test_seconds_bucket{route="/rooms/{room_name}",le="0.1"} 2' in lines
+        assert 'test_seconds_bucket{route="/rooms/{room_name}",le="1.0"} 3' in lines
+        assert 'test_seconds_bucket{route="/rooms/{room_name}",le="+Inf"} 4' in lines
+        assert 'test_seconds_sum{route="/rooms/{room_name}"} 2.65' in lines
+        assert 'test_seconds_count{route="/rooms/{room_name}"} 4' in lines
+        assert 'test_seconds_count{route="say \\"hi\\"\\n"} 1' in lines
+        # The collector that raised is left out, the one after the histograms still there
+        assert lines[-3:] == ['# HELP test_rooms Rooms', '# TYPE test_rooms gauge', 'test_rooms 3']
+
+    def test_snapshot(self):
+        histogram = Histogram('test_seconds', 'Test latency', buckets=(1.0, 2.0))
+        histogram.observe(1.5)
+        histogram.observe(3.0)
+        assert histogram.snapshot() == {'count': 2, 'sum': 4.5, 'buckets': {1.0: 0, 2.0: 1, float('inf'): 2}}
+
+
+class CommandTimerTest(TestCase):
+    """ Testing the pymongo command listener with events shaped like pymongo's
+    """
+    def test_commands(self):
+        histogram = Histogram('test_mongo_seconds', 'Mongo', ('collection', 'command', 'outcome'))
+        timer = CommandTimer(histogram)
+        commands = [(1, 'insert', {'insert': 'messages', 'documents': []}, 'ok'), (2, 'getMore', {'getMore': 12345, 'collection': 'messages'}, 'ok'),
+                    (3, 'ping', {'ping': 1}, 'ok'), (4, 'findAndModify', {'findAndModify': 'sequences'}, 'error')]
+        for request_id, command_name, command, outcome in commands:
+            timer.started(SimpleNamespace(connection_id=('localhost', 27017), request_id=request_id, command_name=command_name, command=command))
+            finished = SimpleNamespace(connection_id=('localhost', 27017), request_id=request_id, command_name=command_name, duration_micros=2500)
+            if outcome == 'ok':
+                timer.succeeded(finished)
+            else:
+                timer.failed(finished)
+        assert histogram.snapshot('messages', 'insert', 'ok')['sum'] == 0.0025
+        assert histogram.snapshot('messages', 'getMore', 'ok')['count'] == 1
+        assert histogram.snapshot('', 'ping', 'ok')['count'] == 1
+        assert histogram.snapshot('sequences', 'findAndModify', 'error')['count'] == 1
+
+    def test_pool_listens(self):
+        previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        try:
+            assert command_timer in get_mongo_client().options['event_listeners']
+        finally:
+            mongo_pool.close()
+            mongo_pool.client_factory = previous_factory
+
+
+class MiddlewareTest(TestCase):
+    """ Testing request timing by route template and status
+    """
+    def test_routes(self):
+        histogram = Histogram('test_http_seconds', 'HTTP', ('method', 'route', 'status'))
+        app = FastAPI()
+        @app.get('/items/{item_id}')
+        async def item(item_id: int):
+            return {'item_id': item_id}
+        app.add_middleware(MetricsMiddleware, histogram=histogram, loop_lag=Histogram('test_lag_seconds', 'Lag'))
+        with TestClient(app) as client:
+            assert client.get('/items/1').status_code == 200
+            assert client.get('/items/2').status_code == 200
+            assert client.get('/items/three').status_code == 422
+            assert client.get('/elsewhere').status_code == 404
+        assert histogram.snapshot('GET', '/items/{item_id}', '200')['count'] == 2
+        assert histogram.snapshot('GET', '/items/{item_id}', '422')['count'] == 1
+        assert histogram.snapshot('GET', UNMATCHED_ROUTE, '404')['count'] == 1
+
+
+class RMQMetricsTest(TestCase):
+    """ Testing the publish latencies rmq.ChatRoom records
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        self.broker = StubBroker()
+        self.publisher = RMQPublisher(connection_factory=self.broker.connect)
+        self.__previous_publisher = set_publisher(self.publisher)
+
+    def tearDown(self) -> None:
+        set_publisher(self.__previous_publisher)
+        self.publisher.close(timeout=1)
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def test_publishes(self):
+        before = {outcome: rmq_publishes.snapshot(outcome)['count'] for outcome in ('confirmed', 'failed')}
+        room = rmq.ChatRoom('metrics-room', owner_alias=SENDER_NAME)
+        mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'rmq-user', SENDER_NAME)
+        # Nothing bound yet, so the broker returns it
+        assert room.send_message('nobody listening', mess_props) is False
+        self.broker.bind_queue('metrics-room', 'metrics-room')
+        assert room.send_messages([(f'message {index}', mess_props) for index in range(3)]) == 3
+        assert rmq_publishes.snapshot('failed')['count'] == before['failed'] + 1
+        assert rmq_publishes.snapshot('confirmed')['count'] == before['confirmed'] + 3
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+from datetime import datetime
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from rmq_stub import StubBroker
+from rmq_consumer import RMQConsumer, set_consumer
+from room_list_bench import fill_room_list, LIST_NAME
+from users import UserList
+from room import RoomList
+import room
+import rmq
+
+NUM_USERS = 10000
+NUM_ROOMS = 10000
+DEQUE_SIZES = [100, 1000, 10000]
+REPEAT = 5
+# Each repeat runs the operation enough times to take at least this long
+MIN_TIME = 0.1
+# How much slower than the baseline (median time per operation, as a fraction) counts as a regression
+TOLERANCE = 0.2
+# The defaults, saved with --json, each benchmark at its slowest median over three runs so run to run noise isn't a
+#   regression. --baseline on its own compares against it. It's one machine's numbers, on other hardware save your own first
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro_bench_baseline.json')
+
+
+def model_cases() -> list:
+    """ Building the message model and turning it into the documents Mongo and the API get
+    """
+    now = datetime.now()
+    room_props = room.MessageProperties('bench-room', 'bench-to', 'bench-from', MESSAGE_TYPE_SENT, 1, now, now)
+    room_message = room.ChatMessage('bench message', mess_props=room_props)
+    room_document = room_message.to_dict()
+    rmq_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'bench-to', 'bench-from', now, now)
+    rmq_message = rmq.ChatMessage('bench message', rmq_props)
+    return [
+        ('room.MessageProperties()', lambda: lambda: room.MessageProperties('bench-room', 'bench-to', 'bench-from', MESSAGE_TYPE_SENT, 1, now, now)),
+        ('room.ChatMessage()', lambda: lambda: room.ChatMessage('bench message', mess_props=room_props)),
+        ('room.ChatMessage.to_dict', lambda: room_message.to_dict),
+        ('room.ChatMessage.from_dict', lambda: lambda: room.ChatMessage.from_dict(room_document)),
+        ('rmq.MessProperties()', lambda: lambda: rmq.MessProperties(MESSAGE_TYPE_SENT, 'bench-to', 'bench-from', now, now)),
+        ('rmq.ChatMessage()', lambda: lambda: rmq.ChatMessage('bench message', rmq_props)),
+        ('rmq.ChatMessage.to_dict', lambda: rmq_message.to_dict),
+    ]
+
+
+def user_cases(num_users: int) -> list:
+    """ get on registered and unknown aliases (every send checks its sender) and register, with num_users already there
+    """
+    state = {}
+    def users() -> UserList:
+        if 'users' not in state:
+            state['users'] = UserList('micro_bench_users')
+            for start in range(0, num_users, 10000):
+                state['users'].register_many([f'user-{index}' for index in range(start, min(start + 10000, num_users))])
+        return state['users']
+    def get_hit():
+        user_list, aliases = users(), itertools.cycle([f'user-{index}' for index in random.Random(1).sample(range(num_users), min(num_users, 1000))])
+        return lambda: user_list.get(next(aliases))
+    def get_miss():
+        user_list = users()
+        return lambda: user_list.get('nobody')
+    def register():
+        user_list, new_aliases = users(), (f'new-user-{index}' for index in itertools.count())
+        return lambda: user_list.register(next(new_aliases))
+    return [(f'UserList.get hit ({num_users} users)', get_hit), (f'UserList.get miss ({num_users} users)', get_miss),
+            (f'UserList.register ({num_users} users)', register)]
+
+
+def room_list_cases(num_rooms: int) -> list:
+    """ RoomList lookups over num_rooms rooms with 10 members each
+    """
+    state = {}
+    def room_list() -> RoomList:
+        if 'room_list' not in state:
+            fill_room_list(num_rooms, 10, num_rooms)
+            state['room_list'] = RoomList(LIST_NAME)
+        return state['room_list']
+    def lookup(method: str, prefix: str):
+        def setup():
+            function, names = getattr(room_list(), method), itertools.cycle([f'{prefix}-{index}' for index in random.Random(1).sample(range(num_rooms), min(num_rooms, 1000))])
+            return lambda: function(next(names))
+        return setup
+    return [(f'RoomList in ({num_rooms} rooms)', lookup('__contains__', 'room')),
+            (f'RoomList.find_room_in_metadata ({num_rooms} rooms)', lookup('find_room_in_metadata', 'room')),
+            (f'RoomList.find_by_owner ({num_rooms} rooms)', lookup('find_by_owner', 'user')),
+            (f'RoomList.find_by_member ({num_rooms} rooms)', lookup('find_by_member', 'user'))]
+
+
+def queue_cases(sizes: list) -> list:
+    """ rmq.ChatRoom.put (which persists the new message) on a full deque of each size, and get_message_bodies formatting all of it
+    """
+    def full_queue(size: int) -> rmq.ChatRoom:
+        queue = rmq.ChatRoom(f'micro-bench-{size}', owner_alias='bench-from', cache_size=size)
+        for index in range(size):
+            queue.put(rmq.ChatMessage(f'bench message {index}', rmq.MessProperties(MESSAGE_TYPE_SENT, 'bench-to', 'bench-from')))
+        return queue
+    def put(size: int):
+        def setup():
+            queue, counter = full_queue(size), itertools.count()
+            return lambda: queue.put(rmq.ChatMessage(f'bench message {next(counter)}', rmq.MessProperties(MESSAGE_TYPE_SENT, 'bench-to', 'bench-from')))
+        return setup
+    def bodies(size: int):
+        def setup():
+            return full_queue(size).get_message_bodies
+        return setup
+    return ([(f'rmq.ChatRoom.put ({size} in the deque)', put(size)) for size in sizes] +
+            [(f'rmq.ChatRoom.get_message_bodies ({size} messages)', bodies(size)) for size in sizes])
+
+
+def measure(operation, repeat: int = REPEAT, min_time: float = MIN_TIME) -> dict:
+    """ Time per call of operation in us: one call to warm up (lazy loads, first Mongo read), find how many calls take at least
+            min_time, then time that many repeat times
+        The min is the least disturbed run, the median what to compare against a baseline
+    """
+    operation()
+    timer = timeit.Timer(operation)
+    number = 1
+    while (elapsed := timer.timeit(number)) < min_time:
+        number *= 10 if elapsed < min_time / 10 else 2
+    times = [timer.timeit(number) / number * 1e6 for _ in range(repeat)]
+    return {'number': number, 'repeat': repeat, 'min': min(times), 'median': statistics.median(times), 'max': max(times)}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """ The benchmarks whose median got slower than the baseline's by more than tolerance, benchmarks only on one side are skipped
+    """
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is not None and result['median'] > before['median'] * (1 + tolerance):
+            regressions.append(f'{name}: {result["median"]:.3f} us, baseline {before["median"]:.3f} us ({result["median"] / before["median"] - 1:+.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro benchmarks for the message model, UserList, RoomList and the rmq queue, on an in-memory '
+                                                 'collection and the broker stand-in. JSON results, compared against a saved baseline')
+    parser.add_argument('--filter', action='append', help='only run benchmarks with this in the name, can be given more than once')
+    parser.add_argument('--list', action='store_true', help='print the benchmark names and stop')
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--rooms', type=int, default=NUM_ROOMS)
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEQUE_SIZES), help='queue sizes for put and get_message_bodies')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--min-time', type=float, default=MIN_TIME)
+    parser.add_argument('--json', help='write the results to this file, to use as a baseline later')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE,
+                        help='compare against the results saved in this file (micro_bench_baseline.json if no file), exits 1 if anything regressed')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='how much slower than the baseline is a regression, as a fraction')
+    args = parser.parse_args()
+    cases = model_cases() + user_cases(args.users) + room_list_cases(args.rooms) + queue_cases([int(size) for size in args.sizes.split(',')])
+    if args.filter is not None:
+        cases = [(name, setup) for name, setup in cases if any(wanted in name for wanted in args.filter)]
+    if args.list is True:
+        print('\n'.join(name for name, _ in cases))
+        return
+    # the constructors log at info level, we want the objects, not the log file
+    logging.disable(logging.INFO)
+    mongo_pool.client_factory = memory_client_factory()
+    # get_message_bodies makes sure the queue is consuming, on the stand-in instead of RMQ_HOST
+    consumer = RMQConsumer(connection_factory=StubBroker().connect)
+    set_consumer(consumer)
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'time': datetime.now().isoformat(),
+               'config': {'users': args.users, 'rooms': args.rooms, 'sizes': args.sizes, 'repeat': args.repeat, 'min_time': args.min_time},
+               'benchmarks': {}}
+    width = max((len(name) for name, _ in cases), default=0)
+    for name, setup in cases:
+        result = measure(setup(), args.repeat, args.min_time)
+        results['benchmarks'][name] = result
+        print(f'{name:<{width}}  median {result["median"]:10.3f} us  min {result["min"]:10.3f} us  ({result["number"]} x {result["repeat"]})')
+    consumer.close()
+    mongo_pool.close()
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('python') != results['python']:
+            print(f'warning: baseline ran on python {baseline.get("python")}, this is {results["python"]}')
+        if baseline.get('platform') != results['platform']:
+            print(f'warning: baseline ran on {baseline.get("platform")}, this is {results["platform"]}')
+        if baseline.get('config') != results['config']:
+            print(f'warning: baseline was run with {baseline.get("config")}, the numbers may not compare')
+        if len(regressions := compare(results, baseline, args.tolerance)) > 0:
+            print('regressions against the baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print('no regressions against the baseline')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from micro_bench import measure, compare, model_cases, user_cases, room_list_cases, queue_cases, BASELINE, NUM_USERS, NUM_ROOMS, DEQUE_SIZES, TOLERANCE
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class MicroBenchTest(TestCase):
+    """ Testing the micro benchmark runner and its baseline comparison
+    """
+    def test_measure(self):
+        calls = []
+        result = measure(lambda: calls.append(1), repeat=3, min_time=0.001)
+        # the warm up call, then however many calibrating took, then repeat runs of number calls
+        assert result['repeat'] == 3 and len(calls) >= 1 + 3 * result['number']
+        assert 0 < result['min'] <= result['median'] <= result['max']
+
+    def test_compare(self):
+        baseline = {'benchmarks': {'fast': {'median': 1.0}, 'slow': {'median': 10.0}, 'gone': {'median': 1.0}}}
+        results = {'benchmarks': {'fast': {'median': 1.1}, 'slow': {'median': 13.0}, 'new': {'median': 100.0}}}
+        regressions = compare(results, baseline, 0.2)
+        assert len(regressions) == 1 and regressions[0].startswith('slow: 13.000 us, baseline 10.000 us')
+
+    def test_run(self):
+        """ A couple of benchmarks in a fresh process, written as JSON and then compared against a baseline they can't keep up with
+        """
+        bench = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro_bench.py')
+        command = [sys.executable, bench, '--filter', 'to_dict', '--filter', 'put (10 ', '--sizes', '10', '--repeat', '2', '--min-time', '0.005']
+        with tempfile.TemporaryDirectory() as directory:
+            saved = os.path.join(directory, 'baseline.json')
+            run = subprocess.run(command + ['--json', saved], cwd=directory, capture_output=True, text=True, timeout=120)
+            assert run.returncode == 0, run.stderr
+            with open(saved) as saved_file:
+                results = json.load(saved_file)
+            assert sorted(results['benchmarks']) == ['rmq.ChatMessage.to_dict', 'rmq.ChatRoom.put (10 in the deque)', 'room.ChatMessage.to_dict']
+            for result in results['benchmarks'].values():
+                result['median'] /= 1000
+            with open(saved, 'w') as saved_file:
+                json.dump(results, saved_file)
+            run = subprocess.run(command + ['--baseline', saved], cwd=directory, capture_output=True, text=True, timeout=120)
+            assert run.returncode == 1 and 'regressions against the baseline' in run.stdout
+
+    def test_committed_baseline(self):
+        """ The baseline --baseline compares against has every benchmark the defaults run, so none of them go unchecked
+        """
+        with open(BASELINE) as baseline_file:
+            baseline = json.load(baseline_file)
+        cases = model_cases() + user_cases(NUM_USERS) + room_list_cases(NUM_ROOMS) + queue_cases(DEQUE_SIZES)
+        assert sorted(baseline['benchmarks']) == sorted(name for name, _ in cases)
+        assert (baseline['config']['users'], baseline['config']['rooms']) == (NUM_USERS, NUM_ROOMS)
+        assert compare(baseline, baseline, TOLERANCE) == []
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import logging
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+from constants import *
+from mongo_pool import get_mongo_client
+from indexes import ensure_indexes
+from layout import room_collection, queue_collection, ROOM_INDEX_KINDS, QUEUE_INDEX_KINDS
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+# Collections in the room and queue databases that are never a room's messages
+NOT_ROOMS = {SEQUENCE_COLLECTION, MIGRATIONS_COLLECTION, MESSAGES_COLLECTION, QUEUES_COLLECTION, DEFAULT_ROOM_LIST_NAME, 'users'}
+
+
+def insert_new(target, documents: list) -> int:
+    """ insert_many that skips documents the target already has (same _id, or same room and sequence number), so copying a batch
+        twice is harmless. Returns how many went in
+    """
+    try:
+        return len(target.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as error:
+        others = [write_error for write_error in error.details['writeErrors'] if write_error['code'] != DUPLICATE_KEY]
+        if len(others) > 0:
+            raise
+        return error.details['nInserted']
+
+def copy_collection(source, target, state_collection, key: str, query: dict, transform = None, batch_size: int = MIGRATION_BATCH_SIZE) -> dict:
+    """ Stream the documents of source matching query into target, batch_size at a time in _id order, and record in
+            state_collection under key the last _id copied after every batch. Run again after a crash it carries on from there,
+            once it finished it does nothing. transform(document) can change each document on the way
+        Returns the state: copied (documents read), inserted (new to the target), last_id and done
+    """
+    state = state_collection.find_one({'_id': key}) or {'copied': 0, 'inserted': 0, 'last_id': None, 'done': False}
+    if state.get('done') is True:
+        return state
+    while True:
+        batch_query = dict(query) if state['last_id'] is None else {**query, '_id': {'$gt': state['last_id']}}
+        batch = list(source.find(batch_query).sort('_id', ASCENDING).limit(batch_size))
+        if len(batch) == 0:
+            break
+        documents = batch if transform is None else [transform(document) for document in batch]
+        state['inserted'] += insert_new(target, documents)
+        state['copied'] += len(batch)
+        state['last_id'] = batch[-1]['_id']
+        state_collection.update_one({'_id': key}, {'$set': {name: state[name] for name in ('copied', 'inserted', 'last_id')}}, upsert=True)
+    state['done'] = True
+    state_collection.update_one({'_id': key}, {'$set': {'done': True, 'source': source.full_name}}, upsert=True)
+    return state
+
+def migrate_room(mongo_db, room_name: str, batch_size: int = MIGRATION_BATCH_SIZE) -> dict:
+    """ Copy a per room collection's messages into the partitioned messages collection. The old counter document stays behind,
+        sequence numbers live in the sequence collection
+    """
+    def with_room(document: dict) -> dict:
+        document['mess_props'].setdefault('room_name', room_name)
+        return document
+    return copy_collection(room_collection(mongo_db, room_name, LAYOUT_PER_ROOM), room_collection(mongo_db, room_name, LAYOUT_PARTITIONED),
+                           mongo_db.get_collection(MIGRATIONS_COLLECTION), f'room:{room_name}', {'message': {'$exists': True}}, with_room, batch_size)
+
+def migrate_queue(mongo_db, queue_name: str, batch_size: int = MIGRATION_BATCH_SIZE) -> dict:
+    """ Copy an rmq.ChatRoom collection into the partitioned queues collection: the metadata document by name, then the messages
+        tagged with the queue name
+    """
+    source = queue_collection(mongo_db, queue_name, LAYOUT_PER_ROOM)
+    target = queue_collection(mongo_db, queue_name, LAYOUT_PARTITIONED)
+    if (metadata := source.find_one({'name': {'$exists': True}}, projection={'_id': False})) is not None:
+        target.replace_one({'name': metadata['name']}, metadata, upsert=True)
+    return copy_collection(source, target, mongo_db.get_collection(MIGRATIONS_COLLECTION), f'queue:{queue_name}', {'message': {'$exists': True}},
+                           lambda document: dict(document, queue_name=queue_name), batch_size)
+
+def old_collections(mongo_db) -> list:
+    return sorted(name for name in mongo_db.list_collection_names() if name not in NOT_ROOMS and not name.startswith('system.'))
+
+def drop_migrated(mongo_db, name: str, kind: str) -> bool:
+    """ Drop an old collection once its migration is done and it holds nothing the migration didn't copy (the messages, the
+        queue metadata, the old counter document). Returns True if we dropped it
+    """
+    state = mongo_db.get_collection(MIGRATIONS_COLLECTION).find_one({'_id': f'{kind}:{name}'})
+    if state is None or state.get('done') is not True:
+        return False
+    source = mongo_db.get_collection(name)
+    left = source.count_documents({'message': {'$exists': False}, 'name': {'$exists': False}, '_id': {'$ne': 'userid'}})
+    if left > 0:
+        logger.warning('Keeping %s, %d documents in it are not messages', source.full_name, left)
+        return False
+    source.drop()
+    return True
+
+def migrate(mongo_db, names: list, kind: str, batch_size: int = MIGRATION_BATCH_SIZE, drop: bool = False) -> list:
+    """ Migrate every named room (kind 'room') or queue (kind 'queue') collection in mongo_db, returns (name, state) for each
+    """
+    if kind == 'room':
+        ensure_indexes(room_collection(mongo_db, '', LAYOUT_PARTITIONED), ROOM_INDEX_KINDS[LAYOUT_PARTITIONED])
+        migrate_one = migrate_room
+    else:
+        ensure_indexes(queue_collection(mongo_db, '', LAYOUT_PARTITIONED), QUEUE_INDEX_KINDS[LAYOUT_PARTITIONED])
+        migrate_one = migrate_queue
+    results = []
+    for name in names:
+        state = migrate_one(mongo_db, name, batch_size)
+        logger.info('Migrated %s %s: %d copied, %d new', kind, name, state['copied'], state['inserted'])
+        if drop is True:
+            drop_migrated(mongo_db, name, kind)
+        results.append((name, state))
+    return results
+
+
+def main():
+    """ Move collection per room data into the partitioned layout. Safe to stop and run again, finished collections are skipped
+    """
+    parser = argparse.ArgumentParser(description='Migrate collection per room messages (and rmq queues) into the partitioned layout')
+    parser.add_argument('--rooms', nargs='*', help='room collections to migrate, default every collection that is not a known list')
+    parser.add_argument('--queues', nargs='*', help='rmq queue collections to migrate, default none, no names means all of them')
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument('--drop', action='store_true', help='drop each old collection after it is migrated')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    room_db = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH).detest
+    rooms = args.rooms if args.rooms else old_collections(room_db)
+    for name, state in migrate(room_db, rooms, 'room', args.batch_size, args.drop):
+        print(f'room  {name}: {state["copied"]} copied, {state["inserted"]} new')
+    if args.queues is not None:
+        queue_db = get_mongo_client(host=MONGODB_URL).gueshner
+        queues = args.queues if len(args.queues) > 0 else old_collections(queue_db)
+        for name, state in migrate(queue_db, queues, 'queue', args.batch_size, args.drop):
+            print(f'queue {name}: {state["copied"]} copied, {state["inserted"]} new')
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
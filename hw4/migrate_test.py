@@ -0,0 +1,133 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from indexes import forget_ensured, ensure_indexes
+from layout import room_collection, ROOM_INDEX_KINDS
+from room import ChatRoom, MessageProperties
+import migrate
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class FailingTarget():
+    """ Passes inserts through to the real collection until the fail_on'th, which blows up like a dropped connection
+    """
+    def __init__(self, target, fail_on: int) -> None:
+        self.__target = target
+        self.__fail_on = fail_on
+        self.calls = 0
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        self.calls += 1
+        if self.calls == self.__fail_on:
+            raise ConnectionError('lost the server')
+        return self.__target.insert_many(documents, ordered=ordered)
+
+
+class MigrateTest(TestCase):
+    """ Testing the partitioned messages collection and the migration from a collection per room, against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        forget_ensured()
+        self.__db = get_mongo_client().detest
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def __old_room(self, name: str, num_messages: int = 15) -> list:
+        """ A room in the old layout, returns (message, sequence number) for what's in it
+        """
+        room = ChatRoom(name, create_new=True, layout=LAYOUT_PER_ROOM)
+        for index in range(num_messages):
+            room.send_message(f'{name} {index}', SENDER_NAME, MessageProperties(name, 'migrate-user', SENDER_NAME, MESSAGE_TYPE_SENT))
+        return self.__strip(room_collection(self.__db, name, LAYOUT_PER_ROOM).find({'message': {'$exists': True}}).sort('mess_props.sequence_num', 1))
+
+    @staticmethod
+    def __strip(messages) -> list:
+        return [(message['message'], message['mess_props']['sequence_num']) for message in messages]
+
+    def test_rooms_move(self):
+        """ Every old room collection ends up in the messages collection and reads the same through a partitioned ChatRoom
+        """
+        before = {name: self.__old_room(name) for name in ('lobby', 'backroom')}
+        results = dict(migrate.migrate(self.__db, migrate.old_collections(self.__db), 'room', batch_size=4))
+        assert sorted(results) == ['backroom', 'lobby']
+        for name, messages in before.items():
+            assert results[name]['copied'] == 15 and results[name]['done'] is True
+            assert self.__strip(ChatRoom(name, layout=LAYOUT_PARTITIONED).get_messages()) == messages
+        # Finished rooms are skipped
+        assert [state['copied'] for _, state in migrate.migrate(self.__db, ['lobby'], 'room', batch_size=4)] == [15]
+
+    def test_resume(self):
+        """ A migration that dies halfway picks up after the last batch it recorded, and copies nothing twice
+        """
+        before = self.__old_room('lobby')
+        source = room_collection(self.__db, 'lobby', LAYOUT_PER_ROOM)
+        target = room_collection(self.__db, 'lobby', LAYOUT_PARTITIONED)
+        failing = FailingTarget(target, fail_on=3)
+        with self.assertRaises(ConnectionError):
+            migrate.copy_collection(source, failing, self.__db.get_collection(MIGRATIONS_COLLECTION), 'room:lobby', {'message': {'$exists': True}}, batch_size=4)
+        assert self.__db.get_collection(MIGRATIONS_COLLECTION).find_one({'_id': 'room:lobby'})['copied'] == 8
+        state = migrate.migrate_room(self.__db, 'lobby', batch_size=4)
+        assert state['copied'] == 15 and state['inserted'] == 15
+        assert self.__strip(target.find({'mess_props.room_name': 'lobby'}).sort('mess_props.sequence_num', 1)) == before
+
+    def test_rerun_batch(self):
+        """ Losing the state after a batch went in (or copying into a target that already has it) only skips duplicates
+        """
+        self.__old_room('lobby')
+        migrate.migrate(self.__db, ['lobby'], 'room', batch_size=4)
+        self.__db.get_collection(MIGRATIONS_COLLECTION).delete_many({})
+        state = migrate.migrate_room(self.__db, 'lobby', batch_size=4)
+        assert state['copied'] == 15 and state['inserted'] == 0
+        assert room_collection(self.__db, 'lobby').count_documents({'mess_props.room_name': 'lobby'}) == 15
+
+    def test_drop(self):
+        """ --drop only removes old collections that hold nothing but what the migration copied
+        """
+        self.__old_room('lobby')
+        self.__old_room('busy')
+        self.__db.get_collection('busy').insert_one({'something': 'else'})
+        migrate.migrate(self.__db, ['lobby', 'busy'], 'room', drop=True)
+        assert 'lobby' not in self.__db.list_collection_names()
+        assert 'busy' in self.__db.list_collection_names()
+
+    def test_queues(self):
+        """ An rmq.ChatRoom collection moves with its metadata, and a partitioned rmq.ChatRoom restores from it
+        """
+        queue_db = get_mongo_client(host=MONGODB_URL).gueshner
+        old = queue_db.get_collection('old-queue')
+        old.insert_one({'name': 'old-queue', 'create_time': datetime(2023, 1, 1), 'modify_time': datetime(2023, 1, 1)})
+        mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'migrate-user', SENDER_NAME, datetime(2023, 1, 1), datetime(2023, 1, 1))
+        old.insert_many([rmq.ChatMessage(f'queued {index}', mess_props).to_dict() for index in range(3)])
+        migrate.migrate(queue_db, ['old-queue'], 'queue')
+        room = rmq.ChatRoom('old-queue', layout=LAYOUT_PARTITIONED)
+        assert [message.message for message in room] == ['queued 2', 'queued 1', 'queued 0']
+        assert queue_db.get_collection(QUEUES_COLLECTION).count_documents({'queue_name': 'old-queue'}) == 3
+
+    def test_partitioned_rooms(self):
+        """ Rooms sharing the collection only see their own messages, and a room can't have a sequence number twice
+        """
+        ensure_indexes(room_collection(self.__db, ''), ROOM_INDEX_KINDS[LAYOUT_PARTITIONED])
+        for name in ('north', 'south'):
+            room = ChatRoom(name, create_new=True)
+            for index in range(3):
+                room.send_message(f'{name} {index}', SENDER_NAME, MessageProperties(name, 'migrate-user', SENDER_NAME, MESSAGE_TYPE_SENT, sequence_num=index + 1))
+        assert self.__strip(ChatRoom('north').get_messages()) == [('north 0', 1), ('north 1', 2), ('north 2', 3)]
+        assert room_collection(self.__db, 'north').count_documents({}) == 6
+        with self.assertRaises(DuplicateKeyError):
+            room_collection(self.__db, 'north').insert_one({'message': 'again', 'mess_props': {'room_name': 'north', 'sequence_num': 1}})
+
+if __name__ == "__main__":
+    unittest.main()
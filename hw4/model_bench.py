@@ -0,0 +1,106 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+from constants import *
+import room
+import rmq
+
+NUM_MESSAGES = 1000000
+
+
+class DictMessageProperties():
+    """ room.MessageProperties the way it was before __slots__, every instance has its own __dict__
+    """
+    def __init__(self, room_name: str, to_user: str, from_user: str, mess_type: int, sequence_num: int = -1, sent_time: datetime = None, rec_time: datetime = None) -> None:
+        self.__mess_type = mess_type
+        self.__room_name = room_name
+        self.__to_user = to_user
+        self.__from_user = from_user
+        self.__sent_time = sent_time
+        self.__rec_time = rec_time
+        self.__sequence_num = sequence_num
+
+
+class DictChatMessage():
+    """ room.ChatMessage before __slots__
+    """
+    def __init__(self, message: str, mess_id = None, mess_props = None) -> None:
+        self.__message = message
+        self.__mess_props = mess_props
+        self.__rmq_props = None
+        self.__dirty = True
+        self.__mess_id = mess_id
+
+
+class DictMessProperties():
+    """ rmq.MessProperties before __slots__
+    """
+    def __init__(self, mess_type: int, to_user: str, from_user: str, sent_time: datetime = None, rec_time: datetime = None) -> None:
+        self.__mess_type = mess_type
+        self.__to_user = to_user
+        self.__from_user = from_user
+        self.__sent_time = sent_time
+        self.__rec_time = rec_time
+
+
+class DictRMQChatMessage():
+    """ rmq.ChatMessage before __slots__
+    """
+    def __init__(self, message: str = "", mess_props = None, rmq_props = None) -> None:
+        self.__message = message
+        self.__mess_props = mess_props
+        self.__rmq_props = rmq_props
+        self.__dirty = True
+
+
+def room_message(index: int, message_class, props_class):
+    now = datetime.now()
+    return message_class(f'bench message {index}', mess_props=props_class('bench-room', 'bench-to', 'bench-from', MESSAGE_TYPE_SENT, index, now, now))
+
+
+def rmq_message(index: int, message_class, props_class):
+    now = datetime.now()
+    return message_class(f'bench message {index}', props_class(MESSAGE_TYPE_SENT, 'bench-to', 'bench-from', now, now))
+
+
+def bytes_per_message(build, message_class, props_class, num_messages: int) -> tuple:
+    """ Fill a deque like a room's cache and see how much memory it took, per message. Returns (bytes, seconds)
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    cache = deque(build(index, message_class, props_class) for index in range(num_messages))
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del cache
+    return used / num_messages, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes per cached message with and without __slots__, measured with tracemalloc')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    args = parser.parse_args()
+    # the constructors log at info level, we want the objects, not the log file
+    logging.disable(logging.INFO)
+    cases = [
+        ('room message, __dict__', room_message, DictChatMessage, DictMessageProperties),
+        ('room message, __slots__', room_message, room.ChatMessage, room.MessageProperties),
+        ('rmq message, __dict__', rmq_message, DictRMQChatMessage, DictMessProperties),
+        ('rmq message, __slots__', rmq_message, rmq.ChatMessage, rmq.MessProperties),
+    ]
+    print(f'{args.messages} messages (text, two datetimes and the deque slot included)')
+    for description, build, message_class, props_class in cases:
+        used, elapsed = bytes_per_message(build, message_class, props_class, args.messages)
+        print(f'{description:<24} {used:7.1f} bytes/message  {used * args.messages / 2 ** 20:8.1f} MB  built in {elapsed:.2f}s (traced)')
+
+
+if __name__ == "__main__":
+    main()
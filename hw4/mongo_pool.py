@@ -0,0 +1,160 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import logging
+import threading
+from pymongo import MongoClient
+from pymongo.monitoring import ConnectionPoolListener
+from constants import *
+from metrics import command_timer
+
+logger = logging.getLogger(__name__)
+
+
+class PoolListener(ConnectionPoolListener):
+    """ Counts the connection events pymongo reports for one client so we can see how many sockets are open and in use
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__created = 0
+        self.__closed = 0
+        self.__checked_out = 0
+        self.__checkout_failures = 0
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {'open': self.__created - self.__closed,
+                'created': self.__created,
+                'closed': self.__closed,
+                'checked_out': self.__checked_out,
+                'checkout_failures': self.__checkout_failures,
+            }
+
+    def connection_created(self, event) -> None:
+        with self.__lock:
+            self.__created += 1
+
+    def connection_closed(self, event) -> None:
+        with self.__lock:
+            self.__closed += 1
+
+    def connection_checked_out(self, event) -> None:
+        with self.__lock:
+            self.__checked_out += 1
+
+    def connection_checked_in(self, event) -> None:
+        with self.__lock:
+            self.__checked_out -= 1
+
+    def connection_check_out_failed(self, event) -> None:
+        with self.__lock:
+            self.__checkout_failures += 1
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+
+class MongoPool():
+    """ Process wide registry of MongoClient instances. A MongoClient already is a thread safe connection pool, so building one per
+        ChatRoom/RoomList/UserList means a new pool, TCP handshake and auth round trip for every room. Instead everybody asks the registry,
+        which hands back the one client for a given host and set of credentials.
+    """
+    def __init__(self, max_pool_size: int = MONGODB_MAX_POOL_SIZE, min_pool_size: int = MONGODB_MIN_POOL_SIZE,
+                max_idle_time_ms: int = MONGODB_MAX_IDLE_TIME_MS, wait_queue_timeout_ms: int = MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                client_factory = MongoClient) -> None:
+        self.__lock = threading.Lock()
+        self.__clients = {}
+        self.__listeners = {}
+        self.__max_pool_size = max_pool_size
+        self.__min_pool_size = min_pool_size
+        self.__max_idle_time_ms = max_idle_time_ms
+        self.__wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.__client_factory = client_factory
+
+    @property
+    def client_factory(self):
+        return self.__client_factory
+
+    @client_factory.setter
+    def client_factory(self, new_factory):
+        """ Swapping the factory only makes sense before anybody got a client, so we close and forget the ones we have
+        """
+        self.close()
+        self.__client_factory = new_factory
+
+    def get_client(self, host: str = MONGODB_HOST, port: int = MONGODB_PORT, username: str = None, password: str = None,
+                auth_source: str = None, auth_mechanism: str = None):
+        """ Return the shared client for this host and credentials, creating it on first use
+            Options that are None are left out so pymongo falls back to its own defaults (or whatever is in the URL)
+        """
+        key = (host, port, username, password, auth_source, auth_mechanism)
+        client = self.__clients.get(key)
+        if client is not None:
+            return client
+        with self.__lock:
+            if (client := self.__clients.get(key)) is not None:
+                return client
+            options = {'host': host, 'port': port, 'username': username, 'password': password,
+                    'authSource': auth_source, 'authMechanism': auth_mechanism}
+            options = {name: value for name, value in options.items() if value is not None}
+            listener = PoolListener()
+            # Command timings go to the process wide histogram, the pool counts stay per client
+            event_listeners = [listener, command_timer] if METRICS_MONGO_COMMANDS is True else [listener]
+            client = self.__client_factory(maxPoolSize=self.__max_pool_size, minPoolSize=self.__min_pool_size,
+                                        maxIdleTimeMS=self.__max_idle_time_ms, waitQueueTimeoutMS=self.__wait_queue_timeout_ms,
+                                        event_listeners=event_listeners, **options)
+            logger.debug('Created shared mongo client for %s', self.__label(key))
+            self.__clients[key] = client
+            self.__listeners[key] = listener
+            return client
+
+    def stats(self) -> dict:
+        """ Connection counts per client, keyed by user@host:port/authSource (no passwords), plus totals
+        """
+        with self.__lock:
+            per_client = {self.__label(key): listener.stats() for key, listener in self.__listeners.items()}
+        return {'clients': len(per_client),
+            'open': sum(client['open'] for client in per_client.values()),
+            'checked_out': sum(client['checked_out'] for client in per_client.values()),
+            'max_pool_size': self.__max_pool_size,
+            'max_idle_time_ms': self.__max_idle_time_ms,
+            'per_client': per_client,
+        }
+
+    def close(self) -> None:
+        """ Close every client we handed out. Only for shutdown and tests, rooms never close the shared client themselves
+        """
+        with self.__lock:
+            for client in self.__clients.values():
+                client.close()
+            self.__clients = {}
+            self.__listeners = {}
+
+    @staticmethod
+    def __label(key: tuple) -> str:
+        host, port, username, _, auth_source, _ = key
+        user = f'{username}@' if username is not None else ''
+        return f'{user}{host}:{port}/{auth_source or ""}'
+
+
+# Same reasoning as the app global in room_chat_api: one registry per process is the whole point
+mongo_pool = MongoPool()
+
+def get_mongo_client(*args, **kwargs):
+    """ Shortcut for mongo_pool.get_client
+    """
+    return mongo_pool.get_client(*args, **kwargs)
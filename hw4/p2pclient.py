@@ -6,6 +6,7 @@ from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from rmq import *
 from constants import *
 from users import *
+from chat_logging import setup_logging
 
 MY_IPADDRESS = ""
 
@@ -14,7 +15,9 @@ MY_IPADDRESS = ""
 
 
 app = FastAPI()
-logging.basicConfig(filename='chat.log', level=logging.INFO)
+setup_logging(LOG_FILE)
+
+logger = logging.getLogger(__name__)
 
 #rmq_private = ChatQueue(private_channel_name="eshner")
 #rmq_public = ChatQueue(private_channel_name="eshner")
@@ -38,18 +41,17 @@ async def get_messages(request: Request, alias: str, exchange_name: str, group_q
     except:
         users = UserList('chat_users')
     if users.get_by_alias(alias) is None:
-        logging.debug(f'Trying to send, have an invalid alias: {alias}')
+        logger.debug('Trying to send, have an invalid alias: %s', alias)
         return JSONResponse(status_code=410, content="Invalid alias")
     """
-    logging.info("starting messages method")
-    if (queue_instance := ChatRoom(exchange_name=exchange_name, queue_name=alias, group_queue=group_queue)) is None:
+    logger.debug("starting messages method")
+    if (queue_instance := get_chat_room(alias, exchange_name=exchange_name, room_type=ROOM_TYPE_PUBLIC if group_queue else ROOM_TYPE_PRIVATE)) is None:
         return JSONResponse(status_code=415, content=f'Chat queue {exchange_name} does not exist.')
     messages, message_objects, total_mess = queue_instance.get_message_bodies(num_messages=messages_to_get, return_objects=True)
-    logging.info(f'inside messages handler, after getting messages for queue: {alias}\n messages are {messages}')
+    logger.debug('inside messages handler, got %d messages for queue: %s', len(messages), alias)
     for message in message_objects:
-        logging.info(f'Message: {message.message} == message props: {message.mess_props} host is {request.client.host}')
-        logging.info(request.json())
-    logging.info("End Messages")
+        logger.debug('Message: %s == message props: %s host is %s', message.message, message.mess_props, request.client.host)
+    logger.debug("End Messages")
     return messages
 #    return JSONResponse(status_code=200, content=messages)
 
@@ -109,14 +111,14 @@ async def send_message(queue_name: str, message: str, from_alias: str, to_alias:
     except:
         users = UserList('chat_users')
     if users.get_by_alias(from_alias) is None:
-        logging.debug(f'Trying to send, have an invalid sender alias: {from_alias}')
+        logger.debug('Trying to send, have an invalid sender alias: %s', from_alias)
         return JSONResponse(status_code=410, content="Invalid sender alias")
     if users.get_by_alias(to_alias) is None:
-        logging.debug(f'Trying to send, have an invalid destination alias: {to_alias}')
+        logger.debug('Trying to send, have an invalid destination alias: %s', to_alias)
         return JSONResponse(status_code=410, content="Invalid destination alias")
     """
-    rmq_instance = ChatRoom(queue_name = queue_name, exchange_name=queue_name)
-    mess_props = MessProperties(mess_type=MESSAGE_TYPE_SENT, mess_type=MESSAGE_TYPE_SENT, to_user=to_alias, from_user=from_alias)
+    rmq_instance = get_chat_room(queue_name, exchange_name=queue_name)
+    mess_props = MessProperties(mess_type=MESSAGE_TYPE_SENT, to_user=to_alias, from_user=from_alias)
     if rmq_instance.send_message(message=message, mess_props=mess_props) is True:
         return "Success"
     else:
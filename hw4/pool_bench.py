@@ -0,0 +1,54 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import time
+from pymongo import MongoClient
+from constants import *
+from mongo_pool import MongoPool
+
+NUM_ROOMS = 10000
+
+
+def new_client_per_room(num_rooms: int, connect: bool) -> float:
+    """ What ChatRoom.__init__ used to do: a brand new client (pool, handshake, auth) for every room, closed when the room goes away
+    """
+    start = time.perf_counter()
+    for room_index in range(num_rooms):
+        client = MongoClient(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, authSource=MONGO_DB, authMechanism=MONGODB_AUTH_MECH)
+        collection = client.detest.get_collection(f'bench-room-{room_index}')
+        if connect is True:
+            client.admin.command('ping')
+        client.close()
+    return time.perf_counter() - start
+
+
+def shared_pool(num_rooms: int, connect: bool) -> float:
+    """ What ChatRoom.__init__ does now: ask the registry for the client, which is built once
+    """
+    pool = MongoPool()
+    start = time.perf_counter()
+    for room_index in range(num_rooms):
+        client = pool.get_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH)
+        collection = client.detest.get_collection(f'bench-room-{room_index}')
+        if connect is True:
+            client.admin.command('ping')
+    elapsed = time.perf_counter() - start
+    print(f'shared pool stats: {pool.stats()}')
+    pool.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare a new MongoClient per room against the shared pool')
+    parser.add_argument('--rooms', type=int, default=NUM_ROOMS)
+    parser.add_argument('--connect', action='store_true', help='ping the server for every room (needs a reachable mongod)')
+    args = parser.parse_args()
+    per_room = new_client_per_room(args.rooms, args.connect)
+    print(f'new client per room: {args.rooms} rooms in {per_room:.3f}s ({per_room / args.rooms * 1e6:.1f} us/room)')
+    shared = shared_pool(args.rooms, args.connect)
+    print(f'shared pool:         {args.rooms} rooms in {shared:.3f}s ({shared / args.rooms * 1e6:.1f} us/room)')
+    print(f'speedup: {per_room / shared:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
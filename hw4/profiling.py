@@ -0,0 +1,186 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import hmac
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+# The profile of the request this task is handling, None for every request that isn't profiled. The storage executor reads it
+#   when it hands a call to a worker thread, so the worker's stacks count towards the request too
+current_profile = contextvars.ContextVar('current_profile', default=None)
+UNSAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def profiling_enabled(token: str = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE) -> bool:
+    """ Whether anything could ever ask for a profile. If not, the app doesn't get the middleware at all
+    """
+    return token is not None or sample_rate > 0
+
+
+class RequestProfile():
+    """ Sampling profiler for one request. A background thread wakes every interval and records the stack of each thread doing
+            the request's work: the event loop thread while the request's task is the one running on it (other requests share the
+            loop), and storage worker threads while they run one of the request's calls
+        Stacks are counted in the collapsed format flamegraph.pl, speedscope and inferno read: root first, frames joined by ';',
+            then the number of samples. The first frame says which kind of thread it was
+    """
+    def __init__(self, interval: float = PROFILE_INTERVAL) -> None:
+        self.__interval = interval
+        self.__loop = asyncio.get_running_loop()
+        self.__task = asyncio.current_task()
+        self.__loop_thread = threading.get_ident()
+        self.__lock = threading.Lock()
+        # thread id -> [role, how many of our calls it's in]
+        self.__threads = {self.__loop_thread: ['event-loop', 1]}
+        self.__stacks = collections.Counter()
+        self.__samples = 0
+        self.__started = time.perf_counter()
+        self.__elapsed = 0.0
+        self.__stop = threading.Event()
+        self.__sampler = threading.Thread(target=self.__run, name='chat-profiler', daemon=True)
+        self.__sampler.start()
+
+    @property
+    def samples(self) -> int:
+        return self.__samples
+
+    @property
+    def elapsed(self) -> float:
+        return self.__elapsed
+
+    @contextlib.contextmanager
+    def thread(self, role: str):
+        """ Count this thread towards the request while the block runs
+        """
+        thread_id = threading.get_ident()
+        with self.__lock:
+            self.__threads.setdefault(thread_id, [role, 0])[1] += 1
+        try:
+            yield
+        finally:
+            with self.__lock:
+                entry = self.__threads[thread_id]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.__threads[thread_id]
+
+    def stop(self) -> collections.Counter:
+        """ Stop sampling, returns folded stack -> samples
+        """
+        self.__stop.set()
+        self.__sampler.join()
+        self.__elapsed = time.perf_counter() - self.__started
+        return self.__stacks
+
+    @staticmethod
+    def fold(role: str, frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':'))
+            frame = frame.f_back
+        names.append(role)
+        return ';'.join(reversed(names))
+
+    def __run(self) -> None:
+        while self.__stop.wait(self.__interval) is False:
+            frames = sys._current_frames()
+            with self.__lock:
+                threads = [(thread_id, entry[0]) for thread_id, entry in self.__threads.items()]
+            for thread_id, role in threads:
+                if thread_id == self.__loop_thread and asyncio.current_task(self.__loop) is not self.__task:
+                    continue
+                if (frame := frames.get(thread_id)) is not None:
+                    self.__stacks[self.fold(role, frame)] += 1
+                    self.__samples += 1
+
+    def write(self, path: str) -> None:
+        """ The folded stacks to path, written to a temporary file first so nobody reads half a profile
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f'{path}.tmp', 'w') as profile_file:
+            for stack, samples in self.__stacks.most_common():
+                profile_file.write(f'{stack} {samples}\n')
+        os.replace(f'{path}.tmp', path)
+
+
+class ProfilingMiddleware():
+    """ ASGI middleware that profiles a request when it asks for it (an X-Profile header or a profile query parameter, with the
+            token in X-Profile-Token or profile_token) or when it's picked by sample_rate. The profile goes to directory as
+            <time>-<method>-<path>-<n>.folded and the response says which file in X-Profile-File
+        Only added to the app when profiling_enabled, so with no token and no sampling it costs nothing. With it, a request that
+            isn't profiled costs a header lookup. At most max_concurrent requests are profiled at once, the rest run as usual
+    """
+    def __init__(self, app, directory: str = PROFILE_DIR, token: str = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE,
+                interval: float = PROFILE_INTERVAL, max_concurrent: int = PROFILE_MAX_CONCURRENT) -> None:
+        self.app = app
+        self.__directory = directory
+        self.__token = token
+        self.__sample_rate = sample_rate
+        self.__interval = interval
+        self.__slots = threading.BoundedSemaphore(max_concurrent)
+        self.__numbers = itertools.count(1)
+
+    def wanted(self, scope) -> bool:
+        """ Sampled, or asked for with the right token. A wrong or missing token is logged and the request runs unprofiled
+        """
+        if self.__sample_rate > 0 and random.random() < self.__sample_rate:
+            return True
+        if self.__token is None:
+            return False
+        headers = dict(scope['headers'])
+        query_string = scope.get('query_string', b'')
+        if b'x-profile' not in headers and b'profile' not in query_string:
+            return False
+        query = parse_qs(query_string.decode('latin-1'))
+        if b'x-profile' not in headers and 'profile' not in query:
+            return False
+        token = headers.get(b'x-profile-token', b'').decode('latin-1') or query.get('profile_token', [''])[0]
+        if hmac.compare_digest(token.encode(), self.__token.encode()) is False:
+            logger.warning('Profile of %s %s asked for without a valid token', scope['method'], scope['path'])
+            return False
+        return True
+
+    def __path(self, scope) -> str:
+        name = UNSAFE_NAME.sub('_', scope['path'].strip('/')) or 'root'
+        return os.path.join(self.__directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{scope["method"]}-{name[:80]}-{next(self.__numbers)}.folded')
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http' or self.wanted(scope) is False:
+            await self.app(scope, receive, send)
+            return
+        if self.__slots.acquire(blocking=False) is False:
+            logger.info('Not profiling %s %s, already profiling as many requests as allowed', scope['method'], scope['path'])
+            await self.app(scope, receive, send)
+            return
+        path = self.__path(scope)
+        async def send_path(message) -> None:
+            if message['type'] == 'http.response.start':
+                message = dict(message, headers=list(message.get('headers', [])) + [(b'x-profile-file', os.path.basename(path).encode())])
+            await send(message)
+        profile = RequestProfile(self.__interval)
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_path)
+        finally:
+            current_profile.reset(token)
+            profile.stop()
+            self.__slots.release()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, profile.write, path)
+                logger.info('Profiled %s %s: %d samples over %.3fs in %s', scope['method'], scope['path'], profile.samples, profile.elapsed, path)
+            except OSError:
+                logger.exception('Unable to write the profile of %s %s to %s', scope['method'], scope['path'], path)
@@ -0,0 +1,93 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+import os
+import tempfile
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from async_store import storage_executor
+from profiling import ProfilingMiddleware, profiling_enabled
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+def busy_storage_call(seconds: float) -> None:
+    """ Stands in for a slow pymongo call on a storage thread
+    """
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def busy_on_the_loop(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilingTest(TestCase):
+    """ Testing on demand request profiles against a small app that spends time on the loop and on a storage thread
+    """
+    def setUp(self) -> None:
+        self.__directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.__directory.cleanup()
+
+    def __client(self, **kwargs) -> TestClient:
+        app = FastAPI()
+        @app.get('/rooms/{room_name}')
+        async def slow_room(room_name: str):
+            busy_on_the_loop(0.1)
+            await storage_executor.run(busy_storage_call, 0.1)
+            return room_name
+        app.add_middleware(ProfilingMiddleware, directory=self.__directory.name, interval=0.001, **kwargs)
+        return TestClient(app)
+
+    def __profiles(self) -> list:
+        return sorted(os.listdir(self.__directory.name))
+
+    def test_enabled(self):
+        assert profiling_enabled(None, 0.0) is False
+        assert profiling_enabled('secret', 0.0) is True and profiling_enabled(None, 0.01) is True
+
+    def test_profile(self):
+        """ Asked for with the token: the folded stacks cover the handler on the loop and the call on the storage thread
+        """
+        with self.__client(token='secret') as client:
+            response = client.get('/rooms/slow', headers={'X-Profile': '1', 'X-Profile-Token': 'secret'})
+        assert response.status_code == 200
+        assert self.__profiles() == [response.headers['x-profile-file']]
+        with open(os.path.join(self.__directory.name, response.headers['x-profile-file'])) as profile_file:
+            lines = profile_file.read().splitlines()
+        samples = {}
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            frames = stack.split(';')
+            samples[frames[0]] = samples.get(frames[0], 0) + int(count)
+            assert frames[0] in ('event-loop', 'storage')
+        assert samples['event-loop'] >= 3 and samples['storage'] >= 3
+        assert any(line.startswith('storage;') and 'busy_storage_call (profiling_test.py:' in line for line in lines)
+        assert any(line.startswith('event-loop;') and 'busy_on_the_loop (profiling_test.py:' in line for line in lines)
+
+    def test_not_asked(self):
+        """ No trigger, a wrong token, or the trigger with profiling off: the request runs as usual and nothing is written
+        """
+        with self.__client(token='secret') as client:
+            assert 'x-profile-file' not in client.get('/rooms/fast').headers
+            assert client.get('/rooms/fast', params={'profile': '1', 'profile_token': 'guess'}).status_code == 200
+        with self.__client(token=None) as client:
+            assert 'x-profile-file' not in client.get('/rooms/fast', headers={'X-Profile': '1', 'X-Profile-Token': 'secret'}).headers
+        assert self.__profiles() == []
+
+    def test_query_and_sampling(self):
+        with self.__client(token='secret') as client:
+            assert 'x-profile-file' in client.get('/rooms/fast', params={'profile': '1', 'profile_token': 'secret'}).headers
+        with self.__client(sample_rate=1.0) as client:
+            assert 'x-profile-file' in client.get('/rooms/sampled').headers
+        assert len(self.__profiles()) == 2 and any('-GET-rooms_sampled-' in name for name in self.__profiles())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import time
+from constants import *
+from rmq_publisher import RMQPublisher
+from rmq_stub import StubBroker
+
+NUM_MESSAGES = 20000
+CONFIRM_DELAY = 0.001
+
+
+def bench_one_at_a_time(publisher: RMQPublisher, exchange: str, routing_key: str, num_messages: int) -> float:
+    """ Wait for each confirm before the next publish, what a blocking channel with confirms does
+    """
+    start = time.perf_counter()
+    for index in range(num_messages):
+        publisher.publish(exchange, routing_key, f'bench message {index}').result()
+    return time.perf_counter() - start
+
+
+def bench_pipelined(publisher: RMQPublisher, exchange: str, routing_key: str, num_messages: int) -> float:
+    """ Publish everything and collect the confirms as they come back in batches
+    """
+    start = time.perf_counter()
+    confirms = [publisher.publish(exchange, routing_key, f'bench message {index}') for index in range(num_messages)]
+    for confirm in confirms:
+        confirm.result()
+    return time.perf_counter() - start
+
+
+def report(name: str, elapsed: float, num_messages: int, publisher: RMQPublisher) -> None:
+    stats = publisher.stats()
+    print(f'{name}: {num_messages} messages in {elapsed:.3f}s ({num_messages / elapsed:.0f} msg/s), '
+          f'{stats["messages_per_ack"]:.1f} messages per ack, confirm p50 {stats["confirm_latency_p50"] * 1e3:.2f} ms '
+          f'p99 {stats["confirm_latency_p99"] * 1e3:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publisher confirms one at a time vs pipelined, against the in-process broker')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--channels', type=int, default=RMQ_PUBLISHER_CHANNELS)
+    parser.add_argument('--confirm-delay', type=float, default=CONFIRM_DELAY, help='simulated broker confirm latency for the stub (seconds)')
+    args = parser.parse_args()
+
+    for name, bench, num_messages in (('one at a time', bench_one_at_a_time, max(args.messages // 10, 1)),
+                                      ('pipelined    ', bench_pipelined, args.messages)):
+        broker = StubBroker(confirm_delay=args.confirm_delay)
+        broker.declare_queue('bench-queue')
+        publisher = RMQPublisher(channels=args.channels, connection_factory=broker.connect)
+        publisher.wait_connected(5)
+        elapsed = bench(publisher, '', 'bench-queue', num_messages)
+        report(name, elapsed, num_messages, publisher)
+        publisher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import asyncio
+import collections
+import logging
+import threading
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+
+
+class SubscriptionClosed(Exception):
+    """ Raised by Subscription.get once the subscription is closed and drained
+    """
+
+
+class Subscription():
+    """ One push subscriber (an SSE or WebSocket connection) on one room. Messages wait in a bounded queue until the connection sends
+            them. Everything except offer from the broadcaster runs on the subscriber's event loop.
+        When the queue is full the slow consumer policy decides: drop_oldest throws away the oldest queued message (and counts it),
+            disconnect closes the subscription so the client can reconnect and catch up from its last sequence number.
+    """
+    def __init__(self, room_name: str, loop, max_queue: int = PUSH_QUEUE_SIZE, policy: str = PUSH_SLOW_CONSUMER_POLICY, user_alias: str = None) -> None:
+        if policy not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f'Unknown slow consumer policy {policy}')
+        self.room_name = room_name
+        self.user_alias = user_alias
+        self.loop = loop
+        self.__max_queue = max_queue
+        self.__policy = policy
+        self.__queue = collections.deque()
+        self.__ready = asyncio.Event()
+        self.__closed = False
+        self.close_reason = None
+        self.dropped = 0
+        self.delivered = 0
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    @property
+    def pending(self) -> int:
+        return len(self.__queue)
+
+    def wants(self, message: dict) -> bool:
+        """ Subscribers for one alias only get messages addressed to them
+        """
+        return self.user_alias is None or message.get('mess_props', {}).get('to_user') == self.user_alias
+
+    def offer(self, message: dict) -> None:
+        """ Queue a message for sending, applying the slow consumer policy if the queue is full
+        """
+        if self.__closed is True:
+            return
+        if len(self.__queue) >= self.__max_queue:
+            if self.__policy == DISCONNECT:
+                self.close('slow consumer')
+                return
+            self.__queue.popleft()
+            self.dropped += 1
+        self.__queue.append(message)
+        self.__ready.set()
+
+    async def get(self, timeout: float = None) -> dict:
+        """ Next message. Returns None on timeout (so callers can send heartbeats), raises SubscriptionClosed when closed
+        """
+        while len(self.__queue) == 0:
+            if self.__closed is True:
+                raise SubscriptionClosed(self.close_reason)
+            self.__ready.clear()
+            try:
+                await asyncio.wait_for(self.__ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.delivered += 1
+        return self.__queue.popleft()
+
+    def close(self, reason: str = 'closed') -> None:
+        if self.__closed is False:
+            self.__closed = True
+            self.close_reason = reason
+            self.__queue.clear()
+            self.__ready.set()
+
+
+class RoomBroadcaster():
+    """ Fans out every message ChatRoom.send_message accepts to the push subscribers of that room in this process.
+        publish is called from whatever thread did the send (usually a storage executor thread), so it hands each message to the
+            subscriber's own event loop instead of touching the queue directly
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__subscriptions = collections.defaultdict(set)
+        self.__published = 0
+
+    def subscribe(self, room_name: str, user_alias: str = None, max_queue: int = PUSH_QUEUE_SIZE, policy: str = PUSH_SLOW_CONSUMER_POLICY) -> Subscription:
+        """ Must be called on the event loop that will read the subscription
+        """
+        subscription = Subscription(room_name, asyncio.get_running_loop(), max_queue, policy, user_alias)
+        with self.__lock:
+            self.__subscriptions[room_name].add(subscription)
+        logger.debug('New push subscriber for %s', room_name)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.close('unsubscribed')
+        with self.__lock:
+            room_subscriptions = self.__subscriptions.get(subscription.room_name)
+            if room_subscriptions is not None:
+                room_subscriptions.discard(subscription)
+                if len(room_subscriptions) == 0:
+                    del self.__subscriptions[subscription.room_name]
+
+    def publish(self, room_name: str, message: dict) -> int:
+        """ Hand the message to every subscriber of the room. Returns how many subscribers it went to
+        """
+        with self.__lock:
+            subscriptions = [subscription for subscription in self.__subscriptions.get(room_name, ()) if subscription.wants(message)]
+            self.__published += 1
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # the subscriber's loop is gone, nobody is going to read this subscription again
+                self.unsubscribe(subscription)
+        return len(subscriptions)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            subscriptions = [subscription for room in self.__subscriptions.values() for subscription in room]
+            return {'rooms': len(self.__subscriptions),
+                'subscribers': len(subscriptions),
+                'published': self.__published,
+                'delivered': sum(subscription.delivered for subscription in subscriptions),
+                'dropped': sum(subscription.dropped for subscription in subscriptions),
+            }
+
+
+# One per process, ChatRoom.send_message publishes to it through the listener room_chat_api registers
+broadcaster = RoomBroadcaster()
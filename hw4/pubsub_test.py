@@ -0,0 +1,76 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import asyncio
+import threading
+import unittest
+from unittest import IsolatedAsyncioTestCase
+import logging
+from constants import *
+from pubsub import RoomBroadcaster, SubscriptionClosed, DROP_OLDEST, DISCONNECT
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+def chat_message(sequence_num: int, to_user: str = 'reader') -> dict:
+    return {'message': f'message {sequence_num}', 'mess_props': {'room_name': 'push-room', 'to_user': to_user, 'sequence_num': sequence_num}}
+
+class PubSubTest(IsolatedAsyncioTestCase):
+    """ Testing the in-process fan out behind the push endpoints
+    """
+    async def test_fan_out_from_another_thread(self):
+        """ Sends happen on storage threads, every subscriber of the room still gets the message on its own loop
+        """
+        broadcaster = RoomBroadcaster()
+        first = broadcaster.subscribe('push-room')
+        second = broadcaster.subscribe('push-room')
+        elsewhere = broadcaster.subscribe('other-room')
+        sender = threading.Thread(target=broadcaster.publish, args=('push-room', chat_message(1)))
+        sender.start()
+        sender.join()
+        assert (await first.get(timeout=1))['mess_props']['sequence_num'] == 1
+        assert (await second.get(timeout=1))['mess_props']['sequence_num'] == 1
+        assert await elsewhere.get(timeout=0.05) is None
+
+    async def test_alias_filter(self):
+        """ A subscriber for one alias doesn't see messages to somebody else
+        """
+        broadcaster = RoomBroadcaster()
+        subscription = broadcaster.subscribe('push-room', user_alias='reader')
+        assert broadcaster.publish('push-room', chat_message(1, 'somebody-else')) == 0
+        assert broadcaster.publish('push-room', chat_message(2, 'reader')) == 1
+        await asyncio.sleep(0)
+        assert (await subscription.get(timeout=1))['mess_props']['sequence_num'] == 2
+
+    async def test_drop_oldest(self):
+        """ A slow reader keeps the newest max_queue messages and we count the ones it lost
+        """
+        broadcaster = RoomBroadcaster()
+        subscription = broadcaster.subscribe('push-room', max_queue=3, policy=DROP_OLDEST)
+        for sequence_num in range(10):
+            broadcaster.publish('push-room', chat_message(sequence_num))
+        await asyncio.sleep(0)
+        received = [(await subscription.get(timeout=1))['mess_props']['sequence_num'] for _ in range(3)]
+        assert received == [7, 8, 9]
+        assert subscription.dropped == 7
+
+    async def test_disconnect_slow_consumer(self):
+        """ With the disconnect policy an overflowing subscriber is closed and told why
+        """
+        broadcaster = RoomBroadcaster()
+        subscription = broadcaster.subscribe('push-room', max_queue=2, policy=DISCONNECT)
+        for sequence_num in range(3):
+            broadcaster.publish('push-room', chat_message(sequence_num))
+        await asyncio.sleep(0)
+        with self.assertRaises(SubscriptionClosed):
+            await subscription.get(timeout=1)
+        assert subscription.close_reason == 'slow consumer'
+
+    async def test_unsubscribe(self):
+        broadcaster = RoomBroadcaster()
+        subscription = broadcaster.subscribe('push-room')
+        broadcaster.unsubscribe(subscription)
+        assert broadcaster.publish('push-room', chat_message(1)) == 0
+        assert broadcaster.stats()['subscribers'] == 0
+
+if __name__ == "__main__":
+    unittest.main()
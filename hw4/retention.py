@@ -0,0 +1,235 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import urllib.parse
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure
+from constants import *
+from message_stream import dumps
+
+logger = logging.getLogger(__name__)
+
+TTL_INDEX_NAME = 'retention_ttl'
+SEGMENT_SUFFIX = '.ndjson.gz'
+
+
+class RetentionPolicy():
+    """ How much of a room stays in Mongo: messages younger than max_age_days, the newest max_messages, both (whichever keeps less),
+        or everything when neither is set. What falls out goes to the room's archive, not away
+    """
+    __slots__ = ('__max_age_days', '__max_messages')
+
+    def __init__(self, max_age_days: float = None, max_messages: int = None) -> None:
+        if max_age_days is not None and max_age_days <= 0:
+            raise ValueError('max_age_days has to be positive')
+        if max_messages is not None and max_messages < 0:
+            raise ValueError('max_messages can not be negative')
+        self.__max_age_days = max_age_days
+        self.__max_messages = max_messages
+
+    @property
+    def max_age_days(self) -> float:
+        return self.__max_age_days
+
+    @property
+    def max_messages(self) -> int:
+        return self.__max_messages
+
+    @property
+    def unlimited(self) -> bool:
+        return self.__max_age_days is None and self.__max_messages is None
+
+    def max_age(self) -> timedelta:
+        return timedelta(days=self.__max_age_days) if self.__max_age_days is not None else None
+
+    def to_dict(self) -> dict:
+        return {'max_age_days': self.__max_age_days, 'max_messages': self.__max_messages}
+
+    @classmethod
+    def from_dict(cls, policy_dict: dict):
+        """ None (rooms from before retention) is unlimited
+        """
+        return cls(**policy_dict) if policy_dict is not None else cls()
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RetentionPolicy) and self.to_dict() == other.to_dict()
+
+    def __str__(self):
+        return str(self.to_dict())
+
+
+def apply_ttl(collection, policy: RetentionPolicy, grace: int = RETENTION_TTL_GRACE) -> None:
+    """ A TTL index on sent_time, max age plus grace seconds, as a backstop: if the sweeper stops running Mongo still drops old messages
+            (without archiving them) before the room outgrows memory. The sweeper normally gets there first
+        No max age, no TTL index. A changed max age replaces the index
+    """
+    existing = collection.index_information().get(TTL_INDEX_NAME)
+    max_age = policy.max_age()
+    expire_after = int(max_age.total_seconds()) + grace if max_age is not None else None
+    if existing is not None and existing.get('expireAfterSeconds') == expire_after:
+        return
+    if existing is not None:
+        try:
+            collection.drop_index(TTL_INDEX_NAME)
+        except OperationFailure as error:
+            logger.warning('Could not drop %s on %s: %s', TTL_INDEX_NAME, collection.name, error)
+    if expire_after is not None:
+        collection.create_index([('mess_props.sent_time', 1)], name=TTL_INDEX_NAME, expireAfterSeconds=expire_after)
+        logger.info('TTL index on %s expires messages after %ds', collection.name, expire_after)
+
+
+def _restore_times(message: dict) -> dict:
+    mess_props = message['mess_props']
+    for field in ('sent_time', 'rec_time'):
+        if isinstance(mess_props.get(field), str):
+            mess_props[field] = datetime.fromisoformat(mess_props[field])
+    return message
+
+
+class MessageArchive():
+    """ The cold part of one room: gzip compressed NDJSON segment files in directory/<room>/, each holding a run of messages in sequence
+            number order and named after the first and last of them. Only the file names are kept in memory.
+        Everything up to ceiling (the last archived sequence number) lives here, Mongo has what comes after it. A segment is written to a
+            temporary file and renamed into place, so readers never see half of one
+    """
+    def __init__(self, room_name: str, directory: str = ARCHIVE_DIR) -> None:
+        self.__directory = os.path.join(directory, urllib.parse.quote(room_name, safe=''))
+        self.__lock = threading.Lock()
+        self.__segments = []
+        if os.path.isdir(self.__directory):
+            for file_name in os.listdir(self.__directory):
+                if file_name.endswith(SEGMENT_SUFFIX):
+                    first, last = file_name[:-len(SEGMENT_SUFFIX)].split('-')
+                    self.__segments.append((int(first), int(last), os.path.join(self.__directory, file_name)))
+            self.__segments.sort()
+
+    @property
+    def ceiling(self) -> int:
+        """ The last archived sequence number, None when nothing is archived
+        """
+        with self.__lock:
+            return self.__segments[-1][1] if len(self.__segments) > 0 else None
+
+    def stats(self) -> dict:
+        with self.__lock:
+            segments = list(self.__segments)
+        return {'segments': len(segments),
+            'ceiling': segments[-1][1] if len(segments) > 0 else None,
+            'bytes': sum(os.path.getsize(path) for _, _, path in segments),
+        }
+
+    def write(self, messages: list) -> None:
+        """ Add one segment. messages are listing dicts (message, mess_props) in sequence number order, all above the ceiling
+        """
+        if len(messages) == 0:
+            return
+        first = messages[0]['mess_props']['sequence_num']
+        last = messages[-1]['mess_props']['sequence_num']
+        ceiling = self.ceiling
+        if ceiling is not None and first <= ceiling:
+            raise ValueError(f'segment starting at {first} is not above the archive ceiling {ceiling}')
+        os.makedirs(self.__directory, exist_ok=True)
+        path = os.path.join(self.__directory, f'{first:012d}-{last:012d}{SEGMENT_SUFFIX}')
+        with gzip.open(path + '.tmp', 'wb') as segment:
+            segment.write(b''.join(dumps(message) + b'\n' for message in messages))
+        os.replace(path + '.tmp', path)
+        with self.__lock:
+            self.__segments.append((first, last, path))
+
+    @staticmethod
+    def __read_segment(path: str, user_alias: str, after_seq: int, before_seq: int):
+        with gzip.open(path, 'rb') as segment:
+            for line in segment:
+                message = json.loads(line)
+                sequence_num = message['mess_props']['sequence_num']
+                if after_seq is not None and sequence_num <= after_seq:
+                    continue
+                if before_seq is not None and sequence_num >= before_seq:
+                    break
+                if user_alias is not None and message['mess_props']['to_user'] != user_alias:
+                    continue
+                yield _restore_times(message)
+
+    def __overlapping(self, after_seq: int, before_seq: int) -> list:
+        with self.__lock:
+            return [path for first, last, path in self.__segments
+                    if (after_seq is None or last > after_seq) and (before_seq is None or first < before_seq)]
+
+    def read(self, user_alias: str = None, after_seq: int = None, before_seq: int = None):
+        """ Archived messages strictly between the cursors, oldest first, one segment open at a time
+        """
+        for path in self.__overlapping(after_seq, before_seq):
+            yield from self.__read_segment(path, user_alias, after_seq, before_seq)
+
+    def read_newest(self, num_messages: int, user_alias: str = None, after_seq: int = None, before_seq: int = None) -> list:
+        """ The newest num_messages archived messages strictly between the cursors, newest first
+        """
+        newest_first = []
+        for path in reversed(self.__overlapping(after_seq, before_seq)):
+            newest_first.extend(reversed(list(self.__read_segment(path, user_alias, after_seq, before_seq))))
+            if len(newest_first) >= num_messages:
+                break
+        return newest_first[:num_messages]
+
+
+def sweep(collection, archive: MessageArchive, room_name: str, policy: RetentionPolicy, batch_size: int = RETENTION_BATCH_SIZE, now: datetime = None) -> int:
+    """ Move what the policy no longer keeps from the room collection to the archive, returns how many messages moved.
+        The cut is a sequence number: everything at or below the newest message that is too old, or below the newest max_messages,
+            so Mongo always holds one unbroken run of the newest messages. Each batch is archived before it is deleted, if we die in
+            between the next sweep archives nothing twice because reads and sweeps only look above the ceiling
+    """
+    if policy.unlimited is True:
+        return 0
+    room_query = {'mess_props.room_name': room_name}
+    cut = None
+    if policy.max_age() is not None:
+        cutoff = (now if now is not None else datetime.now()) - policy.max_age()
+        too_old = collection.find_one({**room_query, 'mess_props.sent_time': {'$lt': cutoff}}, sort=[('mess_props.sequence_num', -1)])
+        if too_old is not None:
+            cut = too_old['mess_props']['sequence_num']
+    if policy.max_messages is not None:
+        newest = collection.find(room_query, {'mess_props.sequence_num': True}).sort('mess_props.sequence_num', -1).skip(policy.max_messages).limit(1)
+        for oldest_dropped in newest:
+            cut = max(cut, oldest_dropped['mess_props']['sequence_num']) if cut is not None else oldest_dropped['mess_props']['sequence_num']
+    if cut is None:
+        return 0
+    moved = 0
+    while True:
+        ceiling = archive.ceiling
+        batch_query = {**room_query, 'mess_props.sequence_num': {'$lte': cut} if ceiling is None else {'$gt': ceiling, '$lte': cut}}
+        batch = list(collection.find(batch_query, {'_id': False, 'message': True, 'mess_props': True})
+                     .sort('mess_props.sequence_num', 1).limit(batch_size))
+        if len(batch) == 0:
+            break
+        archive.write(batch)
+        collection.delete_many({**room_query, 'mess_props.sequence_num': {'$lte': batch[-1]['mess_props']['sequence_num']}})
+        moved += len(batch)
+    if moved > 0:
+        logger.info('Archived %d messages of %s up to sequence number %d', moved, room_name, cut)
+    return moved
+
+
+class RetentionSweeper():
+    """ Calls sweep_all every interval seconds on a daemon thread until stop
+    """
+    def __init__(self, sweep_all, interval: float = RETENTION_SWEEP_INTERVAL) -> None:
+        self.__sweep_all = sweep_all
+        self.__interval = interval
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='retention-sweeper', daemon=True)
+        self.__thread.start()
+
+    def __run(self) -> None:
+        while self.__stopped.wait(self.__interval) is False:
+            try:
+                self.__sweep_all()
+            except Exception:
+                logger.exception('Retention sweep failed')
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        self.__thread.join()
@@ -0,0 +1,149 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+import logging
+from datetime import datetime, timedelta
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from layout import room_collection
+from retention import RetentionPolicy, MessageArchive, TTL_INDEX_NAME, sweep
+from room import ChatRoom, MessageProperties, RoomList, forget_rooms
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class RetentionTest(TestCase):
+    """ Testing retention policies: sweeping old messages into the compressed archive and reading them back through the room,
+        against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        self.__archive_dir = tempfile.mkdtemp()
+        self.__now = datetime.now().replace(microsecond=0)
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+        forget_rooms()
+        shutil.rmtree(self.__archive_dir)
+
+    def __room(self, name: str, retention: RetentionPolicy, num_messages: int = 30, cache_size: int = 5, layout: str = MESSAGE_LAYOUT) -> ChatRoom:
+        """ A room with num_messages sent a day apart, the oldest num_messages days ago, every third one for somebody else
+        """
+        room = ChatRoom(name, create_new=True, cache_size=cache_size, retention=retention, archive_dir=self.__archive_dir, layout=layout)
+        for index in range(num_messages):
+            to_user = 'other-user' if index % 3 == 2 else 'keep-user'
+            sent_time = self.__now - timedelta(days=num_messages - index)
+            room.send_message(f'message {index}', SENDER_NAME, MessageProperties(name, to_user, SENDER_NAME, MESSAGE_TYPE_SENT, sent_time=sent_time, rec_time=sent_time))
+        return room
+
+    def __in_mongo(self, name: str, layout: str = MESSAGE_LAYOUT) -> int:
+        return room_collection(get_mongo_client().detest, name, layout).count_documents({'mess_props.room_name': name, 'message': {'$exists': True}})
+
+    def test_keep_last_messages(self):
+        room = self.__room('count-room', RetentionPolicy(max_messages=10))
+        assert room.enforce_retention() == 20
+        assert self.__in_mongo('count-room') == 10
+        assert room.archive_stats()['ceiling'] == 20
+        assert room.enforce_retention() == 0
+
+    def test_keep_days(self):
+        room = self.__room('age-room', RetentionPolicy(max_age_days=7.5))
+        assert room.enforce_retention() == 23
+        assert self.__in_mongo('age-room') == 7
+
+    def test_ttl_backstop(self):
+        """ Only a room with a collection of its own gets the TTL index, in the shared collection it would expire every room
+        """
+        room = self.__room('ttl-room', RetentionPolicy(max_age_days=7.5), layout=LAYOUT_PER_ROOM)
+        assert room.enforce_retention() == 23
+        assert self.__in_mongo('ttl-room', LAYOUT_PER_ROOM) == 7
+        assert TTL_INDEX_NAME in get_mongo_client().detest.get_collection('ttl-room').index_information()
+        self.__room('shared-room', RetentionPolicy(max_age_days=7.5), layout=LAYOUT_PARTITIONED)
+        assert TTL_INDEX_NAME not in get_mongo_client().detest.get_collection(MESSAGES_COLLECTION).index_information()
+
+    def test_sent_time_stamped_when_sent(self):
+        """ A message sent without a sent_time has the time it was sent, not the time room.py was imported. Otherwise a process
+            that has been up for two days sends messages the sweep already finds two days old
+        """
+        start = datetime.now()
+        room = ChatRoom('fresh-room', create_new=True, archive_dir=self.__archive_dir)
+        room.send_message('fresh', SENDER_NAME, MessageProperties('fresh-room', 'keep-user', SENDER_NAME, MESSAGE_TYPE_SENT))
+        collection = room_collection(get_mongo_client().detest, 'fresh-room')
+        stored = collection.find_one({'mess_props.room_name': 'fresh-room', 'message': 'fresh'})
+        assert start <= stored['mess_props']['sent_time'] <= datetime.now()
+        archive = MessageArchive('fresh-room', self.__archive_dir)
+        assert sweep(collection, archive, 'fresh-room', RetentionPolicy(max_age_days=2), now=start + timedelta(days=2)) == 0
+        assert self.__in_mongo('fresh-room') == 1
+
+    def test_unlimited(self):
+        room = self.__room('forever-room', RetentionPolicy())
+        assert room.enforce_retention() == 0
+        assert self.__in_mongo('forever-room') == 30
+        assert TTL_INDEX_NAME not in room_collection(get_mongo_client().detest, 'forever-room').index_information()
+
+    def test_reads_span_archive(self):
+        """ Every way of reading a room gives the same answer after the sweep as before it, cache or not
+        """
+        room = self.__room('read-room', RetentionPolicy(max_messages=8))
+        reads = [lambda: list(room.get_messages()),
+            lambda: list(room.get_messages('keep-user')),
+            lambda: list(room.get_messages('keep-user', 6)),
+            lambda: list(room.get_messages('keep-user', 6, latest=True)),
+            lambda: list(room.get_messages(after_seq=4, before_seq=26)),
+            lambda: list(room.get_messages('keep-user', 7, before_seq=25)),
+            lambda: json.loads(room.get_messages_json('keep-user', after_seq=10)),
+            lambda: json.loads(room.get_page_json('keep-user', before_seq=24, limit=5)),
+        ]
+        strip = lambda messages: [(message['message'], message['mess_props']['sequence_num']) for message in messages]
+        before = [read() for read in reads]
+        assert room.enforce_retention() > 0
+        after = [read() for read in reads]
+        for old, new in zip(before, after):
+            if isinstance(old, dict):
+                assert strip(old['messages']) == strip(new['messages']) and old['has_more'] == new['has_more']
+            else:
+                assert strip(old) == strip(new)
+        # A fresh instance has an empty cache, so it reads Mongo and the archive
+        fresh = ChatRoom('read-room', cache_size=5, archive_dir=self.__archive_dir)
+        assert strip(fresh.get_messages()) == strip(before[0])
+        assert list(fresh.get_messages('keep-user'))[0]['mess_props']['sent_time'] == self.__now - timedelta(days=30)
+
+    def test_archive_segments(self):
+        """ Segments are gzip files named by their sequence numbers, and a new MessageArchive finds them
+        """
+        room = self.__room('segment-room', RetentionPolicy(max_messages=25))
+        room.enforce_retention()
+        room.set_retention(RetentionPolicy(max_messages=15))
+        room.enforce_retention()
+        archive = MessageArchive('segment-room', self.__archive_dir)
+        assert archive.stats()['segments'] == 2 and archive.ceiling == 15
+        assert sorted(os.listdir(os.path.join(self.__archive_dir, 'segment-room'))) == ['000000000001-000000000005.ndjson.gz', '000000000006-000000000015.ndjson.gz']
+        assert [message['message'] for message in archive.read(after_seq=3, before_seq=8)] == ['message 3', 'message 4', 'message 5', 'message 6']
+        assert [message['message'] for message in archive.read_newest(2, 'keep-user')] == ['message 13', 'message 12']
+
+    def test_room_list_policy(self):
+        """ The policy is part of the room's metadata, survives a restore and reaches the shared ChatRoom
+        """
+        rooms = RoomList('retention-rooms')
+        room = rooms.create('listed-room', 'owner', retention=RetentionPolicy(max_age_days=30))
+        assert room.retention == RetentionPolicy(max_age_days=30)
+        assert rooms.set_retention('listed-room', RetentionPolicy(max_messages=100)) is True
+        assert room.retention == RetentionPolicy(max_messages=100)
+        assert rooms.set_retention('no-such-room', RetentionPolicy()) is False
+        assert RoomList('retention-rooms').find_room_in_metadata('listed-room')['retention'] == {'max_age_days': None, 'max_messages': 100}
+
+    def test_bad_policies(self):
+        for kwargs in ({'max_age_days': 0}, {'max_messages': -1}):
+            with self.assertRaises(ValueError):
+                RetentionPolicy(**kwargs)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,42 @@
 import pika
 import pika.exceptions
 import logging
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as ConfirmTimeout
 from constants import *
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
+from mongo_pool import get_mongo_client
+from indexes import ensure_indexes, ensure_unique_indexes
+from layout import queue_collection, QUEUE_INDEX_KINDS
 from collections import deque
+from rmq_publisher import get_publisher, PublishError, PublishReturned
+from rmq_consumer import get_consumer
+import envelope
+from search import SearchIndex
+from metrics import rmq_publishes, rmq_consumes
+
+logger = logging.getLogger(__name__)
 
 class MessProperties():
     """ Class for holding the properties of a message: type, sent_to, sent_from, rec_time, send_time
     """
-    def __init__(self, mess_type: int, to_user: str, from_user: str, sent_time: datetime = datetime.now(), rec_time: datetime = datetime.now()) -> None:
+    # Slots instead of a __dict__, queues cache a lot of these. to_headers keeps the header names the __dict__ used to give us,
+    #   for peers that still read the old header format. We send envelopes now
+    __slots__ = ('__mess_type', '__to_user', '__from_user', '__sent_time', '__rec_time')
+
+    def __init__(self, mess_type: int, to_user: str, from_user: str, sent_time: datetime = None, rec_time: datetime = None) -> None:
+        """ Without sent_time/rec_time the message is stamped now. Not as defaults, those would be the time rmq.py was imported
+        """
+        now = datetime.now() if sent_time is None or rec_time is None else None
         self.__mess_type = mess_type
         self.__to_user = to_user
         self.__from_user = from_user
-        self.__sent_time = sent_time
-        self.__rec_time = rec_time      
+        self.__sent_time = sent_time if sent_time is not None else now
+        self.__rec_time = rec_time if rec_time is not None else now
 
     def to_dict(self):
         return {'mess_type': self.__mess_type, 
@@ -24,6 +46,16 @@ class MessProperties():
             'rec_time': self.__rec_time
         } 
 
+    def to_headers(self) -> dict:
+        """ The rabbit headers for this message. Receivers look these up by the mangled attribute names, so they stay
+        """
+        return {'_MessProperties__mess_type': self.__mess_type,
+            '_MessProperties__to_user': self.__to_user,
+            '_MessProperties__from_user': self.__from_user,
+            '_MessProperties__sent_time': self.__sent_time,
+            '_MessProperties__rec_time': self.__rec_time
+        }
+
     def __str__(self):
         return str(self.to_dict())
 
@@ -31,6 +63,10 @@ class MessProperties():
 class RMQProperties():
     """ Class for holding details of rabbitMQ messages. Not using at the moment, perhaps in later versions some of this data will be useful
     """
+    __slots__ = ('index', 'consumer_tag', 'delivery_tag', 'exchange', 'redelivered', 'routing_key', 'synchronous', 'name', 'app_id',
+                'cluster_id', 'content_encoding', 'content_type', 'correlation_id', 'delivery_mode', 'expiration', 'headers', 'message_id',
+                'priority', 'reply_to', 'timestamp', 'type', 'user_id')
+
     def __init__(self, index: int, name: str, consumer_tag: str, delivery_tag: int, exchange: str, redelivered: bool, routing_key: str, \
                 synchronous: bool, app_id, cluster_id, content_encoding, content_type, correlation_id, delivery_mode, expiration, headers, \
                 message_id, priority, reply_to, timestamp, ptype, user_id) -> None:
@@ -62,6 +98,8 @@ class ChatMessage():
     """ Class for holding individual messages in a chat thread/queue. 
         Each message a message, Message properties, later a sequence number, timestamp
     """
+    __slots__ = ('__message', '__mess_props', '__rmq_props', '__dirty')
+
     def __init__(self, message: str = "", mess_props: MessProperties = None, rmq_props = None) -> None:
         self.__message = message
         self.__mess_props = mess_props
@@ -101,24 +139,56 @@ class ChatMessage():
 class ChatRoom(deque):
     """ This is main chat queue class. We're building on top of deque from the collections library.
         First, set up Mongo with the defaults, we have a collection per queue. In that collection is a metadata document
-            that describes the queue, and then a bunch of message documents.
+            that describes the queue, and then a bunch of message documents. In the partitioned layout (see layout.py) all queues
+            share one collection, the metadata document is found by name and each message document carries the queue_name
         Second, setup rabbitMQ wiht constants - NOTE: each fanout queue has multiple consumers, so need unique queue names
             We only set up the fanout group queue if the type of queue is public
+            Sends go through the process wide publisher (rmq_publisher), one connection and a few confirm mode channels shared
+                by every room instead of a connection per room. The exchange defaults to the room name
+            Receiving is a background consumer on the room queue (rmq_consumer), started by the first read. Messages land in the
+                deque as the broker pushes them, so reads only look at the deque
         Third, restore data from Mongo to get back all metadata and messages from the DB that we sent or received previously 
             If we can't restore (__restore returns False) then we're setting up a new queue
+        The deque only keeps the newest cache_size messages, older ones are still in Mongo
     """
-    def __init__(self, queue_name: str = DEFAULT_QUEUE_NAME, member_list: list = [], owner_alias: str = "", room_type: int = ROOM_TYPE_PRIVATE, create_new: bool = True) -> None:
-        super(ChatRoom, self).__init__()
-        self.__member_list = member_list
+    def __init__(self, queue_name: str = DEFAULT_QUEUE_NAME, member_list: list = [], owner_alias: str = "", room_type: int = ROOM_TYPE_PRIVATE, create_new: bool = True, cache_size: int = ROOM_CACHE_SIZE, exchange_name: str = None, layout: str = MESSAGE_LAYOUT) -> None:
+        super(ChatRoom, self).__init__(maxlen=cache_size)
+        self.__name = queue_name
+        self.__queue_type = room_type
+        self.__rmq_channel = None
+        self.__rmq_queue_name = queue_name
+        self.__rmq_exchange_name = exchange_name if exchange_name is not None else queue_name
+        self.__exchange_declared = False
+        # put runs on request threads and on the consumer's IO thread
+        self.__lock = threading.RLock()
+        self.__consuming = False
+        self.__member_list = list(member_list)
         self.__owner = owner_alias
+        self.__create_time = datetime.now()
+        self.__modify_time = self.__create_time
+        # Messages put since the last __persist, so persisting never has to walk the whole deque. Once we know the metadata
+        #   document is in Mongo we stop asking for it
+        self.__unsaved = deque()
+        self.__metadata_saved = False
+        # Inverted index over what's in the deque for search_messages. Every message gets the next key as it goes in, and the deque
+        #   only ever drops its oldest, so the keys in it are always oldest_key..newest_key
+        self.__search_index = SearchIndex()
+        self.__oldest_key = 0
+        self.__newest_key = -1
         self.add_room_member(self.__owner)
-        self.__mongo_client = MongoClient(MONGODB_URL)
+        self.__mongo_client = get_mongo_client(host=MONGODB_URL)
         self.__mongo_db = self.__mongo_client.gueshner
-        self.__mongo_collection = self.__mongo_db.get_collection(queue_name)
+        self.__mongo_collection = queue_collection(self.__mongo_db, queue_name, layout)
+        # What picks out this queue's documents: the whole collection when it's ours, our name when it's shared
+        self.__partition = {'queue_name': queue_name} if layout == LAYOUT_PARTITIONED else {}
+        self.__metadata_query = {'name': queue_name} if layout == LAYOUT_PARTITIONED else {'name': {'$exists': True}}
 
         if self.__mongo_collection is None:
             self.__mongo_collection = self.__mongo_db.create_collection(
                 queue_name)       
+        self.__index_kind = QUEUE_INDEX_KINDS[layout]
+        ensure_indexes(self.__mongo_collection, self.__index_kind, wait=False)
+        self.__restore()
 
     def __str__(self):
         return f'Chat Queue. Name: {self.name}'
@@ -147,15 +217,39 @@ class ChatRoom(deque):
     def total_messages(self):
         return self.length()
 
-    
+    def add_room_member(self, member_alias: str) -> None:
+        """ Add an alias to the member list, skipping empty aliases and ones that are already members
+        """
+        if member_alias and member_alias not in self.__member_list:
+            self.__member_list.append(member_alias)
+
     def put(self, message: ChatMessage = None) -> None:
         """ Overriding the queue type put and get operations to add type hints for the ChatMessage type
             Also, since we can insert messages at either end, we're choosing (arbitrarily) to put on left, read from right
+            Only dirty messages are queued for __persist, so a put costs the same no matter how long the deque is
+            Once the deque is full, putting on the left pushes the oldest message off the right
         """
-        logging.info(f'Calling Queue put method. message is {message}')
+        logger.debug('Calling Queue put method. message is %s', message)
         if message is not None:
-            super().appendleft(message)
-            self.__persist()
+            with self.__lock:
+                self.__append(message)
+                if message.dirty is True:
+                    self.__unsaved.append((message, uuid.uuid4().hex))
+                self.__persist()
+
+    def __append(self, message: ChatMessage) -> None:
+        """ appendleft, keeping the search index to what's in the deque. Called with the lock held, or before anybody else has us
+        """
+        if self.maxlen == 0:
+            return
+        if self.maxlen is not None and len(self) == self.maxlen:
+            self.__search_index.remove(self.__oldest_key)
+            self.__oldest_key += 1
+        super().appendleft(message)
+        self.__newest_key += 1
+        mess_props = message.mess_props.to_dict()
+        self.__search_index.add(self.__newest_key, message.message, message, from_user=mess_props['from_user'], to_user=mess_props['to_user'],
+                                sent_time=mess_props['sent_time'])
 
     def length(self) -> int:
         return len(self)
@@ -168,35 +262,50 @@ class ChatRoom(deque):
         try:
             new_message = super()[-1]
         except:
-            logging.debug("No message in chatqueue.get!!")
+            logger.debug("No message in chatqueue.get!!")
             return None
         else:
             return new_message
 
     def find_message(self, message_text: str) -> ChatMessage:
-        """ Go through the deque to find a message object that matches the text. Will return the first such message
+        """ Go through the deque to find a message object that matches the text. Will return the first (newest) such message
             TODO: this should ultimately be done by ID 
         """
-        for chat_message in deque:
-            if chat_message.message == message_text:
-                return chat_message
+        with self.__lock:
+            for chat_message in self:
+                if chat_message.message == message_text:
+                    return chat_message
+        return None
+
+    def search_messages(self, text: str, from_user: str = None, to_user: str = None, sent_after: datetime = None, sent_before: datetime = None,
+                        offset: int = 0, limit: int = SEARCH_PAGE_SIZE) -> dict:
+        """ Ranked full text search of the messages in the deque, the same syntax and page shape as room.ChatRoom.search_messages.
+            Results are message dicts with a score
+        """
+        page = self.__search_index.search(text, offset, limit, from_user=from_user, to_user=to_user, sent_after=sent_after, sent_before=sent_before)
+        page['results'] = [dict(message.to_dict(), score=score) for message, score in page['results']]
+        return page
 
     def __restore(self) -> bool:
         """ We're restoring data from Mongo. 
             First get the metadata record, but looking for a name key with find_one. If it exists, then we have the doc. If not, bail
                 Fill in the metadata (name, create, modify times - we'll do more later)
-            Second, we're getting the actual messages. Now we look for the key "message". Note that we're using find so we'll get all that 
-                match (every document with a key called 'message')
-                For each dictionary we get back (the documents), create a message properties instance and a message instance and
-                    put them in the deque by calling the put method
+            Second, we're getting the actual messages. Now we look for the key "message", newest _id first, and only as many as the
+                deque holds
+                For each dictionary we get back (the documents), oldest first, create a message properties instance and a message instance and
+                    put them straight in the deque. They came from Mongo, so unlike put we don't queue them to be written back
         """
-        queue_metadata = self.__mongo_collection.find_one( { 'name': { '$exists': 'true'}})
+        queue_metadata = self.__mongo_collection.find_one(self.__metadata_query)
         if queue_metadata is None:
             return False
         self.__name = queue_metadata["name"]
         self.__create_time = queue_metadata["create_time"]
         self.__modify_time = queue_metadata["modify_time"]
-        for mess_dict in self.__mongo_collection.find({ 'message': { '$exists': 'true'}}):
+        self.__metadata_saved = True
+        newest_first = self.__mongo_collection.find({**self.__partition, 'message': { '$exists': True}}).sort('_id', DESCENDING)
+        if self.maxlen is not None:
+            newest_first = newest_first.limit(self.maxlen)
+        for mess_dict in reversed(list(newest_first)):
             new_mess_props = MessProperties(
                 mess_dict['mess_props']['mess_type'],
                 mess_dict['mess_props']['to_user'],
@@ -206,25 +315,53 @@ class ChatRoom(deque):
             )
             new_message = ChatMessage(mess_dict['message'], new_mess_props, None)
             new_message.dirty = False
-            self.put(new_message)
+            self.__append(new_message)
         return True
 
     def __persist(self):
         """ First save a document that describes the user list (metadata: name of list, create and modify times) if it isn't already there
-            Second, for each message in the list create and save a document for that user
+                We only ask Mongo once, after that we remember the metadata is there
+            Second, for each message put since the last persist create and save a document for that message
                 NOTE: We're using our custom to_dict so we give Mongo what it wants
+            The messages only leave __unsaved, and stop being dirty, once Mongo took them. The insert is unordered, so when some are
+                refused the rest still go in and only the refused ones stay queued for the next persist, with the error going to the caller
+            Every message is saved with a message_key, unique in the collection: random for the ones put here, the queue and rabbit
+                message_id for received ones. If we insert one again (the insert failed after Mongo took it, or rabbit redelivered it)
+                Mongo refuses the duplicate key, which tells us it's already saved
         """
-        if self.__mongo_collection.find_one({ 'name': { '$exists': 'false'}}) is None:
-            self.__mongo_collection.insert_one({"name": self.name, "create_time": self.__create_time, "modify_time": self.__modify_time})
-        for message in list(self):
-            if message.dirty is True:
-                serialized = {'message': message.message,
-                            'mess_props': message.mess_props.to_dict(),
-                            'rmq_props': message.rmq_props.__dict__ if message.rmq_props is not None else dict(),
-                            }
-                serialized2 = message.to_dict()
-                self.__mongo_collection.insert_one(serialized2)
-                message.dirty = False
+        if self.__metadata_saved is False:
+            if self.__mongo_collection.find_one(self.__metadata_query) is None:
+                self.__mongo_collection.insert_one({"name": self.name, "create_time": self.__create_time, "modify_time": self.__modify_time})
+            self.__metadata_saved = True
+        unsaved = [(message, key) for message, key in self.__unsaved if message.dirty is True]
+        documents = [dict(message.to_dict(), message_key=key, **self.__partition) for message, key in unsaved]
+        refused = {}
+        if len(documents) > 0:
+            ensure_unique_indexes(self.__mongo_collection, self.__index_kind)
+            try:
+                self.__mongo_collection.insert_many(documents, ordered=False)
+            except BulkWriteError as error:
+                refused = {write_error['index']: write_error for write_error in error.details.get('writeErrors', [])
+                            if MESSAGE_KEY_INDEX not in write_error.get('errmsg', '')}
+                if len(refused) > 0:
+                    self.__saved([entry for index, entry in enumerate(unsaved) if index not in refused])
+                    raise
+        self.__saved(unsaved)
+
+    def __saved(self, saved: list) -> None:
+        """ Mongo has these (message, key) entries, they're not dirty anymore and leave __unsaved
+        """
+        for message, _ in saved:
+            message.dirty = False
+        saved_ids = {id(message) for message, _ in saved}
+        self.__unsaved = deque(entry for entry in self.__unsaved if id(entry[0]) not in saved_ids)
+
+    def __delivery_key(self, message: ChatMessage) -> str:
+        """ The same for every delivery of one published message, so a redelivery is saved once. Publishers that don't set a
+            message_id get a random key, like the messages we put
+        """
+        message_id = message.rmq_props.message_id if message.rmq_props is not None else None
+        return f'{self.__rmq_queue_name}:{message_id}' if message_id is not None else uuid.uuid4().hex
 
     def receive_messages(self, message_list):
         """ This is getting messages from Rabbit with a callback. Not use currently, but want it as we may use it later
@@ -234,108 +371,207 @@ class ChatRoom(deque):
         self.rmq_channel.queue_declare(queue='messages')
         def callback(ch, method, properties, body):
             message_list.append(body)
-            logging.info(" [x] Received %r" % body)
+            logger.info(" [x] Received %r", body)
         self.rmq_channel.basic_consume(queue='messages', on_message_callback=callback, auto_ack=True)
-        logging.info(' [*] Waiting for messages. To exit press CTRL+C')
+        logger.info(' [*] Waiting for messages. To exit press CTRL+C')
         self.rmq_channel.start_consuming()
 
-    def __retreive_messages(self, num_messages: int = GET_ALL_MESSAGES):
-        """ Basic retrieve message function from Rabbit.
-            If the channel is closed, we're in bad shape. Issue a warning in logs and bail
-            Use consume that will get all messages in the queue. The return is three things:
+    @staticmethod
+    def __to_message(m_f, props, body) -> ChatMessage:
+        """ Build a message instance from one rabbit delivery. The delivery has three things:
                 1) deliver metadata, what I'm calling m_f - short for message_facts. 
                     NOTE: rare use of short variable name 'm_f' Done because we use that prefix so many times in the constructor call
-                2) main message properties - mostly this is what we're using to pass our own properties to rabbit and get them back
-                3) the message text
+                2) main message properties - the content type tells us if the body is an envelope or the old format (our properties in headers)
+                3) the body, an envelope with the message text and our properties, or just the text
                 First, create the RMQ properties instance. Again, we're not using it right now but may come in handy later
                 Second, Create a message properties instance with data we absolutely want. For now, it's to_user, from_user, and times
-                Finally, create a new message instance with a message properties instance and add it to our queue with the put method
         """
-        logging.info("Starting retreive_messages")
-        if self.rmq_channel.is_closed:
-            logging.warning(f'Inside __retrieve messages, the channel is CLOSED!!')
-        logging.info(f'Inside retreive_messages, queue is {self.rmq_queue_name}, exchange: {self.rmq_exchange_name}, cache: {self}, channel: {self.rmq_channel}')
-        num_mess_received = 0
-        for m_f, props, body in self.rmq_channel.consume(self.rmq_queue_name, auto_ack=True, inactivity_timeout=2):
-            num_mess_received += 1
-            logging.info(f"inside retreive messages, processing a messsage. body = {body}")
-            if body != None:
-                new_rmq_props = RMQProperties(m_f.INDEX, m_f.NAME, m_f.consumer_tag, m_f.delivery_tag, m_f.exchange, m_f.redelivered, m_f.routing_key, \
-                                                m_f.synchronous, props.app_id, props.cluster_id, props.content_encoding, props.content_type, \
-                                                props.correlation_id, props.delivery_mode, props.expiration, props.headers, props.message_id, \
-                                                props.priority, props.reply_to, props.timestamp, props.type, props.user_id)
-                new_mess_props = MessProperties(
-                    MESSAGE_TYPE_RECEIVED, # this is now received, the original will be sent
-                    props.headers['_MessProperties__to_user'],
-                    props.headers['_MessProperties__from_user'],
-                    props.headers['_MessProperties__sent_time'],
-                    props.headers['_MessProperties__rec_time']
-                )
-                new_message = ChatMessage(body.decode('ascii'), new_mess_props, new_rmq_props)
-                logging.info(f'Inside retrieve, here is the new chatmessage: {new_message}')
-                logging.info(f'Inside retrieve, chatmessage body: {body}\n mess_props: {new_mess_props}\n rmq props: {new_rmq_props}')
-                self.put(new_message)
-                if num_mess_received >= num_messages:
-                    break
-            else:
-                break
-        requeued_messages = self.rmq_channel.cancel()
-        logging.info(f'Called cancel after retreive messages, result of that call is {requeued_messages}')
-        
+        message, mess_dict = envelope.decode_delivery(props, body)
+        new_rmq_props = RMQProperties(m_f.INDEX, m_f.NAME, m_f.consumer_tag, m_f.delivery_tag, m_f.exchange, m_f.redelivered, m_f.routing_key, \
+                                        m_f.synchronous, props.app_id, props.cluster_id, props.content_encoding, props.content_type, \
+                                        props.correlation_id, props.delivery_mode, props.expiration, props.headers, props.message_id, \
+                                        props.priority, props.reply_to, props.timestamp, props.type, props.user_id)
+        new_mess_props = MessProperties(
+            MESSAGE_TYPE_RECEIVED, # this is now received, the original will be sent
+            mess_dict['to_user'],
+            mess_dict['from_user'],
+            mess_dict['sent_time'],
+            mess_dict['rec_time']
+        )
+        return ChatMessage(message, new_mess_props, new_rmq_props)
+
+    def __receive(self, deliveries: list) -> None:
+        """ Called by the consumer with a batch of deliveries from our queue. They are persisted with one insert and only then go
+                in the deque, then the consumer acks the batch. If this raises the batch goes back on the queue and nothing of it is kept
+            A message we can't decode would fail the same way every time it came back, so it is logged and dropped instead
+        """
+        logger.debug('Received %d messages for %s', len(deliveries), self.rmq_queue_name)
+        start = time.perf_counter()
+        with self.__lock:
+            new_messages = []
+            for m_f, props, body in deliveries:
+                try:
+                    new_messages.append(self.__to_message(m_f, props, body))
+                except (envelope.EnvelopeError, UnicodeDecodeError) as error:
+                    logger.warning('Dropping undecodable message %d on %s: %s', m_f.delivery_tag, self.rmq_queue_name, error)
+            self.__unsaved.extend((new_message, self.__delivery_key(new_message)) for new_message in new_messages)
+            try:
+                self.__persist()
+            except Exception:
+                # The consumer requeues the batch and we get all of it again: the part Mongo refused can't stay in __unsaved (or it
+                #   would be saved twice), the part it took comes back as a duplicate key and goes in the deque then
+                batch_ids = {id(new_message) for new_message in new_messages}
+                self.__unsaved = deque(entry for entry in self.__unsaved if id(entry[0]) not in batch_ids)
+                raise
+            for new_message in new_messages:
+                self.__append(new_message)
+        rmq_consumes.observe(time.perf_counter() - start)
+
+    def start_consuming(self) -> None:
+        """ Subscribe our queue on the process wide consumer, bound to the room exchange. Only does anything the first time
+        """
+        if self.__consuming is False:
+            self.__consuming = True
+            get_consumer().subscribe(self.rmq_queue_name, self.__receive, exchange=self.rmq_exchange_name,
+                                    exchange_type='fanout' if self.queue_type == ROOM_TYPE_PUBLIC else 'direct')
+
+    def stop_consuming(self) -> None:
+        if self.__consuming is True:
+            self.__consuming = False
+            get_consumer().unsubscribe(self.rmq_queue_name)
+
     def get_message_objects(self, num_messages: int = GET_ALL_MESSAGES) -> list:
         """ We're returning message instances from our internal queue of messages
-            Call __retrieve messages to get any new messages from rabbit
-            we loop through the deque by converting the data to a list. Easy way to get an iterator for the internal list
+            The background consumer keeps the deque up to date, so we only make sure it's running and never wait on rabbit
+            we copy the deque to a list under the lock, the consumer may be adding to it
                 Stop if we reach the desired number of messages
         """
-        logging.info(f'Inside queue get messages. desired messages is (-1 == all): {num_messages}')
-        self.__retreive_messages()
-        logging.info(f'Inside get_messages, after retreiving messages. num messages: {self.length()} ')
-        if num_messages == GET_ALL_MESSAGES:
-            return list(self), self.length()
-        messages = list()
-        cur_num_messages = 0
-        for cur_message in list(self):
-            if cur_num_messages < num_messages:
-                messages.append(cur_message)
-                cur_num_messages += 1
-            else:
-                return messages, cur_num_messages
+        logger.debug('Inside queue get messages. desired messages is (-1 == all): %d', num_messages)
+        self.start_consuming()
+        with self.__lock:
+            messages = list(self)
+        if num_messages != GET_ALL_MESSAGES:
+            messages = messages[:num_messages]
+        return messages, len(messages)
 
     def get_message_bodies(self, num_messages:int=GET_ALL_MESSAGES, return_objects: bool = False):
         """ This method returns only the message strings, not the instances of the message class
             Call the method to get the instances, then just iterate through them getting the message text and putting in our list of messages
                 Return everything, the messages, the instances, and the number of messages
         """
-        logging.info('starting get_messages')
+        logger.debug('starting get_messages, target cache is %s', self.name)
         message_list = list()
-        logging.info(f'inside get_messages, target cache is {self.name}')
-        messages, total_messages = self.get_message_objects()
+        messages, total_messages = self.get_message_objects(num_messages)
         if self.total_messages > 0:
             for message in messages:
                 message_list.append(message.to_dict())
-                logging.info(f'inside get_messages, adding message to list. Message is {message.message} total messages: {self.total_messages}')
-        logging.info(f'Done with get_messages. Total messages: {self.total_messages} -- message list is {message_list}, first element in list: {message_list[0] if len(message_list) > 0 else "no messages"}')
+        # Just the count, formatting every message into the log line cost more than getting them
+        logger.debug('Done with get_messages. Total messages: %d, returning %d', self.total_messages, len(message_list))
         if return_objects is True:
             return message_list, messages, total_messages
         else:
             return message_list, total_messages
 
+    def __declare_exchange(self, publisher) -> None:
+        """ Public rooms fan out to every member's queue, private ones go by routing key. Only asked for once per room
+        """
+        if self.__exchange_declared is False:
+            exchange_type = 'fanout' if self.queue_type == ROOM_TYPE_PUBLIC else 'direct'
+            publisher.declare_exchange(self.rmq_exchange_name, exchange_type).result(RMQ_PUBLISH_TIMEOUT)
+            self.__exchange_declared = True
+
+    def __publish(self, publisher, message: str, mess_props: MessProperties):
+        return publisher.publish(self.rmq_exchange_name, self.rmq_queue_name, envelope.encode(message, mess_props.to_dict()),
+                                properties=envelope.properties(delivery_mode=2), mandatory=True)
+
+    def __confirmed(self, confirm, message: str) -> bool:
+        """ Wait for the broker to take the message. Returned, nacked or too slow is a failed send
+            Too slow cancels the publish, so a message still waiting for the connection isn't sent after we reported it failed
+        """
+        try:
+            confirm.result(RMQ_PUBLISH_TIMEOUT)
+            return True
+        except PublishReturned:
+            logger.debug('Message was returned undeliverable. Message: %s and target queue: %s', message, self.rmq_queue_name)
+        except ConfirmTimeout:
+            if confirm.cancel() is False and confirm.exception() is None:
+                # the confirm came in just as we gave up
+                return True
+            logger.warning('Publish to %s timed out, cancelled it (it can still arrive if it was already sent)', self.rmq_exchange_name)
+        except PublishError as error:
+            logger.warning('Publish to %s failed: %r', self.rmq_exchange_name, error)
+        return False
+
     def send_message(self, message: str, mess_props: MessProperties) -> bool:
         """ Send a message through rabbit, but also create the message instance and add it to our internal queue by calling the internal put method
+            We only put the message once the broker confirmed it
         """
+        publisher = get_publisher()
+        start = time.perf_counter()
         try:
+            self.__declare_exchange(publisher)
+            confirm = self.__publish(publisher, message, mess_props)
+        except (PublishError, ConfirmTimeout) as error:
+            logger.warning('Publish to %s failed: %r', self.rmq_exchange_name, error)
+            rmq_publishes.observe(time.perf_counter() - start, 'failed')
+            return False
+        confirmed = self.__confirmed(confirm, message)
+        rmq_publishes.observe(time.perf_counter() - start, 'confirmed' if confirmed is True else 'failed')
+        if confirmed is False:
+            return False
+        logger.debug('Publish to messaging server succeeded. Message: %s', message)
+        self.put(ChatMessage(message=message, mess_props=mess_props))
+        return True
+
+    def send_messages(self, messages: list) -> int:
+        """ Send a list of (message, mess_props) without waiting for each confirm before the next publish. The broker confirms
+                them in batches, so this costs about one round trip instead of one per message
+            Returns how many were confirmed, those are put in order
+        """
+        publisher = get_publisher()
+        start = time.perf_counter()
+        try:
+            self.__declare_exchange(publisher)
+        except (PublishError, ConfirmTimeout) as error:
+            logger.warning('Publish to %s failed: %r', self.rmq_exchange_name, error)
+            return 0
+        confirms = list()
+        for message, mess_props in messages:
+            try:
+                confirms.append((self.__publish(publisher, message, mess_props), message, mess_props))
+            except PublishError as error:
+                logger.warning('Publish to %s failed: %r', self.rmq_exchange_name, error)
+                break
+        num_sent = 0
+        for confirm, message, mess_props in confirms:
+            # each one timed from the start of the batch, that's how long its sender waited
+            confirmed = self.__confirmed(confirm, message)
+            rmq_publishes.observe(time.perf_counter() - start, 'confirmed' if confirmed is True else 'failed')
+            if confirmed is True:
+                self.put(ChatMessage(message=message, mess_props=mess_props))
+                num_sent += 1
+        return num_sent
+
+_chat_rooms = {}
+_chat_rooms_lock = threading.Lock()
+
+def get_chat_room(queue_name: str, **kwargs) -> ChatRoom:
+    """ The process wide ChatRoom for queue_name, built with kwargs the first time it's asked for. One room per queue means one
+        consumer per queue, however many requests read it
+    """
+    with _chat_rooms_lock:
+        if (room := _chat_rooms.get(queue_name)) is None:
+            room = _chat_rooms[queue_name] = ChatRoom(queue_name, **kwargs)
+        return room
 
-            self.rmq_channel.basic_publish(self.rmq_exchange_name, 
-                                        routing_key=self.rmq_queue_name, 
-                                        properties=pika.BasicProperties(headers=mess_props.__dict__),
-                                        body=message, mandatory=True)
-            logging.info(f'Publish to messaging server succeeded. Message: {message}')
-            self.put(ChatMessage(message=message, mess_props=mess_props))
-            return(True)
-        except pika.exceptions.UnroutableError:
-            logging.debug(f'Message was returned undeliverable. Message: {message} and target queue: {self.rmq_queue}')
-            return(False)        
+def forget_chat_rooms() -> None:
+    """ Stop consuming and drop the shared rooms
+    """
+    with _chat_rooms_lock:
+        rooms = list(_chat_rooms.values())
+        _chat_rooms.clear()
+    for room in rooms:
+        room.stop_consuming()
 
 class UserList(list):
 
@@ -0,0 +1,64 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import time
+from collections import deque
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+import rmq
+
+NUM_MESSAGES = 100000
+LEGACY_SIZES = [1000, 2000, 5000]
+
+
+def new_message(index: int) -> rmq.ChatMessage:
+    return rmq.ChatMessage(f'bench message {index}', rmq.MessProperties(MESSAGE_TYPE_SENT, 'bench-to', 'bench-from'))
+
+
+def bench_put(room: rmq.ChatRoom, num_messages: int) -> float:
+    """ put() with dirty tracking, persist only looks at the message we just added
+    """
+    start = time.perf_counter()
+    for index in range(num_messages):
+        room.put(new_message(index))
+    return time.perf_counter() - start
+
+
+def bench_legacy_scan(num_messages: int) -> float:
+    """ The part of the old __persist that made put O(n): after every append, copy the deque and check every message for dirty.
+        Mongo isn't involved, so this is a lower bound on what the old put path cost
+    """
+    messages = deque()
+    start = time.perf_counter()
+    for index in range(num_messages):
+        message = new_message(index)
+        messages.appendleft(message)
+        for cur_message in list(messages):
+            if cur_message.dirty is True:
+                cur_message.dirty = False
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rmq.ChatRoom put/persist/restore cost against an in-memory collection')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    args = parser.parse_args()
+    mongo_pool.client_factory = memory_client_factory()
+
+    room = rmq.ChatRoom('bench-queue', owner_alias='bench-from')
+    elapsed = bench_put(room, args.messages)
+    print(f'put + persist: {args.messages} messages in {elapsed:.3f}s ({elapsed / args.messages * 1e6:.1f} us/message)')
+
+    start = time.perf_counter()
+    restored = rmq.ChatRoom('bench-queue')
+    elapsed = time.perf_counter() - start
+    print(f'restore:       {len(restored)} messages in {elapsed:.3f}s ({elapsed / max(len(restored), 1) * 1e6:.1f} us/message)')
+
+    for num_messages in LEGACY_SIZES:
+        elapsed = bench_legacy_scan(num_messages)
+        print(f'old full-deque scan per put: {num_messages} messages in {elapsed:.3f}s ({elapsed / num_messages * 1e6:.1f} us/message)')
+
+
+if __name__ == "__main__":
+    main()
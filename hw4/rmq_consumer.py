@@ -0,0 +1,399 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import logging
+import queue
+import threading
+import pika
+from constants import *
+from rmq_publisher import default_parameters
+
+logger = logging.getLogger(__name__)
+
+
+class _Subscription():
+    """ One queue we consume and what we got from it that isn't acked yet. After subscribe only the IO thread touches these
+        in_flight is the batch a handler thread has, a queue only ever has one so its batches are handled in order
+    """
+    __slots__ = ('queue', 'handler', 'exchange', 'exchange_type', 'routing_key', 'channel', 'batch', 'flush_timer', 'consuming',
+                 'in_flight', 'failures', 'retry_timer', 'closing')
+
+    def __init__(self, queue: str, handler, exchange: str, exchange_type: str, routing_key: str) -> None:
+        self.queue = queue
+        self.handler = handler
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.routing_key = routing_key
+        self.channel = None
+        self.batch = []
+        self.flush_timer = None
+        self.consuming = threading.Event()
+        self.in_flight = None
+        self.failures = 0
+        self.retry_timer = None
+        self.closing = False
+
+
+class RMQConsumer():
+    """ Long running consumers for room queues, all on one connection run by a pika SelectConnection on its own IO thread.
+        Every subscribed queue gets its own channel with a prefetch limit (basic_qos), so the broker pushes up to prefetch
+            messages ahead and one busy room can't hold back the others.
+        Deliveries are handed to the queue's handler in batches, a batch goes when it has ack_batch messages or its oldest
+            message waited ack_interval. Once the handler returns the whole batch is acked with one ack (multiple). If the handler
+            raises, the batch is nacked back onto the queue. Anything not acked when a channel or the connection goes is
+            redelivered by the broker, so handlers can see a message twice but don't lose any.
+        Handlers run on handler_threads threads of their own, never on the IO thread, so a handler waiting on Mongo doesn't hold up
+            deliveries, acks and heartbeats for every other queue. A queue has one batch with a handler at a time.
+        A failed batch goes back after retry_delay, doubling with every failure in a row up to max_reconnect_delay, and the queue
+            gets nothing new meanwhile. That way a handler that keeps failing doesn't spin on redeliveries.
+        If the connection drops we reconnect with exponential backoff and consume every subscribed queue again.
+    """
+    def __init__(self, parameters = None, prefetch: int = RMQ_PREFETCH_COUNT, ack_batch: int = RMQ_ACK_BATCH, ack_interval: float = RMQ_ACK_INTERVAL,
+                reconnect_delay: float = RMQ_RECONNECT_DELAY, max_reconnect_delay: float = RMQ_MAX_RECONNECT_DELAY,
+                handler_threads: int = RMQ_HANDLER_THREADS, retry_delay: float = RMQ_HANDLER_RETRY_DELAY,
+                connection_factory = pika.SelectConnection) -> None:
+        self.__parameters = parameters if parameters is not None else default_parameters()
+        self.__prefetch = max(prefetch, 1)
+        # with a bigger batch than the prefetch the broker would stop sending before the batch filled up
+        self.__ack_batch = min(max(ack_batch, 1), self.__prefetch)
+        self.__ack_interval = ack_interval
+        self.__reconnect_delay = reconnect_delay
+        self.__max_reconnect_delay = max_reconnect_delay
+        self.__retry_delay = retry_delay
+        self.__connection_factory = connection_factory
+        self.__lock = threading.Lock()
+        self.__subscriptions = {}
+        self.__connection = None
+        self.__closing = False
+        self.__closed = threading.Event()
+        self.__connected = threading.Event()
+        self.__delivered = 0
+        self.__redelivered = 0
+        self.__handled = 0
+        self.__ack_frames = 0
+        self.__requeued = 0
+        self.__connections = 0
+        # (subscription, channel, batch) for the handler threads, None tells one of them to stop
+        self.__work = queue.Queue()
+        self.__handler_threads = [threading.Thread(target=self.__handle, name=f'rmq-handler-{index}', daemon=True) for index in range(max(handler_threads, 1))]
+        for thread in self.__handler_threads:
+            thread.start()
+        self.__thread = threading.Thread(target=self.__run, name='rmq-consumer', daemon=True)
+        self.__thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self.__connected.is_set()
+
+    def subscribe(self, queue: str, handler, exchange: str = None, exchange_type: str = 'direct', routing_key: str = None) -> None:
+        """ Start consuming queue (declared durable if it isn't there), handler gets lists of (method, properties, body).
+            With an exchange the queue is bound to it with routing_key (default the queue name). Subscribing again is a no-op
+        """
+        subscription = _Subscription(queue, handler, exchange, exchange_type, routing_key if routing_key is not None else queue)
+        with self.__lock:
+            if queue in self.__subscriptions:
+                return
+            self.__subscriptions[queue] = subscription
+        self.__call(lambda: self.__open_subscription(subscription))
+
+    def unsubscribe(self, queue: str) -> None:
+        """ Stop consuming queue. What was already received is handled and acked first
+        """
+        with self.__lock:
+            subscription = self.__subscriptions.pop(queue, None)
+        if subscription is not None:
+            self.__call(lambda: self.__close_subscription(subscription))
+
+    def wait_consuming(self, queue: str, timeout: float = None) -> bool:
+        """ True once the broker is delivering queue to us
+        """
+        with self.__lock:
+            subscription = self.__subscriptions.get(queue)
+        return subscription is not None and subscription.consuming.wait(timeout)
+
+    def close(self, timeout: float = RMQ_PUBLISH_TIMEOUT) -> None:
+        """ Handle and ack what we have, then close the connection and stop the IO and handler threads. The broker redelivers the rest
+        """
+        if self.__closing is True:
+            return
+        self.__closing = True
+        self.__closed.set()
+        connection = self.__connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self.__close_connection)
+            except Exception:
+                pass
+        self.__thread.join(timeout)
+        for _ in self.__handler_threads:
+            self.__work.put(None)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            subscriptions = len(self.__subscriptions)
+        return {'subscriptions': subscriptions,
+            'delivered': self.__delivered,
+            'redelivered': self.__redelivered,
+            'handled': self.__handled,
+            'requeued': self.__requeued,
+            'ack_frames': self.__ack_frames,
+            'messages_per_ack': self.__handled / self.__ack_frames if self.__ack_frames > 0 else 0.0,
+            'connections': self.__connections,
+        }
+
+    def __call(self, callback) -> None:
+        """ Run callback on the IO thread. Before the connection is up there's nothing to do, opening it picks everything up
+        """
+        connection = self.__connection
+        if connection is None or self.__connected.is_set() is False:
+            return
+        try:
+            connection.ioloop.add_callback_threadsafe(callback)
+        except Exception as error:
+            logger.debug('Could not wake the consumer IO loop: %s', error)
+
+    def __handle(self) -> None:
+        """ A handler thread: run handlers and pass the outcome back to the IO thread, which does the acking
+        """
+        while (work := self.__work.get()) is not None:
+            subscription, channel, batch = work
+            try:
+                subscription.handler(batch)
+                error = None
+            except Exception as failure:
+                error = failure
+            self.__call(lambda subscription=subscription, channel=channel, batch=batch, error=error: self.__on_handled(subscription, channel, batch, error))
+
+    # Everything below runs on the IO thread
+
+    def __run(self) -> None:
+        """ Connect, run the IO loop until the connection is gone, wait and connect again until close
+        """
+        delay = self.__reconnect_delay
+        while self.__closing is False:
+            opened_before = self.__connections
+            try:
+                self.__connection = self.__connection_factory(self.__parameters, on_open_callback=self.__on_connection_open,
+                                                              on_open_error_callback=self.__on_connection_open_error,
+                                                              on_close_callback=self.__on_connection_closed)
+                self.__connection.ioloop.start()
+            except Exception as error:
+                logger.warning('Consumer connection failed: %s', error)
+            self.__connected.clear()
+            if self.__closing is True:
+                break
+            delay = self.__reconnect_delay if self.__connections > opened_before else min(delay * 2, self.__max_reconnect_delay)
+            logger.info('Consumer reconnecting in %.2fs', delay)
+            self.__closed.wait(delay)
+
+    def __on_connection_open(self, connection) -> None:
+        logger.info('Consumer connected')
+        self.__connections += 1
+        if self.__closing is True:
+            connection.close()
+            return
+        self.__connected.set()
+        with self.__lock:
+            subscriptions = list(self.__subscriptions.values())
+        for subscription in subscriptions:
+            self.__open_subscription(subscription)
+
+    def __on_connection_open_error(self, connection, error) -> None:
+        logger.warning('Consumer could not connect: %s', error)
+        connection.ioloop.stop()
+
+    def __on_connection_closed(self, connection, reason) -> None:
+        if self.__closing is True:
+            logger.info('Consumer connection closed: %s', reason)
+        else:
+            logger.warning('Consumer connection closed: %s', reason)
+        self.__connected.clear()
+        with self.__lock:
+            subscriptions = list(self.__subscriptions.values())
+        for subscription in subscriptions:
+            self.__reset(subscription)
+        connection.ioloop.stop()
+
+    def __close_connection(self) -> None:
+        with self.__lock:
+            subscriptions = list(self.__subscriptions.values())
+        for subscription in subscriptions:
+            if subscription.retry_timer is not None:
+                # no more waiting, the failed batch goes back now
+                self.__connection.ioloop.remove_timeout(subscription.retry_timer)
+                self.__requeue(subscription, subscription.channel, subscription.in_flight)
+            self.__flush(subscription)
+        self.__close_when_idle()
+
+    def __close_when_idle(self) -> None:
+        """ Close the connection once no handler has a batch of ours, so what they're doing still gets acked
+        """
+        with self.__lock:
+            subscriptions = list(self.__subscriptions.values())
+        if any(subscription.in_flight is not None for subscription in subscriptions):
+            return
+        if self.__connection.is_closed:
+            self.__connection.ioloop.stop()
+        elif not self.__connection.is_closing:
+            self.__connection.close()
+
+    def __reset(self, subscription: _Subscription) -> None:
+        """ The channel is gone, so is the broker's record of what we hadn't acked. It redelivers those, drop our copies
+        """
+        if subscription.flush_timer is not None:
+            self.__connection.ioloop.remove_timeout(subscription.flush_timer)
+            subscription.flush_timer = None
+        if subscription.retry_timer is not None:
+            self.__connection.ioloop.remove_timeout(subscription.retry_timer)
+            subscription.retry_timer = None
+        subscription.channel = None
+        subscription.batch = []
+        # a handler may still be busy with it, what it reports back gets ignored
+        subscription.in_flight = None
+        subscription.consuming.clear()
+
+    def __open_subscription(self, subscription: _Subscription) -> None:
+        """ channel -> qos -> declare queue (and exchange and binding) -> consume, each step from the last one's callback
+        """
+        if subscription.channel is not None or self.__subscriptions.get(subscription.queue) is not subscription:
+            return
+        subscription.channel = self.__connection.channel(on_open_callback=lambda channel: self.__on_channel_open(subscription, channel))
+
+    def __on_channel_open(self, subscription: _Subscription, channel) -> None:
+        subscription.channel = channel
+        channel.add_on_close_callback(lambda channel, reason: self.__on_channel_closed(subscription, channel, reason))
+        channel.basic_qos(prefetch_count=self.__prefetch,
+                        callback=lambda frame: channel.queue_declare(subscription.queue, durable=True,
+                                                                     callback=lambda frame: self.__on_queue_declared(subscription, channel)))
+
+    def __on_queue_declared(self, subscription: _Subscription, channel) -> None:
+        if subscription.exchange is None:
+            self.__consume(subscription, channel)
+            return
+        channel.exchange_declare(exchange=subscription.exchange, exchange_type=subscription.exchange_type, durable=True,
+                                callback=lambda frame: channel.queue_bind(subscription.queue, subscription.exchange, routing_key=subscription.routing_key,
+                                                                          callback=lambda frame: self.__consume(subscription, channel)))
+
+    def __consume(self, subscription: _Subscription, channel) -> None:
+        channel.basic_consume(subscription.queue, on_message_callback=lambda channel, method, properties, body: self.__on_message(subscription, method, properties, body),
+                              auto_ack=False, callback=lambda frame: subscription.consuming.set())
+        logger.info('Consuming %s with prefetch %d', subscription.queue, self.__prefetch)
+
+    def __on_channel_closed(self, subscription: _Subscription, channel, reason) -> None:
+        """ Closed by us (unsubscribe) or along with the connection: nothing to do. Closed by the broker: open it again shortly
+        """
+        if subscription.channel is not channel:
+            return
+        self.__reset(subscription)
+        if self.__closing is True or self.__connection.is_closing or self.__connection.is_closed:
+            return
+        if self.__subscriptions.get(subscription.queue) is subscription:
+            logger.warning('Consumer channel for %s closed: %s', subscription.queue, reason)
+            self.__connection.ioloop.call_later(self.__reconnect_delay, lambda: self.__open_subscription(subscription))
+
+    def __close_subscription(self, subscription: _Subscription) -> None:
+        """ Close the channel once the batch a handler has and what came in behind it are handled
+        """
+        subscription.closing = True
+        if subscription.retry_timer is not None:
+            self.__connection.ioloop.remove_timeout(subscription.retry_timer)
+            self.__requeue(subscription, subscription.channel, subscription.in_flight)
+        self.__flush(subscription)
+        if subscription.in_flight is not None:
+            return
+        channel = subscription.channel
+        self.__reset(subscription)
+        if channel is not None and channel.is_open:
+            channel.close()
+
+    def __on_message(self, subscription: _Subscription, method, properties, body) -> None:
+        self.__delivered += 1
+        if method.redelivered is True:
+            self.__redelivered += 1
+        subscription.batch.append((method, properties, body))
+        if len(subscription.batch) >= self.__ack_batch:
+            self.__flush(subscription)
+        elif subscription.flush_timer is None:
+            subscription.flush_timer = self.__connection.ioloop.call_later(self.__ack_interval, lambda: self.__flush(subscription))
+
+    def __flush(self, subscription: _Subscription) -> None:
+        """ Hand the batch to a handler thread, unless the queue's last batch is still with one (it goes once that's done)
+        """
+        if subscription.flush_timer is not None:
+            self.__connection.ioloop.remove_timeout(subscription.flush_timer)
+            subscription.flush_timer = None
+        if subscription.in_flight is not None:
+            return
+        batch, subscription.batch = subscription.batch, []
+        channel = subscription.channel
+        if len(batch) == 0 or channel is None or not channel.is_open:
+            return
+        subscription.in_flight = batch
+        self.__work.put((subscription, channel, batch))
+
+    def __on_handled(self, subscription: _Subscription, channel, batch: list, error: Exception) -> None:
+        """ Ack the whole batch with one frame. If the handler failed, wait before putting it all back on the queue
+        """
+        if subscription.in_flight is not batch:
+            # the channel went away meanwhile, the broker redelivers the batch
+            return
+        if error is not None:
+            subscription.failures += 1
+            delay = 0.0 if self.__closing is True or subscription.closing is True else min(self.__retry_delay * 2 ** (subscription.failures - 1), self.__max_reconnect_delay)
+            if subscription.failures == 1:
+                logger.error('Handler for %s failed, requeueing %d messages in %.2fs', subscription.queue, len(batch), delay, exc_info=error)
+            else:
+                logger.warning('Handler for %s failed %d times in a row, requeueing %d messages in %.2fs: %r', subscription.queue, subscription.failures, len(batch), delay, error)
+            subscription.retry_timer = self.__connection.ioloop.call_later(delay, lambda: self.__requeue(subscription, channel, batch))
+            return
+        subscription.in_flight = None
+        subscription.failures = 0
+        if channel.is_open:
+            channel.basic_ack(delivery_tag=batch[-1][0].delivery_tag, multiple=True)
+            self.__handled += len(batch)
+            self.__ack_frames += 1
+        self.__next_batch(subscription)
+
+    def __requeue(self, subscription: _Subscription, channel, batch: list) -> None:
+        subscription.retry_timer = None
+        if subscription.in_flight is not batch:
+            return
+        subscription.in_flight = None
+        if channel.is_open:
+            self.__requeued += len(batch)
+            channel.basic_nack(delivery_tag=batch[-1][0].delivery_tag, multiple=True, requeue=True)
+        self.__next_batch(subscription)
+
+    def __next_batch(self, subscription: _Subscription) -> None:
+        """ The queue's batch is done with: send what came in meanwhile, and finish an unsubscribe or close that was waiting on it
+        """
+        self.__flush(subscription)
+        if subscription.closing is True and subscription.in_flight is None:
+            self.__close_subscription(subscription)
+        if self.__closing is True:
+            self.__close_when_idle()
+
+_consumer = None
+_consumer_lock = threading.Lock()
+
+def get_consumer() -> RMQConsumer:
+    """ The process wide consumer, connected to RMQ_HOST the first time anybody asks
+    """
+    global _consumer
+    with _consumer_lock:
+        if _consumer is None:
+            _consumer = RMQConsumer()
+        return _consumer
+
+def current_consumer() -> RMQConsumer:
+    """ The process wide consumer if anybody asked for one yet, else None. For stats, which shouldn't open a connection
+    """
+    with _consumer_lock:
+        return _consumer
+
+def set_consumer(consumer: RMQConsumer) -> RMQConsumer:
+    """ Swap in another consumer (say one on the in-process broker stand-in), returns the one it replaced
+    """
+    global _consumer
+    with _consumer_lock:
+        previous, _consumer = _consumer, consumer
+        return previous
@@ -0,0 +1,197 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import threading
+import time
+import unittest
+from unittest import TestCase
+import logging
+import pika
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from rmq_stub import StubBroker
+from rmq_consumer import RMQConsumer, set_consumer
+from rmq_publisher import RMQPublisher, set_publisher
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+def wait_for(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return condition()
+
+class RMQConsumerTest(TestCase):
+    """ Testing the background consumer against the in-process broker
+    """
+    def setUp(self) -> None:
+        self.broker = StubBroker()
+        self.received = []
+        self.batches = 0
+        self.most_unacked = 0
+        self.consumer = RMQConsumer(prefetch=20, ack_batch=10, ack_interval=0.01, reconnect_delay=0.01, connection_factory=self.broker.connect)
+
+    def tearDown(self) -> None:
+        self.consumer.close(timeout=1)
+
+    def handler(self, deliveries: list) -> None:
+        self.batches += 1
+        self.most_unacked = max(self.most_unacked, self.broker.unacked_count())
+        self.received.extend(body.decode() for _, _, body in deliveries)
+
+    def publish(self, count: int, start: int = 0) -> None:
+        for index in range(start, start + count):
+            self.broker.route('chat', 'chat-queue', pika.BasicProperties(), f'message {index}'.encode())
+
+    def test_prefetch_and_batch_acks(self):
+        """ Messages arrive in order, never more than prefetch unacked, and acked a batch at a time
+        """
+        self.consumer.subscribe('chat-queue', self.handler, exchange='chat')
+        assert self.consumer.wait_consuming('chat-queue', 2) is True
+        self.publish(500)
+        assert wait_for(lambda: len(self.received) == 500)
+        assert self.received == [f'message {index}' for index in range(500)]
+        assert self.most_unacked <= 20
+        stats = self.consumer.stats()
+        assert stats['messages_per_ack'] > 1
+        assert wait_for(lambda: self.broker.unacked_count() == 0)
+
+    def test_partial_batch_acked_after_interval(self):
+        self.consumer.subscribe('chat-queue', self.handler, exchange='chat')
+        assert self.consumer.wait_consuming('chat-queue', 2) is True
+        self.publish(3)
+        assert wait_for(lambda: len(self.received) == 3)
+        assert self.batches == 1
+
+    def test_failed_handler_requeues(self):
+        """ The handler blows up once, the batch comes back redelivered and nothing is lost
+        """
+        failures = [RuntimeError('mongo is down')]
+        def flaky(deliveries):
+            if len(failures) > 0:
+                raise failures.pop()
+            self.handler(deliveries)
+        self.consumer.subscribe('chat-queue', flaky, exchange='chat')
+        assert self.consumer.wait_consuming('chat-queue', 2) is True
+        self.publish(5)
+        assert wait_for(lambda: len(self.received) == 5)
+        assert sorted(self.received) == [f'message {index}' for index in range(5)]
+        assert self.consumer.stats()['requeued'] == 5
+        assert self.consumer.stats()['redelivered'] == 5
+
+    def test_slow_handler_holds_up_only_its_queue(self):
+        """ A handler stuck on Mongo for one queue: the other queue still gets its messages handled and acked
+        """
+        stuck = threading.Event()
+        release = threading.Event()
+        def slow(deliveries):
+            stuck.set()
+            release.wait(2)
+            self.handler(deliveries)
+        self.consumer.subscribe('slow-queue', slow, exchange='chat')
+        self.consumer.subscribe('chat-queue', self.handler, exchange='chat')
+        assert self.consumer.wait_consuming('slow-queue', 2) is True and self.consumer.wait_consuming('chat-queue', 2) is True
+        self.broker.route('chat', 'slow-queue', pika.BasicProperties(), b'slow')
+        assert stuck.wait(2) is True
+        self.publish(5)
+        try:
+            assert wait_for(lambda: len(self.received) == 5)
+            assert wait_for(lambda: self.broker.unacked_count() == 1)
+        finally:
+            release.set()
+        assert wait_for(lambda: len(self.received) == 6)
+        assert wait_for(lambda: self.broker.unacked_count() == 0)
+
+    def test_reconnect(self):
+        """ After a broker restart the queue is consumed again without anybody subscribing again
+        """
+        self.consumer.subscribe('chat-queue', self.handler, exchange='chat')
+        assert self.consumer.wait_consuming('chat-queue', 2) is True
+        self.publish(5)
+        assert wait_for(lambda: len(self.received) == 5)
+        self.broker.close_connections()
+        assert wait_for(lambda: self.consumer.stats()['connections'] == 2)
+        assert self.consumer.wait_consuming('chat-queue', 2) is True
+        self.publish(5, start=5)
+        assert wait_for(lambda: len(self.received) == 10)
+
+    def test_unsubscribe(self):
+        self.consumer.subscribe('chat-queue', self.handler, exchange='chat')
+        assert self.consumer.wait_consuming('chat-queue', 2) is True
+        self.consumer.unsubscribe('chat-queue')
+        assert wait_for(lambda: self.consumer.stats()['subscriptions'] == 0)
+        time.sleep(0.05)
+        self.publish(3)
+        time.sleep(0.05)
+        assert self.received == []
+        assert len(self.broker.queue_messages('chat-queue')) == 3
+
+
+class RMQChatRoomReceiveTest(TestCase):
+    """ Testing that rmq.ChatRoom reads come from the deque the consumer fills, without waiting on rabbit
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        self.broker = StubBroker()
+        self.publisher = RMQPublisher(channels=1, connection_factory=self.broker.connect)
+        self.consumer = RMQConsumer(ack_interval=0.01, retry_delay=0.05, connection_factory=self.broker.connect)
+        self.__previous_publisher = set_publisher(self.publisher)
+        self.__previous_consumer = set_consumer(self.consumer)
+
+    def tearDown(self) -> None:
+        rmq.forget_chat_rooms()
+        set_publisher(self.__previous_publisher)
+        set_consumer(self.__previous_consumer)
+        self.publisher.close(timeout=1)
+        self.consumer.close(timeout=1)
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def test_reads_return_right_away(self):
+        room = rmq.get_chat_room('rmq-room', owner_alias=SENDER_NAME)
+        assert rmq.get_chat_room('rmq-room') is room
+        start = time.perf_counter()
+        messages, total_messages = room.get_message_bodies()
+        assert time.perf_counter() - start < 0.5
+        assert total_messages == 0
+        assert self.consumer.wait_consuming('rmq-room', 2) is True
+        mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'rmq-user', SENDER_NAME)
+        assert room.send_messages([(f'message {index}', mess_props) for index in range(20)]) == 20
+        # every send is put once as sent, and comes back once from the queue as received
+        assert wait_for(lambda: room.length() == 40)
+        messages, total_messages = room.get_message_bodies(num_messages=5)
+        assert total_messages == 5
+        received = [message for message in room.get_message_bodies()[0] if message['mess_props']['mess_type'] == MESSAGE_TYPE_RECEIVED]
+        assert sorted(message['message'] for message in received) == sorted(f'message {index}' for index in range(20))
+        assert received[0]['mess_props']['to_user'] == 'rmq-user'
+        restored = rmq.ChatRoom('rmq-room')
+        assert restored.length() == 40
+
+    def test_failed_receive_is_redelivered_once(self):
+        """ Mongo refuses the received copy for a while: the batch keeps coming back, less and less often, and once it's saved the
+            deque has it once
+        """
+        room = rmq.get_chat_room('rmq-redeliver', owner_alias=SENDER_NAME, layout=LAYOUT_PER_ROOM)
+        collection = get_mongo_client().gueshner.get_collection('rmq-redeliver')
+        # One document per message type, and a received one is already there
+        collection.create_index('mess_props.mess_type', unique=True, sparse=True)
+        collection.insert_one({'message': 'in the way', 'mess_props': {'mess_type': MESSAGE_TYPE_RECEIVED}})
+        room.get_message_bodies()
+        assert self.consumer.wait_consuming('rmq-redeliver', 2) is True
+        assert room.send_message('hello', rmq.MessProperties(MESSAGE_TYPE_SENT, 'rmq-user', SENDER_NAME)) is True
+        assert wait_for(lambda: self.consumer.stats()['requeued'] >= 2)
+        # 0.05s then 0.1s then 0.2s between tries, not a redelivery loop
+        time.sleep(0.1)
+        assert self.consumer.stats()['requeued'] <= 3
+        collection.delete_one({'message': 'in the way'})
+        assert wait_for(lambda: collection.count_documents({'mess_props.mess_type': MESSAGE_TYPE_RECEIVED}) == 1)
+        assert wait_for(lambda: self.broker.unacked_count() == 0)
+        assert sorted(message['mess_props']['mess_type'] for message in room.get_message_bodies()[0]) == sorted([MESSAGE_TYPE_SENT, MESSAGE_TYPE_RECEIVED])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,442 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import collections
+import itertools
+import logging
+import threading
+import time
+import uuid
+import pika
+from concurrent.futures import Future, InvalidStateError
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+
+class PublishError(Exception):
+    """ Base for everything a publish Future can fail with
+    """
+
+class PublishNacked(PublishError):
+    """ The broker nacked the message, it did not take responsibility for it
+    """
+
+class PublishReturned(PublishError):
+    """ A mandatory message had nowhere to go, the broker returned it
+    """
+    def __init__(self, reply_code: int, reply_text: str) -> None:
+        super().__init__(f'{reply_code} {reply_text}')
+        self.reply_code = reply_code
+        self.reply_text = reply_text
+
+class PublishChannelClosed(PublishError):
+    """ The channel the message went out on was closed by the broker (not a lost connection, those messages get sent again)
+    """
+
+class PublisherClosed(PublishError):
+    """ publish after close
+    """
+
+class PublishTimeout(PublishError):
+    """ Too many messages waiting for confirms for too long, the broker isn't keeping up
+    """
+
+
+def default_parameters() -> pika.ConnectionParameters:
+    return pika.ConnectionParameters(host=RMQ_HOST, port=RMQ_PORT, virtual_host=RMQ_VHOST,
+                                     credentials=pika.PlainCredentials(RMQ_USER, RMQ_PASS))
+
+
+class _Outgoing():
+    """ One message from publish until its confirm
+    """
+    __slots__ = ('future', 'exchange', 'routing_key', 'body', 'properties', 'mandatory', 'published_at', 'returned', 'attempts')
+
+    def __init__(self, exchange: str, routing_key: str, body, properties, mandatory: bool) -> None:
+        self.future = Future()
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.mandatory = mandatory
+        self.published_at = None
+        self.returned = None
+        self.attempts = 0
+
+
+class _PooledChannel():
+    """ A confirm mode channel and the messages on it the broker hasn't confirmed yet, by delivery tag. Only the IO thread
+        touches these
+    """
+    def __init__(self, channel) -> None:
+        self.channel = channel
+        self.next_tag = 1
+        self.unconfirmed = collections.OrderedDict()
+        self.by_message_id = {}
+        self.declares = []
+
+
+class RMQPublisher():
+    """ One long lived connection to rabbit with a pool of confirm mode channels, run by a pika SelectConnection on its own IO thread.
+        publish can be called from any thread. It queues the message and returns a Future right away. The Future resolves to True
+            when the broker confirms the message. It fails with PublishReturned if a mandatory message couldn't be routed, PublishNacked
+            on a nack and PublishChannelClosed if the broker closed the channel. Confirms come back in batches (an ack with multiple
+            set covers every message up to its tag), so the cost of a round trip is shared by everything in flight.
+        If the connection drops we reconnect with exponential backoff. Messages that were not confirmed yet are sent again, so a
+            consumer can see a message twice but never lose one the publisher was told was sent.
+        Cancelling the Future takes back a message that hasn't gone out yet, so a caller that gave up waiting can report a failed
+            send without the message turning up later. One that is already on the wire can still arrive.
+        At most max_unconfirmed messages can be waiting for confirms. Past that publish blocks for up to its timeout.
+    """
+    def __init__(self, parameters = None, channels: int = RMQ_PUBLISHER_CHANNELS, max_unconfirmed: int = RMQ_MAX_UNCONFIRMED,
+                reconnect_delay: float = RMQ_RECONNECT_DELAY, max_reconnect_delay: float = RMQ_MAX_RECONNECT_DELAY,
+                connection_factory = pika.SelectConnection) -> None:
+        self.__parameters = parameters if parameters is not None else default_parameters()
+        self.__channel_count = max(channels, 1)
+        self.__reconnect_delay = reconnect_delay
+        self.__max_reconnect_delay = max_reconnect_delay
+        self.__connection_factory = connection_factory
+        self.__slots = threading.BoundedSemaphore(max_unconfirmed)
+        # Messages waiting for a channel. publish appends from any thread, the IO thread pops
+        self.__pending = collections.deque()
+        self.__pending_declares = collections.deque()
+        self.__connection = None
+        self.__channels = []
+        self.__round_robin = itertools.count()
+        self.__closing = False
+        self.__closed = threading.Event()
+        self.__connected = threading.Event()
+        self.__in_flight = 0
+        self.__idle = threading.Condition()
+        self.__metrics_lock = threading.Lock()
+        self.__started = time.monotonic()
+        self.__published = 0
+        self.__confirmed = 0
+        self.__nacked = 0
+        self.__returned = 0
+        self.__failed = 0
+        self.__republished = 0
+        self.__cancelled = 0
+        self.__connections = 0
+        self.__ack_frames = 0
+        self.__latencies = collections.deque(maxlen=RMQ_CONFIRM_SAMPLES)
+        self.__thread = threading.Thread(target=self.__run, name='rmq-publisher', daemon=True)
+        self.__thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self.__connected.is_set()
+
+    def wait_connected(self, timeout: float = None) -> bool:
+        return self.__connected.wait(timeout)
+
+    def publish(self, exchange: str, routing_key: str, body, properties: pika.BasicProperties = None, mandatory: bool = True,
+                timeout: float = RMQ_PUBLISH_TIMEOUT) -> Future:
+        """ Queue a message for the broker, returns the Future for its confirm
+        """
+        if self.__closing is True:
+            raise PublisherClosed('publisher is closed')
+        if self.__slots.acquire(timeout=timeout) is False:
+            raise PublishTimeout(f'no confirm slot within {timeout}s')
+        outgoing = _Outgoing(exchange, routing_key, body, properties if properties is not None else pika.BasicProperties(), mandatory)
+        if outgoing.properties.message_id is None:
+            # returns are matched to messages by message_id, and consumers save a message once per message_id, so it has to be
+            #   unique across processes and restarts
+            outgoing.properties.message_id = uuid.uuid4().hex
+        with self.__idle:
+            self.__in_flight += 1
+        # Confirmed, failed or cancelled by the caller, the slot goes back once
+        outgoing.future.add_done_callback(self.__release)
+        with self.__metrics_lock:
+            self.__published += 1
+        self.__pending.append(outgoing)
+        self.__wake()
+        return outgoing.future
+
+    def declare_exchange(self, exchange: str, exchange_type: str = 'direct', durable: bool = True) -> Future:
+        """ Make sure an exchange exists, resolves to True once the broker says so
+        """
+        future = Future()
+        self.__pending_declares.append((exchange, exchange_type, durable, future))
+        self.__wake()
+        return future
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Wait until every message published so far is confirmed or failed. False if we gave up waiting
+        """
+        with self.__idle:
+            return self.__idle.wait_for(lambda: self.__in_flight == 0, timeout)
+
+    def close(self, timeout: float = RMQ_PUBLISH_TIMEOUT) -> None:
+        """ Wait for outstanding confirms (up to timeout), then close the connection and stop the IO thread. Whatever is still
+            unconfirmed after that fails with PublisherClosed
+        """
+        if self.__closing is True:
+            return
+        self.flush(timeout)
+        self.__closing = True
+        self.__closed.set()
+        connection = self.__connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self.__close_connection)
+            except Exception:
+                pass
+        self.__thread.join(timeout)
+        for outgoing in list(self.__pending):
+            self.__fail(outgoing, PublisherClosed('publisher closed before the message was sent'))
+        self.__pending.clear()
+
+    def stats(self) -> dict:
+        """ Throughput and confirm latency (seconds, over the last RMQ_CONFIRM_SAMPLES confirms)
+        """
+        with self.__metrics_lock:
+            latencies = sorted(self.__latencies)
+            elapsed = time.monotonic() - self.__started
+            stats = {'published': self.__published,
+                'confirmed': self.__confirmed,
+                'nacked': self.__nacked,
+                'returned': self.__returned,
+                'failed': self.__failed,
+                'republished': self.__republished,
+                'cancelled': self.__cancelled,
+                'connections': self.__connections,
+                'ack_frames': self.__ack_frames,
+                'messages_per_ack': self.__confirmed / self.__ack_frames if self.__ack_frames > 0 else 0.0,
+                'confirmed_per_second': self.__confirmed / elapsed if elapsed > 0 else 0.0,
+            }
+        stats['in_flight'] = self.__in_flight
+        stats['channels'] = len(self.__channels)
+        for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            stats[f'confirm_latency_{name}'] = latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] if len(latencies) > 0 else None
+        stats['confirm_latency_mean'] = sum(latencies) / len(latencies) if len(latencies) > 0 else None
+        return stats
+
+    def __wake(self) -> None:
+        connection = self.__connection
+        if connection is None or self.__connected.is_set() is False:
+            # whatever is pending gets sent when the connection opens
+            return
+        try:
+            connection.ioloop.add_callback_threadsafe(self.__drain)
+        except Exception as error:
+            logger.debug('Could not wake the publisher IO loop: %s', error)
+
+    def __release(self, future: Future) -> None:
+        """ Done callback of every publish Future, on whichever thread settled or cancelled it
+        """
+        if future.cancelled():
+            with self.__metrics_lock:
+                self.__cancelled += 1
+        self.__slots.release()
+        with self.__idle:
+            self.__in_flight -= 1
+            if self.__in_flight == 0:
+                self.__idle.notify_all()
+
+    # Everything below runs on the IO thread
+
+    def __run(self) -> None:
+        """ Connect, run the IO loop until the connection is gone, wait and connect again until close
+        """
+        delay = self.__reconnect_delay
+        while self.__closing is False:
+            opened_before = self.__connections
+            try:
+                self.__connection = self.__connection_factory(self.__parameters, on_open_callback=self.__on_connection_open,
+                                                              on_open_error_callback=self.__on_connection_open_error,
+                                                              on_close_callback=self.__on_connection_closed)
+                self.__connection.ioloop.start()
+            except Exception as error:
+                logger.warning('Publisher connection failed: %s', error)
+            self.__connected.clear()
+            if self.__closing is True:
+                break
+            delay = self.__reconnect_delay if self.__connections > opened_before else min(delay * 2, self.__max_reconnect_delay)
+            logger.info('Publisher reconnecting in %.2fs', delay)
+            self.__closed.wait(delay)
+
+    def __on_connection_open(self, connection) -> None:
+        logger.info('Publisher connected')
+        with self.__metrics_lock:
+            self.__connections += 1
+        for _ in range(self.__channel_count):
+            connection.channel(on_open_callback=self.__on_channel_open)
+
+    def __on_connection_open_error(self, connection, error) -> None:
+        logger.warning('Publisher could not connect: %s', error)
+        connection.ioloop.stop()
+
+    def __on_connection_closed(self, connection, reason) -> None:
+        """ Everything that wasn't confirmed goes back to the front of the pending queue, in order, for the next connection
+        """
+        if self.__closing is True:
+            logger.info('Publisher connection closed: %s', reason)
+        else:
+            logger.warning('Publisher connection closed: %s', reason)
+        self.__connected.clear()
+        for pooled in reversed(self.__channels):
+            self.__requeue(pooled)
+        self.__channels = []
+        connection.ioloop.stop()
+
+    def __close_connection(self) -> None:
+        connection = self.__connection
+        if connection is None:
+            return
+        if not connection.is_closed:
+            connection.close()
+        else:
+            connection.ioloop.stop()
+
+    def __on_channel_open(self, channel) -> None:
+        pooled = _PooledChannel(channel)
+        channel.confirm_delivery(ack_nack_callback=lambda frame: self.__on_confirm(pooled, frame))
+        channel.add_on_return_callback(lambda channel, method, properties, body: self.__on_return(pooled, method, properties))
+        channel.add_on_close_callback(lambda channel, reason: self.__on_channel_closed(pooled, reason))
+        self.__channels.append(pooled)
+        if len(self.__channels) == self.__channel_count:
+            self.__connected.set()
+        self.__drain()
+
+    def __on_channel_closed(self, pooled: _PooledChannel, reason) -> None:
+        """ A channel the broker closed (publishing to a missing exchange does that) fails its messages and gets replaced.
+            When the whole connection is going, __on_connection_closed deals with the messages
+        """
+        if pooled not in self.__channels:
+            return
+        self.__channels.remove(pooled)
+        if self.__connection is None or self.__connection.is_closing or self.__connection.is_closed or self.__closing is True:
+            self.__requeue(pooled)
+            return
+        logger.warning('Publisher channel closed: %s', reason)
+        for outgoing in pooled.unconfirmed.values():
+            self.__fail(outgoing, PublishChannelClosed(str(reason)))
+        for future in pooled.declares:
+            if not future.done():
+                future.set_exception(PublishChannelClosed(str(reason)))
+        pooled.unconfirmed.clear()
+        self.__connection.channel(on_open_callback=self.__on_channel_open)
+
+    def __requeue(self, pooled: _PooledChannel) -> None:
+        unconfirmed = list(pooled.unconfirmed.values())
+        pooled.unconfirmed.clear()
+        with self.__metrics_lock:
+            self.__republished += len(unconfirmed)
+        self.__pending.extendleft(reversed(unconfirmed))
+        for future in pooled.declares:
+            if not future.done():
+                future.set_exception(PublishChannelClosed('connection closed'))
+
+    def __drain(self) -> None:
+        """ Send everything pending, spreading the messages over the channels
+        """
+        if len(self.__channels) == 0:
+            return
+        while len(self.__pending_declares) > 0:
+            exchange, exchange_type, durable, future = self.__pending_declares.popleft()
+            pooled = self.__channels[0]
+            pooled.declares.append(future)
+            pooled.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type, durable=durable,
+                                            callback=lambda frame, future=future: future.done() or future.set_result(True))
+        while len(self.__pending) > 0 and len(self.__channels) > 0:
+            outgoing = self.__pending.popleft()
+            if outgoing.future.cancelled():
+                # the caller gave up on it and reported a failed send, it mustn't go out behind their back
+                continue
+            pooled = self.__channels[next(self.__round_robin) % len(self.__channels)]
+            tag = pooled.next_tag
+            pooled.next_tag += 1
+            outgoing.published_at = time.monotonic()
+            outgoing.attempts += 1
+            outgoing.returned = None
+            pooled.unconfirmed[tag] = outgoing
+            pooled.by_message_id[outgoing.properties.message_id] = tag
+            try:
+                pooled.channel.basic_publish(outgoing.exchange, outgoing.routing_key, outgoing.body, outgoing.properties, outgoing.mandatory)
+            except Exception as error:
+                # the channel or connection is going away, its close callback puts the message back
+                logger.warning('Publish failed on the wire: %s', error)
+                return
+
+    def __on_return(self, pooled: _PooledChannel, method, properties) -> None:
+        """ A return always comes before the confirm for the same message, remember it for the confirm
+        """
+        tag = pooled.by_message_id.get(properties.message_id)
+        if tag is not None and tag in pooled.unconfirmed:
+            pooled.unconfirmed[tag].returned = (method.reply_code, method.reply_text)
+
+    def __on_confirm(self, pooled: _PooledChannel, frame) -> None:
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple is True:
+            tags = list(itertools.takewhile(lambda tag: tag <= method.delivery_tag, pooled.unconfirmed))
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in pooled.unconfirmed else []
+        now = time.monotonic()
+        with self.__metrics_lock:
+            self.__ack_frames += 1
+        for tag in tags:
+            outgoing = pooled.unconfirmed.pop(tag)
+            pooled.by_message_id.pop(outgoing.properties.message_id, None)
+            with self.__metrics_lock:
+                self.__latencies.append(now - outgoing.published_at)
+            if acked is False:
+                self.__fail(outgoing, PublishNacked(f'broker nacked delivery tag {tag}'))
+            elif outgoing.returned is not None:
+                self.__fail(outgoing, PublishReturned(*outgoing.returned))
+            else:
+                with self.__metrics_lock:
+                    self.__confirmed += 1
+                self.__finish(outgoing, True)
+
+    def __fail(self, outgoing: _Outgoing, error: PublishError) -> None:
+        if outgoing.future.done():
+            return
+        with self.__metrics_lock:
+            if isinstance(error, PublishNacked):
+                self.__nacked += 1
+            elif isinstance(error, PublishReturned):
+                self.__returned += 1
+            else:
+                self.__failed += 1
+        self.__finish(outgoing, error)
+
+    def __finish(self, outgoing: _Outgoing, result) -> None:
+        if outgoing.future.done():
+            return
+        try:
+            if isinstance(result, Exception):
+                outgoing.future.set_exception(result)
+            else:
+                outgoing.future.set_result(result)
+        except InvalidStateError:
+            # cancelled from the caller's thread in the meantime
+            pass
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+def get_publisher() -> RMQPublisher:
+    """ The process wide publisher, connected to RMQ_HOST the first time anybody asks
+    """
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = RMQPublisher()
+        return _publisher
+
+def current_publisher() -> RMQPublisher:
+    """ The process wide publisher if anybody asked for one yet, else None. For stats, which shouldn't open a connection
+    """
+    with _publisher_lock:
+        return _publisher
+
+def set_publisher(publisher: RMQPublisher) -> RMQPublisher:
+    """ Swap in another publisher (say one on the in-process broker stand-in), returns the one it replaced
+    """
+    global _publisher
+    with _publisher_lock:
+        previous, _publisher = _publisher, publisher
+        return previous
@@ -0,0 +1,191 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import time
+import unittest
+from unittest import TestCase
+import logging
+import pika
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from rmq_stub import StubBroker
+from rmq_publisher import RMQPublisher, PublishNacked, PublishReturned, PublishChannelClosed, PublishTimeout, PublisherClosed, set_publisher
+import envelope
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+def wait_for(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return condition()
+
+class RMQPublisherTest(TestCase):
+    """ Testing the pooled confirm mode publisher against the in-process broker
+    """
+    def setUp(self) -> None:
+        self.broker = StubBroker()
+        self.broker.declare_exchange('chat', 'direct')
+        self.broker.bind_queue('chat-queue', 'chat', 'chat-queue')
+        self.publisher = RMQPublisher(channels=2, reconnect_delay=0.01, connection_factory=self.broker.connect)
+        assert self.publisher.wait_connected(2) is True
+
+    def tearDown(self) -> None:
+        self.publisher.close(timeout=1)
+
+    def test_confirms_are_batched(self):
+        """ Everything in flight gets confirmed, with far fewer ack frames than messages
+        """
+        confirms = [self.publisher.publish('chat', 'chat-queue', f'message {index}') for index in range(1000)]
+        assert all(confirm.result(2) is True for confirm in confirms)
+        assert len(self.broker.queue_messages('chat-queue')) == 1000
+        stats = self.publisher.stats()
+        assert stats['confirmed'] == 1000 and stats['in_flight'] == 0
+        assert stats['messages_per_ack'] > 1
+        assert stats['confirm_latency_p99'] is not None
+
+    def test_unroutable_is_returned(self):
+        confirm = self.publisher.publish('chat', 'nobody-home', 'lost')
+        with self.assertRaises(PublishReturned) as raised:
+            confirm.result(2)
+        assert raised.exception.reply_code == 312
+        assert self.publisher.publish('chat', 'chat-queue', 'found').result(2) is True
+
+    def test_nack(self):
+        self.broker.nack_next()
+        first = self.publisher.publish('chat', 'chat-queue', 'nacked')
+        second = self.publisher.publish('chat', 'chat-queue', 'acked')
+        with self.assertRaises(PublishNacked):
+            first.result(2)
+        assert second.result(2) is True
+        assert self.publisher.stats()['nacked'] == 1
+
+    def test_missing_exchange_closes_only_that_channel(self):
+        """ The broker closes the channel, the publisher opens a new one and carries on
+        """
+        with self.assertRaises(PublishChannelClosed):
+            self.publisher.publish('no-such-exchange', 'chat-queue', 'lost').result(2)
+        assert self.publisher.flush(2) is True
+        confirms = [self.publisher.publish('chat', 'chat-queue', 'after') for _ in range(10)]
+        assert all(confirm.result(2) is True for confirm in confirms)
+        assert self.publisher.stats()['connections'] == 1
+
+    def test_reconnect_republishes_unconfirmed(self):
+        """ A broker restart while confirms are outstanding: those messages go out again on the new connection
+        """
+        self.broker.confirm_delay = 0.2
+        confirms = [self.publisher.publish('chat', 'chat-queue', f'message {index}') for index in range(50)]
+        self.broker.refuse_connections(2)
+        self.broker.close_connections()
+        self.broker.confirm_delay = 0.0
+        assert all(confirm.result(5) is True for confirm in confirms)
+        stats = self.publisher.stats()
+        assert stats['connections'] == 2
+        assert stats['republished'] > 0
+        # at least once, so the queue can hold some messages twice
+        assert len(self.broker.queue_messages('chat-queue')) >= 50
+
+    def test_backpressure(self):
+        """ With max_unconfirmed messages waiting, the next publish times out instead of growing the backlog
+        """
+        self.publisher.close(timeout=1)
+        self.broker.confirm_delay = 0.5
+        self.publisher = RMQPublisher(channels=1, max_unconfirmed=3, connection_factory=self.broker.connect)
+        assert self.publisher.wait_connected(2) is True
+        confirms = [self.publisher.publish('chat', 'chat-queue', 'waiting') for _ in range(3)]
+        with self.assertRaises(PublishTimeout):
+            self.publisher.publish('chat', 'chat-queue', 'one too many', timeout=0.05)
+        assert all(confirm.result(2) is True for confirm in confirms)
+
+    def test_cancelled_is_not_sent(self):
+        """ A publish cancelled while it waits for the connection is dropped, and its slot goes back straight away
+        """
+        self.publisher.close(timeout=1)
+        self.publisher = RMQPublisher(channels=1, reconnect_delay=0.5, connection_factory=self.broker.connect)
+        assert self.publisher.wait_connected(2) is True
+        self.broker.close_connections()
+        assert wait_for(lambda: self.publisher.connected is False)
+        cancelled = self.publisher.publish('chat', 'chat-queue', 'given up on')
+        kept = self.publisher.publish('chat', 'chat-queue', 'still wanted')
+        assert cancelled.cancel() is True
+        assert self.publisher.stats()['in_flight'] == 1
+        assert kept.result(2) is True
+        assert self.publisher.flush(2) is True
+        assert [body for _, _, body in self.broker.queue_messages('chat-queue')] == [b'still wanted']
+        assert self.publisher.stats()['cancelled'] == 1
+
+    def test_closed(self):
+        self.publisher.close(timeout=1)
+        with self.assertRaises(PublisherClosed):
+            self.publisher.publish('chat', 'chat-queue', 'too late')
+
+
+class RMQChatRoomSendTest(TestCase):
+    """ Testing rmq.ChatRoom sends through the shared publisher
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        self.broker = StubBroker()
+        self.publisher = RMQPublisher(channels=2, connection_factory=self.broker.connect)
+        self.__previous_publisher = set_publisher(self.publisher)
+
+    def tearDown(self) -> None:
+        set_publisher(self.__previous_publisher)
+        self.publisher.close(timeout=1)
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def test_send_message(self):
+        """ Nothing bound to the room yet so the send is returned, once a member queue is bound it goes through
+        """
+        room = rmq.ChatRoom('rmq-room', owner_alias=SENDER_NAME)
+        mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'rmq-user', SENDER_NAME)
+        assert room.send_message('nobody listening', mess_props) is False
+        assert room.length() == 0
+        self.broker.bind_queue('rmq-room', 'rmq-room')
+        assert room.send_message('hello', mess_props) is True
+        assert room.length() == 1
+        routing_key, properties, body = self.broker.queue_messages('rmq-room')[0]
+        message, mess_dict = envelope.decode_delivery(properties, body)
+        assert message == 'hello'
+        assert mess_dict['to_user'] == 'rmq-user'
+
+    def test_timed_out_send_is_not_sent_later(self):
+        """ The broker is away for longer than a send waits: the send fails, and the message doesn't go out once it's back
+        """
+        self.broker.bind_queue('rmq-room', 'rmq-room')
+        self.publisher.close(timeout=1)
+        self.publisher = RMQPublisher(channels=1, reconnect_delay=0.5, connection_factory=self.broker.connect)
+        set_publisher(self.publisher)
+        room = rmq.ChatRoom('rmq-room', owner_alias=SENDER_NAME)
+        mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'rmq-user', SENDER_NAME)
+        assert room.send_message('before', mess_props) is True
+        self.broker.close_connections()
+        assert wait_for(lambda: self.publisher.connected is False)
+        previous_timeout = rmq.RMQ_PUBLISH_TIMEOUT
+        rmq.RMQ_PUBLISH_TIMEOUT = 0.1
+        try:
+            assert room.send_message('timed out', mess_props) is False
+        finally:
+            rmq.RMQ_PUBLISH_TIMEOUT = previous_timeout
+        assert self.publisher.wait_connected(2) is True
+        assert room.send_message('after', mess_props) is True
+        messages = [envelope.decode_delivery(properties, body)[0] for _, properties, body in self.broker.queue_messages('rmq-room')]
+        assert messages == ['before', 'after']
+        assert [message.message for message in room] == ['after', 'before']
+
+    def test_send_messages_pipelined(self):
+        self.broker.bind_queue('rmq-room', 'rmq-room')
+        room = rmq.ChatRoom('rmq-room', owner_alias=SENDER_NAME, room_type=ROOM_TYPE_PUBLIC)
+        mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'rmq-user', SENDER_NAME)
+        assert room.send_messages([(f'message {index}', mess_props) for index in range(100)]) == 100
+        assert room.length() == 100
+        assert room[-1].message == 'message 0'
+
+if __name__ == "__main__":
+    unittest.main()
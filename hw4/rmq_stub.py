@@ -0,0 +1,525 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+import pika
+import pika.exceptions
+from pika.frame import Method
+from pika.spec import Basic
+
+logger = logging.getLogger(__name__)
+
+
+class StubIOLoop():
+    """ Just enough of pika's IOLoop for a SelectConnection on the stub broker: callbacks from any thread, timers, start and stop
+    """
+    def __init__(self) -> None:
+        self.__callbacks = collections.deque()
+        self.__timers = []
+        self.__order = itertools.count()
+        self.__wakeup = threading.Condition()
+        self.__stopping = False
+
+    def add_callback_threadsafe(self, callback) -> None:
+        with self.__wakeup:
+            self.__callbacks.append(callback)
+            self.__wakeup.notify()
+
+    add_callback = add_callback_threadsafe
+
+    def call_later(self, delay: float, callback):
+        with self.__wakeup:
+            timer = [time.monotonic() + delay, next(self.__order), callback]
+            heapq.heappush(self.__timers, timer)
+            self.__wakeup.notify()
+            return timer
+
+    def remove_timeout(self, timer) -> None:
+        with self.__wakeup:
+            timer[2] = None
+
+    def stop(self) -> None:
+        with self.__wakeup:
+            self.__stopping = True
+            self.__wakeup.notify()
+
+    def start(self) -> None:
+        """ Run callbacks and due timers until stop. Every round runs what was queued when it started, so anything a callback
+            schedules with add_callback runs after the rest of that round, the same as pika's loop
+        """
+        with self.__wakeup:
+            self.__stopping = False
+        while True:
+            with self.__wakeup:
+                while self.__stopping is False and len(self.__callbacks) == 0 and not self.__timer_due():
+                    self.__wakeup.wait(self.__timer_wait())
+                if self.__stopping is True:
+                    self.__stopping = False
+                    return
+                ready = list(self.__callbacks)
+                self.__callbacks.clear()
+                now = time.monotonic()
+                while len(self.__timers) > 0 and self.__timers[0][0] <= now:
+                    ready.append(heapq.heappop(self.__timers)[2])
+            for callback in ready:
+                if callback is not None:
+                    callback()
+
+    def __timer_due(self) -> bool:
+        return len(self.__timers) > 0 and self.__timers[0][0] <= time.monotonic()
+
+    def __timer_wait(self):
+        if len(self.__timers) == 0:
+            return None
+        return max(self.__timers[0][0] - time.monotonic(), 0)
+
+
+class StubChannel():
+    """ A channel on the stub broker. Publishes are routed right away, confirms go out once per loop round as one ack with
+        multiple set, like a real broker under load.
+        Consumers get at most prefetch_count unacked deliveries at a time (basic_qos, 0 is no limit). Whatever is unacked when the
+            channel closes goes back on its queue marked redelivered
+    """
+    def __init__(self, connection, channel_number: int) -> None:
+        self.connection = connection
+        self.channel_number = channel_number
+        self.is_open = True
+        self.is_closed = False
+        self.__broker = connection.broker
+        self.__confirming = False
+        self.__ack_nack_callback = None
+        self.__return_callbacks = []
+        self.__close_callbacks = []
+        self.__next_tag = 1
+        self.__outcomes = []
+        self.__flush_scheduled = False
+        # Consumer side, the broker changes these under its lock
+        self.prefetch_count = 0
+        self.unacked = collections.OrderedDict()
+        self.next_delivery_tag = 1
+        self.consumers = {}
+        self.__consumer_tags = itertools.count(1)
+
+    def __schedule(self, callback) -> None:
+        self.connection.ioloop.add_callback_threadsafe(callback)
+
+    def add_on_close_callback(self, callback) -> None:
+        self.__close_callbacks.append(callback)
+
+    def add_on_return_callback(self, callback) -> None:
+        self.__return_callbacks.append(callback)
+
+    def confirm_delivery(self, ack_nack_callback, callback = None) -> None:
+        self.__confirming = True
+        self.__ack_nack_callback = ack_nack_callback
+        if callback is not None:
+            self.__schedule(lambda: callback(Method(self.channel_number, pika.spec.Confirm.SelectOk())))
+
+    def exchange_declare(self, exchange: str, exchange_type = 'direct', passive: bool = False, durable: bool = False,
+                        auto_delete: bool = False, internal: bool = False, arguments: dict = None, callback = None) -> None:
+        self.__check_open()
+        exchange_type = getattr(exchange_type, 'value', exchange_type)
+        if passive is True and not self.__broker.has_exchange(exchange):
+            self.__schedule(lambda: self.close_by_broker(404, f"NOT_FOUND - no exchange '{exchange}'"))
+            return
+        self.__broker.declare_exchange(exchange, exchange_type)
+        if callback is not None:
+            self.__schedule(lambda: callback(Method(self.channel_number, pika.spec.Exchange.DeclareOk())))
+
+    def queue_declare(self, queue: str, passive: bool = False, durable: bool = False, exclusive: bool = False, auto_delete: bool = False,
+                    arguments: dict = None, callback = None) -> None:
+        self.__check_open()
+        if passive is True and not self.__broker.has_queue(queue):
+            self.__schedule(lambda: self.close_by_broker(404, f"NOT_FOUND - no queue '{queue}'"))
+            return
+        self.__broker.declare_queue(queue)
+        if callback is not None:
+            self.__schedule(lambda: callback(Method(self.channel_number, pika.spec.Queue.DeclareOk(queue, len(self.__broker.queue_messages(queue)), 0))))
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str = None, arguments: dict = None, callback = None) -> None:
+        self.__check_open()
+        if not self.__broker.has_exchange(exchange) or not self.__broker.has_queue(queue):
+            self.__schedule(lambda: self.close_by_broker(404, f"NOT_FOUND - no exchange '{exchange}' or queue '{queue}'"))
+            return
+        self.__broker.bind_queue(queue, exchange, routing_key)
+        if callback is not None:
+            self.__schedule(lambda: callback(Method(self.channel_number, pika.spec.Queue.BindOk())))
+
+    def basic_qos(self, prefetch_size: int = 0, prefetch_count: int = 0, global_qos: bool = False, callback = None) -> None:
+        self.__check_open()
+        self.__broker.set_prefetch(self, prefetch_count)
+        if callback is not None:
+            self.__schedule(lambda: callback(Method(self.channel_number, Basic.QosOk())))
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack: bool = False, exclusive: bool = False, consumer_tag: str = None,
+                    arguments: dict = None, callback = None) -> str:
+        self.__check_open()
+        consumer_tag = consumer_tag if consumer_tag is not None else f'ctag{self.channel_number}.{next(self.__consumer_tags)}'
+        if not self.__broker.has_queue(queue):
+            self.__schedule(lambda: self.close_by_broker(404, f"NOT_FOUND - no queue '{queue}'"))
+            return consumer_tag
+        if callback is not None:
+            self.__schedule(lambda: callback(Method(self.channel_number, Basic.ConsumeOk(consumer_tag))))
+        self.__broker.add_consumer(self, queue, consumer_tag, on_message_callback, auto_ack)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag: str = '', callback = None) -> None:
+        self.__broker.cancel_consumer(self, consumer_tag)
+        if callback is not None:
+            self.__schedule(lambda: callback(Method(self.channel_number, Basic.CancelOk(consumer_tag))))
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self.__check_open()
+        self.__broker.settle(self, delivery_tag, multiple, requeue=None)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True) -> None:
+        self.__check_open()
+        self.__broker.settle(self, delivery_tag, multiple, requeue=requeue)
+
+    def deliver(self, consumer_tag: str, delivery_tag: int, record: list) -> None:
+        """ Runs on this channel's IO loop, hands one message to the consumer callback
+        """
+        consumer = self.consumers.get(consumer_tag)
+        if self.is_closed is True or consumer is None:
+            return
+        exchange, routing_key, properties, body, redelivered = record
+        consumer(self, Basic.Deliver(consumer_tag, delivery_tag, redelivered, exchange, routing_key), properties, body)
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties: pika.BasicProperties = None, mandatory: bool = False) -> None:
+        """ Route the message now. An unroutable mandatory message comes back as a Basic.Return ahead of its ack, a missing
+            exchange closes the channel with a 404 and the message is never confirmed
+        """
+        self.__check_open()
+        properties = properties if properties is not None else pika.BasicProperties()
+        body = body.encode() if isinstance(body, str) else bytes(body)
+        tag = self.__next_tag
+        self.__next_tag += 1
+        if not self.__broker.has_exchange(exchange):
+            self.__schedule(lambda: self.close_by_broker(404, f"NOT_FOUND - no exchange '{exchange}' in vhost '/'"))
+            return
+        routed = self.__broker.route(exchange, routing_key, properties, body)
+        returned = None
+        if routed == 0 and mandatory is True:
+            returned = (Basic.Return(312, 'NO_ROUTE', exchange, routing_key), properties, body)
+            if self.__confirming is False:
+                self.__schedule(lambda: self.__deliver_return(*returned))
+        if self.__confirming is True:
+            self.__outcomes.append((tag, not self.__broker.take_nack(), returned))
+            if self.__flush_scheduled is False:
+                self.__flush_scheduled = True
+                if self.__broker.confirm_delay > 0:
+                    self.connection.ioloop.call_later(self.__broker.confirm_delay, self.__flush_confirms)
+                else:
+                    self.__schedule(self.__flush_confirms)
+
+    def close(self, reply_code: int = 0, reply_text: str = 'Normal shutdown') -> None:
+        if self.is_closed is False:
+            self.__closed(pika.exceptions.ChannelClosedByClient(reply_code, reply_text))
+
+    def close_by_broker(self, reply_code: int, reply_text: str) -> None:
+        if self.is_closed is False:
+            self.__closed(pika.exceptions.ChannelClosedByBroker(reply_code, reply_text))
+
+    def connection_lost(self, reason) -> None:
+        if self.is_closed is False:
+            self.__closed(reason)
+
+    def __closed(self, reason) -> None:
+        self.is_open = False
+        self.is_closed = True
+        self.__outcomes = []
+        self.connection.forget_channel(self)
+        self.__broker.channel_closed(self)
+        for callback in self.__close_callbacks:
+            callback(self, reason)
+
+    def __check_open(self) -> None:
+        if self.is_closed is True:
+            raise pika.exceptions.ChannelWrongStateError('Channel is closed.')
+
+    def __deliver_return(self, method, properties, body) -> None:
+        if self.is_closed is False:
+            for callback in self.__return_callbacks:
+                callback(self, method, properties, body)
+
+    def __flush_confirms(self) -> None:
+        """ Returns first (rabbit always sends a return ahead of its confirm), then one ack (multiple) for each run of acked tags
+            and a nack on its own for each nacked one
+        """
+        self.__flush_scheduled = False
+        outcomes, self.__outcomes = self.__outcomes, []
+        if self.is_closed is True:
+            return
+        for _, _, returned in outcomes:
+            if returned is not None:
+                self.__deliver_return(*returned)
+        run_end = None
+        for tag, acked, _ in outcomes:
+            if acked is True:
+                run_end = tag
+                continue
+            if run_end is not None:
+                self.__ack_nack_callback(Method(self.channel_number, Basic.Ack(run_end, multiple=True)))
+                run_end = None
+            self.__ack_nack_callback(Method(self.channel_number, Basic.Nack(tag, multiple=False)))
+        if run_end is not None:
+            self.__ack_nack_callback(Method(self.channel_number, Basic.Ack(run_end, multiple=True)))
+
+
+class StubConnection():
+    """ Looks like a pika SelectConnection from the outside: the open, open error and close callbacks fire on its own IO loop
+    """
+    def __init__(self, broker, parameters = None, on_open_callback = None, on_open_error_callback = None, on_close_callback = None) -> None:
+        self.broker = broker
+        self.params = parameters
+        self.ioloop = StubIOLoop()
+        self.is_open = False
+        self.is_closing = False
+        self.is_closed = False
+        self.__on_open = on_open_callback
+        self.__on_open_error = on_open_error_callback
+        self.__on_close = on_close_callback
+        self.__channels = {}
+        self.__channel_numbers = itertools.count(1)
+        self.ioloop.add_callback_threadsafe(self.__open)
+
+    def __open(self) -> None:
+        if self.broker.refuse_connection() is True:
+            self.is_closed = True
+            if self.__on_open_error is not None:
+                self.__on_open_error(self, pika.exceptions.AMQPConnectionError('stub broker refused the connection'))
+            return
+        self.is_open = True
+        self.broker.attach(self)
+        if self.__on_open is not None:
+            self.__on_open(self)
+
+    def channel(self, channel_number: int = None, on_open_callback = None) -> StubChannel:
+        new_channel = StubChannel(self, channel_number if channel_number is not None else next(self.__channel_numbers))
+        self.__channels[new_channel.channel_number] = new_channel
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(new_channel))
+        return new_channel
+
+    def forget_channel(self, channel: StubChannel) -> None:
+        self.__channels.pop(channel.channel_number, None)
+
+    def close(self, reply_code: int = 200, reply_text: str = 'Normal shutdown') -> None:
+        self.__closed(pika.exceptions.ConnectionClosedByClient(reply_code, reply_text))
+
+    def close_by_broker(self, reply_code: int = 320, reply_text: str = 'CONNECTION_FORCED - broker forced connection closure') -> None:
+        self.__closed(pika.exceptions.ConnectionClosedByBroker(reply_code, reply_text))
+
+    def __closed(self, reason) -> None:
+        """ Channels go first, then the connection, in the order pika reports them
+        """
+        if self.is_closed is True:
+            return
+        self.is_closing = True
+        self.is_open = False
+        for open_channel in list(self.__channels.values()):
+            open_channel.connection_lost(reason)
+        self.is_closing = False
+        self.is_closed = True
+        self.broker.detach(self)
+        if self.__on_close is not None:
+            self.__on_close(self, reason)
+
+
+class StubBroker():
+    """ An in-process stand in for a rabbit broker, for tests and benchmarks that shouldn't need a real one. Exchanges route
+            to queues the way rabbit's do ('' straight to the queue by name, fanout to every bound queue, direct by routing key).
+        Pass broker.connect wherever a pika.SelectConnection class would go.
+        Trouble on demand: nack_next nacks the next n publishes, close_connections drops every connection like a broker
+            restart, refuse_connections turns the next n connection attempts away, confirm_delay holds confirms back
+    """
+    def __init__(self, confirm_delay: float = 0.0) -> None:
+        self.confirm_delay = confirm_delay
+        self.__lock = threading.RLock()
+        self.__exchanges = {'': 'direct'}
+        self.__bindings = collections.defaultdict(set)
+        # queue name -> deque of [exchange, routing key, properties, body, redelivered]
+        self.__queues = {}
+        # queue name -> [(channel, consumer tag, auto ack)], deliveries go round robin over them
+        self.__consumers = collections.defaultdict(list)
+        self.__connections = set()
+        self.__nacks = 0
+        self.__refusals = 0
+        self.published = 0
+
+    def connect(self, parameters = None, on_open_callback = None, on_open_error_callback = None, on_close_callback = None) -> StubConnection:
+        return StubConnection(self, parameters, on_open_callback, on_open_error_callback, on_close_callback)
+
+    def attach(self, connection: StubConnection) -> None:
+        with self.__lock:
+            self.__connections.add(connection)
+
+    def detach(self, connection: StubConnection) -> None:
+        with self.__lock:
+            self.__connections.discard(connection)
+
+    @property
+    def connection_count(self) -> int:
+        with self.__lock:
+            return len(self.__connections)
+
+    def declare_exchange(self, exchange: str, exchange_type: str = 'direct') -> None:
+        with self.__lock:
+            self.__exchanges.setdefault(exchange, exchange_type)
+
+    def has_exchange(self, exchange: str) -> bool:
+        with self.__lock:
+            return exchange in self.__exchanges
+
+    def declare_queue(self, queue: str) -> None:
+        with self.__lock:
+            self.__queues.setdefault(queue, collections.deque())
+
+    def has_queue(self, queue: str) -> bool:
+        with self.__lock:
+            return queue in self.__queues
+
+    def bind_queue(self, queue: str, exchange: str, routing_key: str = None) -> None:
+        with self.__lock:
+            self.declare_queue(queue)
+            self.__exchanges.setdefault(exchange, 'direct')
+            self.__bindings[exchange].add((queue, routing_key if routing_key is not None else queue))
+
+    def queue_messages(self, queue: str) -> list:
+        """ What is sitting in a queue waiting for a consumer, as (routing key, properties, body)
+        """
+        with self.__lock:
+            return [(record[1], record[2], record[3]) for record in self.__queues.get(queue, ())]
+
+    def unacked_count(self) -> int:
+        with self.__lock:
+            return sum(len(channel.unacked) for consumers in self.__consumers.values() for channel in {entry[0] for entry in consumers})
+
+    def set_prefetch(self, channel: StubChannel, prefetch_count: int) -> None:
+        with self.__lock:
+            channel.prefetch_count = prefetch_count
+            for queue in self.__queues_consumed_by(channel):
+                self.__dispatch(queue)
+
+    def add_consumer(self, channel: StubChannel, queue: str, consumer_tag: str, callback, auto_ack: bool) -> None:
+        with self.__lock:
+            channel.consumers[consumer_tag] = callback
+            self.__consumers[queue].append((channel, consumer_tag, auto_ack))
+            self.__dispatch(queue)
+
+    def cancel_consumer(self, channel: StubChannel, consumer_tag: str) -> None:
+        with self.__lock:
+            channel.consumers.pop(consumer_tag, None)
+            for queue, consumers in self.__consumers.items():
+                consumers[:] = [entry for entry in consumers if entry[0] is not channel or entry[1] != consumer_tag]
+
+    def settle(self, channel: StubChannel, delivery_tag: int, multiple: bool, requeue) -> None:
+        """ An ack (requeue None) or nack. multiple covers every unacked tag up to delivery_tag, 0 with multiple is everything
+        """
+        with self.__lock:
+            if multiple is True:
+                tags = [tag for tag in channel.unacked if delivery_tag == 0 or tag <= delivery_tag]
+            else:
+                tags = [delivery_tag] if delivery_tag in channel.unacked else []
+            settled = [channel.unacked.pop(tag) for tag in tags]
+            if requeue is True:
+                self.__requeue(settled)
+            for queue in {queue for queue, _ in settled} | set(self.__queues_consumed_by(channel)):
+                self.__dispatch(queue)
+
+    def channel_closed(self, channel: StubChannel) -> None:
+        """ Drop the channel's consumers and put its unacked messages back, in the order they were first delivered
+        """
+        with self.__lock:
+            queues = self.__queues_consumed_by(channel)
+            for consumers in self.__consumers.values():
+                consumers[:] = [entry for entry in consumers if entry[0] is not channel]
+            channel.consumers.clear()
+            unacked = list(channel.unacked.values())
+            channel.unacked.clear()
+            self.__requeue(unacked)
+            for queue in set(queues) | {queue for queue, _ in unacked}:
+                self.__dispatch(queue)
+
+    def __queues_consumed_by(self, channel: StubChannel) -> list:
+        return [queue for queue, consumers in self.__consumers.items() if any(entry[0] is channel for entry in consumers)]
+
+    def __requeue(self, settled: list) -> None:
+        for queue, record in reversed(settled):
+            if queue in self.__queues:
+                record[4] = True
+                self.__queues[queue].appendleft(record)
+
+    def __dispatch(self, queue: str) -> None:
+        """ Hand waiting messages to consumers with room under their prefetch, round robin. Called with the lock held, the
+            deliveries run on each consumer's IO loop
+        """
+        messages = self.__queues.get(queue)
+        consumers = self.__consumers.get(queue)
+        if not messages or not consumers:
+            return
+        while len(messages) > 0:
+            for _ in range(len(consumers)):
+                consumers.append(consumers.pop(0))
+                channel, consumer_tag, auto_ack = consumers[-1]
+                if auto_ack is True or channel.prefetch_count == 0 or len(channel.unacked) < channel.prefetch_count:
+                    break
+            else:
+                return
+            record = messages.popleft()
+            delivery_tag = channel.next_delivery_tag
+            channel.next_delivery_tag += 1
+            if auto_ack is False:
+                channel.unacked[delivery_tag] = (queue, record)
+            channel.connection.ioloop.add_callback_threadsafe(
+                lambda channel=channel, consumer_tag=consumer_tag, delivery_tag=delivery_tag, record=record: channel.deliver(consumer_tag, delivery_tag, record))
+
+    def route(self, exchange: str, routing_key: str, properties, body: bytes) -> int:
+        """ Put the message on every queue the exchange sends it to, returns how many that was
+        """
+        with self.__lock:
+            self.published += 1
+            if exchange == '':
+                targets = [routing_key] if routing_key in self.__queues else []
+            elif self.__exchanges.get(exchange) == 'fanout':
+                targets = sorted({queue for queue, _ in self.__bindings[exchange]})
+            else:
+                targets = sorted({queue for queue, key in self.__bindings[exchange] if key == routing_key})
+            for queue in targets:
+                self.__queues[queue].append([exchange, routing_key, properties, body, False])
+                self.__dispatch(queue)
+            return len(targets)
+
+    def nack_next(self, count: int = 1) -> None:
+        with self.__lock:
+            self.__nacks += count
+
+    def take_nack(self) -> bool:
+        with self.__lock:
+            if self.__nacks > 0:
+                self.__nacks -= 1
+                return True
+            return False
+
+    def refuse_connections(self, count: int = 1) -> None:
+        with self.__lock:
+            self.__refusals += count
+
+    def refuse_connection(self) -> bool:
+        with self.__lock:
+            if self.__refusals > 0:
+                self.__refusals -= 1
+                return True
+            return False
+
+    def close_connections(self) -> None:
+        """ Drop every open connection from its own IO loop, the way a broker restart looks to the clients
+        """
+        with self.__lock:
+            connections = list(self.__connections)
+        for connection in connections:
+            connection.ioloop.add_callback_threadsafe(connection.close_by_broker)
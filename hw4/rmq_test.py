@@ -0,0 +1,68 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+from pymongo.errors import BulkWriteError
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from indexes import forget_ensured
+from rmq_stub import StubBroker
+from rmq_consumer import RMQConsumer, set_consumer
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class RMQPersistTest(TestCase):
+    """ Testing what rmq.ChatRoom saves when Mongo refuses some of it, against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        forget_ensured()
+        self.consumer = RMQConsumer(connection_factory=StubBroker().connect)
+        self.__previous_consumer = set_consumer(self.consumer)
+        self.room = rmq.ChatRoom('rmq-persist', owner_alias=SENDER_NAME, layout=LAYOUT_PER_ROOM)
+        self.collection = get_mongo_client().gueshner.get_collection('rmq-persist')
+        # One document per message text, so a message is refused while a document with its text is in the way
+        self.collection.create_index('message', unique=True)
+        self.mess_props = rmq.MessProperties(MESSAGE_TYPE_SENT, 'rmq-user', SENDER_NAME)
+
+    def tearDown(self) -> None:
+        set_consumer(self.__previous_consumer)
+        self.consumer.close(timeout=1)
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def saved(self) -> list:
+        return sorted(message['message'] for message in rmq.ChatRoom('rmq-persist', layout=LAYOUT_PER_ROOM).get_message_bodies()[0])
+
+    def test_failed_persist_is_retried(self):
+        """ A message Mongo refused stays queued, and goes in with the next persist
+        """
+        self.collection.insert_one({'message': 'first'})
+        with self.assertRaises(BulkWriteError):
+            self.room.put(rmq.ChatMessage('first', self.mess_props))
+        self.collection.delete_one({'message': 'first'})
+        self.room.put(rmq.ChatMessage('second', self.mess_props))
+        assert self.saved() == ['first', 'second']
+
+    def test_partly_refused(self):
+        """ One insert where Mongo takes the first message and refuses the second: only the second is tried again, so the first
+            isn't saved twice
+        """
+        self.collection.insert_one({'message': 'first'})
+        with self.assertRaises(BulkWriteError):
+            self.room.put(rmq.ChatMessage('first', self.mess_props))
+        self.collection.delete_one({'message': 'first'})
+        self.collection.insert_one({'message': 'second'})
+        with self.assertRaises(BulkWriteError):
+            self.room.put(rmq.ChatMessage('second', self.mess_props))
+        self.collection.delete_one({'message': 'second'})
+        self.room.put(rmq.ChatMessage('third', self.mess_props))
+        assert self.saved() == ['first', 'second', 'third']
+
+if __name__ == "__main__":
+    unittest.main()
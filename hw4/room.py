@@ -1,31 +1,52 @@
 """Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
 """
 
-from msilib import sequence
 import re
 import pika
 import json
 import pika.exceptions
 import logging
+import threading
+import itertools
 from users import *
 from constants import *
 from datetime import date, datetime
-from pymongo import MongoClient, ReturnDocument, ASCENDING
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from mongo_pool import get_mongo_client
+from sequence import get_allocator
+from write_behind import get_write_behind
+from indexes import ensure_indexes, ensure_unique_indexes
+from layout import room_collection, ROOM_INDEX_KINDS
+from search import search_collections
 from collections import deque
+from message_stream import dumps, encode_raw_documents
+from retention import RetentionPolicy, MessageArchive, RetentionSweeper, apply_ttl, sweep
 
-logging.basicConfig(filename='chatroom.log', level=logging.DEBUG, filemode='w')
+# Only entry points configure logging (chat_logging.setup_logging), per method tracing is debug and off by default
+logger = logging.getLogger(__name__)
+# The fields a message listing returns, the _id stays in Mongo
+MESSAGE_PROJECTION = {'_id': False, 'message': True, 'mess_props': True}
 
 class MessageProperties():
     """ Class for holding the properties of a message: type, sent_to, sent_from, rec_time, send_time
     """
-    def __init__(self, room_name: str, to_user: str, from_user: str, mess_type: int, sequence_num: int = -1, sent_time: datetime = datetime.now(), rec_time: datetime = datetime.now()) -> None:
-        logging.info(f'Initializing MessageProperties')
+    # Slots instead of a __dict__, rooms cache a lot of these
+    __slots__ = ('__mess_type', '__room_name', '__to_user', '__from_user', '__sent_time', '__rec_time', '__sequence_num')
+
+    def __init__(self, room_name: str, to_user: str, from_user: str, mess_type: int, sequence_num: int = -1, sent_time: datetime = None, rec_time: datetime = None) -> None:
+        """ Without sent_time/rec_time the message is stamped now. Not as defaults, those would be the time room.py was imported
+        """
+        logger.debug('Initializing MessageProperties')
+        now = datetime.now() if sent_time is None or rec_time is None else None
         self.__mess_type = mess_type
         self.__room_name = room_name
         self.__to_user = to_user
         self.__from_user = from_user
-        self.__sent_time = sent_time
-        self.__rec_time = rec_time     
+        self.__sent_time = sent_time if sent_time is not None else now
+        self.__rec_time = rec_time if rec_time is not None else now
         self.__sequence_num = sequence_num
 
     def to_dict(self):
@@ -38,24 +59,61 @@ class MessageProperties():
             'sequence_num': self.__sequence_num,
         } 
 
+    @property
+    def sequence_num(self) -> int:
+        return self.__sequence_num
+
+    @sequence_num.setter
+    def sequence_num(self, new_value: int):
+        self.__sequence_num = new_value
+
+    def numbered(self, sequence_num: int):
+        """ A copy of these properties with sequence_num, so callers can reuse one MessageProperties for many sends
+        """
+        return MessageProperties(self.__room_name, self.__to_user, self.__from_user, self.__mess_type, sequence_num, self.__sent_time, self.__rec_time)
+
+    @property
+    def to_user(self) -> str:
+        return self.__to_user
+
     def __str__(self):
         return str(self.to_dict())
 
 class ChatMessage():
     """ Class for holding individual messages in a chat thread/queue. Each message a message, rabbitmq properties, sequence number, timestamp and type
     """
+    __slots__ = ('__message', '__mess_props', '__rmq_props', '__dirty', '__mess_id', '__json')
+
     def __init__(self, message: str, mess_id = None, mess_props: MessageProperties = None) -> None:
-        logging.info(f'Initializing ChatMessage')
+        logger.debug('Initializing ChatMessage')
         self.__message = message
         self.__mess_props = mess_props
         self.__rmq_props = None
         self.__dirty = True
         self.__mess_id = mess_id
+        self.__json = None
+
+    @property
+    def mess_props(self) -> MessageProperties:
+        return self.__mess_props
+
+    @classmethod
+    def from_dict(cls, mess_dict: dict):
+        """ Rebuild a message from the document send_message stored
+        """
+        return cls(mess_dict['message'], mess_id=mess_dict.get('_id'), mess_props=MessageProperties(**mess_dict['mess_props']))
 
     def to_dict(self):
         mess_props_dict = self.__mess_props.to_dict()
         return {'message': self.__message, 'mess_props': mess_props_dict}
 
+    def to_json(self) -> bytes:
+        """ to_dict as JSON. A message doesn't change once it's in a room, so we encode it the first time and keep the bytes
+        """
+        if self.__json is None:
+            self.__json = dumps(self.to_dict())
+        return self.__json
+
     def __str__(self):
         return f'Chat Message: {self.__message} - message props: {self.__mess_props}'
 
@@ -64,57 +122,275 @@ class ChatRoom(deque):
         We reuse the constructor for creating new or grabbing an existing instance. If owner_alias is empty and user_alias is not, 
             this is assuming an existing instance. The opposite (owner_alias set and user_alias empty) means we're creating new
             members is always optional, and room_type is only relevant if we're creating new.
+        Message listeners (see add_message_listener) are shared by every room in the process
+        The deque is a bounded cache of the room's newest cache_size messages, oldest on the left, ordered by sequence number.
+            Every message with a sequence number above the cache floor is in it, so reads inside that range never go to Mongo.
+            The floor is unknown (None) until the first read warms the cache, unless we just created the room and know it's empty.
+            Other processes send to the room too, so before answering from the cache we ask Mongo for the room's newest sequence
+            number and pull in anything newer than what we have, unless cache_check is off. Use get_room so there is one instance per room
+        The retention policy decides how much history stays in Mongo, enforce_retention moves the rest to the room's archive of
+            compressed files. Mongo holds the messages above the archive ceiling and the archive the ones up to it, reads stitch the two
+        Where the messages live in Mongo depends on the layout (see layout.py), every query filters on the room name either way
     """
-    def __init__(self, room_name: str, member_list: list = None, owner_alias: str = "", room_type: int = ROOM_TYPE_PRIVATE, create_new: bool = False) -> None:
-        super(ChatRoom, self).__init__()
-        logging.info(f'Initializing ChatRoom')
+    # Called as listener(room_name, message_dict) for every message send_message accepts, e.g. to push it to live subscribers
+    _message_listeners = []
+
+    @classmethod
+    def add_message_listener(cls, listener) -> None:
+        if listener not in cls._message_listeners:
+            cls._message_listeners.append(listener)
+
+    @classmethod
+    def remove_message_listener(cls, listener) -> None:
+        if listener in cls._message_listeners:
+            cls._message_listeners.remove(listener)
+
+    def __init__(self, room_name: str, member_list: list = None, owner_alias: str = "", room_type: int = ROOM_TYPE_PRIVATE, create_new: bool = False, write_behind: bool = WRITE_BEHIND_ENABLED, cache_size: int = ROOM_CACHE_SIZE, cache_check: bool = ROOM_CACHE_CHECK, retention: RetentionPolicy = None, archive_dir: str = ARCHIVE_DIR, layout: str = MESSAGE_LAYOUT) -> None:
+        super(ChatRoom, self).__init__(maxlen=cache_size)
+        logger.debug('Initializing ChatRoom')
         self.__room_name = room_name
-        self.__user_list = UserList()
         self.__room_type = room_type
         self.__owner_alias = owner_alias
         self.__member_list = member_list
         # Set up mongo - client, db, collection, sequence_collection
-        self.__mongo_client = MongoClient(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, authSource=MONGO_DB, authMechanism=MONGODB_AUTH_MECH)
+        self.__mongo_client = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH)
         self.__mongo_db = self.__mongo_client.detest
-        self.__mongo_collection = self.__mongo_db.get_collection(self.__room_name) 
-        self.__mongo_seq_collection = self.__mongo_db.get_collection("sequence")
+        self.__layout = layout
+        self.__mongo_collection = room_collection(self.__mongo_db, self.__room_name, layout)
+        self.__mongo_seq_collection = self.__mongo_db.get_collection(SEQUENCE_COLLECTION)
         if self.__mongo_collection is None:
             self.__mongo_collection = self.__mongo_db.create_collection(self.__room_name)
-        if create_new is True:
+        # The old per room counter document, sequence numbers come from the sequence collection and a shared collection can only have one
+        if create_new is True and layout == LAYOUT_PER_ROOM:
             self.__mongo_collection.insert_one({'_id': 'userid', 'seq': 0})
+        self.__index_kind = ROOM_INDEX_KINDS[layout]
+        ensure_indexes(self.__mongo_collection, self.__index_kind, wait=False)
+        # Same collection, but reads hand back the undecoded BSON of each document, for the JSON listings
+        self.__raw_collection = self.__mongo_collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        # Sequence numbers come from a block leased per room, seeded past the old shared 'userid' counter
+        self.__sequence = get_allocator(self.__mongo_seq_collection, self.__room_name, legacy_key=SEQUENCE_LEGACY_KEY)
+        # With write behind, send_message only queues the message and a background thread bulk inserts it
+        self.__write_buffer = get_write_behind(self.__mongo_collection) if write_behind is True else None
+        self.__archive = MessageArchive(self.__room_name, archive_dir)
+        self.__retention = retention if retention is not None else RetentionPolicy()
+        self.__apply_ttl()
+        # Sends come in on several storage threads, the lock keeps the cache in order while readers walk it
+        self.__cache_lock = threading.Lock()
+        self.__cache_floor = self.__archive_floor() if create_new is True else None
+        self.__cache_check = cache_check
+        self.__cache_hits = 0
+        self.__cache_misses = 0
         # restore from mongo if possible, if not create new
         
 
-    def __get_next_sequence_num(self):
-        """ This is the method that you need for managing the sequence. Note that there is a separate collection for just this one document
+    @property
+    def room_name(self) -> str:
+        return self.__room_name
+
+    @property
+    def owner_alias(self) -> str:
+        return self.__owner_alias
+
+    @property
+    def member_list(self) -> list:
+        return self.__member_list
+
+    @property
+    def room_type(self) -> int:
+        return self.__room_type
+
+    @property
+    def retention(self) -> RetentionPolicy:
+        return self.__retention
+
+    def set_retention(self, policy: RetentionPolicy) -> None:
+        """ Change the policy, the next enforce_retention goes by it
+        """
+        self.__retention = policy if policy is not None else RetentionPolicy()
+        self.__apply_ttl()
+
+    def __apply_ttl(self) -> None:
+        """ A TTL index covers its whole collection, so rooms sharing the messages collection rely on the sweeper alone
+        """
+        if self.__layout == LAYOUT_PARTITIONED:
+            return
+        try:
+            apply_ttl(self.__mongo_collection, self.__retention)
+        except Exception as error:
+            logger.warning('Unable to set up the retention TTL index for room %s: %s', self.__room_name, error)
+
+    def enforce_retention(self) -> int:
+        """ Move what the retention policy no longer keeps from Mongo to the archive, returns how many messages moved. Cached
+                messages stay cached, they're still the room's history
+        """
+        logger.debug('Entrered enforce_retention')
+        return sweep(self.__mongo_collection, self.__archive, self.__room_name, self.__retention)
+
+    def archive_stats(self) -> dict:
+        return dict(self.__archive.stats(), room_name=self.__room_name, retention=self.__retention.to_dict())
+
+    def __archive_floor(self):
+        """ Cache floor for when Mongo has all of the room we haven't archived
+        """
+        ceiling = self.__archive.ceiling
+        return float('-inf') if ceiling is None else ceiling
+
+    def __get_next_sequence_num(self) -> int:
+        """ This is the method that you need for managing the sequence. Numbers come out of the block the allocator leased for this room,
+            so only one in SEQUENCE_BLOCK_SIZE calls goes to the sequence collection
         """
-        sequence_num = self.__mongo_seq_collection.find_one_and_update(
-                                                        {'_id': 'userid'},
-                                                        {'$inc': {'seq': 1}},
-                                                        projection={'seq': True, '_id': False},
-                                                        upsert=True,
-                                                        return_document=ReturnDocument.AFTER)
-        return sequence_num
+        return self.__sequence.next()
 
     # Overriding the queue type put and get operations to add type hints for the ChatMessage type
     def put(self, message: ChatMessage = None) -> None:
-        logging.info(f'Entrered put')
-        self.append(message)
+        """ Add a message to the cache in sequence number order. Two sends racing on different threads can put out of order,
+                so a message older than the newest one gets slotted in from the right, which is never far
+            When the cache is full the oldest message goes and the floor moves up to it
+        """
+        logger.debug('Entrered put')
+        sequence_num = message.mess_props.sequence_num
+        with self.__cache_lock:
+            position = len(self)
+            while position > 0 and self[position - 1].mess_props.sequence_num > sequence_num:
+                position -= 1
+            # Catching up from Mongo can race with our own send putting the same message
+            if position > 0 and self[position - 1].mess_props.sequence_num == sequence_num:
+                return
+            if len(self) == self.maxlen:
+                if self.maxlen == 0 or position == 0:
+                    self.__raise_cache_floor(sequence_num)
+                    return
+                self.__raise_cache_floor(self.popleft().mess_props.sequence_num)
+                position -= 1
+            self.insert(position, message)
 
     # overriding parent and setting block to false so we don't wait for messages if there are none
     def get(self) -> ChatMessage:
-        logging.info(f'Entrered get')
-        self.popleft()
+        logger.debug('Entrered get')
+        with self.__cache_lock:
+            message = self.popleft()
+            self.__raise_cache_floor(message.mess_props.sequence_num)
+            return message
+
+    def __raise_cache_floor(self, sequence_num: int) -> None:
+        if self.__cache_floor is not None:
+            self.__cache_floor = max(self.__cache_floor, sequence_num)
+
+    def __warm_cache(self) -> None:
+        """ Load the newest maxlen messages of the room from Mongo and merge them with what's already cached (with write behind
+                the newest sends may not be in Mongo yet). If the room has fewer messages than that, the cache holds its whole history
+            The query runs without the lock so sends aren't held up behind it
+        """
+        logger.debug('Entrered __warm_cache')
+        newest_first = list(self.__mongo_collection.find(self.__message_query()).sort('mess_props.sequence_num', DESCENDING).limit(max(self.maxlen, 1)))
+        with self.__cache_lock:
+            if self.__cache_floor is not None:
+                return
+            messages = {message.mess_props.sequence_num: message for message in self}
+            for mess_dict in newest_first:
+                messages.setdefault(mess_dict['mess_props']['sequence_num'], ChatMessage.from_dict(mess_dict))
+            ordered = [messages[sequence_num] for sequence_num in sorted(messages)]
+            floor = self.__archive_floor() if len(newest_first) < self.maxlen else newest_first[-1]['mess_props']['sequence_num'] - 1
+            if len(ordered) > self.maxlen:
+                floor = max(floor, ordered[-self.maxlen - 1].mess_props.sequence_num)
+            super(ChatRoom, self).clear()
+            self.extend(ordered[-self.maxlen:])
+            self.__cache_floor = floor
+
+    def __check_cache(self) -> None:
+        """ Pull in the messages other processes sent since our newest cached one. It's one query on the room and sequence number
+                index, which finds nothing unless Mongo is ahead of the cache. Without Mongo we go with the cache
+            Each process numbers from its own leased block, so a message another process numbered below our newest isn't caught here
+        """
+        with self.__cache_lock:
+            if self.__cache_floor is None:
+                return
+            cached_newest = self[-1].mess_props.sequence_num if len(self) > 0 else self.__cache_floor
+        after_seq = cached_newest if cached_newest != float('-inf') else None
+        try:
+            for mess_dict in self.__mongo_collection.find(self.__message_query(after_seq=after_seq)).sort('mess_props.sequence_num', ASCENDING):
+                self.put(ChatMessage.from_dict(mess_dict))
+        except Exception as error:
+            logger.warning('Unable to check the message cache of room %s against Mongo: %s', self.__room_name, error)
+
+    def __read_cache(self, user_alias: str, num_messages: int, after_seq: int, before_seq: int, newest_first: bool) -> list:
+        """ The ChatMessages get_messages asked for, oldest first, or None if the cache doesn't cover the range (counted as a miss).
+            We walk from the newest message back, so reading what's new since a recent cursor only touches the new messages
+        """
+        if self.__cache_check is True:
+            self.__check_cache()
+        with self.__cache_lock:
+            selected = self.__select_cached(user_alias, num_messages, after_seq, before_seq, newest_first)
+            if selected is None:
+                self.__cache_misses += 1
+                return None
+            self.__cache_hits += 1
+        selected.reverse()
+        if newest_first is False and num_messages != GET_ALL_MESSAGES:
+            selected = selected[:num_messages]
+        return selected
+
+    def __select_cached(self, user_alias: str, num_messages: int, after_seq: int, before_seq: int, newest_first: bool) -> list:
+        """ Newest first list of the cached messages in range, called with the cache lock held
+        """
+        floor = self.__cache_floor
+        if floor is None:
+            return None
+        if after_seq is not None and after_seq < floor:
+            return None
+        # Reading forwards from the very first message needs the whole history in the cache
+        if after_seq is None and newest_first is False and floor != float('-inf'):
+            return None
+        selected = []
+        for message in reversed(self):
+            sequence_num = message.mess_props.sequence_num
+            if sequence_num <= floor or (after_seq is not None and sequence_num <= after_seq):
+                break
+            if before_seq is not None and sequence_num >= before_seq:
+                continue
+            if user_alias is not None and message.mess_props.to_user != user_alias:
+                continue
+            selected.append(message)
+            if newest_first is True and len(selected) == num_messages:
+                break
+        # Going backwards we can only answer short if we got to the start of the room
+        if newest_first is True and len(selected) < num_messages and floor != float('-inf'):
+            return None
+        return selected
+
+    def cache_stats(self) -> dict:
+        with self.__cache_lock:
+            return {'room_name': self.__room_name,
+                'size': len(self),
+                'capacity': self.maxlen,
+                'floor': self.__cache_floor,
+                'hits': self.__cache_hits,
+                'misses': self.__cache_misses,
+            }
         
     def find_message(self, message_text: str) -> ChatMessage:
-        """ This method is called by the server to find a message in the chatroom. It is called by the server when the chatroom is closed."""
-        logging.info(f'Entrered find_message')
-        self.__mongo_collection.find_one({'message': message_text})
+        """ This method is called by the server to find a message in the chatroom. It is called by the server when the chatroom is closed.
+            Exact text only, the newest such message or None. search_messages is for finding messages by their words
+        """
+        logger.debug('Entrered find_message')
+        mess_dict = self.__mongo_collection.find_one({'mess_props.room_name': self.__room_name, 'message': message_text}, sort=[('mess_props.sequence_num', DESCENDING)])
+        return ChatMessage.from_dict(mess_dict) if mess_dict is not None else None
+
+    def search_messages(self, text: str, from_user: str = None, to_user: str = None, sent_after: datetime = None, sent_before: datetime = None,
+                        offset: int = 0, limit: int = SEARCH_PAGE_SIZE) -> dict:
+        """ Ranked full text search of this room through the text index, best match first and newest first among equals.
+                text takes Mongo's syntax: words are OR'ed, "a phrase" has to be there as is, -word must not be
+            Returns {'results': listing dicts with a score, 'offset', 'next_offset', 'has_more'}, pass next_offset back as offset for the
+                next page. Archived messages aren't searched
+        """
+        logger.debug('Entrered search_messages')
+        return search_collections([(self.__mongo_collection, [self.__room_name])], text, offset, limit, from_user=from_user, to_user=to_user,
+                                  sent_after=sent_after, sent_before=sent_before)
         
     def restore(self) -> bool:
         """ This method is called by the server to restore the chatroom from mongo. It is called by the server when the chatroom is closed.
         """
-        logging.info(f'Entrered restore')
+        logger.debug('Entrered restore')
         self.__mongo_collection.find_one_and_update(
                                                 {'_id': 'userid'},
                                                 {'$inc': {'seq': 1}},
@@ -126,139 +402,493 @@ class ChatRoom(deque):
     def clear(self,this_user_alias):
         """ Remove all documents from MongoDB
         """
-        logging.info(f'Entrered clear')
+        logger.debug('Entrered clear')
         self.__mongo_collection.delete_many(self.get_messages(user_alias=this_user_alias))
 
     def persist(self):
         """ This method is called by the server to persist the chatroom to mongo. It is called by the server when the chatroom is closed.
         """
-        logging.info(f'Entrered persist')
+        logger.debug('Entrered persist')
         self.__mongo_collection.insert_one(self.to_dict())
 
-    # CHECK HERE
-    def get_messages(self, user_alias: str, num_messages:int=GET_ALL_MESSAGES, return_objects: bool = True):
+    def __message_query(self, user_alias: str = None, after_seq: int = None, before_seq: int = None) -> dict:
+        """ Filter for this room's messages, optionally for one recipient and a sequence number range (both ends exclusive)
+        """
+        query = {'mess_props.room_name': self.__room_name}
+        if user_alias is not None:
+            query['mess_props.to_user'] = user_alias
+        seq_range = {}
+        if after_seq is not None:
+            seq_range['$gt'] = after_seq
+        if before_seq is not None:
+            seq_range['$lt'] = before_seq
+        if len(seq_range) > 0:
+            query['mess_props.sequence_num'] = seq_range
+        return query
+
+    def get_messages(self, user_alias: str = None, num_messages:int=GET_ALL_MESSAGES, return_objects: bool = True, after_seq: int = None, before_seq: int = None, latest: bool = False):
         """return message texts, full message objects, and total # of messages
+            With no user_alias we return the messages for every recipient in the room
+            after_seq/before_seq restrict to sequence numbers strictly between them. Messages always come back oldest first, with only
+                before_seq set (or latest) we want the newest num_messages before it, so we read backwards and flip them
+            When the cache covers the range we answer from memory with a list, otherwise it's a Mongo cursor
         """
-        logging.info(f'Entrered get_messages')
-        self.__mongo_collection.find({'mess_props.room_name': self.__room_name, 'mess_props.to_user': user_alias}).sort('mess_props.sequence_num', ASCENDING).limit(num_messages)
+        logger.debug('Entrered get_messages')
+        query = self.__message_query(user_alias, after_seq, before_seq)
         if return_objects is True:
+            newest_first = (latest is True or before_seq is not None) and after_seq is None and num_messages != GET_ALL_MESSAGES
+            if self.__cache_floor is None:
+                try:
+                    self.__warm_cache()
+                except:
+                    logger.warning('Unable to warm the message cache for room %s', self.__room_name)
+            if (cached := self.__read_cache(user_alias, num_messages, after_seq, before_seq, newest_first)) is not None:
+                return [message.to_dict() for message in cached]
             try:
-                return self.__mongo_collection.find({'mess_props.room_name': self.__room_name, 'mess_props.to_user': user_alias}).sort('mess_props.sequence_num', ASCENDING).limit(num_messages)
+                return self.__read_stored(self.__mongo_collection, None, user_alias, num_messages, after_seq, before_seq, newest_first)
             except:
                 return [] # Unable to find any messages
+
+    def __read_stored(self, collection, projection, user_alias: str, num_messages: int, after_seq: int, before_seq: int, newest_first: bool):
+        """ The uncached read, oldest first: Mongo, and the archive when the range goes below what Mongo still has.
+            Backwards we fill up from the archive below the oldest message Mongo gave us, forwards we go through the archive first and
+                lazily, so streaming a long history has one segment open at a time
+        """
+        if newest_first is True:
+            query = self.__message_query(user_alias, after_seq, before_seq)
+            newest = list(collection.find(query, projection).sort('mess_props.sequence_num', DESCENDING).limit(num_messages))
+            if len(newest) < num_messages and self.__archive.ceiling is not None:
+                below = newest[-1]['mess_props']['sequence_num'] if len(newest) > 0 else before_seq
+                newest.extend(self.__archive.read_newest(num_messages - len(newest), user_alias, after_seq, below))
+            return newest[::-1]
+        if self.__archive.ceiling is None or (after_seq is not None and after_seq >= self.__archive.ceiling):
+            messages = collection.find(self.__message_query(user_alias, after_seq, before_seq), projection).sort('mess_props.sequence_num', ASCENDING)
+        else:
+            messages = self.__read_forwards(collection, projection, user_alias, after_seq, before_seq)
+        if num_messages != GET_ALL_MESSAGES:
+            messages = messages.limit(num_messages) if hasattr(messages, 'limit') else itertools.islice(messages, num_messages)
+        return messages
+
+    def __read_forwards(self, collection, projection, user_alias: str, after_seq: int, before_seq: int):
+        """ Archive then Mongo above the last archived message we read. If a sweep archives more while we're in the archive
+            we go round again for the new segments, Mongo has already dropped those messages
+        """
+        position = after_seq
+        while (ceiling := self.__archive.ceiling) is not None and (position is None or ceiling > position):
+            yield from self.__archive.read(user_alias, position, ceiling + 1 if before_seq is None else min(before_seq, ceiling + 1))
+            position = ceiling
+        yield from collection.find(self.__message_query(user_alias, position, before_seq), projection).sort('mess_props.sequence_num', ASCENDING)
+
+    def get_page(self, user_alias: str = None, after_seq: int = None, before_seq: int = None, limit: int = MESSAGES_PAGE_SIZE, latest: bool = False) -> dict:
+        """ One page of messages for keyset pagination. The index on (room, recipient, sequence number) takes Mongo straight to the
+                cursor, so a page costs the same no matter how long the room history is
+            Pass next_cursor back as after_seq to get newer messages (or poll for new ones), prev_cursor as before_seq for older ones.
+                has_more says whether there is more in the direction we're paging. latest starts from the newest page instead of the oldest
+        """
+        logger.debug('Entrered get_page')
+        limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+        backwards = (latest is True or before_seq is not None) and after_seq is None
+        # one extra message tells us if there is another page without a count query
+        messages = list(self.get_messages(user_alias, limit + 1, after_seq=after_seq, before_seq=before_seq, latest=latest))
+        has_more = len(messages) > limit
+        if has_more is True:
+            messages = messages[1:] if backwards is True else messages[:limit]
+        return {'messages': messages,
+            'next_cursor': messages[-1]['mess_props']['sequence_num'] if len(messages) > 0 else after_seq,
+            'prev_cursor': messages[0]['mess_props']['sequence_num'] if len(messages) > 0 else before_seq,
+            'has_more': has_more,
+        }
+
+    def __listing(self, user_alias: str, num_messages: int, after_seq: int, before_seq: int, latest: bool) -> list:
+        """ get_messages for the JSON listings: oldest first, ChatMessages from the cache or RawBSONDocuments (listing fields only)
+            from Mongo, so nobody builds a dict per message just to encode it
+        """
+        newest_first = (latest is True or before_seq is not None) and after_seq is None and num_messages != GET_ALL_MESSAGES
+        if self.__cache_floor is None:
+            try:
+                self.__warm_cache()
+            except:
+                logger.warning('Unable to warm the message cache for room %s', self.__room_name)
+        if (cached := self.__read_cache(user_alias, num_messages, after_seq, before_seq, newest_first)) is not None:
+            return cached
+        try:
+            return list(self.__read_stored(self.__raw_collection, MESSAGE_PROJECTION, user_alias, num_messages, after_seq, before_seq, newest_first))
+        except:
+            return [] # Unable to find any messages
+
+    @staticmethod
+    def __listing_json(messages: list) -> bytes:
+        if len(messages) > 0 and isinstance(messages[0], ChatMessage):
+            return b'[' + b','.join(message.to_json() for message in messages) + b']'
+        return encode_raw_documents(messages)
+
+    @staticmethod
+    def __listing_seq(message) -> int:
+        if isinstance(message, ChatMessage):
+            return message.mess_props.sequence_num
+        return message['mess_props']['sequence_num']
+
+    def get_messages_json(self, user_alias: str = None, num_messages: int = GET_ALL_MESSAGES, after_seq: int = None, before_seq: int = None, latest: bool = False) -> bytes:
+        """ get_messages already encoded as a JSON array, without the _id. From the cache that's joining the bytes each message keeps,
+                from Mongo the batch comes back as raw BSON with only the listing fields and is decoded and encoded in one go
+        """
+        logger.debug('Entrered get_messages_json')
+        return self.__listing_json(self.__listing(user_alias, num_messages, after_seq, before_seq, latest))
+
+    def get_page_json(self, user_alias: str = None, after_seq: int = None, before_seq: int = None, limit: int = MESSAGES_PAGE_SIZE, latest: bool = False) -> bytes:
+        """ get_page already encoded as JSON, the same way as get_messages_json
+        """
+        logger.debug('Entrered get_page_json')
+        limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+        backwards = (latest is True or before_seq is not None) and after_seq is None
+        messages = self.__listing(user_alias, limit + 1, after_seq, before_seq, latest)
+        has_more = len(messages) > limit
+        if has_more is True:
+            messages = messages[1:] if backwards is True else messages[:limit]
+        next_cursor = self.__listing_seq(messages[-1]) if len(messages) > 0 else after_seq
+        prev_cursor = self.__listing_seq(messages[0]) if len(messages) > 0 else before_seq
+        return b'{"messages":' + self.__listing_json(messages) + b',"next_cursor":' + dumps(next_cursor) + \
+            b',"prev_cursor":' + dumps(prev_cursor) + b',"has_more":' + dumps(has_more) + b'}'
     def send_message(self, message: str, from_alias: str, mess_props: MessageProperties) -> bool:
         """ This is the method that you need for sending messages. Note that there is a separate collection for just this one document
+            mess_props isn't changed, the message gets its own copy carrying the sequence number we allocated
         """
-        logging.info(f'Entrered send_message')
+        logger.debug('Entrered send_message')
         try:
-            self.put(ChatMessage(message, mess_props=mess_props))
-            # Persist the message to mongo
-            self.__mongo_collection.insert_one(mess_props.to_dict())
+            if mess_props.sequence_num == -1:
+                mess_props = mess_props.numbered(self.__get_next_sequence_num())
+            ensure_unique_indexes(self.__mongo_collection, self.__index_kind)
+            new_message = ChatMessage(message, mess_props=mess_props)
+            # Persist the message to mongo, get_messages queries on mess_props.* so store the whole message
+            if self.__write_buffer is not None:
+                self.__write_buffer.put(new_message.to_dict())
+            else:
+                self.__mongo_collection.insert_one(new_message.to_dict())
         except:
             return False
+        # Only cached once Mongo (or the write behind queue) took it, a failed send mustn't show up in reads
+        self.put(new_message)
+        self.__notify_listeners(new_message)
         return True
 
+    def __notify_listeners(self, new_message: ChatMessage) -> None:
+        """ Tell the listeners about an accepted message. They share one copy of the document (not the one we gave Mongo, which
+            the driver adds _id to), so they mustn't change it. A broken listener must not turn a sent message into a failed send
+        """
+        if len(self._message_listeners) == 0:
+            return
+        document = new_message.to_dict()
+        for listener in self._message_listeners:
+            try:
+                listener(self.__room_name, document)
+            except Exception as error:
+                logger.warning('Message listener failed for room %s: %s', self.__room_name, error)
+
+    def flush(self, timeout: float = None) -> list:
+        """ Wait until every message queued by write behind is in mongo. Returns the write failures since the last call, each one
+            a FlushFailure with the document and the error. Without write behind there is never anything to wait for
+        """
+        logger.debug('Entrered flush')
+        if self.__write_buffer is None:
+            return []
+        self.__write_buffer.flush(timeout)
+        return self.__write_buffer.failures()
+
+
+# One ChatRoom per room name in this process, so every request for a room shares its message cache
+_rooms = {}
+_rooms_lock = threading.Lock()
+
+def get_room(room_name: str, **kwargs) -> ChatRoom:
+    """ The process wide ChatRoom for room_name, built with kwargs the first time it's asked for
+    """
+    with _rooms_lock:
+        if (room := _rooms.get(room_name)) is None:
+            room = _rooms[room_name] = ChatRoom(room_name, **kwargs)
+        return room
+
+def forget_room(room_name: str) -> ChatRoom:
+    """ Drop the shared ChatRoom for room_name, so the next get_room builds it again. Returns the room we dropped, if there was one
+    """
+    with _rooms_lock:
+        return _rooms.pop(room_name, None)
+
+def forget_rooms() -> None:
+    """ Drop the shared rooms, e.g. after pointing the mongo pool at another server
+    """
+    with _rooms_lock:
+        _rooms.clear()
+
+def search_rooms(text: str, room_names: list = None, layout: str = MESSAGE_LAYOUT, **kwargs) -> dict:
+    """ ChatRoom.search_messages across rooms, every room when room_names is None. Partitioned that's one query on the shared
+        collection, in the collection per room layout it's one per named room, merged on score
+    """
+    mongo_db = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH).detest
+    if layout == LAYOUT_PARTITIONED:
+        return search_collections([(room_collection(mongo_db, '', layout), room_names)], text, **kwargs)
+    if room_names is None:
+        raise ValueError('searching every room needs the partitioned layout, name the rooms to search')
+    return search_collections([(room_collection(mongo_db, room_name, layout), [room_name]) for room_name in room_names], text, **kwargs)
+
+def room_cache_stats() -> list:
+    with _rooms_lock:
+        rooms = list(_rooms.values())
+    return [room.cache_stats() for room in rooms]
+
+def sweep_rooms() -> int:
+    """ enforce_retention on every shared room, returns how many messages went to archives. One room failing doesn't stop the rest
+    """
+    with _rooms_lock:
+        rooms = list(_rooms.values())
+    moved = 0
+    for room in rooms:
+        try:
+            moved += room.enforce_retention()
+        except Exception:
+            logger.exception('Unable to enforce retention for room %s', room.room_name)
+    return moved
+
+def start_retention_sweeper(interval: float = RETENTION_SWEEP_INTERVAL) -> RetentionSweeper:
+    return RetentionSweeper(sweep_rooms, interval)
+
 class RoomList():
     """ Note, I chose to use an explicit private list instead of inheriting the list class
+        Each room is a metadata document in the room list collection (name, owner, members, type, retention). In memory we keep the metadata
+            by name plus owner -> room names and member -> room names, updated on create/add/remove and member changes, so
+            every lookup is O(1) or O(rooms found). The collection has the same three indexes for restores and other processes
+        The ChatRoom for a room is only built when somebody asks for it, through get_room so there is one per room
     """
     def __init__(self, name: str = DEFAULT_ROOM_LIST_NAME) -> None:
         """ Try to restore from mongo 
         """
-        logging.info(f'Initializing RoomList')
+        logger.debug('Initializing RoomList')
         self.room_name = name
-        self.__mongo_client = MongoClient(host=MONGODB_URL, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, authSource=MONGO_DB, authMechanism=MONGODB_AUTH_SOURCE_CLASS)
+        self.__mongo_client = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH)
         self.__mongo_db = self.__mongo_client.detest
         self.__mongo_collection = self.__mongo_db.get_collection(self.room_name)
+        self.__mongo_seq_collection = self.__mongo_db.get_collection(SEQUENCE_COLLECTION)
         if self.__mongo_collection is None:
             self.__mongo_collection = self.__mongo_db.create_collection(self.room_name)
-        self.__room_list = []
+        self.__sequence = get_allocator(self.__mongo_seq_collection, f'room_list.{self.room_name}')
+        ensure_indexes(self.__mongo_collection, 'room_list', wait=False)
+        self.__lock = threading.RLock()
         self.__room_list_dict = {}
+        self.__rooms_by_owner = {}
+        self.__rooms_by_member = {}
+        self.__restored = False
         self.__dirty = True    
 
+    @staticmethod
+    def __metadata(room_name: str, owner_alias: str, member_list: list, room_type: int, retention: dict = None) -> dict:
+        members = [] if member_list is None else list(dict.fromkeys(member_list))
+        if owner_alias and owner_alias not in members:
+            members.append(owner_alias)
+        return {'room_name': room_name, 'owner_alias': owner_alias, 'member_list': members, 'room_type': room_type, 'retention': retention}
+
+    @staticmethod
+    def __room_kwargs(metadata: dict) -> dict:
+        """ What get_room needs to build a room from its metadata
+        """
+        return {'member_list': metadata['member_list'], 'owner_alias': metadata['owner_alias'], 'room_type': metadata['room_type'],
+                'retention': RetentionPolicy.from_dict(metadata.get('retention'))}
+
+    def __index(self, metadata: dict) -> None:
+        """ Add a room's metadata to the in memory indexes, called with the lock held
+        """
+        room_name = metadata['room_name']
+        self.__room_list_dict[room_name] = metadata
+        self.__rooms_by_owner.setdefault(metadata['owner_alias'], set()).add(room_name)
+        for member_alias in metadata['member_list']:
+            self.__rooms_by_member.setdefault(member_alias, set()).add(room_name)
+
+    def __unindex(self, room_name: str) -> dict:
+        """ Take a room out of the in memory indexes, called with the lock held. Returns its metadata, None if we didn't have it
+        """
+        metadata = self.__room_list_dict.pop(room_name, None)
+        if metadata is None:
+            return None
+        self.__discard(self.__rooms_by_owner, metadata['owner_alias'], room_name)
+        for member_alias in metadata['member_list']:
+            self.__discard(self.__rooms_by_member, member_alias, room_name)
+        return metadata
+
+    @staticmethod
+    def __discard(inverted_index: dict, alias: str, room_name: str) -> None:
+        if (room_names := inverted_index.get(alias)) is not None:
+            room_names.discard(room_name)
+            if len(room_names) == 0:
+                del inverted_index[alias]
 
-    def create(self, room_name: str, owner_alias: str, member_list: list = None, room_type: int = ROOM_TYPE_PRIVATE) -> ChatRoom:
-        """ Create a new room
+    def create(self, room_name: str, owner_alias: str, member_list: list = None, room_type: int = ROOM_TYPE_PRIVATE, retention: RetentionPolicy = None) -> ChatRoom:
+        """ Create a new room. Returns None if there already is a room with that name, here or in Mongo
         """
-        logging.info(f'Entrered create in RoomList')
-        self.__room_list.append(ChatRoom(room_name, member_list, owner_alias, room_type))
-        return self.__room_list[-1]
+        logger.debug('Entrered create in RoomList')
+        if room_name in self:
+            return None
+        metadata = self.__metadata(room_name, owner_alias, member_list, room_type, retention.to_dict() if retention is not None else None)
+        ensure_unique_indexes(self.__mongo_collection, 'room_list')
+        try:
+            self.__mongo_collection.insert_one(dict(metadata))
+        except DuplicateKeyError:
+            logger.info('Room %s was created somewhere else', room_name)
+            return None
+        with self.__lock:
+            self.__index(metadata)
+        return get_room(room_name, **self.__room_kwargs(metadata))
 
     def add(self, new_room: ChatRoom):
-        """ Add a new room to the list
+        """ Add a new room to the list, or update the list's copy of it
+        """
+        logger.debug('Entrered add in RoomList')
+        metadata = self.__metadata(new_room.room_name, new_room.owner_alias, new_room.member_list, new_room.room_type, new_room.retention.to_dict())
+        self.__mongo_collection.replace_one({'room_name': new_room.room_name}, dict(metadata), upsert=True)
+        with self.__lock:
+            self.__unindex(new_room.room_name)
+            self.__index(metadata)
+
+    def add_member(self, room_name: str, member_alias: str) -> bool:
+        """ Add a member to a room. Returns False if there is no such room
+        """
+        logger.debug('Entrered add_member in RoomList')
+        if room_name not in self:
+            return False
+        self.__mongo_collection.update_one({'room_name': room_name}, {'$addToSet': {'member_list': member_alias}})
+        with self.__lock:
+            if (metadata := self.__room_list_dict.get(room_name)) is not None and member_alias not in metadata['member_list']:
+                metadata['member_list'].append(member_alias)
+                self.__rooms_by_member.setdefault(member_alias, set()).add(room_name)
+        return True
+
+    def remove_member(self, room_name: str, member_alias: str) -> bool:
+        """ Take a member out of a room. Returns False if there is no such room
         """
-        logging.info(f'Entrered add in RoomList')
-        self.__room_list.append(new_room)
+        logger.debug('Entrered remove_member in RoomList')
+        if room_name not in self:
+            return False
+        self.__mongo_collection.update_one({'room_name': room_name}, {'$pull': {'member_list': member_alias}})
+        with self.__lock:
+            if (metadata := self.__room_list_dict.get(room_name)) is not None and member_alias in metadata['member_list']:
+                metadata['member_list'].remove(member_alias)
+                self.__discard(self.__rooms_by_member, member_alias, room_name)
+        return True
+
+    def set_retention(self, room_name: str, policy: RetentionPolicy) -> bool:
+        """ Change a room's retention policy, and the policy of its ChatRoom if we already built it. Returns False if there is no such room
+        """
+        logger.debug('Entrered set_retention in RoomList')
+        if room_name not in self:
+            return False
+        self.__mongo_collection.update_one({'room_name': room_name}, {'$set': {'retention': policy.to_dict()}})
+        with self.__lock:
+            if (metadata := self.__room_list_dict.get(room_name)) is not None:
+                metadata['retention'] = policy.to_dict()
+        with _rooms_lock:
+            room = _rooms.get(room_name)
+        if room is not None:
+            room.set_retention(policy)
+        return True
 
     def find_room_in_metadata(self, room_name: str) -> dict:
-        """ Find a room in the list by name
+        """ Find a room in the list by name, returns a copy of its metadata or None
         """
-        logging.info(f'Entrered find_room_in_metadata in RoomList')
-        return self.__room_list[room_name]
+        logger.debug('Entrered find_room_in_metadata in RoomList')
+        if room_name not in self:
+            return None
+        with self.__lock:
+            metadata = self.__room_list_dict.get(room_name)
+            return None if metadata is None else dict(metadata, member_list=list(metadata['member_list']))
 
-    def get_rooms(self):
-        """ Get all rooms
+    def get_rooms(self) -> list:
+        """ Get the names of all rooms
         """
-        logging.info(f'Entrered get_rooms in RoomList')
-        return self.__room_list
+        logger.debug('Entrered get_rooms in RoomList')
+        self.__restore()
+        with self.__lock:
+            return list(self.__room_list_dict)
 
     def get(self, room_name: str) -> ChatRoom:
-        """ Get a room by name
+        """ Get a room by name, None if there is no such room
         """
-        logging.info(f'Entrered get in RoomList')
-        return self.__room_list[room_name]
+        logger.debug('Entrered get in RoomList')
+        if (metadata := self.find_room_in_metadata(room_name)) is None:
+            return None
+        return get_room(room_name, **self.__room_kwargs(metadata))
 
-    def __find_pos(self, room_name: str) -> int:
-        """ Find the position of a room in the list
+    def __contains__(self, room_name: str) -> bool:
+        """ A room we haven't seen may have been created by another process, so a miss asks Mongo by the unique room name index
         """
-        logging.info(f'Entrered __find_pos in RoomList')
-        return self.__room_list.index(room_name)
-    
+        self.__restore()
+        with self.__lock:
+            if room_name in self.__room_list_dict:
+                return True
+        metadata = self.__mongo_collection.find_one({'room_name': room_name}, projection={'_id': False})
+        if metadata is None:
+            return False
+        with self.__lock:
+            if room_name not in self.__room_list_dict:
+                self.__index(self.__metadata(metadata['room_name'], metadata['owner_alias'], metadata['member_list'], metadata['room_type'], metadata.get('retention')))
+        return True
+
+    def __len__(self) -> int:
+        self.__restore()
+        return len(self.__room_list_dict)
+
     def find_by_member(self, member_alias: str) -> list:
-        """ Find rooms by member
+        """ Find rooms by member, returns their names
         """
-        logging.info(f'Entrered find_by_member in RoomList')
-        return self.__room_list.find_one({'member_list': member_alias})
+        logger.debug('Entrered find_by_member in RoomList')
+        self.__restore()
+        with self.__lock:
+            return sorted(self.__rooms_by_member.get(member_alias, ()))
 
     def find_by_owner(self, owner_alias: str) -> list:
-        """ Find rooms by owner
+        """ Find rooms by owner, returns their names
         """
-        logging.info(f'Entrered find_by_owner in RoomList')
-        return self.__room_list.find_one({'owner_alias': owner_alias})
+        logger.debug('Entrered find_by_owner in RoomList')
+        self.__restore()
+        with self.__lock:
+            return sorted(self.__rooms_by_owner.get(owner_alias, ()))
 
     def remove(self, room_name: str):
-        """ Remove a room from the list
+        """ Remove a room from the list. The room's messages stay in Mongo
+            The shared ChatRoom goes too (after its write behind is flushed), or a room created later under the same name would get
+                the old one's owner, members and cache
         """
-        logging.info(f'Entrered remove in RoomList')
-        self.__room_list.remove(room_name)
+        logger.debug('Entrered remove in RoomList')
+        self.__mongo_collection.delete_one({'room_name': room_name})
+        with self.__lock:
+            self.__unindex(room_name)
+        if (room := forget_room(room_name)) is not None:
+            room.flush()
 
     def __persist(self):
-        """ Persist the list to mongo
+        """ Persist the list to mongo, one metadata document per room
         """
-        logging.info(f'Entrered __persist in RoomList')
-        self.__mongo_collection.insert_one(self.__room_list)
+        logger.debug('Entrered __persist in RoomList')
+        with self.__lock:
+            rooms = [dict(metadata) for metadata in self.__room_list_dict.values()]
+        for metadata in rooms:
+            self.__mongo_collection.replace_one({'room_name': metadata['room_name']}, metadata, upsert=True)
+        self.__dirty = False
 
     def __restore(self) -> bool:
-        """ Restore the list from mongo
+        """ Restore the list from mongo, the first time anybody looks at it, so building a RoomList doesn't wait on Mongo
         """
-        logging.info(f'Entrered __restore in RoomList')
-        self.__mongo_collection.find_one_and_update(
-            {'_id': 'userid'},
-            {'$inc': {self.room_name: 1}},
-            projection={self.room_name: True, '_id': False},
-            upsert=True,
-            return_document=ReturnDocument.AFTER
-            )
+        if self.__restored is True:
+            return True
+        logger.debug('Entrered __restore in RoomList')
+        rooms = list(self.__mongo_collection.find({'room_name': {'$exists': True}}, projection={'_id': False}))
+        with self.__lock:
+            if self.__restored is False:
+                for metadata in rooms:
+                    if metadata['room_name'] not in self.__room_list_dict:
+                        self.__index(self.__metadata(metadata['room_name'], metadata.get('owner_alias', ''), metadata.get('member_list'), metadata.get('room_type', ROOM_TYPE_PRIVATE), metadata.get('retention')))
+                self.__restored = True
+                self.__dirty = False
         return True
 
-    def __get_next_sequence_num(self):
-        """ Get the next sequence number
-        """
-        logging.info(f'Entrered __get_next_sequence_num in RoomList')
-        sequence_num = self.__mongo_collection.find_one_and_update(
-            {'_id': 'userid'},
-            {'$inc': {self.room_name: 1}},
-            projection={self.room_name: True, '_id': False},
-            upsert=True,
-            return_document=ReturnDocument.AFTER
-            )
-        return sequence_num
\ No newline at end of file
+    def __get_next_sequence_num(self) -> int:
+        """ Get the next sequence number from the block leased for this list
+        """
+        logger.debug('Entrered __get_next_sequence_num in RoomList')
+        return self.__sequence.next()
\ No newline at end of file
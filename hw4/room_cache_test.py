@@ -0,0 +1,124 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from room import ChatRoom, MessageProperties, ChatMessage
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+def send(room: ChatRoom, text: str, to_user: str = 'cache-user') -> None:
+    room.send_message(text, SENDER_NAME, MessageProperties('cache-room', to_user, SENDER_NAME, MESSAGE_TYPE_SENT))
+
+def texts(messages) -> list:
+    return [message['message'] for message in messages]
+
+class RoomCacheTest(TestCase):
+    """ Testing the bounded cache of recent messages in front of Mongo
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        self.__room = ChatRoom('cache-room', cache_size=10, create_new=True)
+        for index in range(25):
+            send(self.__room, f'message {index}')
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def test_bounded(self):
+        """ Only the newest cache_size messages stay in memory, in sequence number order
+        """
+        assert len(self.__room) == 10
+        sequence_nums = [message.mess_props.sequence_num for message in self.__room]
+        assert sequence_nums == sorted(sequence_nums)
+        assert self.__room[0].to_dict()['message'] == 'message 15'
+
+    def test_since_seq_from_cache(self):
+        """ Polling from a recent cursor is answered from memory, a cursor older than the cache goes to Mongo
+        """
+        cursor = self.__room[-4].mess_props.sequence_num
+        assert texts(self.__room.get_messages('cache-user', after_seq=cursor)) == ['message 22', 'message 23', 'message 24']
+        assert self.__room.cache_stats()['hits'] == 1
+        old_cursor = self.__room[0].mess_props.sequence_num - 5
+        assert len(list(self.__room.get_messages('cache-user', after_seq=old_cursor))) == 14
+        assert self.__room.cache_stats()['misses'] == 1
+
+    def test_latest_from_cache(self):
+        """ The newest page is a hit, asking for more than the cache holds is a miss but still the right answer
+        """
+        page = self.__room.get_page('cache-user', limit=5, latest=True)
+        assert texts(page['messages']) == [f'message {index}' for index in range(20, 25)]
+        assert page['has_more'] is True
+        assert self.__room.cache_stats()['hits'] == 1
+        assert texts(self.__room.get_messages('cache-user', 20, latest=True)) == [f'message {index}' for index in range(5, 25)]
+        assert self.__room.cache_stats()['misses'] == 1
+
+    def test_warm_from_mongo(self):
+        """ A fresh instance for a room with history loads the newest messages on the first read
+        """
+        restarted = ChatRoom('cache-room', cache_size=10)
+        assert len(restarted) == 0
+        assert texts(restarted.get_messages('cache-user', 3, latest=True)) == ['message 22', 'message 23', 'message 24']
+        assert len(restarted) == 10
+        assert restarted.cache_stats()['hits'] == 1
+
+    def test_recipient_filter(self):
+        send(self.__room, 'for somebody else', 'other-user')
+        cursor = self.__room[-3].mess_props.sequence_num
+        assert texts(self.__room.get_messages('cache-user', after_seq=cursor)) == ['message 24']
+        assert texts(self.__room.get_messages(after_seq=cursor)) == ['message 24', 'for somebody else']
+
+    def test_out_of_order_put(self):
+        """ Racing senders can put out of order, the cache still ends up sorted
+        """
+        newest = self.__room[-1].mess_props.sequence_num
+        for sequence_num, text in ((newest + 2, 'early'), (newest + 1, 'late')):
+            self.__room.put(ChatMessage(text, mess_props=MessageProperties('cache-room', 'cache-user', SENDER_NAME, MESSAGE_TYPE_SENT, sequence_num)))
+        sequence_nums = [message.mess_props.sequence_num for message in self.__room]
+        assert sequence_nums == sorted(sequence_nums)
+        assert texts(message.to_dict() for message in self.__room)[-2:] == ['late', 'early']
+        assert len(self.__room) == 10
+        # Putting a message that's already cached (Mongo and our own send both had it) keeps one copy
+        self.__room.put(ChatMessage('late', mess_props=MessageProperties('cache-room', 'cache-user', SENDER_NAME, MESSAGE_TYPE_SENT, newest + 1)))
+        assert len(self.__room) == 10 and texts(message.to_dict() for message in self.__room)[-3:] == ['message 24', 'late', 'early']
+
+    def test_failed_send_not_cached(self):
+        """ A message Mongo refused doesn't show up in reads from the cache
+        """
+        collection = mongo_pool.get_client().detest.get_collection(MESSAGES_COLLECTION)
+        collection.create_index('message', unique=True, sparse=True)
+        cursor = self.__room[-1].mess_props.sequence_num
+        assert self.__room.send_message('message 24', SENDER_NAME, MessageProperties('cache-room', 'cache-user', SENDER_NAME, MESSAGE_TYPE_SENT)) is False
+        assert texts(self.__room.get_messages('cache-user', after_seq=cursor - 1)) == ['message 24']
+        assert self.__room.cache_stats()['hits'] == 1
+
+    def test_other_process_sends(self):
+        """ Another process' sends only reach us through Mongo, the cache picks them up before answering
+        """
+        cursor = self.__room[-1].mess_props.sequence_num
+        other_process = ChatRoom('cache-room', cache_size=10)
+        send(other_process, 'from the other process')
+        assert texts(self.__room.get_messages('cache-user', after_seq=cursor)) == ['from the other process']
+        assert texts(self.__room.get_page('cache-user', limit=2, latest=True)['messages']) == ['message 24', 'from the other process']
+        assert self.__room.cache_stats()['hits'] == 2
+        assert len(self.__room) == 10
+
+    def test_rmq_bounded(self):
+        """ The rabbit backed room keeps the newest messages too, including after a restore
+        """
+        queue = rmq.ChatRoom('cache-queue', owner_alias=SENDER_NAME, cache_size=5)
+        for index in range(12):
+            queue.put(rmq.ChatMessage(f'queued {index}', rmq.MessProperties(MESSAGE_TYPE_SENT, 'cache-user', SENDER_NAME)))
+        assert [message.message for message in queue] == [f'queued {index}' for index in range(11, 6, -1)]
+        restored = rmq.ChatRoom('cache-queue', cache_size=5)
+        assert [message.message for message in restored] == [f'queued {index}' for index in range(11, 6, -1)]
+
+if __name__ == "__main__":
+    unittest.main()
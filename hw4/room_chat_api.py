@@ -1,15 +1,28 @@
 """Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
 """
 import socket
+import contextlib
 import logging
 import json
-from fastapi import FastAPI, Request, status, Form
-from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from datetime import datetime
+from fastapi import FastAPI, Request, status, Form, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from rmq import *
 from room import *
 from constants import *
 from users import *
+from async_store import AsyncChatRoom, AsyncRoomList, AsyncUserList, storage_executor
+from message_stream import stream_chunks, encode_message, dumps
+from pubsub import broadcaster, SubscriptionClosed
+from chat_logging import setup_logging, logging_stats
+from mongo_pool import mongo_pool
+from sequence import allocator_stats
+from rmq_publisher import current_publisher
+from rmq_consumer import current_consumer
+from metrics import registry, MetricsMiddleware
+from profiling import ProfilingMiddleware, profiling_enabled
 
 MY_IPADDRESS = ""
 
@@ -17,10 +30,20 @@ MY_IPADDRESS = ""
 # instance of the rmq class that is necessary across all handlers that behave essentially as callbacks. 
 
 app = FastAPI()
-room_list = RoomList()
-users = UserList()
-templates = Jinja2Templates(directory="")
-logging.basicConfig(filename='chat.log', level=logging.INFO)
+room_list = AsyncRoomList(RoomList())
+users = AsyncUserList(UserList())
+templates = Jinja2Templates(directory=".")
+setup_logging(LOG_FILE)
+logger = logging.getLogger(__name__)
+# Every message a ChatRoom in this process accepts goes out to the push subscribers of its room
+ChatRoom.add_message_listener(broadcaster.publish)
+# Moves messages past their room's retention policy to the archive every RETENTION_SWEEP_INTERVAL seconds
+retention_sweeper = start_retention_sweeper()
+# Latency of every request by route and status for /metrics, the Mongo and rmq timings are recorded where they happen
+app.add_middleware(MetricsMiddleware)
+# Profiles of single requests on demand (X-Profile plus the PROFILE_TOKEN) or by PROFILE_SAMPLE_RATE, not even installed when both are off
+if profiling_enabled() is True:
+    app.add_middleware(ProfilingMiddleware)
 
 @app.get("/")
 async def index():
@@ -38,100 +61,274 @@ async def send_form(request: Request):
 async def get_form(request: Request, room_choice: str = Form(...), message: str = Form(...), alias: str = Form(...)):
     """ HTML POST page for sending a message
     """
-    logging.info(f'inside send message handler, room choice is {room_choice}')
-    if room_choice not in room_list.get_rooms():
-        logging.info(f'room choice is {room_choice}')
+    logger.debug('inside send message handler, room choice is %s', room_choice)
+    if await room_list.contains(room_choice) is False:
+        logger.debug('room choice is %s', room_choice)
         return JSONResponse(status_code=415, content=f'Chat room {room_choice} does not exist.')
-    if users.get(alias) is None:
-        logging.info(f'Trying to send, have an invalid alias: {alias}')
+    if await users.get(alias) is None:
+        logger.info('Trying to send, have an invalid alias: %s', alias)
         return JSONResponse(status_code=410, content="Invalid alias")
-    logging.info(f'inside send message handler, room choice is {room_choice}')
-    room = room_list.get(room_choice)
-    logging.info(f'inside send message handler, room choice is {room_choice}')
-    room.send_message(message, alias)
-    logging.info(f'inside send message handler, room choice is {room_choice}')
+    logger.debug('inside send message handler, room choice is %s', room_choice)
+    room = AsyncChatRoom(await room_list.get(room_choice))
+    logger.debug('inside send message handler, room choice is %s', room_choice)
+    await room.send_message(message, alias, MessageProperties(room_choice, room_choice, alias, MESSAGE_TYPE_SENT))
+    logger.debug('inside send message handler, room choice is %s', room_choice)
     return JSONResponse(status_code=201, content=f'Message sent to room {room_choice}')
 
 @app.get("/page/messages", status_code=200)
-async def form_messages(request: Request, room_name: str = DEFAULT_PUBLIC_ROOM):
-    """ HTML GET page for seeing messages
+async def form_messages(request: Request, room_name: str = DEFAULT_PUBLIC_ROOM, after_seq: int = None, before_seq: int = None, limit: int = MESSAGES_PAGE_SIZE, stream: str = None):
+    """ HTML GET page for seeing messages, one page at a time. Pass next_cursor back as after_seq to get what's new
+        stream=ndjson or stream=json sends everything between the cursors instead, straight from the Mongo cursor
     """
-    logging.info(f'inside messages handler, room name is {room_name}')
-    if room_name not in room_list.get_rooms():
-        logging.info(f'room name is {room_name}')
+    logger.debug('inside messages handler, room name is %s', room_name)
+    if await room_list.contains(room_name) is False:
+        logger.debug('room name is %s', room_name)
         return JSONResponse(status_code=415, content=f'Chat room {room_name} does not exist.')
-    room = room_list.get(room_name)
-    logging.info(f'inside messages handler, room name is {room_name}')
-    return JSONResponse(status_code=200, content=room.get_messages())
+    room = AsyncChatRoom(await room_list.get(room_name))
+    logger.debug('inside messages handler, room name is %s', room_name)
+    if stream is not None:
+        return stream_messages(room, stream, after_seq=after_seq, before_seq=before_seq)
+    return Response(status_code=200, content=await room.get_page_json(after_seq=after_seq, before_seq=before_seq, limit=limit), media_type='application/json')
     
 @app.post("/page/messages", status_code=201)
-async def form_messages(request: Request, room_name: str = Form(...)):
+async def form_messages(request: Request, room_name: str = Form(...), after_seq: int = Form(None), before_seq: int = Form(None), limit: int = Form(MESSAGES_PAGE_SIZE)):
     """ HTML POST page for seeing messages in a different room or different quantities
     """
-    logging.info(f'inside messages handler, room name is {room_name}')
-    if room_name not in room_list.get_rooms():
-        logging.info(f'room name is {room_name}')
+    logger.debug('inside messages handler, room name is %s', room_name)
+    if await room_list.contains(room_name) is False:
+        logger.debug('room name is %s', room_name)
         return JSONResponse(status_code=415, content=f'Chat room {room_name} does not exist.')
-    room = room_list.get(room_name)
-    logging.info(f'inside messages handler, room name is {room_name}')
-    return JSONResponse(status_code=200, content=room.get_messages())
+    room = AsyncChatRoom(await room_list.get(room_name))
+    logger.debug('inside messages handler, room name is %s', room_name)
+    return Response(status_code=200, content=await room.get_page_json(after_seq=after_seq, before_seq=before_seq, limit=limit), media_type='application/json')
 
 @app.get("/messages/", status_code=200)
-async def get_messages(request: Request, alias: str, room_name: str, messages_to_get: int = GET_ALL_MESSAGES):
-    """ API for getting messages
-    """
-    logging.info("starting messages method")
-    if (queue_instance := ChatRoom(room_name=room_name, queue_name=alias)) is None:
-        return JSONResponse(status_code=415, content=f'Chat queue {room_name} does not exist.')
-    messages, message_objects, total_mess = queue_instance.get_message_bodies(num_messages=messages_to_get, return_objects=True)
-    logging.info(f"messages: {messages}")
-    logging.info(f"message_objects: {message_objects}")
-    logging.info(f"total_mess: {total_mess}")
-    return JSONResponse(status_code=200, content=messages)
+async def get_messages(request: Request, alias: str, room_name: str, after_seq: int = None, before_seq: int = None, limit: int = MESSAGES_PAGE_SIZE, stream: str = None, latest: bool = False):
+    """ API for getting messages, keyset paginated on sequence number. The response has the page of messages plus next_cursor
+        (use as after_seq for newer messages) and prev_cursor (use as before_seq for older ones). latest=true starts at the newest page
+        stream=ndjson (one message per line) or stream=json (one array) exports everything between the cursors with flat memory use
+        Recent pages usually come straight out of the room's message cache
+    """
+    logger.debug("starting messages method")
+    if (queue_instance := await existing_room(room_name)) is None:
+        return JSONResponse(status_code=404, content=f'Chat room {room_name} does not exist.')
+    if stream is not None:
+        return stream_messages(queue_instance, stream, alias, after_seq=after_seq, before_seq=before_seq)
+    # Already JSON: cached messages keep their encoded bytes, Mongo reads come back as raw BSON with just the listing fields
+    page = await queue_instance.get_page_json(alias, after_seq=after_seq, before_seq=before_seq, limit=limit, latest=latest)
+    logger.debug("page bytes: %d", len(page))
+    return Response(status_code=200, content=page, media_type='application/json')
+
+@app.get("/messages/search", status_code=200)
+async def search_messages(text: str, room_name: str = None, from_alias: str = None, to_alias: str = None, sent_after: datetime = None,
+                          sent_before: datetime = None, offset: int = 0, limit: int = SEARCH_PAGE_SIZE):
+    """ API for full text search, best match first. With room_name it searches that room, without it every room
+        Words are OR'ed, "a phrase" has to appear as is, -word must not. Pass next_offset back as offset for the next page
+    """
+    logger.debug("starting search method")
+    filters = {'from_user': from_alias, 'to_user': to_alias, 'sent_after': sent_after, 'sent_before': sent_before}
+    if room_name is not None:
+        if (room := await existing_room(room_name)) is None:
+            return JSONResponse(status_code=404, content=f'Chat room {room_name} does not exist.')
+        page = await room.search_messages(text, offset=offset, limit=limit, **filters)
+    else:
+        # Partitioned that's one query on the shared collection. With a collection per room search_rooms needs the names, which
+        #   come from the room list
+        room_names = None if MESSAGE_LAYOUT == LAYOUT_PARTITIONED else await room_list.get_rooms()
+        page = await storage_executor.run(search_rooms, text, room_names, offset=offset, limit=limit, **filters)
+    logger.debug("search results: %d", len(page['results']))
+    return Response(status_code=200, content=dumps(page), media_type='application/json')
+
+@app.get("/metrics", status_code=200)
+async def get_metrics():
+    """ Prometheus text format: request, Mongo command, storage wait, rmq and event loop lag histograms, plus the pool, cache,
+        sequence, publisher, consumer, push and logging stats as of now
+    """
+    return Response(status_code=200, content=registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.get("/users/", status_code=200)
 async def get_users():
     """ API for getting users
     """
-    logging.info("starting users method")
-    users_list = users.get_all_users()
-    logging.info(f"users_list: {users_list}")
-    return JSONResponse(status_code=200, content=users_list)
+    logger.debug("starting users method")
+    users_list = [user.to_dict() for user in await users.get_all_users()]
+    logger.debug("users_list: %d users", len(users_list))
+    return JSONResponse(status_code=200, content=jsonable_encoder(users_list))
 
 @app.post("/alias", status_code=201)
 async def register_client(client_alias: str, group_alias: bool = False):
     """ API for adding a user alias
     """
-    logging.info("starting alias method")
-    if (client_alias := users.register(client_alias, group_alias)) is None:
+    logger.debug("starting alias method")
+    if (new_user := await users.register(client_alias)) is None:
         return JSONResponse(status_code=415, content=f'Alias {client_alias} already exists.')
-    logging.info(f"client_alias: {client_alias}")
-    return JSONResponse(status_code=200, content=client_alias)
+    logger.debug("client_alias: %s", client_alias)
+    return JSONResponse(status_code=200, content=jsonable_encoder(new_user.to_dict()))
 
 @app.post("/room")
 async def create_room(room_name: str, owner_alias: str, room_type: int = ROOM_TYPE_PRIVATE):
     """ API for creating a room
     """
-    logging.info("starting room method")
-    if (room_name := room_list.add(room_name, owner_alias, room_type)) is None:
+    logger.debug("starting room method")
+    if await room_list.create(room_name, owner_alias, room_type=room_type) is None:
         return JSONResponse(status_code=415, content=f'Room {room_name} already exists.')
-    logging.info(f"room_name: {room_name}")
+    logger.debug("room_name: %s", room_name)
     return JSONResponse(status_code=200, content=room_name)
 
+@app.post("/room/retention")
+async def set_room_retention(room_name: str, max_age_days: float = None, max_messages: int = None):
+    """ API for setting how much of a room stays in Mongo, the rest goes to its archive. Neither limit keeps everything
+    """
+    logger.debug("starting room retention method")
+    try:
+        policy = RetentionPolicy(max_age_days, max_messages)
+    except ValueError as error:
+        return JSONResponse(status_code=415, content=str(error))
+    if await room_list.set_retention(room_name, policy) is False:
+        return JSONResponse(status_code=415, content=f'Room {room_name} does not exist.')
+    return JSONResponse(status_code=200, content=policy.to_dict())
+
 @app.post("/message/", status_code=201)
 async def send_message(room_name: str, message: str, from_alias: str, to_alias: str):
     """ API for sending a message
     """
-    logging.info("starting message method")
-    if (queue_instance := ChatRoom(room_name=room_name, queue_name=from_alias)) is None:
-        return JSONResponse(status_code=415, content=f'Chat queue {room_name} does not exist.')
-    if (message := queue_instance.send_message(message, to_alias)) is None:
+    logger.debug("starting message method")
+    if (queue_instance := await existing_room(room_name)) is None:
+        return JSONResponse(status_code=404, content=f'Chat room {room_name} does not exist.')
+    if await queue_instance.send_message(message, from_alias, MessageProperties(room_name, to_alias, from_alias, MESSAGE_TYPE_SENT)) is False:
         return JSONResponse(status_code=415, content=f'Message {message} could not be sent.')
-    logging.info(f"message: {message}")
+    logger.debug("message: %s", message)
     return JSONResponse(status_code=200, content=message)
 
+@app.get("/rooms/{room_name}/events")
+async def room_events(room_name: str, alias: str = None, after_seq: int = None):
+    """ Server-Sent Events push channel for a room. Each message is one event with the sequence number as its id, a comment line goes
+        out every PUSH_HEARTBEAT_SECONDS to keep proxies from closing the connection. With after_seq we first send what was missed
+    """
+    logger.debug('starting events stream for room %s', room_name)
+    if (room := await existing_room(room_name)) is None:
+        return JSONResponse(status_code=404, content=f'Chat room {room_name} does not exist.')
+    async def events():
+        # aclosing so the subscription goes away as soon as the client does, not whenever the generator is collected
+        async with contextlib.aclosing(live_messages(room, alias, after_seq)) as messages:
+            async for message in messages:
+                if message is None:
+                    yield ': heartbeat\n\n'
+                elif isinstance(message, SubscriptionClosed):
+                    yield f'event: close\ndata: {message}\n\n'
+                else:
+                    yield f'id: {message["mess_props"]["sequence_num"]}\ndata: {encode_message(message)}\n\n'
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.websocket("/ws/{room_name}")
+async def room_websocket(websocket: WebSocket, room_name: str, alias: str = None, after_seq: int = None):
+    """ WebSocket push channel for a room, one JSON text frame per message. Same catch up and slow consumer rules as the SSE channel
+    """
+    await websocket.accept()
+    logger.debug('starting websocket for room %s', room_name)
+    if (room := await existing_room(room_name)) is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f'Chat room {room_name} does not exist.')
+        return
+    try:
+        async with contextlib.aclosing(live_messages(room, alias, after_seq)) as messages:
+            async for message in messages:
+                if isinstance(message, SubscriptionClosed):
+                    await websocket.close(code=1013, reason=str(message))
+                elif message is not None:
+                    await websocket.send_text(encode_message(message))
+    except WebSocketDisconnect:
+        logger.info('websocket for room %s went away', room_name)
+
+async def existing_room(room_name: str):
+    """ The shared AsyncChatRoom for room_name, None when the room list doesn't have it. Checking the list first keeps a typo
+        in a request from building (and persisting) a new room, and get_room can restore from Mongo so it goes on the executor
+    """
+    if await room_list.contains(room_name) is False:
+        logger.debug('no room named %s', room_name)
+        return None
+    return AsyncChatRoom(await storage_executor.run(get_room, room_name))
+
+async def live_messages(room: AsyncChatRoom, alias: str = None, after_seq: int = None):
+    """ Messages for one push subscriber. We subscribe first and only then read what was sent after after_seq, so nothing falls in
+            between. A live message numbered at or below the last one we caught up on was already sent, however late it reaches us
+            (deliveries can still be on their way through call_soon_threadsafe when the catch up ends), so it gets skipped
+        Yields None when there was nothing for PUSH_HEARTBEAT_SECONDS and the SubscriptionClosed error last if we got cut off
+    """
+    subscription = broadcaster.subscribe(room.room.room_name, alias)
+    try:
+        caught_up_to = after_seq
+        if after_seq is not None:
+            async for batch in room.stream_messages(alias, GET_ALL_MESSAGES, after_seq=after_seq):
+                for message in batch:
+                    caught_up_to = max(caught_up_to, message['mess_props']['sequence_num'])
+                    yield message
+        while True:
+            try:
+                message = await subscription.get(timeout=PUSH_HEARTBEAT_SECONDS)
+            except SubscriptionClosed as closed:
+                yield closed
+                return
+            if message is not None and caught_up_to is not None and message['mess_props']['sequence_num'] <= caught_up_to:
+                continue
+            yield message
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+def stream_messages(room: AsyncChatRoom, stream_format: str, user_alias: str = None, after_seq: int = None, before_seq: int = None):
+    """ Streaming response for a whole range of messages. The cursor is read STREAM_BATCH_SIZE messages at a time and each batch is
+        encoded and sent before the next one is read, so memory stays flat however big the room is
+    """
+    batches = room.stream_messages(user_alias, GET_ALL_MESSAGES, after_seq=after_seq, before_seq=before_seq)
+    try:
+        chunks, media_type = stream_chunks(batches, stream_format)
+    except ValueError:
+        return JSONResponse(status_code=400, content=f'Unknown stream format {stream_format}, use ndjson or json.')
+    return StreamingResponse(chunks, media_type=media_type)
+
+def service_metrics() -> list:
+    """ The stats the pool, rooms, sequence allocators, storage executor, rmq publisher and consumer, broadcaster and logging
+        pipeline already keep, as metrics. Rooms and sequence keys are summed, a series per room would be too many
+    """
+    pool = mongo_pool.stats()
+    caches = room_cache_stats()
+    hits, misses = sum(cache['hits'] for cache in caches), sum(cache['misses'] for cache in caches)
+    allocators = allocator_stats()
+    pushes = broadcaster.stats()
+    metrics = [
+        ('chat_mongo_pool_connections', 'gauge', 'Open and checked out connections per Mongo client',
+            [({'client': client, 'state': state}, stats[state]) for client, stats in pool['per_client'].items() for state in ('open', 'checked_out')]),
+        ('chat_mongo_pool_max_size', 'gauge', 'Most connections a Mongo client opens', [({}, pool['max_pool_size'])]),
+        ('chat_mongo_pool_checkout_failures_total', 'counter', 'Connection check outs that failed per Mongo client',
+            [({'client': client}, stats['checkout_failures']) for client, stats in pool['per_client'].items()]),
+        ('chat_room_cache_hits_total', 'counter', 'Message reads served from a room cache', [({}, hits)]),
+        ('chat_room_cache_misses_total', 'counter', 'Message reads that went to Mongo', [({}, misses)]),
+        ('chat_room_cache_hit_ratio', 'gauge', 'Room cache hits over all reads', [({}, hits / (hits + misses) if hits + misses > 0 else 0.0)]),
+        ('chat_room_cache_messages', 'gauge', 'Messages held in room caches', [({}, sum(cache['size'] for cache in caches))]),
+        ('chat_sequence_leases_total', 'counter', 'Sequence number blocks leased from Mongo', [({}, sum(stats['leases'] for stats in allocators))]),
+        ('chat_sequence_lease_seconds_total', 'counter', 'Time spent leasing sequence number blocks', [({}, sum(stats['lease_time'] for stats in allocators))]),
+        ('chat_sequence_lock_wait_seconds_total', 'counter', 'Time senders waited on each other for a sequence number',
+            [({}, sum(stats['lock_wait_time'] for stats in allocators))]),
+        ('chat_storage_in_flight', 'gauge', 'Storage calls running or waiting for a worker', [({}, storage_executor.in_flight)]),
+        ('chat_storage_max_concurrency', 'gauge', 'Storage calls allowed at once', [({}, storage_executor.max_concurrency)]),
+        ('chat_push_subscribers', 'gauge', 'Live SSE and websocket subscribers', [({}, pushes['subscribers'])]),
+        ('chat_push_dropped_total', 'counter', 'Messages dropped for push subscribers that fell behind', [({}, pushes['dropped'])]),
+    ]
+    if (publisher := current_publisher()) is not None:
+        published = publisher.stats()
+        metrics.append(('chat_rmq_published_total', 'counter', 'Messages published to rabbit by outcome',
+                        [({'outcome': outcome}, published[outcome]) for outcome in ('confirmed', 'nacked', 'returned', 'failed')]))
+        metrics.append(('chat_rmq_publish_in_flight', 'gauge', 'Published messages waiting for a confirm', [({}, published['in_flight'])]))
+    if (consumer := current_consumer()) is not None:
+        consumed = consumer.stats()
+        metrics.append(('chat_rmq_consumed_total', 'counter', 'Deliveries from rabbit by outcome',
+                        [({'outcome': outcome}, consumed[outcome]) for outcome in ('delivered', 'handled', 'requeued')]))
+    if len(logged := logging_stats()) > 0:
+        metrics.append(('chat_log_records_dropped_total', 'counter', 'Log records dropped because the logging queue was full', [({}, logged['dropped'])]))
+    return metrics
+
+registry.add_collector(service_metrics)
+
 def main():
-    logging.basicConfig(filename='chat.log', level=logging.INFO)
     MY_IPADDRESS = socket.gethostbyname(socket.gethostname())
     MY_NAME = input("Please enter your name: ")
 
@@ -0,0 +1,119 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import asyncio
+import json
+import unittest
+from unittest import TestCase, IsolatedAsyncioTestCase
+import logging
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from constants import *
+from mongo_pool import mongo_pool
+from rmq_publisher import current_publisher, set_publisher
+from rmq_consumer import current_consumer, set_consumer
+from chat_logging import stop_logging
+from pubsub import broadcaster
+from room import ChatRoom
+from load_bench import local_app
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+api = None
+previous = None
+close_app = None
+
+def setUpModule() -> None:
+    """ The api on the stand-ins. Its globals grab their clients on import, so it's imported once for the whole module
+    """
+    global api, previous, close_app
+    previous = (mongo_pool.client_factory, current_publisher(), current_consumer())
+    _, close_app = local_app()
+    import room_chat_api
+    api = room_chat_api
+
+def tearDownModule() -> None:
+    ChatRoom.remove_message_listener(broadcaster.publish)
+    close_app()
+    stop_logging()
+    mongo_pool.client_factory = previous[0]
+    set_publisher(previous[1])
+    set_consumer(previous[2])
+
+def chat_message(sequence_num: int) -> dict:
+    return {'message': f'message {sequence_num}', 'mess_props': {'room_name': 'race-room', 'to_user': 'reader', 'sequence_num': sequence_num}}
+
+
+class CatchUpRace():
+    """ A room whose catch up ends while the live copies of the messages it just returned, and of one sent right after, are
+        still on their way through call_soon_threadsafe, so the subscription hasn't counted them yet
+    """
+    def __init__(self) -> None:
+        self.room = SimpleNamespace(room_name='race-room')
+
+    async def stream_messages(self, user_alias: str, num_messages: int, after_seq: int = None):
+        caught_up = [chat_message(1), chat_message(2)]
+        yield caught_up
+        for message in caught_up + [chat_message(3)]:
+            broadcaster.publish('race-room', message)
+
+
+class LiveMessagesTest(IsolatedAsyncioTestCase):
+    """ Testing the catch up and live hand over behind both push channels, and the SSE channel itself
+    """
+    async def test_catch_up_race(self):
+        """ The live copies of caught up messages get skipped even when they're not queued yet when the catch up ends
+        """
+        messages = api.live_messages(CatchUpRace(), after_seq=0)
+        try:
+            assert [(await anext(messages))['mess_props']['sequence_num'] for _ in range(2)] == [1, 2]
+            assert (await anext(messages))['mess_props']['sequence_num'] == 3
+        finally:
+            await messages.aclose()
+
+    async def test_events(self):
+        """ What was sent after after_seq, then what's sent live, each one as an event with its sequence number as the id
+        """
+        await api.create_room('events-room', SENDER_NAME)
+        for index in range(3):
+            await api.send_message('events-room', f'message {index}', SENDER_NAME, 'reader')
+        first_seq = list(api.get_room('events-room').get_messages())[0]['mess_props']['sequence_num']
+        response = await api.room_events('events-room', after_seq=first_seq)
+        assert response.media_type == 'text/event-stream'
+        events = response.body_iterator
+        try:
+            caught_up = [await anext(events) for _ in range(2)]
+            assert [json.loads(event.split('data: ', 1)[1])['message'] for event in caught_up] == ['message 1', 'message 2']
+            assert caught_up[0].startswith(f'id: {first_seq + 1}\n')
+            await api.send_message('events-room', 'live message', SENDER_NAME, 'reader')
+            live = await asyncio.wait_for(anext(events), timeout=2)
+            assert json.loads(live.split('data: ', 1)[1])['message'] == 'live message'
+        finally:
+            await events.aclose()
+        assert broadcaster.stats()['subscribers'] == 0
+
+    async def test_events_unknown_room(self):
+        assert (await api.room_events('no-such-room')).status_code == 404
+
+
+class WebSocketTest(TestCase):
+    """ Testing the websocket channel through the test client
+    """
+    def test_websocket(self):
+        client = TestClient(api.app)
+        assert client.post('/room', params={'room_name': 'ws-room', 'owner_alias': SENDER_NAME}).status_code == 200
+        client.post('/message/', params={'room_name': 'ws-room', 'message': 'before', 'from_alias': SENDER_NAME, 'to_alias': 'reader'})
+        with client.websocket_connect('/ws/ws-room?after_seq=0') as websocket:
+            assert json.loads(websocket.receive_text())['message'] == 'before'
+            client.post('/message/', params={'room_name': 'ws-room', 'message': 'live', 'from_alias': SENDER_NAME, 'to_alias': 'reader'})
+            assert json.loads(websocket.receive_text())['message'] == 'live'
+
+    def test_websocket_unknown_room(self):
+        with TestClient(api.app).websocket_connect('/ws/no-such-room') as websocket:
+            with self.assertRaises(WebSocketDisconnect) as closed:
+                websocket.receive_text()
+        assert closed.exception.code == 1008
+
+if __name__ == "__main__":
+    unittest.main()
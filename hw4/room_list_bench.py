@@ -0,0 +1,65 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import random
+import time
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from indexes import ensure_indexes
+from room import RoomList
+
+NUM_ROOMS = 100000
+MEMBERS_PER_ROOM = 10
+NUM_USERS = 100000
+NUM_LOOKUPS = 10000
+LIST_NAME = 'bench_rooms'
+
+
+def fill_room_list(num_rooms: int, members_per_room: int, num_users: int) -> None:
+    """ Write the room metadata documents straight to the collection, as if another process had created the rooms
+    """
+    rng = random.Random(num_rooms)
+    collection = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB,
+                                  auth_mechanism=MONGODB_AUTH_MECH).detest.get_collection(LIST_NAME)
+    ensure_indexes(collection, 'room_list')
+    for start in range(0, num_rooms, 10000):
+        collection.insert_many([{'room_name': f'room-{index}', 'owner_alias': f'user-{rng.randrange(num_users)}',
+                                 'member_list': [f'user-{rng.randrange(num_users)}' for _ in range(members_per_room)],
+                                 'room_type': ROOM_TYPE_PRIVATE} for index in range(start, min(start + 10000, num_rooms))])
+
+
+def time_per_call(function, arguments: list) -> float:
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    return (time.perf_counter() - start) / len(arguments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RoomList lookups with many rooms and memberships, on an in-memory collection')
+    parser.add_argument('--rooms', type=int, default=NUM_ROOMS)
+    parser.add_argument('--members', type=int, default=MEMBERS_PER_ROOM, help='members per room')
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--lookups', type=int, default=NUM_LOOKUPS)
+    args = parser.parse_args()
+    mongo_pool.client_factory = memory_client_factory()
+    fill_room_list(args.rooms, args.members, args.users)
+
+    room_list = RoomList(LIST_NAME)
+    start = time.perf_counter()
+    room_names = room_list.get_rooms()
+    print(f'restore: {len(room_names)} rooms, {args.rooms * args.members} memberships in {time.perf_counter() - start:.2f}s')
+
+    rng = random.Random(1)
+    names = [f'room-{rng.randrange(args.rooms)}' for _ in range(args.lookups)]
+    aliases = [f'user-{rng.randrange(args.users)}' for _ in range(args.lookups)]
+    print(f'name in room_list:     {time_per_call(room_list.__contains__, names) * 1e6:8.2f} us')
+    print(f'find_room_in_metadata: {time_per_call(room_list.find_room_in_metadata, names) * 1e6:8.2f} us')
+    print(f'find_by_owner:         {time_per_call(room_list.find_by_owner, aliases) * 1e6:8.2f} us')
+    print(f'find_by_member:        {time_per_call(room_list.find_by_member, aliases) * 1e6:8.2f} us')
+    print(f'old name in get_rooms: {time_per_call(room_names.__contains__, names[:100]) * 1e6:8.2f} us (linear scan of the name list)')
+
+
+if __name__ == "__main__":
+    main()
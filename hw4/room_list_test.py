@@ -0,0 +1,78 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from indexes import forget_ensured
+from room import RoomList, ChatRoom, forget_rooms
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class RoomListTest(TestCase):
+    """ Testing the name, owner and member indexes of RoomList, against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__client_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        forget_ensured()
+        forget_rooms()
+        self.__rooms = RoomList('test_rooms')
+        self.__rooms.create('general', 'alice', ['bob'], ROOM_TYPE_PUBLIC)
+        self.__rooms.create('private', 'bob', ['carol'])
+
+    def tearDown(self) -> None:
+        forget_rooms()
+        mongo_pool.client_factory = self.__client_factory
+
+    def test_get(self):
+        room = self.__rooms.get('general')
+        assert isinstance(room, ChatRoom)
+        assert room.owner_alias == 'alice'
+        assert self.__rooms.get('general') is room
+        assert self.__rooms.get('nowhere') is None
+        assert 'general' in self.__rooms and 'nowhere' not in self.__rooms
+        assert sorted(self.__rooms.get_rooms()) == ['general', 'private']
+
+    def test_duplicate_name(self):
+        assert self.__rooms.create('general', 'carol') is None
+        assert RoomList('test_rooms').create('general', 'carol') is None
+
+    def test_owner_and_member(self):
+        """ The owner counts as a member too
+        """
+        assert self.__rooms.find_by_owner('bob') == ['private']
+        assert self.__rooms.find_by_member('bob') == ['general', 'private']
+        assert self.__rooms.find_by_member('nobody') == []
+        self.__rooms.add_member('general', 'carol')
+        assert self.__rooms.find_by_member('carol') == ['general', 'private']
+        self.__rooms.remove_member('private', 'carol')
+        assert self.__rooms.find_by_member('carol') == ['general']
+        assert self.__rooms.find_room_in_metadata('general')['member_list'] == ['bob', 'alice', 'carol']
+
+    def test_remove(self):
+        removed = self.__rooms.get('private')
+        self.__rooms.remove('private')
+        assert 'private' not in self.__rooms
+        assert self.__rooms.find_by_owner('bob') == []
+        assert self.__rooms.find_by_member('carol') == []
+        assert 'private' not in RoomList('test_rooms')
+        # Created again, the name gets a new ChatRoom with the new owner
+        self.__rooms.create('private', 'carol')
+        assert self.__rooms.get('private') is not removed
+        assert self.__rooms.get('private').owner_alias == 'carol'
+
+    def test_restore(self):
+        """ Another RoomList on the same collection (a restart, or another process) sees the same rooms and memberships
+        """
+        self.__rooms.add_member('private', 'dave')
+        restored = RoomList('test_rooms')
+        assert sorted(restored.get_rooms()) == ['general', 'private']
+        assert restored.find_by_member('dave') == ['private']
+        assert restored.find_room_in_metadata('general')['room_type'] == ROOM_TYPE_PUBLIC
+
+if __name__ == "__main__":
+    unittest.main()
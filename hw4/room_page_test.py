@@ -0,0 +1,90 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import json
+import unittest
+from unittest import TestCase
+import logging
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from room import ChatRoom, MessageProperties
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class RoomPageTest(TestCase):
+    """ Testing keyset pagination on sequence number, against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        self.__room = ChatRoom('page-room')
+        for index in range(25):
+            self.__room.send_message(f'message {index}', SENDER_NAME, MessageProperties('page-room', 'page-user', SENDER_NAME, MESSAGE_TYPE_SENT))
+        self.__room.send_message('for somebody else', SENDER_NAME, MessageProperties('page-room', 'other-user', SENDER_NAME, MESSAGE_TYPE_SENT))
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def test_forward_pages(self):
+        """ Following next_cursor walks the whole history exactly once, in order
+        """
+        seen = []
+        page = self.__room.get_page('page-user', limit=10)
+        while True:
+            seen.extend(message['message'] for message in page['messages'])
+            if page['has_more'] is False:
+                break
+            page = self.__room.get_page('page-user', after_seq=page['next_cursor'], limit=10)
+        assert seen == [f'message {index}' for index in range(25)]
+
+    def test_poll_for_new(self):
+        """ Polling with the last next_cursor only returns what was sent since
+        """
+        page = self.__room.get_page('page-user', limit=100)
+        assert page['has_more'] is False
+        assert self.__room.get_page('page-user', after_seq=page['next_cursor'])['messages'] == []
+        self.__room.send_message('new one', SENDER_NAME, MessageProperties('page-room', 'page-user', SENDER_NAME, MESSAGE_TYPE_SENT))
+        new_page = self.__room.get_page('page-user', after_seq=page['next_cursor'])
+        assert [message['message'] for message in new_page['messages']] == ['new one']
+        assert new_page['next_cursor'] > page['next_cursor']
+
+    def test_backward_pages(self):
+        """ before_seq gives the newest messages before the cursor, still oldest first
+        """
+        latest = self.__room.get_page('page-user', limit=100)
+        page = self.__room.get_page('page-user', before_seq=latest['next_cursor'], limit=5)
+        assert [message['message'] for message in page['messages']] == [f'message {index}' for index in range(19, 24)]
+        assert page['has_more'] is True
+        older = self.__room.get_page('page-user', before_seq=page['prev_cursor'], limit=5)
+        assert [message['message'] for message in older['messages']] == [f'message {index}' for index in range(14, 19)]
+
+    def test_get_all_messages(self):
+        """ GET_ALL_MESSAGES means no limit, the whole room for every recipient
+        """
+        assert len(list(self.__room.get_messages(num_messages=GET_ALL_MESSAGES))) == 26
+
+    def test_json_pages_match(self):
+        """ The JSON listings say the same as get_page, from the cache and from Mongo (raw BSON) alike, just without the _id
+        """
+        uncached = ChatRoom('page-room', cache_size=3)
+        for room in (self.__room, uncached):
+            for kwargs in ({'limit': 10}, {'after_seq': 5, 'limit': 10}, {'before_seq': 20, 'limit': 4}, {'latest': True, 'limit': 3}):
+                page = room.get_page('page-user', **kwargs)
+                for message in page['messages']:
+                    message.pop('_id', None)
+                    for field in ('sent_time', 'rec_time'):
+                        message['mess_props'][field] = message['mess_props'][field].isoformat()[:23]
+                json_page = json.loads(room.get_page_json('page-user', **kwargs))
+                for message in json_page['messages']:
+                    assert '_id' not in message
+                    for field in ('sent_time', 'rec_time'):
+                        message['mess_props'][field] = message['mess_props'][field][:23]
+                assert json_page == page
+        assert [message['message'] for message in json.loads(uncached.get_messages_json('page-user'))] == [f'message {index}' for index in range(25)]
+        assert json.loads(uncached.get_messages_json('nobody')) == []
+        assert uncached.cache_stats()['misses'] > 0
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import heapq
+import math
+import re
+import threading
+from datetime import datetime
+from constants import *
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# Mongo's $text syntax: "a phrase" has to appear as is, -word must not appear, the other words are OR'ed
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(-?)(\w+)')
+# What a search result carries besides the score, the same fields as a message listing
+SEARCH_PROJECTION = {'_id': False, 'message': True, 'mess_props': True, 'score': {'$meta': 'textScore'}}
+SEARCH_SORT = [('score', {'$meta': 'textScore'}), ('mess_props.sequence_num', -1)]
+
+
+def tokenize(text: str) -> list:
+    """ Lower case words, how both the inverted index and the in-memory Mongo stand-in split text
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def parse_search(text: str) -> tuple:
+    """ (terms, phrases, excluded) of a search string. Terms are every word that counts towards the score, phrase words included
+    """
+    terms, phrases, excluded = [], [], []
+    for phrase, negated, word in QUERY_PATTERN.findall(text):
+        if phrase:
+            phrases.append(phrase.lower())
+            terms.extend(tokenize(phrase))
+        elif negated:
+            excluded.append(word.lower())
+        else:
+            terms.append(word.lower())
+    return terms, phrases, excluded
+
+def clamp_page(offset: int, limit: int) -> tuple:
+    """ Pages are offsets into the ranking, which only goes SEARCH_MAX_RESULTS deep: ranked results can't be keyset paginated, and
+        skipping far into a sorted text search costs as much as reading everything before it
+    """
+    return max(0, min(offset, SEARCH_MAX_RESULTS)), max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+
+def _page(ranked: list, offset: int, limit: int) -> dict:
+    """ ranked holds up to offset + limit + 1 results, the extra one tells us there's another page
+    """
+    results = ranked[offset:offset + limit]
+    has_more = len(ranked) > offset + limit and offset + limit < SEARCH_MAX_RESULTS
+    return {'results': results, 'offset': offset, 'next_offset': offset + len(results) if has_more is True else None, 'has_more': has_more}
+
+def search_filter(text: str, room_names: list = None, from_user: str = None, to_user: str = None, sent_after: datetime = None, sent_before: datetime = None) -> dict:
+    """ The Mongo filter for a text search with the optional room, sender, recipient and sent time (after inclusive, before
+        exclusive) filters, all of them on fields the messages indexes lead with or the text index itself
+    """
+    query = {'$text': {'$search': text}}
+    if room_names is not None:
+        query['mess_props.room_name'] = room_names[0] if len(room_names) == 1 else {'$in': list(room_names)}
+    if from_user is not None:
+        query['mess_props.from_user'] = from_user
+    if to_user is not None:
+        query['mess_props.to_user'] = to_user
+    sent_range = {}
+    if sent_after is not None:
+        sent_range['$gte'] = sent_after
+    if sent_before is not None:
+        sent_range['$lt'] = sent_before
+    if len(sent_range) > 0:
+        query['mess_props.sent_time'] = sent_range
+    return query
+
+def search_collections(targets: list, text: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE, **filters) -> dict:
+    """ One page of ranked results from Mongo's text index. targets is a list of (collection, room names or None for all of them),
+            one entry for the shared messages collection, one per room in the collection per room layout. With several we ask each
+            for the first offset + limit + 1 and merge on score
+        Each result is a listing dict (message, mess_props) plus its score
+    """
+    offset, limit = clamp_page(offset, limit)
+    ranked = []
+    for collection, room_names in targets:
+        cursor = collection.find(search_filter(text, room_names, **filters), SEARCH_PROJECTION).sort(SEARCH_SORT).limit(offset + limit + 1)
+        ranked.extend(cursor)
+    if len(targets) > 1:
+        ranked.sort(key=lambda result: (result['score'], result['mess_props']['sequence_num']), reverse=True)
+    return _page(ranked, offset, limit)
+
+
+class SearchIndex():
+    """ Incremental inverted index for messages that only live in memory (the rmq queues). Each term maps to the keys of the messages
+            with it and how often, so a search only touches the postings of its terms. Ranked with BM25, ties go to the larger
+            (newer) key. add and remove as the messages come and go
+        Keys have to be orderable, values are whatever the caller wants back
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.__k1 = k1
+        self.__b = b
+        self.__postings = {}
+        # key -> (lower case text, number of terms, fields, value)
+        self.__documents = {}
+        self.__total_terms = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__documents)
+
+    def add(self, key, text: str, value = None, room_name: str = None, from_user: str = None, to_user: str = None, sent_time: datetime = None) -> None:
+        terms = tokenize(text)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self.__lock:
+            if key in self.__documents:
+                self.__remove(key)
+            for term, count in counts.items():
+                self.__postings.setdefault(term, {})[key] = count
+            self.__documents[key] = (text.lower(), len(terms), (room_name, from_user, to_user, sent_time), value)
+            self.__total_terms += len(terms)
+
+    def remove(self, key) -> None:
+        with self.__lock:
+            if key in self.__documents:
+                self.__remove(key)
+
+    def __remove(self, key) -> None:
+        text, length, _, _ = self.__documents.pop(key)
+        self.__total_terms -= length
+        for term in set(tokenize(text)):
+            postings = self.__postings[term]
+            del postings[key]
+            if len(postings) == 0:
+                del self.__postings[term]
+
+    @staticmethod
+    def __wanted(fields: tuple, room_names: list, from_user: str, to_user: str, sent_after: datetime, sent_before: datetime) -> bool:
+        room_name, sender, recipient, sent_time = fields
+        if room_names is not None and room_name not in room_names:
+            return False
+        if (from_user is not None and sender != from_user) or (to_user is not None and recipient != to_user):
+            return False
+        if sent_after is not None and (sent_time is None or sent_time < sent_after):
+            return False
+        return sent_before is None or (sent_time is not None and sent_time < sent_before)
+
+    def search(self, text: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE, room_names: list = None, from_user: str = None, to_user: str = None,
+               sent_after: datetime = None, sent_before: datetime = None) -> dict:
+        """ One page of (value, score), best first, the same shape as search_collections
+        """
+        offset, limit = clamp_page(offset, limit)
+        terms, phrases, excluded = parse_search(text)
+        with self.__lock:
+            num_documents = len(self.__documents)
+            if num_documents == 0:
+                return _page([], offset, limit)
+            average_length = self.__total_terms / num_documents or 1
+            scores = {}
+            for term in set(terms):
+                postings = self.__postings.get(term, {})
+                idf = math.log(1 + (num_documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, count in postings.items():
+                    length = self.__documents[key][1]
+                    scores[key] = scores.get(key, 0.0) + idf * count * (self.__k1 + 1) / (count + self.__k1 * (1 - self.__b + self.__b * length / average_length))
+            excluded_keys = set().union(*(self.__postings.get(term, {}) for term in excluded))
+            candidates = []
+            for key, score in scores.items():
+                lowered, _, fields, value = self.__documents[key]
+                if key in excluded_keys or not all(phrase in lowered for phrase in phrases):
+                    continue
+                if self.__wanted(fields, room_names, from_user, to_user, sent_after, sent_before):
+                    candidates.append((score, key, value))
+        ranked = heapq.nlargest(offset + limit + 1, candidates, key=lambda candidate: (candidate[0], candidate[1]))
+        return _page([(value, score) for score, _, value in ranked], offset, limit)
@@ -0,0 +1,115 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import itertools
+import random
+import re
+import statistics
+import time
+from datetime import datetime, timedelta
+from pymongo import TEXT
+from constants import *
+from search import SearchIndex, search_collections
+
+NUM_MESSAGES = 1000000
+NUM_ROOMS = 100
+VOCABULARY = 20000
+NUM_QUERIES = 200
+
+
+def make_corpus(num_messages: int, num_rooms: int, seed: int) -> list:
+    """ (text, room_name, from_user, sent_time) with Zipf distributed words, so some words are in most messages and most are rare
+    """
+    rng = random.Random(seed)
+    words = [f'w{index}' for index in range(VOCABULARY)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(VOCABULARY)))
+    start = datetime(2023, 1, 1)
+    corpus = []
+    for index in range(num_messages):
+        text = ' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(5, 15)))
+        corpus.append((text, f'room-{rng.randrange(num_rooms)}', f'user-{rng.randrange(1000)}', start + timedelta(seconds=index)))
+    return corpus
+
+
+def make_queries(num_queries: int, seed: int) -> list:
+    """ A mix of one common word, one rare word, two words, and a word in one room
+    """
+    rng = random.Random(seed)
+    queries = []
+    for index in range(num_queries):
+        kind = index % 4
+        if kind == 0:
+            queries.append((f'w{rng.randrange(10)}', None))
+        elif kind == 1:
+            queries.append((f'w{rng.randrange(1000, VOCABULARY)}', None))
+        elif kind == 2:
+            queries.append((f'w{rng.randrange(100)} w{rng.randrange(100, 5000)}', None))
+        else:
+            queries.append((f'w{rng.randrange(100, 1000)}', [f'room-{rng.randrange(NUM_ROOMS)}']))
+    return queries
+
+
+def latencies(search, queries: list) -> list:
+    times = []
+    for text, room_names in queries:
+        start = time.perf_counter()
+        search(text, room_names)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list) -> None:
+    times = sorted(times)
+    print(f'{name}: p50 {statistics.median(times) * 1e3:9.2f} ms, p99 {times[int(len(times) * 0.99)] * 1e3:9.2f} ms, '
+          f'mean {statistics.fmean(times) * 1e3:9.2f} ms over {len(times)} queries')
+
+
+def regex_scan(corpus: list):
+    """ What search looks like without an index: every message against a word boundary regex, then sort the hits
+    """
+    def search(text: str, room_names: list):
+        pattern = re.compile('|'.join(rf'\b{re.escape(word)}\b' for word in text.split()))
+        hits = [(len(pattern.findall(message)), index) for index, (message, room_name, _, _) in enumerate(corpus)
+                if (room_names is None or room_name in room_names) and pattern.search(message)]
+        return sorted(hits, reverse=True)[:SEARCH_PAGE_SIZE]
+    return search
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search latency over a large corpus: regex scan vs the inverted index (vs Mongo text index with --mongo)')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--queries', type=int, default=NUM_QUERIES)
+    parser.add_argument('--scan-queries', type=int, default=20, help='the regex scan gets fewer queries, each one reads everything')
+    parser.add_argument('--mongo', action='store_true', help='also load the corpus into the configured mongod and time $text against $regex')
+    parser.add_argument('--seed', type=int, default=313)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    corpus = make_corpus(args.messages, NUM_ROOMS, args.seed)
+    queries = make_queries(args.queries, args.seed)
+    print(f'{args.messages} messages generated in {time.perf_counter() - start:.1f}s')
+
+    report('regex scan    ', latencies(regex_scan(corpus), queries[:args.scan_queries]))
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    for key, (text, room_name, from_user, sent_time) in enumerate(corpus):
+        index.add(key, text, key, room_name=room_name, from_user=from_user, sent_time=sent_time)
+    print(f'inverted index built in {time.perf_counter() - start:.1f}s ({(time.perf_counter() - start) / args.messages * 1e6:.1f} us/message)')
+    report('inverted index', latencies(lambda text, room_names: index.search(text, room_names=room_names), queries))
+
+    if args.mongo is True:
+        from mongo_pool import get_mongo_client
+        collection = get_mongo_client(host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USER, password=MONGODB_PASS, auth_source=MONGO_DB, auth_mechanism=MONGODB_AUTH_MECH).detest.get_collection('search-bench')
+        collection.drop()
+        for batch_start in range(0, len(corpus), 10000):
+            collection.insert_many([{'message': text, 'mess_props': {'room_name': room_name, 'from_user': from_user, 'sent_time': sent_time, 'sequence_num': key}}
+                                    for key, (text, room_name, from_user, sent_time) in enumerate(corpus[batch_start:batch_start + 10000], batch_start)])
+        collection.create_index([('message', TEXT)], default_language=SEARCH_LANGUAGE)
+        report('mongo $text   ', latencies(lambda text, room_names: search_collections([(collection, room_names)], text), queries))
+        report('mongo $regex  ', latencies(lambda text, room_names: list(collection.find({'message': {'$regex': '|'.join(rf'\b{word}\b' for word in text.split())}})
+                                                                        .limit(SEARCH_PAGE_SIZE)), queries[:args.scan_queries]))
+        collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import unittest
+from unittest import TestCase
+import logging
+from datetime import datetime, timedelta
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from indexes import forget_ensured, ensure_indexes
+from layout import room_collection, ROOM_INDEX_KINDS
+from room import ChatRoom, MessageProperties, search_rooms
+from search import SearchIndex, parse_search
+import rmq
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class SearchIndexTest(TestCase):
+    """ Testing the in-memory inverted index
+    """
+    def setUp(self) -> None:
+        self.__start = datetime(2023, 5, 1)
+        self.__index = SearchIndex()
+        texts = ['the deploy failed again', 'deploy went fine', 'lunch at noon', 'deploy failed, rolling back the deploy', 'failed lunch order']
+        for key, text in enumerate(texts):
+            self.__index.add(key, text, text, room_name='ops' if key < 4 else 'food', from_user=f'user{key % 2}', to_user='team',
+                             sent_time=self.__start + timedelta(hours=key))
+
+    def __texts(self, page: dict) -> list:
+        return [value for value, _ in page['results']]
+
+    def test_ranking(self):
+        """ More of the search words (and more often) ranks higher, ties go to the newer message
+        """
+        assert self.__texts(self.__index.search('deploy failed')) == ['deploy failed, rolling back the deploy', 'the deploy failed again',
+                                                                       'failed lunch order', 'deploy went fine']
+
+    def test_syntax(self):
+        assert parse_search('deploy "rolling back" -lunch') == (['deploy', 'rolling', 'back'], ['rolling back'], ['lunch'])
+        assert self.__texts(self.__index.search('"rolling back"')) == ['deploy failed, rolling back the deploy']
+        assert self.__texts(self.__index.search('failed -deploy')) == ['failed lunch order']
+
+    def test_filters(self):
+        assert self.__texts(self.__index.search('failed', room_names=['food'])) == ['failed lunch order']
+        assert self.__texts(self.__index.search('deploy', from_user='user1')) == ['deploy failed, rolling back the deploy', 'deploy went fine']
+        in_range = self.__index.search('deploy', sent_after=self.__start + timedelta(hours=1), sent_before=self.__start + timedelta(hours=3))
+        assert self.__texts(in_range) == ['deploy went fine']
+
+    def test_pages_and_removal(self):
+        first = self.__index.search('deploy failed lunch', limit=2)
+        second = self.__index.search('deploy failed lunch', offset=first['next_offset'], limit=2)
+        last = self.__index.search('deploy failed lunch', offset=second['next_offset'], limit=2)
+        assert first['has_more'] is True and second['has_more'] is True and last['has_more'] is False and last['next_offset'] is None
+        assert len(set(self.__texts(first) + self.__texts(second) + self.__texts(last))) == 5
+        self.__index.remove(3)
+        assert len(self.__index) == 4
+        assert 'deploy failed, rolling back the deploy' not in self.__texts(self.__index.search('deploy'))
+
+
+class RoomSearchTest(TestCase):
+    """ Testing room search through the text index, against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        forget_ensured()
+        self.__start = datetime(2023, 5, 1)
+        self.__db = get_mongo_client().detest
+        ensure_indexes(room_collection(self.__db, ''), ROOM_INDEX_KINDS[LAYOUT_PARTITIONED])
+        self.__rooms = {name: ChatRoom(name, create_new=True) for name in ('ops', 'food')}
+        self.__send('ops', 'the deploy failed again', 'alice', 0)
+        self.__send('ops', 'deploy went fine', 'bob', 1)
+        self.__send('ops', 'deploy failed, rolling back the deploy', 'alice', 2)
+        self.__send('food', 'failed lunch order', 'bob', 3)
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def __send(self, room_name: str, text: str, from_user: str, hours: int) -> None:
+        sent_time = self.__start + timedelta(hours=hours)
+        self.__rooms[room_name].send_message(text, from_user, MessageProperties(room_name, 'team', from_user, MESSAGE_TYPE_SENT, sent_time=sent_time, rec_time=sent_time))
+
+    @staticmethod
+    def __texts(page: dict) -> list:
+        return [result['message'] for result in page['results']]
+
+    def test_room_search(self):
+        page = self.__rooms['ops'].search_messages('failed')
+        assert sorted(self.__texts(page)) == ['deploy failed, rolling back the deploy', 'the deploy failed again']
+        assert all(result['score'] > 0 and '_id' not in result for result in page['results'])
+        assert self.__texts(self.__rooms['ops'].search_messages('deploy', from_user='bob')) == ['deploy went fine']
+        assert self.__texts(self.__rooms['ops'].search_messages('deploy', sent_after=self.__start + timedelta(hours=2))) == ['deploy failed, rolling back the deploy']
+
+    def test_pages(self):
+        ranked = self.__texts(self.__rooms['ops'].search_messages('deploy failed'))
+        first = self.__rooms['ops'].search_messages('deploy failed', limit=2)
+        second = self.__rooms['ops'].search_messages('deploy failed', offset=first['next_offset'], limit=2)
+        assert first['has_more'] is True and second['has_more'] is False
+        assert self.__texts(first) + self.__texts(second) == ranked
+
+    def test_across_rooms(self):
+        assert len(search_rooms('failed')['results']) == 3
+        assert self.__texts(search_rooms('failed', room_names=['food'])) == ['failed lunch order']
+
+    def test_across_room_collections(self):
+        """ The collection per room layout asks each room and merges on score
+        """
+        for name in ('north', 'south'):
+            ensure_indexes(room_collection(self.__db, name, LAYOUT_PER_ROOM), ROOM_INDEX_KINDS[LAYOUT_PER_ROOM])
+            room = ChatRoom(name, create_new=True, layout=LAYOUT_PER_ROOM)
+            room.send_message(f'{name} wind', SENDER_NAME, MessageProperties(name, 'team', SENDER_NAME, MESSAGE_TYPE_SENT))
+        assert sorted(self.__texts(search_rooms('wind', ['north', 'south'], LAYOUT_PER_ROOM))) == ['north wind', 'south wind']
+        with self.assertRaises(ValueError):
+            search_rooms('wind', layout=LAYOUT_PER_ROOM)
+
+    def test_find_message(self):
+        found = self.__rooms['ops'].find_message('deploy went fine')
+        assert found.mess_props.to_dict()['from_user'] == 'bob'
+        assert self.__rooms['ops'].find_message('failed lunch order') is None
+
+
+class QueueSearchTest(TestCase):
+    """ Testing find_message and search on the rmq queue deque
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def test_queue_search(self):
+        queue = rmq.ChatRoom('search-queue', cache_size=3)
+        for index in range(5):
+            queue.put(rmq.ChatMessage(f'status update {index}', rmq.MessProperties(MESSAGE_TYPE_SENT, 'team', SENDER_NAME)))
+        assert queue.find_message('status update 4').message == 'status update 4'
+        assert queue.find_message('status update 0') is None
+        # Only what's still in the deque is searchable, newest first between equals
+        assert [result['message'] for result in queue.search_messages('status')['results']] == ['status update 4', 'status update 3', 'status update 2']
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import logging
+import threading
+import time
+from pymongo import ReturnDocument
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+
+class SequenceAllocator():
+    """ Hands out sequence numbers for one key (normally a room name) from blocks leased out of the sequence collection.
+        Leasing a block is a single $inc of block_size on the key's counter document, after that every number in the block is handed out
+            from memory, so send_message no longer does a remote atomic write per message.
+        Numbers are unique per key across processes and strictly increasing within a process and across restarts, since a restarted
+            process always leases past the last block anybody took. Numbers left in a block when the process exits are skipped, not reused.
+        If legacy_key is set, the first lease makes sure the counter starts above that (old, shared) counter document so new numbers
+            sort after anything that was written with it.
+    """
+    def __init__(self, seq_collection, key: str, block_size: int = SEQUENCE_BLOCK_SIZE, legacy_key: str = None) -> None:
+        if block_size < 1:
+            raise ValueError('block_size must be at least 1')
+        self.__seq_collection = seq_collection
+        self.__key = key
+        self.__block_size = block_size
+        self.__legacy_key = legacy_key
+        self.__lock = threading.Lock()
+        self.__next = 0
+        self.__high = -1
+        self.__issued = 0
+        self.__leases = 0
+        self.__lease_time = 0.0
+        self.__lock_waits = 0
+        self.__lock_wait_time = 0.0
+
+    @property
+    def key(self) -> str:
+        return self.__key
+
+    @property
+    def block_size(self) -> int:
+        return self.__block_size
+
+    def next(self) -> int:
+        """ Return the next number, leasing a new block first if the current one is used up
+        """
+        if not self.__lock.acquire(blocking=False):
+            wait_start = time.perf_counter()
+            self.__lock.acquire()
+            self.__lock_waits += 1
+            self.__lock_wait_time += time.perf_counter() - wait_start
+        try:
+            if self.__next > self.__high:
+                self.__lease()
+            sequence_num = self.__next
+            self.__next += 1
+            self.__issued += 1
+            return sequence_num
+        finally:
+            self.__lock.release()
+
+    def stats(self) -> dict:
+        """ How many numbers we handed out, how many round trips that took and how often callers had to wait on each other
+        """
+        return {'key': self.__key,
+            'block_size': self.__block_size,
+            'issued': self.__issued,
+            'leases': self.__leases,
+            'lease_time': self.__lease_time,
+            'lock_waits': self.__lock_waits,
+            'lock_wait_time': self.__lock_wait_time,
+            'remaining': max(self.__high - self.__next + 1, 0),
+        }
+
+    def __lease(self) -> None:
+        """ Take the next block. Called with the lock held
+        """
+        lease_start = time.perf_counter()
+        if self.__leases == 0 and self.__legacy_key is not None:
+            self.__raise_floor()
+        counter = self.__seq_collection.find_one_and_update(
+                                                {'_id': self.__key},
+                                                {'$inc': {'seq': self.__block_size}},
+                                                projection={'seq': True, '_id': False},
+                                                upsert=True,
+                                                return_document=ReturnDocument.AFTER)
+        self.__high = counter['seq']
+        self.__next = self.__high - self.__block_size + 1
+        self.__leases += 1
+        self.__lease_time += time.perf_counter() - lease_start
+        logger.debug('Leased sequence block %d-%d for %s', self.__next, self.__high, self.__key)
+
+    def __raise_floor(self) -> None:
+        """ Move our counter up to the legacy counter if it is behind. $max never moves it down so this is safe to repeat
+        """
+        legacy = self.__seq_collection.find_one({'_id': self.__legacy_key}, projection={'seq': True, '_id': False})
+        if legacy is not None and legacy.get('seq') is not None:
+            self.__seq_collection.update_one({'_id': self.__key}, {'$max': {'seq': legacy['seq']}}, upsert=True)
+
+
+# One allocator per counter document per process, otherwise two ChatRoom instances for the same room would each lease blocks
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+def get_allocator(seq_collection, key: str, block_size: int = SEQUENCE_BLOCK_SIZE, legacy_key: str = None) -> SequenceAllocator:
+    """ Return the process wide allocator for this collection and key, creating it on first use
+    """
+    registry_key = (seq_collection.full_name, key)
+    with _allocators_lock:
+        if (allocator := _allocators.get(registry_key)) is None:
+            allocator = SequenceAllocator(seq_collection, key, block_size, legacy_key)
+            _allocators[registry_key] = allocator
+        return allocator
+
+def allocator_stats() -> list:
+    """ Stats for every allocator in this process
+    """
+    with _allocators_lock:
+        return [allocator.stats() for allocator in _allocators.values()]
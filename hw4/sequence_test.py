@@ -0,0 +1,109 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import threading
+import unittest
+from unittest import TestCase
+import logging
+from constants import *
+from sequence import SequenceAllocator
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool
+from room import ChatRoom, MessageProperties
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class CounterCollection():
+    """ Just enough of a pymongo collection for the allocator: counter documents with $inc, $max and upsert
+    """
+    def __init__(self) -> None:
+        self.full_name = 'detest.sequence'
+        self.documents = {}
+        self.round_trips = 0
+
+    def find_one(self, filter: dict, projection: dict = None):
+        self.round_trips += 1
+        document = self.documents.get(filter['_id'])
+        return None if document is None else {'seq': document['seq']}
+
+    def find_one_and_update(self, filter: dict, update: dict, projection: dict = None, upsert: bool = False, return_document = None):
+        self.round_trips += 1
+        document = self.documents.setdefault(filter['_id'], {'seq': 0})
+        document['seq'] += update['$inc']['seq']
+        return {'seq': document['seq']}
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        self.round_trips += 1
+        document = self.documents.setdefault(filter['_id'], {'seq': 0})
+        document['seq'] = max(document['seq'], update['$max']['seq'])
+
+
+class SequenceTest(TestCase):
+    """ Testing the block leasing sequence allocator
+    """
+    def setUp(self) -> None:
+        self.__collection = CounterCollection()
+
+    def test_one_round_trip_per_block(self):
+        """ 2500 numbers with a block of 1000 should only need three leases
+        """
+        allocator = SequenceAllocator(self.__collection, 'test-room', block_size=1000)
+        numbers = [allocator.next() for _ in range(2500)]
+        assert numbers == list(range(1, 2501))
+        assert self.__collection.round_trips == 3
+        assert allocator.stats()['leases'] == 3
+
+    def test_increasing_across_restarts(self):
+        """ A new allocator (a restarted process) has to start past everything the old one could have handed out
+        """
+        first = SequenceAllocator(self.__collection, 'test-room', block_size=10)
+        last_before_restart = [first.next() for _ in range(3)][-1]
+        second = SequenceAllocator(self.__collection, 'test-room', block_size=10)
+        assert second.next() > last_before_restart
+
+    def test_starts_after_legacy_counter(self):
+        """ Rooms that used the shared userid counter must not go back to 1
+        """
+        self.__collection.documents['userid'] = {'seq': 42}
+        allocator = SequenceAllocator(self.__collection, 'test-room', block_size=10, legacy_key='userid')
+        assert allocator.next() == 43
+
+    def test_unique_under_threads(self):
+        """ Threads share one allocator, every number must come out exactly once
+        """
+        allocator = SequenceAllocator(self.__collection, 'test-room', block_size=50)
+        results = []
+        def worker():
+            results.extend(allocator.next() for _ in range(1000))
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == list(range(1, 8001))
+        assert allocator.stats()['issued'] == 8000
+
+class ChatRoomSequenceTest(TestCase):
+    """ Testing the numbers ChatRoom.send_message hands out, against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__previous_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__previous_factory
+
+    def test_reused_props(self):
+        """ One MessageProperties for every send: each message still gets its own, increasing number and the props are left alone
+        """
+        room = ChatRoom('sequence-room')
+        mess_props = MessageProperties('sequence-room', 'sequence-user', SENDER_NAME, MESSAGE_TYPE_SENT)
+        for index in range(3):
+            assert room.send_message(f'message {index}', SENDER_NAME, mess_props) is True
+        assert mess_props.sequence_num == -1
+        numbers = [message['mess_props']['sequence_num'] for message in room.get_messages('sequence-user')]
+        assert len(numbers) == 3 and numbers == sorted(set(numbers))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import asyncio
+import resource
+import time
+from datetime import datetime
+from bson import ObjectId
+from constants import *
+from async_store import AsyncChatRoom
+from message_stream import stream_chunks
+
+NUM_MESSAGES = 1000000
+
+
+class HugeRoom():
+    """ A room whose get_messages is a lazy cursor over num_messages documents, like pymongo's
+    """
+    def __init__(self, num_messages: int = NUM_MESSAGES) -> None:
+        self.num_messages = num_messages
+
+    def get_messages(self, user_alias: str = None, num_messages: int = GET_ALL_MESSAGES, after_seq: int = None, before_seq: int = None):
+        sent_time = datetime.now()
+        return ({'_id': ObjectId(), 'message': f'message number {index}',
+                'mess_props': {'room_name': 'huge-room', 'mess_type': MESSAGE_TYPE_SENT, 'to_user': 'reader', 'from_user': SENDER_NAME,
+                            'sent_time': sent_time, 'rec_time': sent_time, 'sequence_num': index}}
+                for index in range(self.num_messages))
+
+
+async def drain(room: HugeRoom, stream_format: str) -> tuple:
+    """ Stream the whole room and throw the bytes away like a socket would. Returns the lines and bytes sent
+    """
+    chunks, _ = stream_chunks(AsyncChatRoom(room).stream_messages('reader', GET_ALL_MESSAGES), stream_format)
+    lines = 0
+    size = 0
+    async for chunk in chunks:
+        lines += chunk.count(b'\n')
+        size += len(chunk)
+    return lines, size
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming a huge room as NDJSON, time and peak RSS. Run it in its own process: ru_maxrss is the peak so far')
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--format', choices=['ndjson', 'json'], default='ndjson')
+    args = parser.parse_args()
+
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    lines, size = asyncio.run(drain(HugeRoom(args.messages), args.format))
+    elapsed = time.perf_counter() - start
+    print(f'{args.format}: {args.messages} messages, {lines} lines, {size} bytes in {elapsed:.3f}s ({elapsed / args.messages * 1e6:.2f} us/message)')
+    print(f'peak RSS {peak_rss_mb():.1f} MB, grew {peak_rss_mb() - before:.1f} MB while streaming')
+
+
+if __name__ == "__main__":
+    main()
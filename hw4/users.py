@@ -2,26 +2,52 @@
 """
 import queue
 import logging
+import threading
 from datetime import date, datetime
-from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from mongo_pool import get_mongo_client
+from indexes import ensure_indexes, ensure_unique_indexes
 from constants import *
 
-logging.basicConfig(filename='chatroom.log', level=logging.DEBUG, filemode='w')
+# Only entry points configure logging (chat_logging.setup_logging), per method tracing is debug and off by default
+logger = logging.getLogger(__name__)
 
 class ChatUser():
     """ Class for users of the chat system. Users must be registered 
     """
-    def __init__(self, alias: str, user_id = None, create_time: datetime = datetime.now(), modify_time: datetime = datetime.now()) -> None:
-        logging.info(f'Initializing ChatUser')
+    __slots__ = ('__alias', '__user_id', '__create_time', '__modify_time', '__dirty')
+
+    def __init__(self, alias: str, user_id = None, create_time: datetime = None, modify_time: datetime = None) -> None:
+        """ Without create_time/modify_time the user is stamped now. Not as defaults, those would be the time users.py was imported
+        """
+        logger.debug('Initializing ChatUser')
         self.__alias = alias
         self.__user_id = user_id 
-        self.__create_time = create_time
-        self.__modify_time = modify_time
+        self.__create_time = create_time if create_time is not None else datetime.now()
+        self.__modify_time = modify_time if modify_time is not None else self.__create_time
         if self.__user_id is not None:
             self.__dirty = False
         else:
             self.__dirty = True
 
+    @property
+    def alias(self) -> str:
+        return self.__alias
+
+    @property
+    def user_id(self):
+        return self.__user_id
+
+    @property
+    def dirty(self) -> bool:
+        return self.__dirty
+
+    def saved(self, user_id) -> None:
+        """ Mongo has this user now, under user_id
+        """
+        self.__user_id = user_id
+        self.__dirty = False
+
     def to_dict(self):
         return {
                 'alias': self.__alias,
@@ -31,54 +57,139 @@ class ChatUser():
         
 class UserList(list):
     """ List of users, inheriting list class
+        Next to the list we keep a dict from alias to user, so checking an alias (every send does) doesn't depend on how many users
+            there are. Mongo has a unique index on alias, so two processes can't register the same alias either
+        Users are loaded from Mongo when they're first asked for (get_all_users loads them all), and so is the document for the list
+            itself (only __persist needs it), so making a UserList never waits on Mongo
     """
     def __init__(self, list_name: str = DEFAULT_USER_LIST_NAME) -> None:
-        logging.info(f'Initializing UserList')
+        logger.debug('Initializing UserList')
         self.__user_list = list()
-        self.__mongo_client = MongoClient('mongodb://34.94.157.136:27017/')
+        self.__user_index = dict()
+        self.__lock = threading.Lock()
+        self.__loaded_all = False
+        self.__mongo_client = get_mongo_client(host=MONGODB_URL)
         self.__mongo_db = self.__mongo_client.detest
         self.__mongo_collection = self.__mongo_db.users    
-        if self.__restore() is True:
-            self.__dirty = False
-        else:
-            self.__name = list_name
-            self.__create_time = datetime.now()
-            self.__modify_time = datetime.now()
-            self.__dirty = True
+        ensure_indexes(self.__mongo_collection, 'users', wait=False)
+        self.__name = list_name
+        self.__create_time = datetime.now()
+        self.__modify_time = self.__create_time
+        self.__dirty = True
+        self.__restored = False
             
     
     def register(self, new_alias: str) -> ChatUser:
-        """ Register a new user alias 
+        """ Register a new user alias and save it to Mongo straight away. Returns None if the alias is already taken, here or by
+            another process
         """
-        self.__user_list.append(ChatUser(new_alias))
-        self.__dirty = True
-        return self.__user_list[-1]
+        if self.get(new_alias) is not None:
+            return None
+        new_user = ChatUser(new_alias)
+        ensure_unique_indexes(self.__mongo_collection, 'users')
+        try:
+            new_user.saved(self.__mongo_collection.insert_one(new_user.to_dict()).inserted_id)
+        except DuplicateKeyError:
+            logger.info('Alias %s was registered somewhere else', new_alias)
+            return None
+        self.__add(new_user)
+        return new_user
+
+    def register_many(self, new_aliases: list) -> list:
+        """ Register a batch of aliases with one unordered bulk insert. Aliases that are taken (or repeated in the batch) are
+            skipped, the return is the list of users that did get registered
+        """
+        new_users = list()
+        seen = set()
+        for new_alias in new_aliases:
+            if new_alias in seen or new_alias in self.__user_index:
+                continue
+            seen.add(new_alias)
+            new_users.append(ChatUser(new_alias))
+        if len(new_users) == 0:
+            return []
+        documents = [new_user.to_dict() for new_user in new_users]
+        ensure_unique_indexes(self.__mongo_collection, 'users')
+        failed = set()
+        try:
+            self.__mongo_collection.insert_many(documents, ordered=False)
+        except BulkWriteError as error:
+            failed = {write_error['index'] for write_error in error.details.get('writeErrors', [])}
+            logger.info('register_many: %d aliases were registered somewhere else', len(failed))
+        registered = list()
+        for position, new_user in enumerate(new_users):
+            if position not in failed:
+                new_user.saved(documents[position]['_id'])
+                registered.append(new_user)
+        with self.__lock:
+            for new_user in registered:
+                self.__user_index.setdefault(new_user.alias, new_user)
+            self.__user_list.extend(registered)
+        return registered
 
     def get(self, target_alias: str) -> ChatUser:
-        """ Returns the user with the given alias
+        """ Returns the user with the given alias, or None. An alias we don't know yet might have been registered by another
+            process, so a miss asks Mongo (by the unique index) before giving up
         """
-        if len(self.__user_list) == 0:
-            raise Exception('User not found')
-        for user in self.__user_list:
-            if user.__alias == target_alias:
-                return user
+        if (user := self.__user_index.get(target_alias)) is not None:
+            return user
+        user_dict = self.__mongo_collection.find_one({'alias': target_alias})
+        if user_dict is None:
+            return None
+        self.__add(self.__user_from_dict(user_dict))
+        return self.__user_index[target_alias]
+
+    @staticmethod
+    def __user_from_dict(user_dict: dict) -> ChatUser:
+        return ChatUser(user_dict['alias'], user_dict['_id'], user_dict['create_time'], user_dict['modify_time'])
+
+    def __add(self, user: ChatUser) -> None:
+        """ Put a user in the list and the alias index, unless another thread got that alias in first
+        """
+        with self.__lock:
+            if user.alias not in self.__user_index:
+                self.__user_index[user.alias] = user
+                self.__user_list.append(user)
+
+    def __contains__(self, target_alias: str) -> bool:
+        return self.get(target_alias) is not None
+
+    def __len__(self) -> int:
+        return len(self.__user_list)
 
 
     def get_all_users(self) -> list:
-        """ Returns a list of all users in the list
+        """ Returns a list of all users in the list. The first call reads every user from Mongo
         """
+        if self.__loaded_all is False:
+            for user_dict in self.__mongo_collection.find({'alias': {'$exists': True}}):
+                if user_dict['alias'] not in self.__user_index:
+                    self.__add(self.__user_from_dict(user_dict))
+            self.__loaded_all = True
         return self.__user_list
 
     def append(self, new_user: ChatUser) -> None:
-        """ Append a user to the list
+        """ Append a user to the list. It only goes to Mongo with the next __persist
+            register already added its user, so appending what it returned (or None for a taken alias) changes nothing
         """
-        self.__user_list.append(new_user)
+        if new_user is None or self.__user_index.get(new_user.alias) is new_user:
+            return
+        with self.__lock:
+            self.__user_list.append(new_user)
+            self.__user_index[new_user.alias] = new_user
         self.__dirty = True
 
     def __restore(self) -> bool:
-        """ First get the document for the queue itself, then get all documents that are not the queue metadata
+        """ Get the document for the user list itself, the first time __persist needs it. The users stay in Mongo until get or
+            get_all_users wants them
         """
-        self.__user_list = list()
+        list_metadata = self.__mongo_collection.find_one({'name': {'$exists': True}})
+        self.__restored = True
+        if list_metadata is None:
+            return False
+        self.__name = list_metadata['name']
+        self.__create_time = list_metadata['create_time']
+        self.__modify_time = list_metadata['modify_time']
         self.__dirty = False
         return True
 
@@ -87,11 +198,13 @@ class UserList(list):
         """ First save a document that describes the user list (name of list, create and modify times)
             Second, for each user in the list create and save a document for that user
         """
-        self.__mongo_collection.insert_one({
-            'name': self.__name,
-            'create_time': self.__create_time,
-            'modify_time': self.__modify_time
-        })
+        if self.__restored is False and self.__restore() is False:
+            self.__mongo_collection.insert_one({
+                'name': self.__name,
+                'create_time': self.__create_time,
+                'modify_time': self.__modify_time
+            })
         for user in self.__user_list:
-            self.__mongo_collection.insert_one(user.to_dict())
+            if user.dirty is True:
+                user.saved(self.__mongo_collection.insert_one(user.to_dict()).inserted_id)
         self.__dirty = False
\ No newline at end of file
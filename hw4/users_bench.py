@@ -0,0 +1,68 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import argparse
+import random
+import time
+from constants import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+from indexes import ensure_indexes
+from users import UserList
+
+NUM_USERS = 1000000
+CHECKPOINTS = [1000, 10000, 100000, 1000000]
+BATCH_SIZE = 10000
+NUM_LOOKUPS = 10000
+
+
+def bench_lookups(users: UserList, num_users: int, num_lookups: int) -> float:
+    """ Average time for get on a random registered alias, which is what every send does to validate the sender
+    """
+    rng = random.Random(num_users)
+    aliases = [f'user-{rng.randrange(num_users)}' for _ in range(num_lookups)]
+    start = time.perf_counter()
+    for alias in aliases:
+        users.get(alias)
+    return (time.perf_counter() - start) / num_lookups
+
+
+def bench_linear_scan(users: UserList, num_users: int, num_lookups: int) -> float:
+    """ What the old get did: walk the list comparing aliases
+    """
+    rng = random.Random(num_users)
+    aliases = [f'user-{rng.randrange(num_users)}' for _ in range(num_lookups)]
+    user_list = users.get_all_users()
+    start = time.perf_counter()
+    for alias in aliases:
+        for user in user_list:
+            if user.alias == alias:
+                break
+    return (time.perf_counter() - start) / num_lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UserList.get time as registered users grow, on an in-memory collection')
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--lookups', type=int, default=NUM_LOOKUPS)
+    parser.add_argument('--scan-lookups', type=int, default=100, help='lookups for the old linear scan, it gets slow')
+    args = parser.parse_args()
+    mongo_pool.client_factory = memory_client_factory()
+    ensure_indexes(get_mongo_client(host=MONGODB_URL).detest.users, 'users')
+
+    users = UserList()
+    registered = 0
+    register_time = 0.0
+    for checkpoint in [size for size in CHECKPOINTS if size < args.users] + [args.users]:
+        start = time.perf_counter()
+        while registered < checkpoint:
+            batch = [f'user-{index}' for index in range(registered, min(registered + BATCH_SIZE, checkpoint))]
+            registered += len(users.register_many(batch))
+        register_time += time.perf_counter() - start
+        lookup = bench_lookups(users, registered, args.lookups)
+        scan = bench_linear_scan(users, registered, args.scan_lookups)
+        print(f'{registered:>8} users: get {lookup * 1e6:6.2f} us  old linear scan {scan * 1e6:10.1f} us  '
+            f'(register_many so far {register_time / registered * 1e6:.1f} us/user)')
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,33 @@
 import unittest
 from unittest import TestCase
 import logging
+from pymongo.errors import DuplicateKeyError
 from constants import *
 from users import *
+from memory_mongo import memory_client_factory
+from mongo_pool import mongo_pool, get_mongo_client
+import indexes
+from indexes import forget_ensured, ensure_indexes
 
 logging.basicConfig(filename='chat.log', level=logging.INFO)
 
 class UserTest(TestCase):
     """ Docstring
+        register and get go to Mongo now, so these run against a fresh in-memory stand-in each time
     """
     def setUp(self) -> None:
         logging.info(f'Starting UserTest setUp')
         super().__init__(methodName = 'test_adding')
+        self.__client_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
         self.__cur_users = UserList('test_users')
         self.__cur_users.__init__('test_users')
         logging.info(f'Exiting UserTest setUp')
 
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__client_factory
+
     @property
     def users(self):
         return self.__cur_users
@@ -70,6 +82,87 @@ class UserTest(TestCase):
         self.assertEqual(self.__cur_users.get_all_users(), [])
         logging.info(f'Exiting test_get_all_empty')
 
-        
+
+class UserListTest(TestCase):
+    """ Testing the alias index and bulk registration, against the in-memory mongo stand-in
+    """
+    def setUp(self) -> None:
+        self.__client_factory = mongo_pool.client_factory
+        mongo_pool.client_factory = memory_client_factory()
+        forget_ensured()
+        self.__collection = get_mongo_client(host=MONGODB_URL).detest.users
+        self.__users = UserList()
+
+    def tearDown(self) -> None:
+        mongo_pool.close()
+        mongo_pool.client_factory = self.__client_factory
+
+    def test_register_and_get(self):
+        new_user = self.__users.register('alice')
+        assert new_user.alias == 'alice'
+        assert new_user.user_id is not None
+        assert self.__users.get('alice') is new_user
+        assert self.__users.get('nobody') is None
+        assert 'alice' in self.__users
+
+    def test_duplicate_alias(self):
+        """ Registering a taken alias gives None, whether this process or another one took it
+        """
+        self.__users.register('alice')
+        assert self.__users.register('alice') is None
+        other_process = UserList()
+        assert other_process.register('alice') is None
+        assert other_process.get('alice').alias == 'alice'
+
+    def test_unique_index(self):
+        """ Mongo itself refuses a second document for an alias, the index is there by the time the first register is done
+        """
+        self.__users.register('alice')
+        assert self.__collection.index_information()['alias_unique']['unique'] is True
+        with self.assertRaises(DuplicateKeyError):
+            self.__collection.insert_one(ChatUser('alice').to_dict())
+
+    def test_register_many(self):
+        """ One bulk insert, skipping aliases that are taken or repeated
+        """
+        self.__users.register('alice')
+        UserList().register('bob')
+        registered = self.__users.register_many(['alice', 'bob', 'carol', 'dave', 'carol'])
+        assert [user.alias for user in registered] == ['carol', 'dave']
+        assert self.__users.get('dave') is registered[1]
+        assert sorted(user.alias for user in UserList().get_all_users()) == ['alice', 'bob', 'carol', 'dave']
+
+    def test_failed_index_build_is_retried(self):
+        """ Mongo refuses the first build: the collection isn't marked done, and the next call after the retry interval builds it
+        """
+        collection = FlakyIndexCollection(get_mongo_client(host=MONGODB_URL).detest.flaky_users)
+        previous_retry = indexes.ENSURE_INDEXES_RETRY
+        indexes.ENSURE_INDEXES_RETRY = 0
+        try:
+            assert ensure_indexes(collection, 'users') == ['user_list_metadata']
+            assert 'alias_unique' not in collection.index_information()
+            assert ensure_indexes(collection, 'users') == ['alias_unique']
+            assert ensure_indexes(collection, 'users') == []
+        finally:
+            indexes.ENSURE_INDEXES_RETRY = previous_retry
+
+
+class FlakyIndexCollection:
+    """ A collection whose first create_index fails, like Mongo going away in the middle of the background build
+    """
+    def __init__(self, collection) -> None:
+        self.__collection = collection
+        self.__failures = 1
+        self.full_name = collection.full_name
+
+    def index_information(self) -> dict:
+        return self.__collection.index_information()
+
+    def create_index(self, keys, **options) -> str:
+        if self.__failures > 0:
+            self.__failures -= 1
+            raise ConnectionError('mongo went away')
+        return self.__collection.create_index(keys, **options)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from pymongo.errors import BulkWriteError
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+# Tells the flusher to write what it has right away instead of waiting for the batch to fill or age out
+_FLUSH = object()
+
+
+class FlushFailure():
+    """ One document that did not make it into Mongo and why
+    """
+    def __init__(self, document: dict, error: Exception) -> None:
+        self.document = document
+        self.error = error
+
+    def __str__(self):
+        return f'Write behind failure: {self.error} - document: {self.document}'
+
+
+class WriteBehindBuffer():
+    """ Bounded in-memory buffer in front of a collection. put queues a document and returns right away, a background thread writes
+            the queue out with insert_many(ordered=False) whenever it holds max_batch documents or the oldest one is max_age seconds old.
+        Backpressure: when max_pending documents are waiting, put blocks for up to put_timeout and then raises queue.Full.
+        Failures: every put returns a Future that resolves to True once written or raises the write error. Failed documents are also
+            kept for failures() and handed to on_error(failure_list) if one was given.
+        close() (also run at interpreter exit) writes everything that is still queued.
+    """
+    def __init__(self, collection, max_batch: int = WRITE_BEHIND_BATCH_SIZE, max_age: float = WRITE_BEHIND_MAX_AGE,
+                max_pending: int = WRITE_BEHIND_MAX_PENDING, put_timeout: float = WRITE_BEHIND_PUT_TIMEOUT, on_error = None) -> None:
+        self.__collection = collection
+        self.__max_batch = max_batch
+        self.__max_age = max_age
+        self.__put_timeout = put_timeout
+        self.__on_error = on_error
+        self.__queue = queue.Queue(maxsize=max_pending)
+        self.__unwritten = 0
+        self.__unwritten_cond = threading.Condition()
+        self.__failures = []
+        self.__failures_lock = threading.Lock()
+        self.__closed = False
+        self.__batches = 0
+        self.__written = 0
+        self.__failed = 0
+        self.__put_waits = 0
+        self.__thread = threading.Thread(target=self.__run, name=f'write-behind-{collection.name}', daemon=True)
+        self.__thread.start()
+        _buffers.add(self)
+
+    @property
+    def pending(self) -> int:
+        return self.__unwritten
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    def put(self, document: dict) -> Future:
+        """ Queue a document for the next bulk write. Raises queue.Full if the buffer stays full for put_timeout seconds
+        """
+        if self.__closed is True:
+            raise RuntimeError('write behind buffer is closed')
+        future = Future()
+        item = (document, future)
+        with self.__unwritten_cond:
+            self.__unwritten += 1
+        try:
+            try:
+                self.__queue.put_nowait(item)
+            except queue.Full:
+                self.__put_waits += 1
+                self.__queue.put(item, timeout=self.__put_timeout)
+        except queue.Full:
+            self.__written_out(1)
+            raise
+        return future
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Write everything queued so far and wait for it. Returns False if that took longer than timeout
+        """
+        try:
+            self.__queue.put_nowait(_FLUSH)
+        except queue.Full:
+            pass # a full queue means the flusher is writing full batches already
+        with self.__unwritten_cond:
+            return self.__unwritten_cond.wait_for(lambda: self.__unwritten == 0, timeout=timeout)
+
+    def close(self, timeout: float = None) -> bool:
+        """ Stop taking documents, write out what's left and stop the flusher thread
+        """
+        if self.__closed is True:
+            return True
+        self.__closed = True
+        flushed = self.flush(timeout)
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+        return flushed
+
+    def failures(self, clear: bool = True) -> list:
+        """ Documents that failed to write since the last call
+        """
+        with self.__failures_lock:
+            failures = self.__failures
+            if clear is True:
+                self.__failures = []
+            return list(failures)
+
+    def stats(self) -> dict:
+        return {'pending': self.__unwritten,
+            'batches': self.__batches,
+            'written': self.__written,
+            'failed': self.__failed,
+            'put_waits': self.__put_waits,
+        }
+
+    def __run(self) -> None:
+        """ Flusher thread. Wait for a first document, then keep collecting until the batch is full, the first document is too old,
+            or somebody asked for a flush
+        """
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            if item is _FLUSH:
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.__max_age
+            stop = False
+            while len(batch) < self.__max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.__queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if item is _FLUSH:
+                    break
+                batch.append(item)
+            self.__write(batch)
+            if stop is True:
+                return
+
+    def __write(self, batch: list) -> None:
+        """ One unordered bulk insert for the whole batch. With ordered=False Mongo keeps going past a bad document, so only the
+            documents listed in writeErrors failed
+        """
+        documents = [document for document, _ in batch]
+        failed = {}
+        try:
+            self.__collection.insert_many(documents, ordered=False)
+        except BulkWriteError as bulk_error:
+            for write_error in bulk_error.details.get('writeErrors', []):
+                failed[write_error['index']] = bulk_error
+        except Exception as error:
+            failed = {index: error for index in range(len(batch))}
+        failures = []
+        for index, (document, future) in enumerate(batch):
+            if index in failed:
+                failures.append(FlushFailure(document, failed[index]))
+                future.set_exception(failed[index])
+            else:
+                future.set_result(True)
+        self.__batches += 1
+        self.__written += len(batch) - len(failures)
+        if len(failures) > 0:
+            logger.warning('Write behind to %s failed for %d of %d documents', self.__collection.name, len(failures), len(batch))
+            self.__failed += len(failures)
+            with self.__failures_lock:
+                self.__failures.extend(failures)
+            if self.__on_error is not None:
+                try:
+                    self.__on_error(failures)
+                except Exception as error:
+                    logger.warning('Write behind error callback raised: %s', error)
+        self.__written_out(len(batch))
+
+    def __written_out(self, count: int) -> None:
+        with self.__unwritten_cond:
+            self.__unwritten -= count
+            self.__unwritten_cond.notify_all()
+
+
+# Everybody that still has a buffer open at exit gets flushed, otherwise queued messages would be lost on shutdown
+_buffers = weakref.WeakSet()
+
+@atexit.register
+def close_all() -> None:
+    for buffer in list(_buffers):
+        buffer.close(timeout=WRITE_BEHIND_PUT_TIMEOUT * 5)
+
+_buffers_by_collection = {}
+_buffers_lock = threading.Lock()
+
+def get_write_behind(collection, **kwargs) -> WriteBehindBuffer:
+    """ One buffer (and flusher thread) per collection per process, shared by every ChatRoom instance for that room
+    """
+    with _buffers_lock:
+        buffer = _buffers_by_collection.get(collection.full_name)
+        if buffer is None or buffer.closed is True:
+            buffer = WriteBehindBuffer(collection, **kwargs)
+            _buffers_by_collection[collection.full_name] = buffer
+        return buffer
@@ -0,0 +1,110 @@
+"""Group Members: Matt Moore, Adrian Abeyta, Ahmad Moltafet
+"""
+
+import queue
+import threading
+import time
+import unittest
+from unittest import TestCase
+import logging
+from pymongo.errors import BulkWriteError
+from constants import *
+from write_behind import WriteBehindBuffer
+
+logging.basicConfig(filename='chat.log', level=logging.INFO)
+
+class BulkCollection():
+    """ Records insert_many calls. Documents with 'bad' in them fail the way an unordered bulk write reports it
+    """
+    def __init__(self, name: str = 'test-room') -> None:
+        self.name = name
+        self.full_name = f'detest.{name}'
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        assert ordered is False
+        self.gate.wait()
+        self.batches.append(list(documents))
+        errors = [{'index': index, 'code': 11000, 'errmsg': 'duplicate key'} for index, document in enumerate(documents) if 'bad' in document]
+        if len(errors) > 0:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(documents) - len(errors)})
+
+
+class WriteBehindTest(TestCase):
+    """ Testing the write behind buffer in front of a room collection
+    """
+    def test_batches_by_size(self):
+        """ 1000 puts with a batch size of 250 become four bulk writes
+        """
+        collection = BulkCollection()
+        buffer = WriteBehindBuffer(collection, max_batch=250, max_age=5)
+        futures = [buffer.put({'seq': index}) for index in range(1000)]
+        assert buffer.flush(timeout=5) is True
+        assert all(future.result() is True for future in futures)
+        assert sum(len(batch) for batch in collection.batches) == 1000
+        assert len(collection.batches) <= 5
+        buffer.close()
+
+    def test_flushes_by_age(self):
+        """ A lone message still goes out once it is max_age old
+        """
+        collection = BulkCollection()
+        buffer = WriteBehindBuffer(collection, max_batch=1000, max_age=0.05)
+        future = buffer.put({'seq': 1})
+        assert future.result(timeout=2) is True
+        assert collection.batches == [[{'seq': 1}]]
+        buffer.close()
+
+    def test_backpressure(self):
+        """ With Mongo stuck and the buffer full, put waits put_timeout and then gives up
+        """
+        collection = BulkCollection()
+        collection.gate.clear()
+        buffer = WriteBehindBuffer(collection, max_batch=1, max_age=0, max_pending=2, put_timeout=0.1)
+        buffer.put({'seq': 1}) # taken by the flusher, stuck in insert_many
+        time.sleep(0.05)
+        buffer.put({'seq': 2})
+        buffer.put({'seq': 3})
+        start = time.perf_counter()
+        with self.assertRaises(queue.Full):
+            buffer.put({'seq': 4})
+        assert time.perf_counter() - start >= 0.1
+        assert buffer.stats()['put_waits'] == 1
+        collection.gate.set()
+        buffer.close()
+        assert buffer.stats()['written'] == 3
+
+    def test_reports_failures(self):
+        """ Only the documents Mongo rejected fail, and the caller hears about them three ways
+        """
+        collection = BulkCollection()
+        reported = []
+        buffer = WriteBehindBuffer(collection, max_batch=10, max_age=5, on_error=reported.extend)
+        good = buffer.put({'seq': 1})
+        bad = buffer.put({'seq': 2, 'bad': True})
+        buffer.flush(timeout=5)
+        assert good.result() is True
+        with self.assertRaises(BulkWriteError):
+            bad.result()
+        failures = buffer.failures()
+        assert [failure.document['seq'] for failure in failures] == [2]
+        assert [failure.document['seq'] for failure in reported] == [2]
+        assert buffer.failures() == []
+        buffer.close()
+
+    def test_close_writes_everything(self):
+        """ Nothing queued is lost on shutdown
+        """
+        collection = BulkCollection()
+        buffer = WriteBehindBuffer(collection, max_batch=10000, max_age=60)
+        for index in range(100):
+            buffer.put({'seq': index})
+        assert buffer.close(timeout=5) is True
+        assert sum(len(batch) for batch in collection.batches) == 100
+        with self.assertRaises(RuntimeError):
+            buffer.put({'seq': 101})
+
+if __name__ == "__main__":
+    unittest.main()